@@ -1,8 +1,13 @@
 import { defineStore } from 'pinia'
 
+let refreshTimer = null
+
 export const useUserStore = defineStore('user', {
   state: () => ({
     user: null,
+    // Signed session token, sent to the other services as a bearer token
+    token: null,
+    tokenExpiresAt: null,
     isAuthenticated: false,
     loading: false,
     error: null
@@ -14,6 +19,11 @@ export const useUserStore = defineStore('user', {
     userName: (state) => {
       if (!state.user) return ''
       return `${state.user.first_name || ''} ${state.user.last_name || ''}`.trim()
+    },
+    // Headers authenticating requests to the other services, empty once the token has expired
+    authHeaders: (state) => {
+      if (!state.token || !state.tokenExpiresAt || state.tokenExpiresAt <= Date.now()) return {}
+      return { Authorization: `Bearer ${state.token}` }
     }
   },
 
@@ -24,6 +34,41 @@ export const useUserStore = defineStore('user', {
       this.error = null
     },
 
+    setToken(token, expiresIn) {
+      this.token = token || null
+      this.tokenExpiresAt = token ? Date.now() + expiresIn * 1000 : null
+      if (token) {
+        localStorage.setItem('token', JSON.stringify({ token: this.token, expiresAt: this.tokenExpiresAt }))
+      }
+      this.scheduleTokenRefresh()
+    },
+
+    // Refresh the token shortly before it expires
+    scheduleTokenRefresh() {
+      clearTimeout(refreshTimer)
+      if (!this.token) return
+      const delay = Math.max(0, (this.tokenExpiresAt - Date.now()) * 0.8)
+      refreshTimer = setTimeout(() => this.refreshToken(), delay)
+    },
+
+    async refreshToken() {
+      if (!this.token) return
+      try {
+        const response = await fetch('http://localhost:5001/api/users/token/refresh', {
+          method: 'POST',
+          headers: { Authorization: `Bearer ${this.token}` }
+        })
+        if (!response.ok) throw new Error('Session expired')
+        const data = await response.json()
+        this.setToken(data.token, data.expires_in)
+      } catch (error) {
+        // Requests carry on without a token until the next login
+        this.token = null
+        this.tokenExpiresAt = null
+        localStorage.removeItem('token')
+      }
+    },
+
     setLoading(loading) {
       this.loading = loading
     },
@@ -51,6 +96,7 @@ export const useUserStore = defineStore('user', {
         }
 
         this.setUser(data.user)
+        this.setToken(data.token, data.expires_in)
         
         // Store user data in localStorage for persistence
         localStorage.setItem('user', JSON.stringify(data.user))
@@ -82,6 +128,7 @@ export const useUserStore = defineStore('user', {
         }
 
         this.setUser(data.user)
+        this.setToken(data.token, data.expires_in)
         
         // Store user data in localStorage for persistence
         localStorage.setItem('user', JSON.stringify(data.user))
@@ -97,6 +144,9 @@ export const useUserStore = defineStore('user', {
 
     logout() {
       this.setUser(null)
+      this.token = null
+      this.tokenExpiresAt = null
+      clearTimeout(refreshTimer)
       this.isAuthenticated = false
       this.error = null
       
@@ -110,6 +160,12 @@ export const useUserStore = defineStore('user', {
       if (storedUser) {
         try {
           this.setUser(JSON.parse(storedUser))
+          const storedToken = JSON.parse(localStorage.getItem('token') || 'null')
+          if (storedToken && storedToken.expiresAt > Date.now()) {
+            this.token = storedToken.token
+            this.tokenExpiresAt = storedToken.expiresAt
+            this.scheduleTokenRefresh()
+          }
         } catch (error) {
           this.logout()
         }
@@ -0,0 +1,126 @@
+"""
+Closed-loop HTTP load benchmark.
+
+Keeps `--concurrency` keep-alive connections busy with GET requests to the
+given URLs, round robin, for `--duration` seconds after a warm-up, then
+reports requests/sec and latency percentiles. Connections are spread over
+`--processes` client processes so the client's own GIL isn't the limit.
+
+    python scripts/load_benchmark.py http://localhost:5008/health \\
+        http://localhost:5008/api/finance/calculate/1 --concurrency 32 --duration 20
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import threading
+import time
+from urllib.parse import urlsplit
+
+def _connect(url):
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    return connection_class(parts.hostname, parts.port, timeout=30)
+
+def _path(url):
+    parts = urlsplit(url)
+    return parts.path + (f"?{parts.query}" if parts.query else '')
+
+def _run_connection(urls, start_at, stop_at, offset, results):
+    """Send requests one after the other on one connection, recording latencies after start_at"""
+    connection = _connect(urls[0])
+    paths = [_path(url) for url in urls]
+    latencies, errors = [], 0
+    index = offset
+    while True:
+        now = time.perf_counter()
+        if now >= stop_at:
+            break
+        try:
+            connection.request('GET', paths[index % len(paths)])
+            response = connection.getresponse()
+            response.read()
+            ok = response.status < 500
+            if response.getheader('Connection', '').lower() == 'close':
+                connection.close()
+                connection = _connect(urls[0])
+        except (OSError, http.client.HTTPException):
+            ok = False
+            connection.close()
+            connection = _connect(urls[0])
+        done = time.perf_counter()
+        if now >= start_at:
+            if ok:
+                latencies.append(done - now)
+            else:
+                errors += 1
+        index += 1
+    connection.close()
+    results.append((latencies, errors))
+
+def _run_process(urls, connections, first, start_at, stop_at, queue):
+    results = []
+    threads = [
+        threading.Thread(target=_run_connection, args=(urls, start_at, stop_at, first + number, results))
+        for number in range(connections)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies = [latency for thread_latencies, _ in results for latency in thread_latencies]
+    queue.put((latencies, sum(errors for _, errors in results)))
+
+def run(urls, concurrency, duration, warmup, processes):
+    """
+    Returns:
+        Dict: requests, errors, requests_per_sec and latency percentiles in ms
+    """
+    start_at = time.perf_counter() + warmup
+    stop_at = start_at + duration
+    queue = multiprocessing.get_context('fork').Queue()
+    workers = []
+    for number in range(processes):
+        connections = concurrency // processes + (1 if number < concurrency % processes else 0)
+        if connections:
+            worker = multiprocessing.get_context('fork').Process(
+                target=_run_process, args=(urls, connections, number * concurrency, start_at, stop_at, queue)
+            )
+            worker.start()
+            workers.append(worker)
+
+    latencies, errors = [], 0
+    for _ in workers:
+        worker_latencies, worker_errors = queue.get()
+        latencies.extend(worker_latencies)
+        errors += worker_errors
+    for worker in workers:
+        worker.join()
+
+    latencies.sort()
+    def percentile(fraction):
+        return round(latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1000, 2) if latencies else None
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_sec': round(len(latencies) / duration, 1),
+        'p50_ms': percentile(0.5),
+        'p90_ms': percentile(0.9),
+        'p99_ms': percentile(0.99),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('urls', nargs='+', help="URLs to GET, round robin, on the same host")
+    parser.add_argument('--concurrency', type=int, default=32, help="Connections kept busy (default: 32)")
+    parser.add_argument('--duration', type=float, default=20, help="Seconds measured (default: 20)")
+    parser.add_argument('--warmup', type=float, default=3, help="Seconds of load before measuring (default: 3)")
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                        help="Client processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.urls, args.concurrency, args.duration, args.warmup, args.processes)))
+
+if __name__ == '__main__':
+    main()
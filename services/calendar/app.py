@@ -3,6 +3,9 @@ from flask_cors import CORS
 import os
 from app.models import db
 from app.routes import register_routes
+from app.consumers import register_consumers
+from app.consumer_runtime import ConsumerRuntime
+from app import serving
 
 
 app = Flask(__name__)
@@ -29,6 +32,20 @@ def handle_error(error):
         "message": str(error)
     }), 500
 
+def dispose_engine():
+    """Drop the database connections a forked process inherited"""
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+# RabbitMQ consumers, started with the app
+consumers = ConsumerRuntime('calendar', app=app, after_fork=dispose_engine)
+register_consumers(consumers)
+
+# Throughput and depth of the queues this service consumes
+@app.route('/api/consumers', methods=['GET'])
+def consumer_metrics():
+    return jsonify(consumers.metrics()), 200
+
 # Health check
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -42,5 +59,19 @@ with app.app_context():
     except Exception as e:
         print(f"Error creating database tables: {e}")
 
+def start_background():
+    """Start the work running once per instance, in one process only, see app/serving.py"""
+    # Start the RabbitMQ consumers
+    try:
+        consumers.start()
+        print("RabbitMQ consumers started successfully")
+    except Exception as e:
+        print(f"Error starting RabbitMQ consumers: {e}")
+
+# Under gunicorn, see gunicorn.conf.py
+serving.at_worker_start(dispose_engine)
+serving.run_once('calendar', start_background, stop=consumers.stop)
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5004, debug=True) 
\ No newline at end of file
+    start_background()
+    app.run(host='0.0.0.0', port=5004, debug=True) 
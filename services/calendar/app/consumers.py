@@ -0,0 +1,91 @@
+import json
+import logging
+
+import pika
+
+from app.models import db, Calendar, UserAvailability
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Availability updates queued by the group management service when the
+# calendar API can't be reached
+USER_AVAILABILITY_QUEUE = 'user_availability'
+
+# Group deletions are broadcast by the trip management service on a fanout
+# exchange; this service reports what it deleted on the results queue
+DELETION_EVENTS_EXCHANGE = 'deletion_events'
+DELETION_EVENTS_QUEUE = 'calendar.deletion_events'
+DELETION_RESULTS_QUEUE = 'deletion_results'
+
+def handle_user_availability(delivery):
+    """Create or update a user's availability in a calendar"""
+    data = delivery.json()
+    calendar_id = data.get('calendar_id')
+    user_id = data.get('user_id')
+    available_dates = data.get('available_dates', [])
+    logger.info(f"Received availability update for user {user_id} in calendar {calendar_id}")
+
+    try:
+        availability = UserAvailability.query.filter_by(calendar_id=calendar_id, user_id=user_id).first()
+        if availability:
+            availability.available_dates = available_dates
+        else:
+            db.session.add(UserAvailability(
+                calendar_id=calendar_id,
+                user_id=user_id,
+                available_dates=available_dates
+            ))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    logger.info(f"Updated availability for user {user_id} in calendar {calendar_id}")
+
+def delete_group(group_id):
+    """
+    Delete the calendars of a group and their availabilities in one transaction.
+
+    Returns:
+        int: Number of rows deleted
+    """
+    calendar_ids = [calendar_id for (calendar_id,) in db.session.query(Calendar.id).filter(Calendar.group_id == group_id)]
+    if not calendar_ids:
+        return 0
+    deleted = UserAvailability.query.filter(UserAvailability.calendar_id.in_(calendar_ids)).delete(synchronize_session=False)
+    deleted += Calendar.query.filter(Calendar.id.in_(calendar_ids)).delete(synchronize_session=False)
+    db.session.commit()
+    logger.info(f"Deleted {deleted} calendar and availability rows of group {group_id}")
+    return deleted
+
+def handle_deletion(delivery):
+    """Delete the calendar of a deleted group and report back to the trip management service"""
+    message = delivery.json()
+    # Only group deletions have a calendar task to complete
+    if message.get("group_id") is None:
+        return
+
+    result = {"job_id": message.get("job_id"), "service": "calendar"}
+    logger.info(f"Received deletion request for job {result['job_id']}")
+    try:
+        result.update(status="completed", deleted=delete_group(int(message["group_id"])))
+    except Exception as e:
+        db.session.rollback()
+        # Retried first; the failure is only reported once retries run out
+        if not delivery.final_attempt:
+            raise
+        logger.error(f"Error processing deletion request: {e}")
+        result.update(status="failed", error=str(e))
+
+    delivery.channel.basic_publish(
+        exchange='',
+        routing_key=DELETION_RESULTS_QUEUE,
+        body=json.dumps(result),
+        properties=pika.BasicProperties(delivery_mode=2, content_type='application/json')
+    )
+
+def register_consumers(runtime):
+    """Register the queues this service consumes, see app/consumer_runtime.py"""
+    runtime.register(USER_AVAILABILITY_QUEUE, handle_user_availability)
+    runtime.register(DELETION_EVENTS_QUEUE, handle_deletion, exchange=DELETION_EVENTS_EXCHANGE)
@@ -31,7 +31,7 @@ def send_test_message(calendar_id=1, user_id=2):
         print("Connected to RabbitMQ!")
 
         # Declare the queue
-        channel.queue_declare(queue='user_availability')
+        channel.queue_declare(queue='user_availability', durable=True)
         print("Queue declared: user_availability")
 
         # Prepare the message
@@ -4,7 +4,7 @@ from flask_cors import CORS
 
 app = Flask(__name__)
 # Enable CORS for all routes with all origins
-CORS(app, resources={r"/*": {"origins": "*"}})
+CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=["ETag"])
 
 @app.route('/api/expenses', methods=['POST'])
 def add_expense():
@@ -135,9 +135,14 @@ def update_readiness_status(trip_id, user_id):
         user_data = request.get_json()
         
         # Forward the request to the finance service
+        # Pass the caller's session token on, so finance knows who is asking
+        headers = {}
+        if 'Authorization' in request.headers:
+            headers['Authorization'] = request.headers['Authorization']
         response = requests.put(
             f"http://finance:5008/api/finance/readiness/{trip_id}/{user_id}",
             json=user_data,
+            headers=headers,
             timeout=5
         )
         response.raise_for_status()
@@ -183,15 +188,23 @@ def calculate_settlement(trip_id):
         if base_currency:
             url += f"?base={base_currency}"
         
-        # Forward the request to the finance service
+        # Forward the request to the finance service, passing the client's
+        # ETag through so an unchanged settlement is answered with a 304
+        headers = {}
+        if request.headers.get('If-None-Match'):
+            headers['If-None-Match'] = request.headers['If-None-Match']
         response = requests.get(
             url,
+            headers=headers,
             timeout=10  # Longer timeout for calculation
         )
+        etag_headers = {'ETag': response.headers['ETag'], 'Cache-Control': 'no-cache'} if 'ETag' in response.headers else {}
+        if response.status_code == 304:
+            return '', 304, etag_headers
         response.raise_for_status()
         result = response.json()
 
-        return jsonify(result), 200
+        return jsonify(result), 200, etag_headers
     except requests.exceptions.RequestException as e:
         print(f"Error communicating with finance service: {str(e)}")
         return jsonify({'error': f"Error communicating with finance service: {str(e)}"}), 501
@@ -199,6 +212,36 @@ def calculate_settlement(trip_id):
         print(f"Unexpected error calculating settlement: {str(e)}")
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
+@app.route('/api/expenses/analytics/<trip_id>', methods=['GET'])
+def get_expense_analytics(trip_id):
+    """Get a trip's spend broken down by category, day, payer or currency."""
+    try:
+        # Forward the query parameters and the client's ETag to the finance service
+        headers = {}
+        if request.headers.get('If-None-Match'):
+            headers['If-None-Match'] = request.headers['If-None-Match']
+        response = requests.get(
+            f"http://finance:5008/api/finance/analytics/{trip_id}",
+            params=request.args,
+            headers=headers,
+            timeout=5
+        )
+        etag_headers = {'ETag': response.headers['ETag'], 'Cache-Control': 'no-cache'} if 'ETag' in response.headers else {}
+        if response.status_code == 304:
+            return '', 304, etag_headers
+        # Invalid parameters are reported as the finance service reported them
+        if response.status_code == 400:
+            return jsonify(response.json()), 400
+        response.raise_for_status()
+
+        return jsonify(response.json()), 200, etag_headers
+    except requests.exceptions.RequestException as e:
+        print(f"Error communicating with finance service: {str(e)}")
+        return jsonify({'error': f"Error communicating with finance service: {str(e)}"}), 501
+    except Exception as e:
+        print(f"Unexpected error getting expense analytics: {str(e)}")
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
@@ -0,0 +1,66 @@
+import json
+import logging
+
+import pika
+
+from app.models import db, Expense, UserReadiness, bump_trip_versions
+from app.readiness import invalidate_members
+from app.settlement_emails import SETTLEMENT_EMAILS_QUEUE, handle_settlement_requested
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Trip deletions are broadcast by the trip management service on a fanout
+# exchange; this service reports what it deleted on the results queue
+DELETION_EVENTS_EXCHANGE = 'deletion_events'
+DELETION_EVENTS_QUEUE = 'finance.deletion_events'
+DELETION_RESULTS_QUEUE = 'deletion_results'
+
+def delete_trips(trip_ids):
+    """
+    Delete the expenses and readiness of many trips in one transaction.
+
+    Returns:
+        int: Number of rows deleted
+    """
+    trip_ids = [str(trip_id) for trip_id in trip_ids]
+    if not trip_ids:
+        return 0
+    deleted = Expense.query.filter(Expense.trip_id.in_(trip_ids)).delete(synchronize_session=False)
+    deleted += UserReadiness.query.filter(UserReadiness.trip_id.in_(trip_ids)).delete(synchronize_session=False)
+    # Bumped rather than deleted, so a settlement cached before the deletion is never served again
+    bump_trip_versions(trip_ids)
+    db.session.commit()
+    for trip_id in trip_ids:
+        invalidate_members(trip_id)
+    logger.info(f"Deleted {deleted} expense and readiness rows of {len(trip_ids)} trips")
+    return deleted
+
+def handle_deletion(delivery):
+    """Delete the data of deleted trips and report back to the trip management service"""
+    message = delivery.json()
+    result = {"job_id": message.get("job_id"), "service": "finance"}
+    logger.info(f"Received deletion request for job {result['job_id']}")
+
+    try:
+        result.update(status="completed", deleted=delete_trips(message.get("trip_ids") or []))
+    except Exception as e:
+        db.session.rollback()
+        # Retried first; the failure is only reported once retries run out
+        if not delivery.final_attempt:
+            raise
+        logger.error(f"Error processing deletion request: {e}")
+        result.update(status="failed", error=str(e))
+
+    delivery.channel.basic_publish(
+        exchange='',
+        routing_key=DELETION_RESULTS_QUEUE,
+        body=json.dumps(result),
+        properties=pika.BasicProperties(delivery_mode=2, content_type='application/json')
+    )
+
+def register_consumers(runtime):
+    """Register the queues this service consumes, see app/consumer_runtime.py"""
+    runtime.register(DELETION_EVENTS_QUEUE, handle_deletion, exchange=DELETION_EVENTS_EXCHANGE)
+    runtime.register(SETTLEMENT_EMAILS_QUEUE, handle_settlement_requested)
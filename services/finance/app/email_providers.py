@@ -0,0 +1,92 @@
+"""
+Email providers the settlement dispatcher sends batches through.
+
+A provider takes a list of messages ({from, to, subject, html}) and an
+idempotency key, sends them in one request and returns the provider's
+message IDs in the same order. Sending the same key again must not send
+the messages twice, so a batch can be retried safely.
+"""
+import os
+import logging
+import threading
+import uuid
+
+import requests
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# resend sends through the Resend batch API; stub keeps the messages in
+# memory, for local development and tests
+EMAIL_PROVIDER = os.getenv('EMAIL_PROVIDER', 'resend')
+
+RESEND_API_URL = os.getenv('RESEND_API_URL', 'https://api.resend.com')
+
+class EmailProviderError(Exception):
+    """Raised when a batch couldn't be sent; retryable errors may succeed later"""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+class ResendProvider:
+    """Sends batches through Resend's /emails/batch endpoint, up to 100 messages each"""
+
+    max_batch_size = 100
+
+    def __init__(self, api_key, domain):
+        self.api_key = api_key
+        self.sender = f"Trip Settlement <settlement@{domain}>"
+        self.session = requests.Session()
+
+    def send_batch(self, messages, idempotency_key):
+        try:
+            response = self.session.post(
+                f"{RESEND_API_URL}/emails/batch",
+                json=[{**message, 'from': self.sender} for message in messages],
+                headers={
+                    'Authorization': f"Bearer {self.api_key}",
+                    'Idempotency-Key': idempotency_key
+                },
+                timeout=10
+            )
+        except requests.exceptions.RequestException as e:
+            raise EmailProviderError(f"Error calling Resend: {e}")
+
+        if not response.ok:
+            # Rate limits and server errors are worth retrying, invalid batches aren't
+            retryable = response.status_code == 429 or response.status_code >= 500
+            raise EmailProviderError(f"Resend returned {response.status_code}: {response.text}", retryable)
+        return [message['id'] for message in response.json()['data']]
+
+class StubProvider:
+    """Records the batches it's given instead of sending them"""
+
+    max_batch_size = 100
+
+    def __init__(self):
+        self.sent = []
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def send_batch(self, messages, idempotency_key):
+        with self._lock:
+            if idempotency_key not in self._ids:
+                self._ids[idempotency_key] = [str(uuid.uuid4()) for _ in messages]
+                self.sent.extend(messages)
+                logger.info(f"Stub provider accepted {len(messages)} emails ({idempotency_key})")
+            return self._ids[idempotency_key]
+
+def create_provider():
+    """The provider named by EMAIL_PROVIDER"""
+    if EMAIL_PROVIDER == 'stub':
+        return StubProvider()
+    if EMAIL_PROVIDER != 'resend':
+        raise ValueError(f"Unknown EMAIL_PROVIDER: {EMAIL_PROVIDER}")
+
+    resend_api_key = os.getenv('RESEND_API_KEY')
+    resend_domain = os.getenv('RESEND_DOMAIN')
+    if not resend_api_key or not resend_domain:
+        raise ValueError("Missing required environment variables: RESEND_API_KEY and RESEND_DOMAIN")
+    return ResendProvider(resend_api_key, resend_domain)
@@ -0,0 +1,86 @@
+import logging
+
+from app.models import db, Expense, UserReadiness
+from app.rate_store import rate_store
+from app.money import from_minor
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Columns a trip's expenses can be broken down by
+DIMENSIONS = {
+    'category': Expense.category,
+    'day': Expense.date,
+    'payer': Expense.user_id,
+    'currency': Expense.base_currency,
+}
+
+class AnalyticsError(ValueError):
+    """Raised when the parameters of a breakdown are invalid"""
+
+def expense_breakdown(trip_id, by, base_currency='SGD'):
+    """
+    Total spend of a trip per category, day, payer or currency.
+
+    The expenses are summed by the database, grouped by the dimension, the
+    currency and the date, so that each group is converted at the rates of
+    its own date; only the groups are read, not the expenses. Totals are
+    added up in minor units of the base currency, see app/money.py.
+
+    Returns:
+        Dict: The breakdown in columnar form, one list per column, in the
+        order of the days for `day` and of decreasing totals otherwise
+
+    Raises:
+        AnalyticsError: If `by` isn't a known dimension
+        RatesUnavailable: If a currency has no stored rate
+    """
+    if by not in DIMENSIONS:
+        raise AnalyticsError(f"by must be one of {', '.join(DIMENSIONS)}")
+
+    stmt = (
+        db.select(
+            DIMENSIONS[by].label('key'),
+            Expense.base_currency,
+            Expense.date,
+            db.func.sum(Expense.amount_minor).label('amount_minor'),
+            db.func.count().label('count')
+        )
+        .where(Expense.trip_id == str(trip_id))
+        .group_by(DIMENSIONS[by], Expense.base_currency, Expense.date)
+    )
+
+    totals, counts, original_totals = {}, {}, {}
+    for group in db.session.execute(stmt):
+        amount = rate_store.convert_minor(int(group.amount_minor), group.base_currency, base_currency, group.date)
+        totals[group.key] = totals.get(group.key, 0) + amount
+        counts[group.key] = counts.get(group.key, 0) + group.count
+        original_totals[group.key] = original_totals.get(group.key, 0) + int(group.amount_minor)
+
+    if by == 'day':
+        keys = sorted(totals)
+    else:
+        keys = sorted(totals, key=lambda key: totals[key], reverse=True)
+
+    columns = {
+        by: [key.isoformat() for key in keys] if by == 'day' else keys,
+        'total': [from_minor(totals[key], base_currency) for key in keys],
+        'count': [counts[key] for key in keys]
+    }
+    if by == 'currency':
+        columns['original_total'] = [from_minor(original_totals[key], key) for key in keys]
+    elif by == 'payer':
+        names = dict(db.session.execute(
+            db.select(UserReadiness.user_id, UserReadiness.name).where(UserReadiness.trip_id == str(trip_id))
+        ).all())
+        columns['name'] = [names.get(key) or f"User {key}" for key in keys]
+
+    return {
+        'trip_id': str(trip_id),
+        'by': by,
+        'currency': base_currency,
+        'total': from_minor(sum(totals.values()), base_currency),
+        'count': sum(counts.values()),
+        'columns': columns
+    }
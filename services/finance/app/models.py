@@ -1,22 +1,68 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
 import json
 
+from app.money import exponent, to_minor
+
 db = SQLAlchemy()
 
+def insert_ignoring_existing(model, rows):
+    """
+    Insert rows in one statement, skipping the ones whose primary key already exists.
+
+    Returns:
+        int: Number of rows inserted
+    """
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    statement = dialect.insert(model).values(rows).on_conflict_do_nothing(
+        index_elements=[column.name for column in model.__table__.primary_key]
+    )
+    return db.session.execute(statement).rowcount
+
+def bump_trip_versions(trip_ids):
+    """Increment the versions of trips, in the caller's transaction"""
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    statement = dialect.insert(TripVersion).values(
+        [{'trip_id': trip_id, 'version': 1} for trip_id in dict.fromkeys(str(trip_id) for trip_id in trip_ids)]
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=['trip_id'],
+        set_={'version': TripVersion.version + 1}
+    )
+    db.session.execute(statement)
+
+def trip_version(trip_id):
+    """Current version of a trip, 0 if it never changed"""
+    version = db.session.scalar(db.select(TripVersion.version).where(TripVersion.trip_id == str(trip_id)))
+    return version or 0
+
 class Expense(db.Model):
     __tablename__ = 'expenses'
+    # Cover the GROUP BYs of the expense analytics, so a trip's breakdowns
+    # are read from the indexes alone; the primary key covers the payer one
+    __table_args__ = (
+        db.Index('ix_expenses_trip_category', 'trip_id', 'category', 'base_currency', 'date',
+                 postgresql_include=['amount_minor']),
+        db.Index('ix_expenses_trip_currency_date', 'trip_id', 'base_currency', 'date',
+                 postgresql_include=['amount_minor']),
+    )
 
     trip_id = db.Column(db.String(64), primary_key=True, nullable=False)
     user_id = db.Column(db.String(64), primary_key=True, nullable=False)
     date = db.Column(db.Date, server_default=db.func.now(), primary_key=True, nullable=False)
     location = db.Column(db.String(64), primary_key=True, nullable=False)
-    amount = db.Column(db.Float, primary_key=True, nullable=False)
+    # As entered, for display; the amount is keyed and added up as amount_minor
+    amount = db.Column(db.Float, nullable=False)
     base_currency = db.Column(db.String(3), primary_key=True, nullable=False, default='SGD')
     description = db.Column(db.String(64))
     is_paid = db.Column(db.Boolean, default=False)
     category = db.Column(db.String(64))
     payee_id = db.Column(db.String(64), nullable=True)
     payees_json = db.Column(db.Text, nullable=True)  # Store payees as JSON array
+    # The amount in minor units of base_currency, e.g. cents, which
+    # settlements and analytics add up exactly, see app/money.py
+    amount_minor = db.Column(db.BigInteger, primary_key=True, nullable=False, autoincrement=False)
+    amount_exponent = db.Column(db.SmallInteger, nullable=False)
 
     def __init__(self, trip_id, user_id, date, location, amount, base_currency, description, is_paid, category, payee_id=None, payees=None):
         self.trip_id = trip_id
@@ -25,6 +71,8 @@ class Expense(db.Model):
         self.location = location
         self.amount = amount
         self.base_currency = base_currency
+        self.amount_minor = to_minor(amount, base_currency)
+        self.amount_exponent = exponent(base_currency)
         self.description = description
         self.is_paid = is_paid
         self.category = category
@@ -64,6 +112,7 @@ class Expense(db.Model):
             "date": self.date.isoformat() if self.date else None, 
             "location": self.location,
             "amount": self.amount, 
+            "amount_minor": self.amount_minor,
             "base_currency": self.base_currency, 
             "description": self.description, 
             "is_paid": self.is_paid,
@@ -95,4 +144,52 @@ class UserReadiness(db.Model):
             "name": self.name,
             "email": self.email,
             "ready": self.ready
-        } 
\ No newline at end of file
+        } 
+
+class TripVersion(db.Model):
+    """
+    Version of a trip's expenses and readiness, bumped in the same
+    transaction as every change to them; cached settlements are only
+    served while it's unchanged.
+    """
+    __tablename__ = 'trip_versions'
+
+    trip_id = db.Column(db.String(64), primary_key=True, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class ExchangeRateDay(db.Model):
+    """Exchange rates of one day against the pivot currency, see app/rate_store.py"""
+    __tablename__ = 'exchange_rates'
+
+    rate_date = db.Column(db.Date, primary_key=True, nullable=False)
+    # Comma-separated currency codes, in the order of rates
+    currencies = db.Column(db.Text, nullable=False)
+    # Units of each currency per unit of the pivot currency, as packed doubles
+    rates = db.Column(db.LargeBinary, nullable=False)
+    fetched_at = db.Column(db.DateTime, server_default=db.func.now())
+
+class SettlementEmail(db.Model):
+    """Delivery status of a trip's settlement email to one user"""
+    __tablename__ = 'settlement_emails'
+
+    trip_id = db.Column(db.String(64), primary_key=True, nullable=False)
+    user_id = db.Column(db.String(64), primary_key=True, nullable=False)
+    email = db.Column(db.String(128))
+    # queued, sent or failed
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    provider_message_id = db.Column(db.String(128))
+    error = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+
+    def json(self):
+        return {
+            "trip_id": self.trip_id,
+            "user_id": self.user_id,
+            "email": self.email,
+            "status": self.status,
+            "attempts": self.attempts,
+            "provider_message_id": self.provider_message_id,
+            "error": self.error,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -0,0 +1,115 @@
+"""
+Money as integer minor units.
+
+Amounts are counted in the minor unit of their currency (cents of SGD,
+yen, fils of KWD) as int64, with the number of minor unit digits of each
+currency taken from ISO 4217, so sums and splits are exact. Splits use the
+largest remainder method over NumPy int arrays: every share is rounded
+down, and the units left over go to the shares with the largest
+remainders, so the shares always add up to what was split.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+
+# Minor unit digits of the currencies that don't have two
+CURRENCY_EXPONENTS = {
+    'BIF': 0, 'CLP': 0, 'DJF': 0, 'GNF': 0, 'ISK': 0, 'JPY': 0, 'KMF': 0, 'KRW': 0,
+    'PYG': 0, 'RWF': 0, 'UGX': 0, 'UYI': 0, 'VND': 0, 'VUV': 0, 'XAF': 0, 'XOF': 0, 'XPF': 0,
+    'BHD': 3, 'IQD': 3, 'JOD': 3, 'KWD': 3, 'LYD': 3, 'OMR': 3, 'TND': 3,
+}
+DEFAULT_EXPONENT = 2
+
+def exponent(currency):
+    """Number of minor unit digits of a currency"""
+    return CURRENCY_EXPONENTS.get(currency, DEFAULT_EXPONENT)
+
+def to_minor(amount, currency):
+    """An amount in major units, e.g. 12.34, as minor units, e.g. 1234, rounding half up"""
+    minor = Decimal(str(amount)).scaleb(exponent(currency))
+    return int(minor.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def from_minor(minor, currency):
+    """Minor units as an amount in major units, for display and JSON"""
+    digits = exponent(currency)
+    return round(int(minor) / 10 ** digits, digits)
+
+def convert_minor(minor, from_currency, to_currency, rate):
+    """
+    Convert minor units of one currency to the nearest minor unit of another.
+
+    Args:
+        minor: An int or an int array of minor units of from_currency
+        rate: Units of to_currency per unit of from_currency
+
+    Returns:
+        The minor units of to_currency, with the type of minor
+    """
+    scale = rate * 10.0 ** (exponent(to_currency) - exponent(from_currency))
+    if isinstance(minor, np.ndarray):
+        return np.rint(minor * scale).astype(np.int64)
+    return int(round(minor * scale))
+
+def allocate(amounts, weights):
+    """
+    Split amounts in proportion to weights and total the shares of each
+    column, exactly.
+
+    Every share is rounded down in integers. The units the rounding left
+    over, added up across all the amounts, go one each to the columns with
+    the largest totals of remainders, earlier columns first on ties. So the
+    totals add up to the sum of the amounts, and each is within a unit of
+    its exact value however many amounts are split.
+
+    Args:
+        amounts: Int array (n,) of minor units
+        weights: Non-negative int array (n, k), with a positive weight in every row
+
+    Returns:
+        Int64 array (k,) of each column's total share
+    """
+    amounts = np.asarray(amounts, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.int64)
+    row_weights = weights.sum(axis=1)[:, None]
+
+    shares, remainders = np.divmod(amounts[:, None] * weights, row_weights)
+    totals = shares.sum(axis=0)
+
+    # The remainders are only compared, so floats are exact enough; a total
+    # off by a hair from a whole unit just moves that unit to the next step
+    fractions = (remainders / row_weights).sum(axis=0)
+    whole = np.floor(fractions).astype(np.int64)
+    totals += whole
+    leftover = int(amounts.sum() - totals.sum())
+    order = np.argsort(whole - fractions, kind='stable')
+    totals[order[:leftover]] += 1
+    return totals
+
+def settle_balances(balances):
+    """
+    Transfers that bring balances summing to zero back to zero, paying the
+    largest creditors from the largest debtors first.
+
+    Args:
+        balances: Int array of minor units, negative for debtors
+
+    Returns:
+        List: (debtor index, creditor index, minor units) tuples
+    """
+    balances = np.array(balances, dtype=np.int64)
+    order = np.argsort(balances, kind='stable')
+    transfers = []
+    i, j = 0, len(order) - 1
+    while i < j:
+        debtor, creditor = order[i], order[j]
+        if balances[debtor] >= 0 or balances[creditor] <= 0:
+            break
+        amount = min(-balances[debtor], balances[creditor])
+        transfers.append((int(debtor), int(creditor), int(amount)))
+        balances[debtor] += amount
+        balances[creditor] -= amount
+        if balances[debtor] == 0:
+            i += 1
+        if balances[creditor] == 0:
+            j -= 1
+    return transfers
@@ -0,0 +1,64 @@
+"""
+Exchange rate providers the rate fetcher fills the rate store from.
+
+A provider returns the rates of a day as {currency: units per unit of the
+pivot currency}. Providers that can't serve past days have
+supports_history = False and are only asked for today's rates.
+"""
+import os
+import math
+from datetime import datetime, timezone
+
+from app.client import ExchangeRateClient
+
+# exchangerate-api fetches from ExchangeRate-API; stub generates stable
+# rates locally, for local development and tests
+RATE_PROVIDER = os.getenv('RATE_PROVIDER', 'exchangerate-api')
+
+# Historical rates need a paid ExchangeRate-API plan
+EXCHANGE_RATE_HISTORY = os.getenv('EXCHANGE_RATE_HISTORY', 'false').lower() == 'true'
+
+def utc_today():
+    return datetime.now(timezone.utc).date()
+
+class ExchangeRateApiProvider:
+    """Daily rates from ExchangeRate-API"""
+
+    def __init__(self, supports_history=EXCHANGE_RATE_HISTORY):
+        self.supports_history = supports_history
+
+    def fetch(self, pivot_currency, day):
+        if day >= utc_today():
+            response = ExchangeRateClient.get_latest_rates(pivot_currency)
+        else:
+            response = ExchangeRateClient.get_historical_rates(pivot_currency, day)
+        if response.get('result') != 'success':
+            raise ValueError(f"ExchangeRate-API returned {response.get('error-type', response.get('result'))}")
+        return response['conversion_rates']
+
+class StubRateProvider:
+    """Rates that drift a little from day to day, the same for a given day every time"""
+
+    supports_history = True
+
+    RATES = {
+        'USD': 1.0, 'SGD': 1.35, 'EUR': 0.92, 'GBP': 0.79, 'JPY': 150.0, 'MYR': 4.7,
+        'THB': 36.0, 'IDR': 15600.0, 'KRW': 1330.0, 'AUD': 1.52, 'CNY': 7.2, 'HKD': 7.8
+    }
+
+    def fetch(self, pivot_currency, day):
+        ordinal = day.toordinal()
+        rates = {
+            currency: rate * (1 + 0.02 * math.sin(ordinal / 7 + index))
+            for index, (currency, rate) in enumerate(sorted(self.RATES.items()))
+        }
+        pivot_rate = rates[pivot_currency]
+        return {currency: rate / pivot_rate for currency, rate in rates.items()}
+
+def create_provider():
+    """The provider named by RATE_PROVIDER"""
+    if RATE_PROVIDER == 'stub':
+        return StubRateProvider()
+    if RATE_PROVIDER != 'exchangerate-api':
+        raise ValueError(f"Unknown RATE_PROVIDER: {RATE_PROVIDER}")
+    return ExchangeRateApiProvider()
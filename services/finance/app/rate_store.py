@@ -0,0 +1,222 @@
+"""
+Daily exchange rates, stored locally so conversions never call upstream.
+
+Each day's rates are one row of exchange_rates: the units of every
+currency per unit of RATE_PIVOT_CURRENCY, packed as doubles. Every process
+keeps them in memory as one vector per day, from the first stored day to
+the last, with days and currencies missing upstream carried forward from
+the day before. Converting at a date is then an index into that list;
+dates before the first day use its rates, and dates after the last day
+use the last one's.
+
+The rate fetcher stores today's rates every RATE_FETCH_INTERVAL seconds,
+along with the days of the last RATE_BACKFILL_DAYS the store is missing
+if the provider has historical rates. Processes reload the stored rates
+every RATE_RELOAD_INTERVAL seconds.
+"""
+import os
+import sys
+import math
+import logging
+import threading
+import time
+import traceback
+from array import array
+from datetime import timedelta
+
+from app.models import db, ExchangeRateDay, insert_ignoring_existing
+from app.rate_providers import create_provider, utc_today
+from app import money
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Currency every stored rate is relative to
+RATE_PIVOT_CURRENCY = os.getenv('RATE_PIVOT_CURRENCY', 'USD')
+
+# Seconds between two fetches of today's rates
+RATE_FETCH_INTERVAL = int(os.getenv('RATE_FETCH_INTERVAL', 21600))
+
+# Past days filled in when missing, for providers with historical rates
+RATE_BACKFILL_DAYS = int(os.getenv('RATE_BACKFILL_DAYS', 30))
+
+# Seconds a process serves its loaded rates before reading them again
+RATE_RELOAD_INTERVAL = int(os.getenv('RATE_RELOAD_INTERVAL', 300))
+
+class RatesUnavailable(Exception):
+    """Raised when there's no stored rate for a currency"""
+
+def pack_rates(rates):
+    """Row values of a day's rates: (comma-separated currencies, packed little-endian doubles)"""
+    currencies = sorted(rates)
+    packed = array('d', (float(rates[currency]) for currency in currencies))
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return ','.join(currencies), packed.tobytes()
+
+def unpack_rates(currencies, rates):
+    packed = array('d')
+    packed.frombytes(rates)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return dict(zip(currencies.split(','), packed))
+
+class RateSnapshot:
+    """The stored rates as loaded at one point in time; never modified"""
+
+    def __init__(self, first_day=None, columns=None, days=None, version='0'):
+        self.first_day = first_day
+        # Format: {currency: index in the day vectors}
+        self.columns = columns or {}
+        self.days = days or []
+        self.version = version
+
+    def vector(self, day):
+        if not self.days:
+            raise RatesUnavailable("No exchange rates stored yet")
+        index = (day - self.first_day).days
+        return self.days[min(max(index, 0), len(self.days) - 1)]
+
+    def _column(self, vector, currency):
+        column = self.columns.get(currency)
+        if column is None or math.isnan(vector[column]):
+            raise RatesUnavailable(f"No exchange rate stored for {currency}")
+        return vector[column]
+
+    def rate(self, from_currency, to_currency, day):
+        """Units of to_currency per unit of from_currency on a day"""
+        if from_currency == to_currency:
+            return 1.0
+        vector = self.vector(day)
+        return self._column(vector, to_currency) / self._column(vector, from_currency)
+
+    def rates(self, base_currency, day):
+        """Every currency's rate against base_currency on a day"""
+        vector = self.vector(day)
+        base_rate = self._column(vector, base_currency)
+        return {
+            currency: vector[column] / base_rate
+            for currency, column in self.columns.items() if not math.isnan(vector[column])
+        }
+
+class RateStore:
+    """The rates of every stored day, in memory"""
+
+    def __init__(self):
+        self._snapshot = RateSnapshot()
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        """The current rates, reloaded if they're older than RATE_RELOAD_INTERVAL"""
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at >= RATE_RELOAD_INTERVAL:
+            # The first load is waited for; later ones are done by one
+            # thread while the others keep using the rates they have
+            if self._lock.acquire(blocking=loaded_at is None):
+                try:
+                    if self._loaded_at is loaded_at:
+                        self.load()
+                finally:
+                    self._lock.release()
+        return self._snapshot
+
+    def load(self):
+        """Read every stored day into memory"""
+        rows = db.session.execute(
+            db.select(ExchangeRateDay.rate_date, ExchangeRateDay.currencies, ExchangeRateDay.rates)
+            .order_by(ExchangeRateDay.rate_date)
+        ).all()
+        if not rows:
+            self._snapshot, self._loaded_at = RateSnapshot(), time.monotonic()
+            return
+
+        stored = {rate_date: unpack_rates(currencies, rates) for rate_date, currencies, rates in rows}
+        columns = {currency: index for index, currency in enumerate(sorted(set().union(*stored.values())))}
+        first_day, last_day = rows[0].rate_date, rows[-1].rate_date
+
+        days = []
+        previous = array('d', [math.nan] * len(columns))
+        for offset in range((last_day - first_day).days + 1):
+            rates = stored.get(first_day + timedelta(days=offset))
+            if rates is not None:
+                vector = array('d', previous)
+                for currency, rate in rates.items():
+                    vector[columns[currency]] = rate
+                previous = vector
+            days.append(previous)
+
+        self._snapshot = RateSnapshot(first_day, columns, days, f"{len(rows)}.{last_day:%Y%m%d}")
+        self._loaded_at = time.monotonic()
+        logger.info(f"Loaded exchange rates of {len(rows)} days, {first_day} to {last_day}")
+
+    @property
+    def version(self):
+        """Changes whenever a day is added to the store"""
+        return self.snapshot().version
+
+    def convert(self, amount, from_currency, to_currency, day):
+        """Convert an amount at the rates of a day"""
+        return amount * self.snapshot().rate(from_currency, to_currency, day)
+
+    def convert_minor(self, minor, from_currency, to_currency, day):
+        """Convert minor units, or an array of them, at the rates of a day, see app/money.py"""
+        if from_currency == to_currency:
+            return minor
+        return money.convert_minor(minor, from_currency, to_currency, self.snapshot().rate(from_currency, to_currency, day))
+
+rate_store = RateStore()
+
+def fetch_rates(provider=None):
+    """
+    Store the rates of today, and of the days of the backfill window missing
+    from the store if the provider has historical rates.
+
+    Returns:
+        int: Number of days stored
+    """
+    provider = provider or create_provider()
+    today = utc_today()
+    window_days = RATE_BACKFILL_DAYS if provider.supports_history else 0
+    window = [today - timedelta(days=offset) for offset in range(window_days, -1, -1)]
+    stored = set(db.session.scalars(
+        db.select(ExchangeRateDay.rate_date).where(ExchangeRateDay.rate_date >= window[0])
+    ))
+
+    added = 0
+    for day in window:
+        if day in stored:
+            continue
+        try:
+            currencies, rates = pack_rates(provider.fetch(RATE_PIVOT_CURRENCY, day))
+            added += insert_ignoring_existing(ExchangeRateDay, [{'rate_date': day, 'currencies': currencies, 'rates': rates}])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            # Left for the next run
+            logger.error(f"Error fetching exchange rates of {day}: {e}")
+
+    if added:
+        logger.info(f"Stored exchange rates of {added} days")
+        rate_store.load()
+    return added
+
+def run_rate_fetcher(app):
+    """Keep the rate store filled"""
+    while True:
+        try:
+            with app.app_context():
+                fetch_rates()
+        except Exception as e:
+            logger.error(f"Error fetching exchange rates: {e}")
+            logger.error(traceback.format_exc())
+        time.sleep(RATE_FETCH_INTERVAL)
+
+def start_rate_fetcher(app):
+    """Start a thread to keep the rate store filled"""
+    fetcher_thread = threading.Thread(target=run_rate_fetcher, args=(app,))
+    fetcher_thread.daemon = True
+    fetcher_thread.start()
+
+    return fetcher_thread
@@ -0,0 +1,126 @@
+import os
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from app.models import db, UserReadiness, insert_ignoring_existing, bump_trip_versions
+from app.client import TripClient, GroupClient, UserClient
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Group members of a trip are cached for GROUP_MEMBERS_CACHE_TTL seconds,
+# for up to GROUP_MEMBERS_CACHE_SIZE trips
+GROUP_MEMBERS_CACHE_TTL = float(os.getenv('GROUP_MEMBERS_CACHE_TTL', 300))
+GROUP_MEMBERS_CACHE_SIZE = int(os.getenv('GROUP_MEMBERS_CACHE_SIZE', 1024))
+
+# Format: {trip_id: (expires_at, list of member user IDs)}
+_members_cache = OrderedDict()
+_members_lock = threading.Lock()
+
+# One bootstrap per trip at a time; concurrent requests wait for it
+# rather than repeating the same upstream calls. Trips share a fixed set
+# of locks so the set doesn't grow with every trip seen.
+_bootstrap_locks = [threading.Lock() for _ in range(64)]
+
+class ReadinessBootstrapError(Exception):
+    """Raised when a trip's members can't be determined"""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+def invalidate_members(trip_id):
+    """Drop the cached group members of a trip"""
+    with _members_lock:
+        _members_cache.pop(str(trip_id), None)
+
+def get_trip_members(trip_id):
+    """
+    Return the user IDs of the members of a trip's group, cached per trip.
+
+    Raises:
+        ReadinessBootstrapError: If the trip has no group or the group service failed
+    """
+    trip_id = str(trip_id)
+    with _members_lock:
+        entry = _members_cache.get(trip_id)
+        if entry and entry[0] > time.monotonic():
+            _members_cache.move_to_end(trip_id)
+            return entry[1]
+
+    trip_details = TripClient.get_trip_details(trip_id)
+    if not trip_details or not trip_details.get('group_id'):
+        logger.info(f"No group_id found for trip_id: {trip_id}")
+        raise ReadinessBootstrapError('No group_id associated with this trip', 404)
+
+    group_id = trip_details['group_id']
+    members = GroupClient.get_group_members(group_id)
+    if members is None:
+        raise ReadinessBootstrapError(
+            'No users found for this trip and could not fetch from group service', 404
+        )
+    members = [str(member) for member in members]
+    logger.info(f"Group {group_id} of trip {trip_id} has {len(members)} members")
+
+    with _members_lock:
+        _members_cache[trip_id] = (time.monotonic() + GROUP_MEMBERS_CACHE_TTL, members)
+        _members_cache.move_to_end(trip_id)
+        while len(_members_cache) > GROUP_MEMBERS_CACHE_SIZE:
+            _members_cache.popitem(last=False)
+    return members
+
+def _bootstrap_lock(trip_id):
+    return _bootstrap_locks[hash(trip_id) % len(_bootstrap_locks)]
+
+def bootstrap_readiness(trip_id):
+    """
+    Create the readiness rows of a trip from its group members.
+
+    Members are fetched from the group service (cached per trip) and their
+    names and emails resolved with one batch request to the user service.
+    All rows are written with a single INSERT ... ON CONFLICT DO NOTHING,
+    so concurrent bootstraps, in this or another process, can't duplicate
+    or overwrite rows.
+
+    Returns:
+        List: The trip's UserReadiness rows
+
+    Raises:
+        ReadinessBootstrapError: If the trip's members can't be determined
+    """
+    trip_id = str(trip_id)
+    with _bootstrap_lock(trip_id):
+        # Another request may have finished the bootstrap while we waited
+        users = UserReadiness.query.filter_by(trip_id=trip_id).all()
+        if users:
+            return users
+
+        members = get_trip_members(trip_id)
+        if members:
+            profiles = UserClient.resolve_users(members)
+            rows = []
+            for user_id in members:
+                profile = profiles.get(user_id, {})
+                name = ' '.join(part for part in (profile.get('first_name'), profile.get('last_name')) if part)
+                rows.append({
+                    'trip_id': trip_id,
+                    'user_id': user_id,
+                    'name': name or f"User {user_id}",
+                    'email': profile.get('email', f"{user_id}@example.com"),
+                    'ready': False
+                })
+            try:
+                if insert_ignoring_existing(UserReadiness, rows):
+                    # Settlements show the users' names
+                    bump_trip_versions([trip_id])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            logger.info(f"Added {len(rows)} readiness rows for trip {trip_id}")
+
+        return UserReadiness.query.filter_by(trip_id=trip_id).all()
@@ -1,9 +1,16 @@
 from flask import request, jsonify
-from app.models import db, Expense, UserReadiness
-from app.client import ExchangeRateClient, EmailClient, TripClient
+from app.models import db, Expense, UserReadiness, SettlementEmail, bump_trip_versions
+from app.rate_store import rate_store, RatesUnavailable
+from app.rate_providers import utc_today
+from app.session_tokens import session_user, is_other_user
+from app.readiness import bootstrap_readiness, ReadinessBootstrapError
+from app.settlement import get_settlement, settlement_version
+from app.expense_analytics import expense_breakdown, AnalyticsError
+from app.settlement_emails import queue_settlement_emails
 import requests
 import os
 import logging
+from datetime import date
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -11,19 +18,24 @@ logger = logging.getLogger(__name__)
 
 def register_routes(app):
 
-    # Gets conversion rates for local currency
+    # Gets conversion rates for local currency, from the rate store; `date`
+    # (YYYY-MM-DD, default today) picks the day
     @app.route('/api/finance/rates', methods=['GET'])
     def get_rates():
         base_currency = request.args.get('base', 'SGD')
         target_currencies = request.args.get('symbols')
         
         try:
-            rates = ExchangeRateClient.get_latest_rates(base_currency, target_currencies)
-            return jsonify({'result': rates["result"], 'rates': rates["conversion_rates"]})
+            day = date.fromisoformat(request.args['date']) if 'date' in request.args else utc_today()
+            rates = rate_store.snapshot().rates(base_currency, day)
+            if target_currencies:
+                symbols = target_currencies.upper().split(',')
+                rates = {currency: rate for currency, rate in rates.items() if currency in symbols}
+            return jsonify({'result': 'success', 'date': day.isoformat(), 'rates': rates})
         except Exception as e:
             return jsonify({'error': str(e)}), 400
 
-    # Converts a given amount of currency from base currency to target currency
+    # Converts a given amount of currency from base currency to target currency, at today's rates
     @app.route('/api/finance/convert/<string:from_currency>/<string:to_currency>/<float:amount>', methods=['GET'])
     def convert_currency(from_currency, to_currency, amount):
         
@@ -31,7 +43,7 @@ def register_routes(app):
             return jsonify({'error': 'Missing required parameters'}), 400
         
         try:
-            converted_amount = ExchangeRateClient.convert_amount(from_currency.upper(), to_currency.upper(), amount)
+            converted_amount = rate_store.convert(amount, from_currency.upper(), to_currency.upper(), utc_today())
             return jsonify({
                 'from': from_currency.upper(),
                 'to': to_currency.upper(),
@@ -75,270 +87,13 @@ def register_routes(app):
             # Get the base currency from query params, default to SGD
             base_currency = request.args.get('base', 'SGD')
 
-            logger.info(f"Calculating settlement for trip {trip_id} with base currency {base_currency}")
-            
-            stmt = db.select(Expense).where(Expense.trip_id == trip_id)
-            expenses = db.session.scalars(stmt).all()  
-                
-            if not expenses:
-                logger.info(f"No expenses found for trip {trip_id}")
-                return jsonify({
-                    'trip_id': trip_id,
-                    'message': 'No expenses found for this trip',
-                    'total_amount': 0,
-                    'currency': base_currency,
-                    'settlements': [],
-                    'user_balances': {}
-                }), 200 
-            
-            logger.info(f"Found {len(expenses)} expenses for trip {trip_id}")
-            
-            # Initialize total amount
-            total_amount = 0
-            
-            # Get the list of users for a given trip
-            users = []
-            for e in expenses:
-                # Add payer
-                if e.user_id not in users:
-                    users.append(e.user_id)
-                
-                # Add payees from the payees list
-                try:
-                    payees = e.payees
-                    if payees and isinstance(payees, list):
-                        for payee_id in payees:
-                            if payee_id != "all" and payee_id not in users:
-                                users.append(payee_id)
-                except Exception as payee_error:
-                    # Handle any issues with payees property
-                    logger.error(f"Error processing payees: {str(payee_error)}")
-                
-                # Legacy support for payee_id field
-                if e.payee_id and e.payee_id != 'all' and e.payee_id not in users:
-                    users.append(e.payee_id)
-            
-            logger.info(f"Found {len(users)} users for trip {trip_id}: {users}")
-            
-            if not users:
-                logger.warning(f"No users found for trip {trip_id}")
-                return jsonify({
-                    'trip_id': trip_id,
-                    'message': 'No users found for this trip',
-                    'total_amount': 0,
-                    'currency': base_currency,
-                    'settlements': [],
-                    'user_balances': {}
-                }), 200
-            
-            # Convert all expenses to base currency and sum them up
-            for expense in expenses:
-                try:
-                    if expense.base_currency == base_currency:
-                        amount = expense.amount
-                    else:
-                        # Convert to base currency using your ExchangeRateClient
-                        amount = ExchangeRateClient.convert_amount(
-                            from_currency=expense.base_currency,
-                            to_currency=base_currency,
-                            amount=expense.amount
-                        )
-                    total_amount += amount
-                except Exception as conversion_error:
-                    logger.error(f"Error converting amount for expense {expense.trip_id}, {expense.user_id}, {expense.date}: {str(conversion_error)}")
-                    # Use original amount as fallback
-                    total_amount += expense.amount
-            
-            logger.info(f"Total amount for trip {trip_id}: {total_amount} {base_currency}")
-            
-            # Get user names/emails from the UserReadiness model for better display
-            users_info = {}
-            try:
-                stmt = db.select(UserReadiness).where(UserReadiness.trip_id == trip_id)
-                user_readiness_records = db.session.scalars(stmt).all()
-                for record in user_readiness_records:
-                    users_info[record.user_id] = {
-                        'name': record.name or f"User {record.user_id}",
-                        'email': record.email
-                    }
-                logger.info(f"Retrieved user info for {len(users_info)} users")
-            except Exception as user_info_error:
-                logger.error(f"Error getting user readiness records: {str(user_info_error)}")
-                
-            # Create balance sheet to track how much each user has spent and owes
-            balances = {user_id: 0 for user_id in users}
-            
-            # Calculate each user's expenditure and who they paid for
-            for expense in expenses:
-                # Convert amount to base currency if needed
-                if expense.base_currency == base_currency:
-                    amount = expense.amount
-                else:
-                    amount = ExchangeRateClient.convert_amount(
-                        from_currency=expense.base_currency,
-                        to_currency=base_currency,
-                        amount=expense.amount
-                    )
-                
-                logger.info(f"Processing expense: User {expense.user_id} paid {amount} {base_currency} for {expense.description}")
-                
-                # Get the list of payees from the expense
-                try:
-                    payees = expense.payees
-                    logger.info(f"  Payees: {payees}")
-                    
-                    # Check if we have specific payees or if it's "all"
-                    if payees and (len(payees) == 1 and payees[0] == "all" or "all" in payees):
-                        # Split the expense among all users evenly
-                        payer_share = amount / len(users)
-                        
-                        # The payer paid the full amount but only owes their share
-                        old_balance = balances[expense.user_id]
-                        balances[expense.user_id] += amount - payer_share
-                        logger.info(f"  Split among all: {expense.user_id} balance: {old_balance} → {balances[expense.user_id]} (paid {amount}, share {payer_share})")
-                        
-                        # Everyone else owes their share to the payer
-                        for user_id in users:
-                            if user_id != expense.user_id:
-                                old_balance = balances[user_id]
-                                balances[user_id] -= payer_share
-                                logger.info(f"    {user_id} balance: {old_balance} → {balances[user_id]} (share {payer_share})")
-                    
-                    elif payees and isinstance(payees, list) and len(payees) > 0:
-                        # Expense is split among specific payees
-                        payee_share = amount / len(payees)
-                        logger.info(f"  Split among specific payees: each pays {payee_share}")
-                        
-                        # Increase payer's balance by full amount (they are owed money)
-                        old_balance = balances[expense.user_id]
-                        balances[expense.user_id] += amount
-                        logger.info(f"  Payer {expense.user_id} balance: {old_balance} → {balances[expense.user_id]} (paid {amount})")
-                        
-                        # If payer is also in the payees list, subtract their share
-                        if expense.user_id in payees:
-                            old_balance = balances[expense.user_id]
-                            balances[expense.user_id] -= payee_share
-                            logger.info(f"    (Payer also a payee) {expense.user_id} balance adjustment: {old_balance} → {balances[expense.user_id]} (share {payee_share})")
-                        
-                        # Each payee owes their share
-                        for payee_id in payees:
-                            if payee_id != expense.user_id and payee_id in balances:  # Make sure payee_id is valid
-                                old_balance = balances[payee_id]
-                                balances[payee_id] -= payee_share
-                                logger.info(f"    Payee {payee_id} balance: {old_balance} → {balances[payee_id]} (share {payee_share})")
-                    
-                    # Legacy support for single payee_id
-                    elif expense.payee_id and expense.payee_id != 'all' and expense.payee_id in balances:
-                        # Increase payer's balance (they are owed money)
-                        old_balance = balances[expense.user_id]
-                        balances[expense.user_id] += amount
-                        logger.info(f"  Single payee (legacy): {expense.user_id} balance: {old_balance} → {balances[expense.user_id]}")
-                        
-                        # Decrease payee's balance (they owe money)
-                        old_balance = balances[expense.payee_id]
-                        balances[expense.payee_id] -= amount
-                        logger.info(f"    Payee {expense.payee_id} balance: {old_balance} → {balances[expense.payee_id]}")
-                    else:
-                        # Fallback to splitting among all users evenly
-                        logger.info(f"  Fallback to split among all")
-                        payer_share = amount / len(users)
-                        old_balance = balances[expense.user_id]
-                        balances[expense.user_id] += amount - payer_share
-                        logger.info(f"  Payer {expense.user_id} balance: {old_balance} → {balances[expense.user_id]}")
-                        
-                        for user_id in users:
-                            if user_id != expense.user_id:
-                                old_balance = balances[user_id]
-                                balances[user_id] -= payer_share
-                                logger.info(f"    User {user_id} balance: {old_balance} → {balances[user_id]}")
-                except Exception as err:
-                    # Log the error and fallback to splitting evenly
-                    logger.error(f"Error calculating balance for expense {expense.trip_id}, {expense.user_id}, {expense.date}: {str(err)}")
-                    
-                    # Fallback to splitting evenly
-                    logger.info(f"  Error fallback to split among all")
-                    payer_share = amount / len(users)
-                    old_balance = balances[expense.user_id]
-                    balances[expense.user_id] += amount - payer_share
-                    logger.info(f"  Payer {expense.user_id} balance: {old_balance} → {balances[expense.user_id]}")
-                    
-                    for user_id in users:
-                        if user_id != expense.user_id:
-                            old_balance = balances[user_id]
-                            balances[user_id] -= payer_share
-                            logger.info(f"    User {user_id} balance: {old_balance} → {balances[user_id]}")
-            
-            # Log final balances
-            logger.info("Final balances:")
-            for user_id, balance in balances.items():
-                logger.info(f"  User {user_id}: {balance} {base_currency}")
-            
-            # Create settlement plan - who pays whom
-            settlements = []
-            # Sort users by balance (negative balances owe money, positive are owed money)
-            sorted_users = sorted(users, key=lambda u: balances[u])
-            
-            # Simple approach: users with negative balances pay to users with positive balances
-            i, j = 0, len(sorted_users) - 1
-            while i < j:
-                debtor = sorted_users[i]  # User who owes money (negative balance)
-                creditor = sorted_users[j]  # User who is owed money (positive balance)
-                
-                if abs(balances[debtor]) < 0.01 or abs(balances[creditor]) < 0.01:
-                    # Skip users with negligible balances
-                    if abs(balances[debtor]) < 0.01:
-                        i += 1
-                    if abs(balances[creditor]) < 0.01:
-                        j -= 1
-                    continue
-                
-                # Amount to transfer is the minimum of what debtor owes and creditor is owed
-                amount = min(abs(balances[debtor]), balances[creditor])
-                
-                if amount > 0:
-                    # Create a settlement transaction
-                    settlements.append({
-                        'from': debtor,
-                        'from_name': users_info.get(debtor, {}).get('name', f"User {debtor}"),
-                        'to': creditor,
-                        'to_name': users_info.get(creditor, {}).get('name', f"User {creditor}"),
-                        'amount': round(amount, 2),
-                        'currency': base_currency
-                    })
-                
-                    # Update balances
-                    balances[debtor] += amount
-                    balances[creditor] -= amount
-                
-                # Move pointers if balances are settled
-                if abs(balances[debtor]) < 0.01:
-                    i += 1
-                if abs(balances[creditor]) < 0.01:
-                    j -= 1
-            
-            # Prepare response with settlement details
-            settlements_formatted = []
-            for settlement in settlements:
-                settlements_formatted.append({
-                    'from': str(settlement['from']),
-                    'from_name': settlement['from_name'],
-                    'to': str(settlement['to']),
-                    'to_name': settlement['to_name'],
-                    'amount': round(float(settlement['amount']), 2),
-                    'currency': settlement['currency']
-                })
-                
-            response_data = {
-                'trip_id': str(trip_id),
-                'total_amount': round(float(total_amount), 2),
-                'currency': base_currency,
-                'users': len(users),
-                'user_names': {str(user_id): users_info.get(user_id, {}).get('name', f"User {user_id}") for user_id in users},
-                'settlements': settlements_formatted
-            }
-            
-            logger.info(f"Settlement calculation completed for trip {trip_id} with {len(settlements)} settlements")
-            return jsonify(response_data), 200
+            # Repeated views are answered from memory, or with a 304 if the
+            # client's ETag still matches the settlement's version
+            settlement, version = get_settlement(trip_id, base_currency)
+            response = jsonify(settlement)
+            response.set_etag(version)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response.make_conditional(request)
                 
         except Exception as e:
             logger.error(f"Error calculating settlement for trip {trip_id}: {str(e)}", exc_info=True)
@@ -349,6 +104,30 @@ def register_routes(app):
                 'user_balances': {}
             }), 500
         
+    # Spend of a trip broken down by category, day, payer or currency, as
+    # columns; see expense_analytics for the parameters
+    @app.route('/api/finance/analytics/<trip_id>', methods=['GET'])
+    def get_expense_analytics(trip_id):
+        by = request.args.get('by', 'category')
+        base_currency = request.args.get('base', 'SGD')
+        
+        try:
+            # Breakdowns change with the same versions as the settlement
+            version = settlement_version(trip_id)
+            if version in request.if_none_match:
+                response = app.response_class(status=304)
+            else:
+                response = jsonify(expense_breakdown(trip_id, by, base_currency))
+        except (AnalyticsError, RatesUnavailable) as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error breaking down expenses of trip {trip_id}: {str(e)}", exc_info=True)
+            return jsonify({'error': str(e)}), 500
+        
+        response.set_etag(version)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+        
     # Add route to add expense into database
     @app.route('/api/finance/<trip_id>/add', methods=['POST'])
     def add_expense(trip_id):
@@ -366,6 +145,7 @@ def register_routes(app):
             try:
                 new_expense = Expense(**data)
                 db.session.add(new_expense)
+                bump_trip_versions([new_expense.trip_id])
                 db.session.commit()
             except Exception as e:
                 return jsonify(
@@ -400,80 +180,17 @@ def register_routes(app):
             logger.info(f"Initial users query result: {users}")
             
             if not users:
-                # If no users are found, try to fetch them from the group service
+                # First view of the trip: create its rows from the group members
                 try:
-                    logger.info(f"No users found in database, trying to fetch from group service")
-                    
-                    # Get the trip details to get the group_id
-                    trip_details = TripClient.get_trip_details(trip_id)
-                    
-                    if trip_details and 'group_id' in trip_details and trip_details['group_id']:
-                        group_id = trip_details['group_id']
-                        logger.info(f"Found group_id: {group_id} for trip_id: {trip_id}")
-                        
-                        # Use group_id to fetch users from group service
-                        group_service_url = f"https://personal-ekdcuwio.outsystemscloud.com/GroupMicroservice/rest/GroupService/groups/{group_id}/users"
-                        logger.info(f"Calling group service: {group_service_url}")
-                        response = requests.get(group_service_url)
-                        logger.info(f"Group service response status: {response.status_code}")
-                        
-                        if response.ok:
-                            group_members = response.json()
-                            logger.info(f"Group members from service: {group_members}")
-                            
-                            # Add each group member to our database
-                            for member in group_members:
-                                user_id = member
-                                logger.info(f"Processing member: {user_id}")
-                                
-                                # Fetch user details from the user service
-                                try:
-                                    user_service_url = f"http://user-service:5001/api/users/{user_id}"
-                                    logger.info(f"Calling user service: {user_service_url}")
-                                    user_response = requests.get(user_service_url)
-                                    logger.info(f"User service response status: {user_response.status_code}")
-                                    
-                                    user_data = {}
-                                    if user_response.ok:
-                                        user_data = user_response.json()
-                                        logger.info(f"User data: {user_data}")
-                                except Exception as e:
-                                    logger.error(f"Error fetching user details from user service: {str(e)}")
-                                    user_data = {}
-                                
-                                user_readiness = UserReadiness(
-                                    trip_id=trip_id,
-                                    user_id=user_id,
-                                    name=user_data.get('first_name') + " " + user_data.get('last_name'),
-                                    email=user_data.get('email', f"{user_id}@example.com"),  # Get email from user service
-                                    ready=False
-                                )
-                                db.session.add(user_readiness)
-                            
-                            db.session.commit()
-                            logger.info("Added users to database and committed")
-                            
-                            # Fetch the newly added users
-                            stmt = db.select(UserReadiness).where(UserReadiness.trip_id == trip_id)
-                            users = db.session.scalars(stmt).all()
-                            logger.info(f"Users after adding to database: {users}")
-                        else:
-                            logger.error(f"Group service returned error: {response.text}")
-                            return jsonify({
-                                'trip_id': trip_id,
-                                'message': f'No users found for this trip and could not fetch from group service. Status: {response.status_code}',
-                                'users': []
-                            }), 404
-                    else:
-                        logger.info(f"No group_id found for trip_id: {trip_id}")
-                        return jsonify({
-                            'trip_id': trip_id,
-                            'message': 'No group_id associated with this trip',
-                            'users': []
-                        }), 404
-                        
+                    users = bootstrap_readiness(trip_id)
+                except ReadinessBootstrapError as e:
+                    return jsonify({
+                        'trip_id': trip_id,
+                        'message': e.message,
+                        'users': []
+                    }), e.status_code
                 except Exception as e:
-                    logger.error(f"Exception during group service call: {str(e)}")
+                    logger.error(f"Exception during readiness bootstrap: {str(e)}")
                     return jsonify({
                         'trip_id': trip_id,
                         'message': f'Error fetching users from group service: {str(e)}',
@@ -500,6 +217,10 @@ def register_routes(app):
     # Update a user's readiness status
     @app.route('/api/finance/readiness/<trip_id>/<user_id>', methods=['PUT'])
     def update_readiness_status(trip_id, user_id):
+        # Signed-in callers can only mark themselves ready
+        if is_other_user(user_id):
+            return jsonify({'error': 'Cannot update the readiness of another user'}), 403
+        
         try:
             # Check if the user exists
             stmt = db.select(UserReadiness).where(UserReadiness.trip_id == trip_id, UserReadiness.user_id == user_id)
@@ -509,15 +230,21 @@ def register_routes(app):
                 # Try to get user info from request body
                 data = request.get_json() or {}
                 
-                # Fetch user details from the user service
-                try:
-                    user_response = requests.get(f"http://user-service:5001/api/users/{user_id}")
-                    user_data = {}
-                    if user_response.ok:
-                        user_data = user_response.json()
-                except Exception as e:
-                    print(f"Error fetching user details from user service: {str(e)}")
-                    user_data = {}
+                # The caller's details come from their session token, otherwise
+                # they're fetched from the user service
+                user_data = session_user(user_id)
+                if user_data:
+                    user_data['name'] = f"{user_data.get('first_name') or ''} {user_data.get('last_name') or ''}".strip() or None
+                    user_data = {key: value for key, value in user_data.items() if value}
+                else:
+                    try:
+                        user_response = requests.get(f"http://user-service:5001/api/users/{user_id}")
+                        user_data = {}
+                        if user_response.ok:
+                            user_data = user_response.json()
+                    except Exception as e:
+                        print(f"Error fetching user details from user service: {str(e)}")
+                        user_data = {}
                 
                 name = user_data.get('name', data.get('name', f"User {user_id}"))
                 email = user_data.get('email', data.get('email', f"{user_id}@example.com"))
@@ -531,6 +258,7 @@ def register_routes(app):
                     ready=True  # Set as ready since this is an update request
                 )
                 db.session.add(user)
+                bump_trip_versions([trip_id])
             else:
                 # Update existing user readiness status
                 user.ready = True
@@ -549,20 +277,14 @@ def register_routes(app):
                 'all_ready': all_ready
             }
             
-            # If all users are ready, trigger settlement calculation and email notification
+            # If all users are ready, the settlement emails are sent in the background
             if all_ready:
                 try:
-                    # Get settlement details
-                    settlement_response = get_all_expenses(trip_id)
-                    
-                    # Check if the response has settlement data
-                    if settlement_response and hasattr(settlement_response, '__getitem__') and settlement_response[1] == 200:
-                        settlement_data = settlement_response[0].json
-                        
-                        # Send email notification with settlement details
-                        email_sent = send_settlement_email(trip_id, settlement_data, all_users)
-                        response_data['email_sent'] = email_sent
+                    response_data['email_queued'] = queue_settlement_emails(
+                        trip_id, all_users, request.args.get('base', 'SGD')
+                    )
                 except Exception as e:
+                    logger.error(f"Error queueing settlement emails for trip {trip_id}: {str(e)}")
                     response_data['settlement_error'] = str(e)
             
             return jsonify(response_data), 200
@@ -570,15 +292,11 @@ def register_routes(app):
         except Exception as e:
             return jsonify({'error': str(e)}), 500
     
-    # Send email notification with settlement details
-    def send_settlement_email(trip_id, settlement_data, users):
-        try:
-            # Use the EmailClient to send batch emails
-            result = EmailClient.send_batch_settlement_emails(trip_id, settlement_data, users)
-            
-            # Return True if at least one email was sent successfully
-            return len(result['success']) > 0
-            
-        except Exception as e:
-            logger.error(f"Error sending settlement email: {str(e)}")
-            return False
\ No newline at end of file
+    # Delivery status of a trip's settlement emails, per user
+    @app.route('/api/finance/readiness/<trip_id>/emails', methods=['GET'])
+    def get_settlement_email_status(trip_id):
+        emails = SettlementEmail.query.filter_by(trip_id=trip_id).order_by(SettlementEmail.user_id).all()
+        return jsonify({
+            'trip_id': trip_id,
+            'emails': [email.json() for email in emails]
+        }), 200
\ No newline at end of file
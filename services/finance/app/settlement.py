@@ -0,0 +1,198 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from app.models import db, Expense, UserReadiness, trip_version
+from app.rate_store import rate_store
+from app.money import allocate, from_minor, settle_balances
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Most settlements kept in memory, least recently used evicted first
+SETTLEMENT_CACHE_SIZE = int(os.getenv('SETTLEMENT_CACHE_SIZE', 512))
+
+# Format: {(trip_id, base_currency): (version, settlement)}
+_settlements = OrderedDict()
+_settlements_lock = threading.Lock()
+
+def settlement_version(trip_id):
+    """
+    Version of a trip's settlement: the trip's version, bumped with every
+    change to its expenses and readiness, and the rate store's version
+    """
+    return f"{trip_version(trip_id)}.{rate_store.version}"
+
+def get_settlement(trip_id, base_currency='SGD'):
+    """
+    The settlement of a trip, from memory while its version is unchanged.
+
+    Returns:
+        Tuple: (settlement, version)
+    """
+    key = (str(trip_id), base_currency)
+    # Read before calculating, so a change made meanwhile is never hidden
+    # behind a version that predates it
+    version = settlement_version(trip_id)
+    with _settlements_lock:
+        entry = _settlements.get(key)
+        if entry and entry[0] == version:
+            _settlements.move_to_end(key)
+            return entry[1], version
+
+    settlement = calculate_settlement(trip_id, base_currency)
+    with _settlements_lock:
+        _settlements[key] = (version, settlement)
+        _settlements.move_to_end(key)
+        while len(_settlements) > SETTLEMENT_CACHE_SIZE:
+            _settlements.popitem(last=False)
+    return settlement, version
+
+def split_between(expense, users, index):
+    """User IDs an expense is split between: its payees, or everyone"""
+    try:
+        payees = expense.payees
+    except Exception as payee_error:
+        logger.error(f"Error processing payees: {str(payee_error)}")
+        return users
+
+    if payees and isinstance(payees, list) and "all" not in payees:
+        payees = [payee_id for payee_id in dict.fromkeys(payees) if payee_id in index]
+        if payees:
+            return payees
+    # Legacy support for single payee_id
+    elif not payees and expense.payee_id and expense.payee_id != 'all' and expense.payee_id in index:
+        return [expense.payee_id]
+    return users
+
+def calculate_settlement(trip_id, base_currency='SGD'):
+    """
+    Split a trip's expenses between its users and work out who pays whom.
+
+    Amounts are added up and split in integer minor units of the base
+    currency, see app/money.py, so every unit spent is owed by exactly one
+    user, each user's share is within a unit of its exact value and the
+    transfers settle the balances exactly.
+
+    Args:
+        trip_id: The ID of the trip
+        base_currency: Currency the amounts are converted to
+
+    Returns:
+        Dict: Total amount, user names and settlements of the trip
+    """
+    logger.info(f"Calculating settlement for trip {trip_id} with base currency {base_currency}")
+
+    stmt = db.select(Expense).where(Expense.trip_id == trip_id)
+    expenses = db.session.scalars(stmt).all()  
+
+    if not expenses:
+        logger.info(f"No expenses found for trip {trip_id}")
+        return {
+            'trip_id': trip_id,
+            'message': 'No expenses found for this trip',
+            'total_amount': 0,
+            'currency': base_currency,
+            'settlements': [],
+            'user_balances': {}
+        }
+
+    logger.info(f"Found {len(expenses)} expenses for trip {trip_id}")
+
+    # Get the list of users for a given trip, with their positions in the arrays below
+    index = {}
+    for e in expenses:
+        # Add payer
+        index.setdefault(e.user_id, len(index))
+
+        # Add payees from the payees list
+        try:
+            payees = e.payees
+            if payees and isinstance(payees, list):
+                for payee_id in payees:
+                    if payee_id != "all":
+                        index.setdefault(payee_id, len(index))
+        except Exception as payee_error:
+            # Handle any issues with payees property
+            logger.error(f"Error processing payees: {str(payee_error)}")
+
+        # Legacy support for payee_id field
+        if e.payee_id and e.payee_id != 'all':
+            index.setdefault(e.payee_id, len(index))
+    users = list(index)
+
+    logger.info(f"Found {len(users)} users for trip {trip_id}: {users}")
+
+    if not users:
+        logger.warning(f"No users found for trip {trip_id}")
+        return {
+            'trip_id': trip_id,
+            'message': 'No users found for this trip',
+            'total_amount': 0,
+            'currency': base_currency,
+            'settlements': [],
+            'user_balances': {}
+        }
+
+    # Amounts in minor units of the base currency, each converted at the
+    # rates of its date and rounded to the nearest minor unit once
+    amounts = np.fromiter(
+        (rate_store.convert_minor(expense.amount_minor, expense.base_currency, base_currency, expense.date)
+         for expense in expenses),
+        dtype=np.int64, count=len(expenses)
+    )
+    total_amount = int(amounts.sum())
+    logger.info(f"Total amount for trip {trip_id}: {from_minor(total_amount, base_currency)} {base_currency}")
+
+    # Get user names/emails from the UserReadiness model for better display
+    users_info = {}
+    try:
+        stmt = db.select(UserReadiness).where(UserReadiness.trip_id == trip_id)
+        user_readiness_records = db.session.scalars(stmt).all()
+        for record in user_readiness_records:
+            users_info[record.user_id] = {
+                'name': record.name or f"User {record.user_id}",
+                'email': record.email
+            }
+        logger.info(f"Retrieved user info for {len(users_info)} users")
+    except Exception as user_info_error:
+        logger.error(f"Error getting user readiness records: {str(user_info_error)}")
+
+    # One row per expense weighing the users it's split between
+    weights = np.zeros((len(expenses), len(users)), dtype=np.int64)
+    payers = np.empty(len(expenses), dtype=np.int64)
+    for row, expense in enumerate(expenses):
+        payers[row] = index[expense.user_id]
+        weights[row, [index[user_id] for user_id in split_between(expense, users, index)]] = 1
+
+    # What each user paid, less their share of the expenses; exact, so the
+    # balances add up to zero
+    paid = np.zeros(len(users), dtype=np.int64)
+    np.add.at(paid, payers, amounts)
+    balances = paid - allocate(amounts, weights)
+
+    # Create settlement plan - who pays whom
+    settlements_formatted = [{
+        'from': str(users[debtor]),
+        'from_name': users_info.get(users[debtor], {}).get('name', f"User {users[debtor]}"),
+        'to': str(users[creditor]),
+        'to_name': users_info.get(users[creditor], {}).get('name', f"User {users[creditor]}"),
+        'amount': from_minor(amount, base_currency),
+        'currency': base_currency
+    } for debtor, creditor, amount in settle_balances(balances)]
+
+    response_data = {
+        'trip_id': str(trip_id),
+        'total_amount': from_minor(total_amount, base_currency),
+        'currency': base_currency,
+        'users': len(users),
+        'user_names': {str(user_id): users_info.get(user_id, {}).get('name', f"User {user_id}") for user_id in users},
+        'settlements': settlements_formatted
+    }
+
+    logger.info(f"Settlement calculation completed for trip {trip_id} with {len(settlements_formatted)} settlements")
+    return response_data
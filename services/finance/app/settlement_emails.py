@@ -0,0 +1,218 @@
+"""
+Settlement emails, sent in the background once everyone in a trip is ready.
+
+The readiness PUT records a queued SettlementEmail per user and publishes a
+settlement event on SETTLEMENT_EMAILS_QUEUE. The consumer calculates the
+settlement, renders the emails from a template compiled once at startup and
+sends them through the email provider in batches. Each batch is sent with
+an idempotency key derived from its recipients, so a batch retried after a
+failure or a redelivery is never sent twice, and the outcome is recorded
+per user.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+
+import pika
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from app.models import db, SettlementEmail, UserReadiness, insert_ignoring_existing
+from app.settlement import get_settlement
+from app.email_providers import EmailProviderError, create_provider
+from app.consumer_runtime import RejectMessage, RetryLater, connection_parameters
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SETTLEMENT_EMAILS_QUEUE = 'finance.settlement_emails'
+
+# Most emails sent in one provider request, capped by the provider's own limit
+EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', 100))
+
+_templates = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), 'templates')),
+    autoescape=select_autoescape()
+)
+SETTLEMENT_TEMPLATE = _templates.get_template('settlement_email.html')
+
+_provider = None
+_provider_lock = threading.Lock()
+
+def get_provider():
+    """The email provider, created on first use"""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = create_provider()
+        return _provider
+
+def publish_settlement_requested(trip_id, base_currency):
+    """
+    Publish a settlement event for a trip.
+
+    Returns:
+        bool: Whether the broker confirmed the event
+    """
+    connection = None
+    try:
+        connection = pika.BlockingConnection(connection_parameters())
+        channel = connection.channel()
+        channel.confirm_delivery()
+        channel.queue_declare(queue=SETTLEMENT_EMAILS_QUEUE, durable=True)
+        channel.basic_publish(
+            exchange='',
+            routing_key=SETTLEMENT_EMAILS_QUEUE,
+            body=json.dumps({'trip_id': str(trip_id), 'base_currency': base_currency}),
+            properties=pika.BasicProperties(delivery_mode=2, content_type='application/json')
+        )
+        return True
+    except pika.exceptions.AMQPError as e:
+        logger.error(f"Failed to publish settlement event for trip {trip_id}: {e!r}")
+        return False
+    finally:
+        if connection and connection.is_open:
+            connection.close()
+
+def queue_settlement_emails(trip_id, users, base_currency='SGD'):
+    """
+    Queue the settlement emails of a trip's users and publish the event
+    sending them. Users already emailed are skipped, as are users queued by
+    a concurrent request; emails that failed before are queued again.
+
+    Returns:
+        bool: Whether emails were queued
+    """
+    trip_id = str(trip_id)
+    rows = [{
+        'trip_id': trip_id,
+        'user_id': user.user_id,
+        'email': user.email,
+        'status': 'queued',
+        'attempts': 0
+    } for user in users]
+    try:
+        queued = insert_ignoring_existing(SettlementEmail, rows) if rows else 0
+        queued += SettlementEmail.query.filter_by(trip_id=trip_id, status='failed').update(
+            {'status': 'queued', 'error': None}, synchronize_session=False
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if not queued:
+        return False
+
+    if publish_settlement_requested(trip_id, base_currency):
+        logger.info(f"Queued {queued} settlement emails for trip {trip_id}")
+        return True
+
+    # Marked failed so that the next readiness update queues them again
+    SettlementEmail.query.filter_by(trip_id=trip_id, status='queued').update(
+        {'status': 'failed', 'error': 'Could not queue settlement email'}, synchronize_session=False
+    )
+    db.session.commit()
+    return False
+
+def idempotency_key(trip_id, recipients):
+    """Key of a batch, the same for as long as it has the same recipients"""
+    user_ids = ','.join(sorted(recipient.user_id for recipient in recipients))
+    return f"settlement-{trip_id}-{hashlib.sha256(user_ids.encode()).hexdigest()[:32]}"
+
+def render_settlement_emails(trip_id, settlement, recipients, names):
+    """
+    Render the settlement email of each recipient.
+
+    Returns:
+        List: Messages ({to, subject, html}) in the order of the recipients
+    """
+    # Index the settlements by user once instead of scanning them per recipient
+    to_pay, to_receive = {}, {}
+    for transfer in settlement.get('settlements', []):
+        to_pay.setdefault(transfer['from'], []).append({
+            'to': transfer['to_name'], 'amount': transfer['amount'], 'currency': transfer['currency']
+        })
+        to_receive.setdefault(transfer['to'], []).append({
+            'from': transfer['from_name'], 'amount': transfer['amount'], 'currency': transfer['currency']
+        })
+
+    subject = f"Trip Settlement Details for Trip #{trip_id}"
+    return [{
+        'to': recipient.email,
+        'subject': subject,
+        'html': SETTLEMENT_TEMPLATE.render(
+            trip_id=trip_id,
+            user_name=names.get(recipient.user_id) or 'Traveler',
+            total_trip_amount=settlement.get('total_amount', 0),
+            currency=settlement.get('currency', 'SGD'),
+            to_pay=to_pay.get(recipient.user_id, []),
+            to_receive=to_receive.get(recipient.user_id, [])
+        )
+    } for recipient in recipients]
+
+def handle_settlement_requested(delivery):
+    """Send the queued settlement emails of a trip, see app/consumer_runtime.py for how failures are retried"""
+    message = delivery.json()
+    trip_id = message.get('trip_id')
+    if not trip_id:
+        raise RejectMessage("Settlement event without a trip_id")
+
+    pending = SettlementEmail.query.filter_by(trip_id=trip_id, status='queued').order_by(SettlementEmail.user_id).all()
+    if not pending:
+        logger.info(f"No settlement emails left to send for trip {trip_id}")
+        return
+
+    try:
+        settlement, _ = get_settlement(trip_id, message.get('base_currency', 'SGD'))
+    except Exception as e:
+        db.session.rollback()
+        # Retried first; the emails are only marked failed once retries run out
+        if not delivery.final_attempt:
+            raise
+        for row in pending:
+            row.status, row.error = 'failed', f"Error calculating settlement: {e}"
+        db.session.commit()
+        return
+
+    names = {user.user_id: user.name for user in UserReadiness.query.filter_by(trip_id=trip_id)}
+
+    recipients = []
+    for row in pending:
+        if row.email:
+            recipients.append(row)
+        else:
+            row.status, row.error = 'failed', 'No email address'
+    db.session.commit()
+
+    provider = get_provider()
+    batch_size = min(EMAIL_BATCH_SIZE, provider.max_batch_size)
+    retry_error = None
+    for start in range(0, len(recipients), batch_size):
+        batch = recipients[start:start + batch_size]
+        messages = render_settlement_emails(trip_id, settlement, batch, names)
+        for row in batch:
+            row.attempts += 1
+
+        try:
+            message_ids = provider.send_batch(messages, idempotency_key(trip_id, batch))
+        except EmailProviderError as e:
+            logger.error(f"Failed to send {len(batch)} settlement emails for trip {trip_id}: {e}")
+            # Left queued to be retried, unless retrying can't help
+            failed = not e.retryable or delivery.final_attempt
+            for row in batch:
+                row.error = str(e)
+                if failed:
+                    row.status = 'failed'
+            if not failed:
+                retry_error = e
+        else:
+            for row, message_id in zip(batch, message_ids):
+                row.status, row.provider_message_id, row.error = 'sent', message_id, None
+            logger.info(f"Sent {len(batch)} settlement emails for trip {trip_id}")
+        # Recorded batch by batch, so a retry only resends the batches that failed
+        db.session.commit()
+
+    if retry_error:
+        raise RetryLater(str(retry_error))
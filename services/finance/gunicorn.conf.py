@@ -0,0 +1,20 @@
+"""gunicorn settings of the finance service: `gunicorn wsgi:app`, see app/serving.py"""
+import os
+
+from app import serving
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5008)}"
+worker_class = 'gthread'
+workers = serving.WEB_CONCURRENCY
+threads = serving.WEB_THREADS
+preload_app = serving.WEB_PRELOAD
+max_requests = serving.WEB_MAX_REQUESTS
+max_requests_jitter = serving.WEB_MAX_REQUESTS_JITTER
+timeout = serving.WEB_TIMEOUT
+graceful_timeout = serving.WEB_GRACEFUL_TIMEOUT
+keepalive = serving.WEB_KEEPALIVE
+accesslog = '-'
+
+post_fork = serving.post_fork
+post_worker_init = serving.post_worker_init
+worker_exit = serving.worker_exit
@@ -0,0 +1,96 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+from datetime import date
+
+from flask import Flask
+
+from app.models import db, Expense, UserReadiness, ExchangeRateDay, insert_ignoring_existing
+from app.rate_store import rate_store, pack_rates
+from app.expense_analytics import expense_breakdown, AnalyticsError
+from app.routes import register_routes
+
+def create_test_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    register_routes(app)
+    return app
+
+class ExpenseBreakdownTest(unittest.TestCase):
+    def setUp(self):
+        self.app = create_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+        db.create_all()
+
+        # One USD is 1.25 SGD on 1 April and 1.5 SGD on 2 April
+        for day, sgd in ((date(2025, 4, 1), 1.25), (date(2025, 4, 2), 1.5)):
+            currencies, rates = pack_rates({'USD': 1.0, 'SGD': sgd, 'JPY': 150.0})
+            insert_ignoring_existing(ExchangeRateDay, [{'rate_date': day, 'currencies': currencies, 'rates': rates}])
+
+        for user_id, day, amount, currency, category in [
+            ('1', date(2025, 4, 1), 10, 'USD', 'Food'),
+            ('1', date(2025, 4, 2), 10, 'USD', 'Food'),
+            ('2', date(2025, 4, 1), 20, 'SGD', 'Transport'),
+            ('2', date(2025, 4, 2), 1500, 'JPY', 'Food'),
+        ]:
+            db.session.add(Expense(trip_id='trip-1', user_id=user_id, date=day, location='Tokyo', amount=amount,
+                                   base_currency=currency, description='', is_paid=False, category=category))
+        db.session.add(Expense(trip_id='trip-2', user_id='3', date=date(2025, 4, 1), location='Oslo', amount=99,
+                               base_currency='SGD', description='', is_paid=False, category='Food'))
+        db.session.add(UserReadiness(trip_id='trip-1', user_id='1', name='Ana'))
+        db.session.commit()
+        rate_store.load()
+
+    def test_by_category(self):
+        breakdown = expense_breakdown('trip-1', 'category')
+        # Each day's USD at that day's rate: 12.5 + 15, and 1500 JPY at 0.01 SGD
+        self.assertEqual(breakdown['columns'], {
+            'category': ['Food', 'Transport'],
+            'total': [42.5, 20],
+            'count': [3, 1],
+        })
+        self.assertEqual((breakdown['total'], breakdown['count'], breakdown['currency']), (62.5, 4, 'SGD'))
+
+    def test_by_day(self):
+        columns = expense_breakdown('trip-1', 'day', 'USD')['columns']
+        # In the order of the days, not of the totals
+        self.assertEqual(columns, {'day': ['2025-04-01', '2025-04-02'], 'total': [26, 20], 'count': [2, 2]})
+
+    def test_by_payer(self):
+        columns = expense_breakdown('trip-1', 'payer')['columns']
+        # Named from the readiness rows where there is one
+        self.assertEqual(columns, {'payer': ['2', '1'], 'total': [35, 27.5], 'count': [2, 2], 'name': ['User 2', 'Ana']})
+
+    def test_by_currency(self):
+        columns = expense_breakdown('trip-1', 'currency')['columns']
+        self.assertEqual(columns, {
+            'currency': ['USD', 'SGD', 'JPY'],
+            'total': [27.5, 20, 15],
+            'count': [2, 1, 1],
+            'original_total': [20, 20, 1500],
+        })
+
+    def test_invalid_dimension(self):
+        with self.assertRaises(AnalyticsError):
+            expense_breakdown('trip-1', 'location')
+        client = self.app.test_client()
+        self.assertEqual(client.get('/api/finance/analytics/trip-1?by=location').status_code, 400)
+        self.assertEqual(client.get('/api/finance/analytics/trip-1?by=category&base=XYZ').status_code, 400)
+
+        response = client.get('/api/finance/analytics/trip-1?by=payer')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['columns']['payer'], ['2', '1'])
+
+    def test_trip_without_expenses(self):
+        breakdown = expense_breakdown('trip-3', 'category')
+        self.assertEqual((breakdown['total'], breakdown['count']), (0, 0))
+        self.assertEqual(breakdown['columns'], {'category': [], 'total': [], 'count': []})
+
+if __name__ == '__main__':
+    unittest.main()
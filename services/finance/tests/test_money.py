@@ -0,0 +1,67 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+import numpy as np
+from app.money import exponent, to_minor, from_minor, convert_minor, allocate, settle_balances
+
+class MoneyTest(unittest.TestCase):
+    def test_minor_units(self):
+        self.assertEqual(exponent('SGD'), 2)
+        self.assertEqual(exponent('JPY'), 0)
+        self.assertEqual(exponent('KWD'), 3)
+        self.assertEqual(to_minor(12.34, 'SGD'), 1234)
+        # Floats that are just under the half still round half up
+        self.assertEqual(to_minor(1.005, 'SGD'), 101)
+        self.assertEqual(to_minor('1500', 'JPY'), 1500)
+        self.assertEqual(to_minor(1.2345, 'KWD'), 1235)
+        self.assertEqual(from_minor(1234, 'SGD'), 12.34)
+        self.assertEqual(from_minor(1500, 'JPY'), 1500)
+
+    def test_convert_minor(self):
+        # 1000 yen at 0.009 SGD per yen is 9.00 SGD
+        self.assertEqual(convert_minor(1000, 'JPY', 'SGD', 0.009), 900)
+        self.assertEqual(convert_minor(np.array([1000, 1]), 'JPY', 'SGD', 0.009).tolist(), [900, 1])
+
+    def test_allocate_is_exact(self):
+        rng = np.random.default_rng(7)
+        amounts = rng.integers(-10**9, 10**9, 500)
+        weights = rng.integers(0, 4, (500, 30))
+        weights[:, 0] += 1
+        totals = allocate(amounts, weights)
+        self.assertEqual(totals.sum(), amounts.sum())
+        # No total is off its exact proportion by a unit or more
+        exact = (amounts[:, None] * weights / weights.sum(axis=1)[:, None]).sum(axis=0)
+        self.assertTrue((np.abs(totals - exact) < 1).all())
+
+    def test_allocate_leftovers(self):
+        # 100 split three ways: one share gets the extra unit
+        self.assertEqual(allocate([100], [[1, 1, 1]]).tolist(), [34, 33, 33])
+        # The largest remainder wins over position
+        self.assertEqual(allocate([10], [[1, 2]]).tolist(), [3, 7])
+        # Users not splitting an amount get nothing
+        self.assertEqual(allocate([5], [[1, 0, 1]]).tolist(), [3, 0, 2])
+        # The leftovers of many splits are added up before they're handed
+        # out, so they don't all land on the first shares
+        self.assertEqual(allocate(np.full(300, 100), np.ones((300, 3))).tolist(), [10000, 10000, 10000])
+        self.assertEqual(allocate(np.ones(300), np.ones((300, 3))).tolist(), [100, 100, 100])
+
+    def test_settle_balances(self):
+        self.assertEqual(settle_balances([-300, 100, 200]), [(0, 2, 200), (0, 1, 100)])
+        self.assertEqual(settle_balances([0, 0]), [])
+
+        rng = np.random.default_rng(11)
+        balances = rng.integers(-10**6, 10**6, 1000)
+        balances[0] -= balances.sum()
+        transfers = settle_balances(balances)
+        settled = balances.copy()
+        for debtor, creditor, amount in transfers:
+            self.assertGreater(amount, 0)
+            settled[debtor] += amount
+            settled[creditor] -= amount
+        self.assertFalse(settled.any())
+        self.assertLess(len(transfers), len(balances))
+
+if __name__ == '__main__':
+    unittest.main()
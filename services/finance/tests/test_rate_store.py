@@ -0,0 +1,102 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+from datetime import date, timedelta
+from unittest.mock import patch
+
+from flask import Flask
+
+from app import rate_store as rate_store_module
+from app.models import db, ExchangeRateDay, insert_ignoring_existing
+from app.rate_providers import StubRateProvider
+from app.rate_store import RateStore, RatesUnavailable, pack_rates, unpack_rates, fetch_rates
+
+def create_test_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+class RateStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.app = create_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+        db.create_all()
+        self.store = RateStore()
+
+    def store_day(self, day, rates):
+        currencies, packed = pack_rates(rates)
+        insert_ignoring_existing(ExchangeRateDay, [{'rate_date': day, 'currencies': currencies, 'rates': packed}])
+        db.session.commit()
+
+    def test_pack_round_trip(self):
+        rates = {'USD': 1.0, 'SGD': 1.35, 'JPY': 150.0}
+        self.assertEqual(unpack_rates(*pack_rates(rates)), rates)
+
+    def test_missing_days_and_currencies_are_carried_forward(self):
+        self.store_day(date(2025, 4, 1), {'USD': 1.0, 'SGD': 1.25, 'JPY': 150.0})
+        # 2 April is missing, and JPY is missing on 3 April
+        self.store_day(date(2025, 4, 3), {'USD': 1.0, 'SGD': 1.5})
+        self.store.load()
+
+        self.assertEqual(self.store.convert(10, 'USD', 'SGD', date(2025, 4, 1)), 12.5)
+        self.assertEqual(self.store.convert(10, 'USD', 'SGD', date(2025, 4, 2)), 12.5)
+        self.assertEqual(self.store.convert(10, 'USD', 'SGD', date(2025, 4, 3)), 15)
+        self.assertEqual(self.store.convert(1, 'USD', 'JPY', date(2025, 4, 3)), 150)
+
+        # Dates outside the stored ones use the nearest day's rates
+        self.assertEqual(self.store.convert(10, 'USD', 'SGD', date(2025, 1, 1)), 12.5)
+        self.assertEqual(self.store.convert(10, 'USD', 'SGD', date(2026, 1, 1)), 15)
+
+        self.assertEqual(self.store.snapshot().rates('USD', date(2025, 4, 3)), {'USD': 1.0, 'SGD': 1.5, 'JPY': 150.0})
+        # 1000 JPY to SGD cents, at the 3 April rates
+        self.assertEqual(self.store.convert_minor(1000, 'JPY', 'SGD', date(2025, 4, 3)), 1000)
+
+    def test_currency_added_later_is_unavailable_before(self):
+        self.store_day(date(2025, 4, 1), {'USD': 1.0, 'SGD': 1.25})
+        self.store_day(date(2025, 4, 2), {'USD': 1.0, 'SGD': 1.25, 'EUR': 0.5})
+        self.store.load()
+        self.assertEqual(self.store.convert(1, 'EUR', 'USD', date(2025, 4, 2)), 2)
+        with self.assertRaises(RatesUnavailable):
+            self.store.convert(1, 'EUR', 'USD', date(2025, 4, 1))
+        with self.assertRaises(RatesUnavailable):
+            self.store.convert(1, 'XYZ', 'USD', date(2025, 4, 2))
+
+    def test_empty_store(self):
+        self.store.load()
+        with self.assertRaises(RatesUnavailable):
+            self.store.convert(1, 'USD', 'SGD', date(2025, 4, 1))
+        # Same currency needs no rate
+        self.assertEqual(self.store.convert_minor(150, 'SGD', 'SGD', date(2025, 4, 1)), 150)
+
+    def test_version_changes_with_the_stored_days(self):
+        self.store_day(date(2025, 4, 1), {'USD': 1.0, 'SGD': 1.25})
+        self.store.load()
+        version = self.store.version
+        self.store.load()
+        self.assertEqual(self.store.version, version)
+
+        self.store_day(date(2025, 4, 2), {'USD': 1.0, 'SGD': 1.3})
+        self.store.load()
+        self.assertNotEqual(self.store.version, version)
+
+    def test_fetch_backfills_missing_days(self):
+        today = date(2025, 4, 10)
+        self.store_day(today - timedelta(days=1), {'USD': 1.0, 'SGD': 1.25})
+        with patch.multiple(rate_store_module, utc_today=lambda: today, RATE_BACKFILL_DAYS=3), \
+                patch.object(rate_store_module, 'rate_store', self.store):
+            self.assertEqual(fetch_rates(StubRateProvider()), 3)
+            self.assertEqual(fetch_rates(StubRateProvider()), 0)
+
+        days = db.session.scalars(db.select(ExchangeRateDay.rate_date).order_by(ExchangeRateDay.rate_date)).all()
+        self.assertEqual(days, [today - timedelta(days=offset) for offset in range(3, -1, -1)])
+        # The day that was already stored is kept
+        self.assertEqual(self.store.convert(1, 'USD', 'SGD', today - timedelta(days=1)), 1.25)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from flask import Flask
+
+from app import models, readiness
+from app.client import TripClient, GroupClient, UserClient
+from app.models import db, UserReadiness, trip_version
+from app.readiness import bootstrap_readiness, get_trip_members, invalidate_members, ReadinessBootstrapError
+from app.routes import register_routes
+
+def create_test_app(database_uri='sqlite://'):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    register_routes(app)
+    return app
+
+PROFILES = {
+    '1': {'id': 1, 'first_name': 'Ana', 'last_name': 'Lim', 'email': 'ana@example.com'},
+    '2': {'id': 2, 'first_name': 'Ben', 'last_name': None, 'email': 'ben@example.com'},
+}
+
+class ReadinessBootstrapTest(unittest.TestCase):
+    database_uri = 'sqlite://'
+
+    def setUp(self):
+        self.app = create_test_app(self.database_uri)
+        self.context = self.app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+        db.create_all()
+        self.addCleanup(db.drop_all)
+        self.client = self.app.test_client()
+
+        readiness._members_cache.clear()
+        self.addCleanup(readiness._members_cache.clear)
+
+        self.get_trip = self.patch(TripClient, 'get_trip_details', return_value={'id': 'trip-1', 'group_id': 7})
+        self.get_members = self.patch(GroupClient, 'get_group_members', return_value=[1, 2, 3])
+        self.resolve = self.patch(UserClient, 'resolve_users', return_value=PROFILES)
+
+    def patch(self, target, name, **kwargs):
+        patcher = patch.object(target, name, **kwargs)
+        mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        return mock
+
+    def rows(self):
+        rows = UserReadiness.query.filter_by(trip_id='trip-1').order_by(UserReadiness.user_id).all()
+        return [(row.user_id, row.name, row.email, row.ready) for row in rows]
+
+    def test_rows_are_created_from_the_group(self):
+        insert = self.patch(readiness, 'insert_ignoring_existing', wraps=models.insert_ignoring_existing)
+
+        response = self.client.get('/api/finance/readiness/trip-1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()['users']), 3)
+        self.assertEqual(self.rows(), [
+            ('1', 'Ana Lim', 'ana@example.com', False),
+            ('2', 'Ben', 'ben@example.com', False),
+            # Unknown to the user service
+            ('3', 'User 3', '3@example.com', False),
+        ])
+
+        # One batch request for the profiles, one statement for the rows
+        self.resolve.assert_called_once_with(['1', '2', '3'])
+        insert.assert_called_once()
+        self.assertEqual(len(insert.call_args[0][1]), 3)
+        self.assertEqual(trip_version('trip-1'), 1)
+
+    def test_repeated_bootstrap_reuses_the_rows(self):
+        bootstrap_readiness('trip-1')
+        UserReadiness.query.filter_by(trip_id='trip-1', user_id='1').one().ready = True
+        db.session.commit()
+
+        self.assertEqual(len(bootstrap_readiness('trip-1')), 3)
+        self.assertEqual(self.client.get('/api/finance/readiness/trip-1').status_code, 200)
+        self.assertEqual(len(self.rows()), 3)
+        self.assertTrue(self.rows()[0][3])
+        self.assertEqual(self.resolve.call_count, 1)
+
+    def test_rows_inserted_meanwhile_are_kept(self):
+        # Another process bootstraps the trip while this one fetches the members
+        def other_bootstrap(group_id):
+            db.session.add(UserReadiness('trip-1', '2', 'Ben Tan', 'ben@example.com', ready=True))
+            db.session.commit()
+            return [1, 2, 3]
+        self.get_members.side_effect = other_bootstrap
+
+        self.assertEqual(len(bootstrap_readiness('trip-1')), 3)
+        self.assertEqual(self.rows()[1], ('2', 'Ben Tan', 'ben@example.com', True))
+
+    def test_trip_without_group(self):
+        self.get_trip.return_value = {'id': 'trip-1', 'group_id': None}
+        with self.assertRaises(ReadinessBootstrapError) as caught:
+            bootstrap_readiness('trip-1')
+        self.assertEqual(caught.exception.status_code, 404)
+        self.assertEqual(self.client.get('/api/finance/readiness/trip-1').status_code, 404)
+        self.resolve.assert_not_called()
+
+    def test_members_are_cached_until_they_expire(self):
+        self.assertEqual(get_trip_members('trip-1'), ['1', '2', '3'])
+        self.get_members.return_value = [1, 2]
+        self.assertEqual(get_trip_members('trip-1'), ['1', '2', '3'])
+        self.assertEqual(self.get_members.call_count, 1)
+
+        invalidate_members('trip-1')
+        self.assertEqual(get_trip_members('trip-1'), ['1', '2'])
+
+        with patch.object(readiness, 'GROUP_MEMBERS_CACHE_TTL', 0.05):
+            get_trip_members('trip-2')
+            get_trip_members('trip-2')
+            self.assertEqual(self.get_members.call_count, 3)
+            time.sleep(0.1)
+            get_trip_members('trip-2')
+            self.assertEqual(self.get_members.call_count, 4)
+
+    def test_members_cache_is_bounded(self):
+        with patch.object(readiness, 'GROUP_MEMBERS_CACHE_SIZE', 2):
+            for trip_id in ('trip-1', 'trip-2', 'trip-3'):
+                get_trip_members(trip_id)
+        self.assertEqual(list(readiness._members_cache), ['trip-2', 'trip-3'])
+
+class ConcurrentBootstrapTest(ReadinessBootstrapTest):
+    """Bootstraps on several threads, each with its own connection to a database file"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.database_uri = f"sqlite:///{os.path.join(directory, 'finance.db')}"
+        super().setUp()
+
+    def test_concurrent_bootstraps_create_the_rows_once(self):
+        # Hold the group service long enough for every thread to be waiting
+        def slow_members(group_id):
+            time.sleep(0.1)
+            return [1, 2, 3]
+        self.get_members.side_effect = slow_members
+
+        results, errors = [], []
+        def bootstrap():
+            with self.app.app_context():
+                try:
+                    results.append(len(bootstrap_readiness('trip-1')))
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=bootstrap) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(results, [3] * 8)
+        self.assertEqual(len(self.rows()), 3)
+        self.assertEqual(self.get_members.call_count, 1)
+        self.resolve.assert_called_once()
+        self.assertEqual(trip_version('trip-1'), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import tempfile
+import threading
+import time
+import unittest
+from app import serving
+
+class FakeWorker:
+    def __init__(self):
+        self.alive = True
+        self.max_requests = 100
+
+class ServingTest(unittest.TestCase):
+    def setUp(self):
+        self.lock_dir = tempfile.mkdtemp()
+        serving.BACKGROUND_LOCK_DIR = self.lock_dir
+        serving.BACKGROUND_LOCK_RETRY = 0.05
+
+    def test_run_once_elects_one_worker(self):
+        # flock locks belong to open files, so two opens in one process
+        # compete like two worker processes do
+        started = []
+        workers = [FakeWorker(), FakeWorker()]
+        threads = [
+            threading.Thread(target=serving._hold_lock, args=(worker, 'probe', lambda: started.append(1), None))
+            for worker in workers
+        ]
+        for thread in threads:
+            thread.start()
+        threads[0].join(1)
+        threads[1].join(1)
+        self.assertEqual(started, [1])
+        # The leader is never recycled, the other keeps waiting
+        self.assertEqual(sorted(worker.max_requests for worker in workers), [100, sys.maxsize])
+        for worker in workers:
+            worker.alive = False
+        for thread in threads:
+            thread.join(1)
+            self.assertFalse(thread.is_alive())
+
+    def test_wakeup_crosses_processes(self):
+        wakeup = serving.Wakeup('probe')
+        pid = os.fork()
+        if pid == 0:
+            time.sleep(0.2)
+            serving.Wakeup('probe').set()
+            os._exit(0)
+        started = time.monotonic()
+        wakeup.wait(10)
+        os.waitpid(pid, 0)
+        self.assertLess(time.monotonic() - started, 5)
+
+        # Waiting clears it
+        started = time.monotonic()
+        wakeup.wait(0.1)
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+if __name__ == '__main__':
+    unittest.main()
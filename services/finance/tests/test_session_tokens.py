@@ -0,0 +1,111 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from flask import Flask, jsonify
+from jwt.algorithms import OKPAlgorithm
+
+from app import session_tokens
+from app.session_tokens import KeySet, SessionTokenError, SessionKeysUnavailable, verify_token, session_user
+
+class FakeUserService:
+    """Serves the JWK set of the user service's current keys"""
+
+    def __init__(self):
+        self.keys = {}
+        self.fetches = 0
+
+    def rotate(self, kid):
+        self.keys = {kid: Ed25519PrivateKey.generate()}
+
+    def get(self, url, timeout=None):
+        self.fetches += 1
+        keys = []
+        for kid, key in self.keys.items():
+            jwk = OKPAlgorithm.to_jwk(key.public_key(), as_dict=True)
+            jwk.update({'kid': kid, 'alg': 'EdDSA', 'use': 'sig'})
+            keys.append(jwk)
+        return SimpleNamespace(raise_for_status=lambda: None, json=lambda: {'keys': keys})
+
+    def token(self, kid, user_id=1, ttl=60):
+        now = datetime.now(timezone.utc)
+        claims = {'sub': str(user_id), 'email': 'ana@example.com', 'iss': 'user-service',
+                  'iat': now, 'exp': now + timedelta(seconds=ttl)}
+        return jwt.encode(claims, self.keys[kid], algorithm='EdDSA', headers={'kid': kid})
+
+class SessionTokenTest(unittest.TestCase):
+    def setUp(self):
+        self.user_service = FakeUserService()
+        self.user_service.rotate('first')
+        patchers = [
+            patch.object(session_tokens.requests, 'get', self.user_service.get),
+            patch.object(session_tokens, '_key_set', KeySet('http://user:5001/jwks.json')),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_valid_token(self):
+        claims = verify_token(self.user_service.token('first'))
+        self.assertEqual((claims['sub'], claims['email']), ('1', 'ana@example.com'))
+        # The keys are cached
+        verify_token(self.user_service.token('first'))
+        self.assertEqual(self.user_service.fetches, 1)
+
+    def test_rotated_key_is_fetched(self):
+        retired = self.user_service.token('first')
+        verify_token(retired)
+        self.user_service.rotate('second')
+        token = self.user_service.token('second')
+
+        # Unknown key IDs refetch the keys, at most every SESSION_KEYS_MIN_REFRESH seconds
+        with self.assertRaises(SessionTokenError):
+            verify_token(token)
+        self.assertEqual(self.user_service.fetches, 1)
+
+        session_tokens._key_set._fetched_at = time.monotonic() - session_tokens.SESSION_KEYS_MIN_REFRESH
+        self.assertEqual(verify_token(token)['sub'], '1')
+        self.assertEqual(self.user_service.fetches, 2)
+        # The retired key no longer verifies
+        with self.assertRaises(SessionTokenError):
+            verify_token(retired)
+
+    def test_invalid_tokens(self):
+        forged = FakeUserService()
+        forged.rotate('first')
+        for token in ('not a token', forged.token('first'), self.user_service.token('first', ttl=-120)):
+            with self.assertRaises(SessionTokenError):
+                verify_token(token)
+
+    def test_user_service_down(self):
+        def unreachable(url, timeout=None):
+            raise session_tokens.requests.ConnectionError('refused')
+
+        with patch.object(session_tokens.requests, 'get', unreachable):
+            with self.assertRaises(SessionKeysUnavailable):
+                verify_token(self.user_service.token('first'))
+
+    def test_requests(self):
+        app = Flask(__name__)
+        session_tokens.init_app(app)
+        app.add_url_rule('/me', 'me', lambda: jsonify(session_user()))
+        client = app.test_client()
+
+        # Requests without a token are let through
+        self.assertIsNone(client.get('/me').get_json())
+        response = client.get('/me', headers={'Authorization': f"Bearer {self.user_service.token('first', user_id=7)}"})
+        self.assertEqual(response.get_json()['id'], 7)
+        response = client.get('/me', headers={'Authorization': 'Bearer forged'})
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('invalid_token', response.headers['WWW-Authenticate'])
+
+if __name__ == '__main__':
+    unittest.main()
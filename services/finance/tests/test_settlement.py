@@ -0,0 +1,127 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+from flask import Flask
+from sqlalchemy.exc import IntegrityError
+
+from app import routes, settlement
+from app.models import db, Expense, ExchangeRateDay, bump_trip_versions, insert_ignoring_existing
+from app.rate_providers import StubRateProvider
+from app.rate_store import rate_store, pack_rates, RATE_PIVOT_CURRENCY
+from app.routes import register_routes
+
+def create_test_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    register_routes(app)
+    return app
+
+def store_rates(day):
+    currencies, rates = pack_rates(StubRateProvider().fetch(RATE_PIVOT_CURRENCY, day))
+    insert_ignoring_existing(ExchangeRateDay, [{'rate_date': day, 'currencies': currencies, 'rates': rates}])
+    db.session.commit()
+    rate_store.load()
+
+class SettlementEtagTest(unittest.TestCase):
+    def setUp(self):
+        self.app = create_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+        db.create_all()
+        self.client = self.app.test_client()
+
+        # Every test starts from a new database, so from the same versions
+        settlement._settlements.clear()
+        store_rates(date(2025, 4, 1))
+
+    def add_expense(self, user_id, amount, payees=None):
+        # As the add route does; the route itself passes the date on as a
+        # string, which Postgres accepts and SQLite doesn't
+        db.session.add(Expense(trip_id='trip-1', user_id=user_id, date=date(2025, 4, 1), location='Tokyo',
+                               amount=amount, base_currency='SGD', description='Dinner', is_paid=False,
+                               category='Food', payees=payees))
+        bump_trip_versions(['trip-1'])
+        db.session.commit()
+
+    def settle(self, etag=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.client.get('/api/finance/calculate/trip-1', headers=headers)
+
+    def test_unchanged_settlement_is_not_modified(self):
+        self.add_expense('1', 30, ['1', '2', '3'])
+        response = self.settle()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        self.assertEqual(response.get_json()['total_amount'], 30)
+
+        etag = response.headers['ETag']
+        self.assertEqual(self.settle(etag).status_code, 304)
+        # Answered from memory
+        with patch.object(settlement, 'calculate_settlement', side_effect=AssertionError('recalculated')):
+            self.assertEqual(self.settle().headers['ETag'], etag)
+
+    def test_expense_changes_the_etag(self):
+        self.add_expense('1', 30, ['1', '2'])
+        etag = self.settle().headers['ETag']
+        self.add_expense('2', 10, ['1', '2'])
+
+        response = self.settle(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.get_json()['total_amount'], 40)
+
+    def test_readiness_changes_the_etag(self):
+        self.add_expense('1', 30, ['1', '2'])
+        etag = self.settle().headers['ETag']
+        with patch.object(routes, 'queue_settlement_emails', return_value=True):
+            response = self.client.put('/api/finance/readiness/trip-1/1', json={'name': 'Ana', 'email': 'ana@example.com'})
+        self.assertEqual(response.status_code, 200)
+
+        response = self.settle(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['user_names']['1'], 'Ana')
+
+    def test_rates_change_the_etag(self):
+        self.add_expense('1', 30, ['1', '2'])
+        etag = self.settle().headers['ETag']
+        store_rates(date(2025, 4, 2))
+        self.assertEqual(self.settle(etag).status_code, 200)
+
+    def test_analytics_share_the_version(self):
+        self.add_expense('1', 30, ['1', '2'])
+        etag = self.settle().headers['ETag']
+        response = self.client.get('/api/finance/analytics/trip-1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_expenses_are_keyed_on_minor_units(self):
+        key = [column.name for column in Expense.__table__.primary_key]
+        self.assertIn('amount_minor', key)
+        self.assertNotIn('amount', key)
+
+        # Amounts that only differ as floats are the same expense
+        self.add_expense('1', 0.1 + 0.2, ['1', '2'])
+        with self.assertRaises(IntegrityError):
+            self.add_expense('1', 0.3, ['1', '2'])
+        db.session.rollback()
+
+        self.add_expense('1', 0.31, ['1', '2'])
+        self.assertEqual(self.settle().get_json()['total_amount'], 0.61)
+
+    def test_minor_units_are_required(self):
+        expense = Expense(trip_id='trip-1', user_id='1', date=date(2025, 4, 1), location='Tokyo', amount=30,
+                          base_currency='SGD', description='Dinner', is_paid=False, category='Food')
+        expense.amount_exponent = None
+        db.session.add(expense)
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+
+if __name__ == '__main__':
+    unittest.main()
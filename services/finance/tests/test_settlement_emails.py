@@ -0,0 +1,216 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+from flask import Flask
+
+from app import email_providers, settlement, settlement_emails
+from app.consumer_runtime import RetryLater
+from app.email_providers import EmailProviderError, StubProvider
+from app.models import db, Expense, ExchangeRateDay, SettlementEmail, UserReadiness, bump_trip_versions, insert_ignoring_existing
+from app.rate_providers import StubRateProvider
+from app.rate_store import rate_store, pack_rates, RATE_PIVOT_CURRENCY
+from app.routes import register_routes
+from app.settlement_emails import handle_settlement_requested, idempotency_key, queue_settlement_emails
+
+def create_test_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    register_routes(app)
+    return app
+
+def store_rates(day):
+    currencies, rates = pack_rates(StubRateProvider().fetch(RATE_PIVOT_CURRENCY, day))
+    insert_ignoring_existing(ExchangeRateDay, [{'rate_date': day, 'currencies': currencies, 'rates': rates}])
+    db.session.commit()
+    rate_store.load()
+
+class FakeDelivery:
+    def __init__(self, message, final_attempt=False):
+        self.body = json.dumps(message).encode()
+        self.final_attempt = final_attempt
+
+    def json(self):
+        return json.loads(self.body)
+
+class SettlementEmailTest(unittest.TestCase):
+    def setUp(self):
+        self.app = create_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+        db.create_all()
+        self.client = self.app.test_client()
+
+        settlement._settlements.clear()
+        store_rates(date(2025, 4, 1))
+
+        # As with EMAIL_PROVIDER=stub, emails are kept by a new stub
+        # provider per test instead of being sent
+        self.patch(email_providers, 'EMAIL_PROVIDER', new='stub')
+        self.patch(settlement_emails, '_provider', new=None)
+        self.provider = settlement_emails.get_provider()
+        self.assertIsInstance(self.provider, StubProvider)
+        self.stub_send_batch = self.provider.send_batch
+        self.send_batch = self.patch(self.provider, 'send_batch', wraps=self.stub_send_batch)
+        self.publish = self.patch(settlement_emails, 'publish_settlement_requested', return_value=True)
+
+        for user_id, name in [('1', 'Ana'), ('2', 'Ben'), ('3', 'Cai')]:
+            db.session.add(UserReadiness('trip-1', user_id, name, f"{name.lower()}@example.com", ready=user_id != '3'))
+        db.session.add(Expense(trip_id='trip-1', user_id='1', date=date(2025, 4, 1), location='Tokyo',
+                               amount=30, base_currency='SGD', description='Dinner', is_paid=False,
+                               category='Food', payees=['1', '2', '3']))
+        bump_trip_versions(['trip-1'])
+        db.session.commit()
+
+    def patch(self, target, name, **kwargs):
+        patcher = patch.object(target, name, **kwargs)
+        mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        return mock
+
+    def queue(self):
+        self.assertTrue(queue_settlement_emails('trip-1', UserReadiness.query.filter_by(trip_id='trip-1').all()))
+
+    def statuses(self):
+        emails = self.client.get('/api/finance/readiness/trip-1/emails').get_json()['emails']
+        return {email['user_id']: (email['status'], email['attempts']) for email in emails}
+
+    def test_readiness_put_queues_without_sending(self):
+        response = self.client.put('/api/finance/readiness/trip-1/3')
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertTrue(body['all_ready'])
+        self.assertTrue(body['email_queued'])
+
+        # Published for the consumer; nothing is rendered or sent in the request
+        self.publish.assert_called_once_with('trip-1', 'SGD')
+        self.send_batch.assert_not_called()
+        self.assertEqual(self.provider.sent, [])
+        self.assertEqual(self.statuses(), {'1': ('queued', 0), '2': ('queued', 0), '3': ('queued', 0)})
+
+        # Users already queued aren't queued or published again
+        self.assertFalse(self.client.put('/api/finance/readiness/trip-1/3').get_json()['email_queued'])
+        self.publish.assert_called_once()
+
+    def test_unpublished_emails_are_marked_failed(self):
+        self.publish.return_value = False
+        self.assertFalse(self.client.put('/api/finance/readiness/trip-1/3').get_json()['email_queued'])
+        self.assertEqual(set(self.statuses().values()), {('failed', 0)})
+
+        # The next readiness update queues them again
+        self.publish.return_value = True
+        self.assertTrue(self.client.put('/api/finance/readiness/trip-1/3').get_json()['email_queued'])
+        self.assertEqual(set(self.statuses().values()), {('queued', 0)})
+
+    def test_emails_are_sent_in_one_batch(self):
+        self.queue()
+        handle_settlement_requested(FakeDelivery({'trip_id': 'trip-1', 'base_currency': 'SGD'}))
+
+        self.send_batch.assert_called_once()
+        messages, key = self.send_batch.call_args[0]
+        self.assertEqual([message['to'] for message in messages],
+                         ['ana@example.com', 'ben@example.com', 'cai@example.com'])
+        self.assertIn('Ben', messages[1]['html'])
+        self.assertEqual(key, idempotency_key('trip-1', SettlementEmail.query.all()))
+
+        self.assertEqual(self.statuses(), {'1': ('sent', 1), '2': ('sent', 1), '3': ('sent', 1)})
+        self.assertTrue(all(row.provider_message_id for row in SettlementEmail.query))
+
+        # A redelivered event finds nothing left to send
+        handle_settlement_requested(FakeDelivery({'trip_id': 'trip-1'}))
+        self.send_batch.assert_called_once()
+
+    def test_batches_are_capped(self):
+        self.queue()
+        with patch.object(settlement_emails, 'EMAIL_BATCH_SIZE', 2):
+            handle_settlement_requested(FakeDelivery({'trip_id': 'trip-1'}))
+        self.assertEqual([len(call[0][0]) for call in self.send_batch.call_args_list], [2, 1])
+        self.assertEqual(len(self.provider.sent), 3)
+
+    def test_resent_batch_is_sent_once(self):
+        self.queue()
+        handle_settlement_requested(FakeDelivery({'trip_id': 'trip-1'}))
+        message_ids = {row.user_id: row.provider_message_id for row in SettlementEmail.query}
+
+        # As if the consumer died after sending, before recording the outcome
+        SettlementEmail.query.update({'status': 'queued'})
+        db.session.commit()
+        handle_settlement_requested(FakeDelivery({'trip_id': 'trip-1'}))
+
+        self.assertEqual(self.send_batch.call_count, 2)
+        self.assertEqual(len(self.provider.sent), 3)
+        self.assertEqual({row.user_id: row.provider_message_id for row in SettlementEmail.query}, message_ids)
+
+    def test_idempotency_key_depends_on_the_recipients(self):
+        rows = [SettlementEmail(trip_id='trip-1', user_id=user_id) for user_id in ('1', '2', '3')]
+        self.assertEqual(idempotency_key('trip-1', rows), idempotency_key('trip-1', rows[::-1]))
+        self.assertNotEqual(idempotency_key('trip-1', rows), idempotency_key('trip-1', rows[:2]))
+        self.assertNotEqual(idempotency_key('trip-1', rows), idempotency_key('trip-2', rows))
+
+    def test_retryable_failure_is_retried(self):
+        self.queue()
+        self.send_batch.side_effect = EmailProviderError('Resend returned 429: slow down')
+
+        with self.assertRaises(RetryLater):
+            handle_settlement_requested(FakeDelivery({'trip_id': 'trip-1'}))
+        self.assertEqual(set(self.statuses().values()), {('queued', 1)})
+        self.assertEqual({row.error for row in SettlementEmail.query}, {'Resend returned 429: slow down'})
+
+        self.send_batch.side_effect = None
+        handle_settlement_requested(FakeDelivery({'trip_id': 'trip-1'}))
+        self.assertEqual(set(self.statuses().values()), {('sent', 2)})
+        self.assertEqual({row.error for row in SettlementEmail.query}, {None})
+
+    def test_retryable_failure_on_the_final_attempt_fails(self):
+        self.queue()
+        self.send_batch.side_effect = EmailProviderError('Resend returned 503: unavailable')
+
+        handle_settlement_requested(FakeDelivery({'trip_id': 'trip-1'}, final_attempt=True))
+        self.assertEqual(set(self.statuses().values()), {('failed', 1)})
+
+    def test_non_retryable_failure_fails_at_once(self):
+        self.queue()
+        self.send_batch.side_effect = EmailProviderError('Resend returned 422: invalid', retryable=False)
+
+        # Not retried, nothing would change
+        handle_settlement_requested(FakeDelivery({'trip_id': 'trip-1'}))
+        self.assertEqual(set(self.statuses().values()), {('failed', 1)})
+        self.assertEqual(self.provider.sent, [])
+
+        # Failed emails are queued again by the next readiness update
+        self.send_batch.side_effect = None
+        self.queue()
+        handle_settlement_requested(FakeDelivery({'trip_id': 'trip-1'}))
+        self.assertEqual(set(self.statuses().values()), {('sent', 2)})
+
+    def test_each_batch_is_recorded_separately(self):
+        self.queue()
+        def fail_second_batch(messages, key):
+            if self.send_batch.call_count == 2:
+                raise EmailProviderError('Resend returned 500: error')
+            return self.stub_send_batch(messages, key)
+        self.send_batch.side_effect = fail_second_batch
+
+        with patch.object(settlement_emails, 'EMAIL_BATCH_SIZE', 2), self.assertRaises(RetryLater):
+            handle_settlement_requested(FakeDelivery({'trip_id': 'trip-1'}))
+        self.assertEqual(self.statuses(), {'1': ('sent', 1), '2': ('sent', 1), '3': ('queued', 1)})
+
+    def test_user_without_email_is_marked_failed(self):
+        UserReadiness.query.filter_by(user_id='2').one().email = None
+        db.session.commit()
+        self.queue()
+
+        handle_settlement_requested(FakeDelivery({'trip_id': 'trip-1'}))
+        self.assertEqual(self.statuses(), {'1': ('sent', 1), '2': ('failed', 0), '3': ('sent', 1)})
+        self.assertEqual(db.session.get(SettlementEmail, ('trip-1', '2')).error, 'No email address')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,7 @@ from flask_cors import CORS
 import os
 from app.models import db
 from app.routes import register_routes
+from app import session_tokens, serving
 
 app = Flask(__name__)
 CORS(app)
@@ -15,6 +16,9 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 # Initialize the database
 db.init_app(app)
 
+# Verify session tokens of callers
+session_tokens.init_app(app)
+
 # Register routes
 register_routes(app)
 
@@ -27,5 +31,13 @@ def health_check():
 with app.app_context():
     db.create_all()
 
+def dispose_engine():
+    """Drop the database connections a forked process inherited"""
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+# Under gunicorn, see gunicorn.conf.py
+serving.at_worker_start(dispose_engine)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5003, debug=True) 
\ No newline at end of file
@@ -1,9 +1,8 @@
 from flask import request, jsonify
 from datetime import datetime
 from app.models import db, GroupRequest
-from app.services import UserService, GroupService, CalendarService
-import os
-import requests
+from app.services import UserService, GroupService, CalendarService, TripService
+from app.session_tokens import is_other_user
 
 def register_routes(app):
     @app.route('/api/groups', methods=['POST'])
@@ -27,6 +26,10 @@ def register_routes(app):
         description = data.get('description', '')
         created_by = data['createdBy']
         
+        # Signed-in callers can only create groups as themselves
+        if is_other_user(created_by):
+            return jsonify({'error': 'Cannot create a group on behalf of another user'}), 403
+        
         # Get invited users (excluding the creator who will be added automatically)
         invited_users = []
         if 'users' in data and data['users']:
@@ -154,6 +157,8 @@ def register_routes(app):
             return jsonify({'error': 'user_id is required'}), 400
             
         user_id = data['user_id']
+        if is_other_user(user_id):
+            return jsonify({'error': 'Cannot act on behalf of another user'}), 403
         
         # First, verify the group exists in our records
         group_request = GroupRequest.query.filter_by(group_id=group_id).first()
@@ -220,8 +225,13 @@ def register_routes(app):
         """
         Composite endpoint to delete a group and its associated resources
         1. Delete the group from group service
-        2. Delete the group's calendar from calendar service
+        2. Start a job deleting the group's trips, their itineraries and
+           expenses, and its calendar, in the trip management service
         3. Delete the record of the group request from our database
+        
+        Returns 202 with the deletion job if it was started; its progress is
+        at job.status_url. If it can't be started, the calendar is deleted
+        directly instead.
         """
         # First, verify the group exists in our records
         group_request = GroupRequest.query.filter_by(group_id=group_id).first()
@@ -231,8 +241,12 @@ def register_routes(app):
         # Step 1: Delete the group from group service
         group_success, group_response = GroupService.delete_group(group_id)
         
-        # Step 2: Delete the group's calendar from calendar service
-        calendar_success, calendar_response = CalendarService.delete_calendar(group_id)
+        # Step 2: Delete the group's trips and calendar in the background
+        job_success, job_response = TripService.delete_group_trips(group_id)
+        if job_success:
+            calendar_success, calendar_response = True, {"message": "Calendar deletion queued", "job_id": job_response['id']}
+        else:
+            calendar_success, calendar_response = CalendarService.delete_calendar(group_id)
         
         # Step 3: Delete the record from our database
         try:
@@ -246,6 +260,11 @@ def register_routes(app):
             
         # Determine overall success and response
         if group_success and calendar_success and db_success:
+            if job_success:
+                return jsonify({
+                    'message': f'Group {group_id} deleted, its trips and calendar are being deleted',
+                    'job': job_response
+                }), 202
             return jsonify({'message': f'Group {group_id} and all associated resources deleted successfully'}), 200
         else:
             # Construct response with details of what failed
@@ -255,6 +274,7 @@ def register_routes(app):
                 'details': {
                     'group_service': {'success': group_success, 'details': group_response},
                     'calendar_service': {'success': calendar_success, 'details': calendar_response},
+                    'trip_service': {'success': job_success, 'details': job_response},
                     'database': {'success': db_success}
                 }
             }
@@ -272,20 +292,38 @@ def register_routes(app):
             return jsonify({'error': 'Email parameter is required'}), 400
         
         try:
-            user_service_url = os.getenv('USER_SERVICE_URL', 'http://user:5001')
-            response = requests.get(f"{user_service_url}/api/users/search?q={email}")
-            
-            if response.status_code == 200:
-                users = response.json()
-                exists = len(users) > 0
-                # Only try to get userId if users exist
-                userId = users[0]['id'] if exists and len(users) > 0 else None
-                return jsonify({'exists': exists, 'userId': userId})
-            else:
-                return jsonify({'exists': False, 'error': f'User service returned status {response.status_code}'}), response.status_code
+            # Exact match, so a partial email doesn't resolve to someone else
+            success, result = UserService.resolve_emails([email])
+            if not success:
+                return jsonify({'exists': False, 'error': result.get('error')}), 502
+            
+            users = result['users']
+            exists = len(users) > 0
+            userId = users[0]['id'] if exists else None
+            return jsonify({'exists': exists, 'userId': userId})
         except Exception as e:
             return jsonify({'exists': False, 'error': str(e)}), 500
 
+    # Endpoint to verify a batch of invitees at once
+    @app.route('/api/verify-users', methods=['POST'])
+    def verify_users():
+        """
+        Resolve {"emails": [...]} to user IDs with one lookup in the User service.
+        Returns {"users": {email: userId}, "missing": [email]}.
+        """
+        data = request.get_json(silent=True) or {}
+        emails = data.get('emails')
+        if not isinstance(emails, list) or not emails:
+            return jsonify({'error': 'emails must be a non-empty list'}), 400
+        
+        success, result = UserService.resolve_emails(emails)
+        if not success:
+            return jsonify(result), 502
+        return jsonify({
+            'users': {user['email'].lower(): user['id'] for user in result['users']},
+            'missing': result['missing']
+        }), 200
+
     @app.route('/api/groups/user/<int:user_id>', methods=['GET'])
     def get_user_groups(user_id):
         """Get all groups a user is a member of"""
@@ -370,6 +408,8 @@ def register_routes(app):
             
         user_id = data['user_id']
         available_dates = data['available_dates']
+        if is_other_user(user_id):
+            return jsonify({'error': 'Cannot act on behalf of another user'}), 403
         
         # First, verify the group exists in our records
         group_request = GroupRequest.query.filter_by(group_id=group_id).first()
@@ -481,6 +521,8 @@ def register_routes(app):
             return jsonify({'error': 'user_id is required'}), 400
             
         user_id = data['user_id']
+        if is_other_user(user_id):
+            return jsonify({'error': 'Cannot act on behalf of another user'}), 403
         
         # First, verify the group exists in our records
         group_request = GroupRequest.query.filter_by(group_id=group_id).first()
@@ -3,6 +3,7 @@ import requests
 from flask import current_app
 import json
 from app.message_broker import MessageBroker
+from app.session_tokens import session_user
 
 class UserService:
     """Service to interact with the User microservice"""
@@ -10,7 +11,8 @@ class UserService:
     @staticmethod
     def validate_user(user_id):
         """
-        Validates if a user exists by ID
+        Validates if a user exists by ID. The caller's own profile is read
+        from their session token, other users are looked up in the User service.
         
         Args:
             user_id (int): The user ID to validate
@@ -18,6 +20,10 @@ class UserService:
         Returns:
             tuple: (bool, dict) - (is_valid, user_data or error_message)
         """
+        user_data = session_user(user_id)
+        if user_data:
+            return True, user_data
+        
         user_service_url = os.getenv('USER_SERVICE_URL')
         
         try:
@@ -35,6 +41,31 @@ class UserService:
             return False, {"error": f"Error connecting to User service: {str(e)}"}
 
 
+    @staticmethod
+    def resolve_emails(emails):
+        """
+        Looks up users by exact email, all in one request to the User service
+        
+        Args:
+            emails (list): Emails to look up
+            
+        Returns:
+            tuple: (bool, dict) - (success, {"users": [user_data], "missing": [email]} or error_message)
+        """
+        user_service_url = os.getenv('USER_SERVICE_URL', 'http://user:5001')
+        
+        try:
+            response = requests.post(f"{user_service_url}/api/users/resolve", json={"emails": emails}, timeout=5)
+            
+            if response.status_code == 200:
+                return True, response.json()
+            return False, {"error": f"Error resolving users: {response.text}"}
+                
+        except requests.RequestException as e:
+            current_app.logger.error(f"Error connecting to User service: {str(e)}")
+            return False, {"error": f"Error connecting to User service: {str(e)}"}
+
+
 class GroupService:
     """Service to interact with the Group microservice"""
     
@@ -394,4 +425,43 @@ class CalendarService:
             if success:
                 return True, {"message": "Availability update queued via message broker", "queued": True}
             else:
-                return False, {"error": "Failed to publish availability update to message queue"} 
\ No newline at end of file
+                return False, {"error": "Failed to publish availability update to message queue"} 
+
+class TripService:
+    """Service to interact with the Trip Management microservice"""
+    
+    @staticmethod
+    def delete_group_trips(group_id):
+        """
+        Starts a job deleting a group's trips, their itineraries and expenses,
+        and the group's calendar
+        
+        Args:
+            group_id (int): ID of the group being deleted
+            
+        Returns:
+            tuple: (bool, dict) - (success, deletion job or error_message)
+        """
+        trip_service_url = os.getenv('TRIP_SERVICE_URL')
+        
+        if not trip_service_url:
+            current_app.logger.warning("TRIP_SERVICE_URL not set. Group trips can't be deleted.")
+            return False, {"error": "TRIP_SERVICE_URL not configured"}
+        
+        try:
+            response = requests.post(
+                f"{trip_service_url}/api/trips/deletions",
+                json={"group_id": group_id},
+                timeout=5
+            )
+            
+            if response.status_code == 202:
+                job = response.json()
+                job['status_url'] = response.headers.get('Location')
+                return True, job
+            else:
+                return False, {"error": f"Error deleting group trips: {response.text}"}
+                
+        except requests.RequestException as e:
+            current_app.logger.error(f"Error connecting to Trip Management service: {str(e)}")
+            return False, {"error": f"Error connecting to Trip Management service: {str(e)}"}
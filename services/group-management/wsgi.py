@@ -0,0 +1,14 @@
+"""
+WSGI entry point of the service, for gunicorn: `gunicorn wsgi:app`.
+
+app.py can't be imported as `app`, which is the name of the package next
+to it, so it's loaded from its path.
+"""
+import os
+import importlib.util
+
+_spec = importlib.util.spec_from_file_location('service', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py'))
+service = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(service)
+
+app = service.app
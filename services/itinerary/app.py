@@ -1,12 +1,15 @@
 from flask import Flask, jsonify
 from flask_cors import CORS
 import os
-import threading
+import json
 import logging
 import traceback
 from app.models import db
 from app.routes import register_routes
 from app.message_broker import MessageBroker
+from app import session_tokens, serving
+from app.event_hub import event_hub
+from app.response_cache import response_cache
 
 # Configure logging
 logging.basicConfig(
@@ -45,6 +48,9 @@ except Exception as e:
     logger.error(f"Error initializing database: {e}")
     logger.error(traceback.format_exc())
 
+# Verify session tokens of callers
+session_tokens.init_app(app)
+
 # Register routes
 try:
     register_routes(app)
@@ -74,63 +80,134 @@ def root():
 # Health check
 @app.route('/health', methods=['GET'])
 def health_check():
-    rabbitmq_status = "connected" if message_broker and message_broker.connection and message_broker.connection.is_open else "disconnected"
+    # Only the worker running the consumers knows whether they're connected
+    if message_broker and not message_broker.consuming:
+        rabbitmq_status = "not responsible for consumers"
+    elif message_broker and message_broker.is_connected():
+        rabbitmq_status = "connected"
+    else:
+        rabbitmq_status = "disconnected"
     return jsonify({
         "status": "healthy", 
         "service": "itinerary",
         "rabbitmq_status": rabbitmq_status
     }), 200
 
-def start_message_consumer():
-    """Start consuming messages from RabbitMQ in a separate thread."""
-    try:
-        with app.app_context():
-            if message_broker:
-                message_broker.start_consuming()
-            else:
-                logger.error("Cannot start message consumer: Message broker not initialized")
-    except Exception as e:
-        logger.error(f"Error starting message consumer: {e}")
-        logger.error(traceback.format_exc())
+# Throughput and depth of the queues this service consumes, the same from
+# every worker since their counters are shared
+@app.route('/api/consumers', methods=['GET'])
+def consumer_metrics():
+    if not message_broker:
+        return jsonify({}), 200
+    return jsonify(message_broker.consumers.metrics()), 200
 
-def setup_rabbitmq():
-    """Connect to RabbitMQ and set up message consumer thread."""
-    global message_broker
+def migrate_recommendation_payloads():
+    """Move recommendations from the per-section JSON columns into the JSONB payload column."""
+    from sqlalchemy import inspect, text
+    
+    inspector = inspect(db.engine)
+    columns = [column['name'] for column in inspector.get_columns('recommendations')]
+    if 'payload' in columns:
+        return
     
+    logger.info("Migrating recommendations to the JSONB payload column")
+    sections = ['attractions', 'restaurants', 'activities', 'events', 'tips']
+    with db.engine.begin() as connection:
+        connection.execute(text('ALTER TABLE recommendations ADD COLUMN payload JSONB'))
+        connection.execute(text(
+            'UPDATE recommendations SET payload = jsonb_build_object(' +
+            ', '.join(f"'{section}', COALESCE({section}::jsonb, '[]'::jsonb)" for section in sections) +
+            ')'
+        ))
+        connection.execute(text('ALTER TABLE recommendations ALTER COLUMN payload SET NOT NULL'))
+        for section in sections:
+            connection.execute(text(f'ALTER TABLE recommendations DROP COLUMN {section}'))
+
+def migrate_itinerary_version():
+    """Add the version column used for optimistic concurrency to existing itineraries."""
+    from sqlalchemy import inspect, text
+    
+    inspector = inspect(db.engine)
+    columns = [column['name'] for column in inspector.get_columns('itineraries')]
+    if 'version' not in columns:
+        logger.info("Adding version column to itineraries table")
+        with db.engine.begin() as connection:
+            connection.execute(text('ALTER TABLE itineraries ADD COLUMN version INTEGER NOT NULL DEFAULT 1'))
+
+def migrate_daily_activities():
+    """
+    Move activities from the daily_activities JSON column into the
+    itinerary_activities table, see ActivityService.migrated_day_values.
+    """
+    from sqlalchemy import inspect, text
+    from app.models import ItineraryActivity
+    from app.activity_service import ActivityService
+    
+    inspector = inspect(db.engine)
+    columns = [column['name'] for column in inspector.get_columns('itineraries')]
+    if 'daily_activities' not in columns:
+        return
+    
+    logger.info("Migrating itinerary activities to the itinerary_activities table")
+    with db.engine.begin() as connection:
+        rows = connection.execute(text('SELECT trip_id, daily_activities FROM itineraries')).fetchall()
+        
+        values = []
+        for trip_id, daily_activities in rows:
+            if isinstance(daily_activities, str):
+                daily_activities = json.loads(daily_activities)
+            for date, activities in (daily_activities or {}).items():
+                values.extend(ActivityService.migrated_day_values(trip_id, date, activities))
+        
+        if values:
+            connection.execute(ItineraryActivity.__table__.insert(), values)
+        connection.execute(text('ALTER TABLE itineraries DROP COLUMN daily_activities'))
+        unscheduled = sum(1 for value in values if value['time'] is None)
+        logger.info(f"Migrated {len(values)} activities from {len(rows)} itineraries, {unscheduled} of them unscheduled")
+
+def setup_rabbitmq():
+    """Start the RabbitMQ consumers; they connect and reconnect in the background."""
     if not message_broker:
         logger.error("Cannot connect to RabbitMQ: Message broker not initialized")
         return False
     
     try:
-        # Connect to RabbitMQ
-        logger.info("Connecting to RabbitMQ...")
-        connected = message_broker.connect()
-        if not connected:
-            logger.error("Failed to connect to RabbitMQ")
-            return False
-        
-        # Start message consumer in a separate thread
-        logger.info("Starting RabbitMQ consumer thread...")
-        consumer_thread = threading.Thread(target=start_message_consumer)
-        consumer_thread.daemon = True
-        consumer_thread.start()
-        logger.info("RabbitMQ consumer thread started successfully")
+        message_broker.start_consumers()
+        logger.info("RabbitMQ consumers started successfully")
         return True
     except Exception as e:
         logger.error(f"Error setting up RabbitMQ: {e}")
         logger.error(traceback.format_exc())
         return False
 
+def dispose_engine():
+    """Drop the database connections a forked process inherited"""
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+def stop_rabbitmq():
+    if message_broker:
+        message_broker.close()
+
+# Create tables if they don't exist
+try:
+    with app.app_context():
+        db.create_all()
+        migrate_recommendation_payloads()
+        migrate_daily_activities()
+        migrate_itinerary_version()
+        logger.info("Database tables created successfully")
+except Exception as e:
+    logger.error(f"Error creating database tables: {e}")
+    logger.error(traceback.format_exc())
+
+# Under gunicorn, see gunicorn.conf.py
+serving.at_worker_start(dispose_engine)
+serving.at_worker_start(response_cache.after_fork)
+serving.at_worker_start(event_hub.after_fork)
+serving.run_once('itinerary', setup_rabbitmq, stop=stop_rabbitmq)
+
 if __name__ == '__main__':
-    # Create tables if they don't exist
-    try:
-        with app.app_context():
-            db.create_all()
-            logger.info("Database tables created successfully")
-    except Exception as e:
-        logger.error(f"Error creating database tables: {e}")
-        logger.error(traceback.format_exc())
-    
     # Setup RabbitMQ
     setup_result = setup_rabbitmq()
     if setup_result:
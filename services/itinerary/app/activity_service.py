@@ -0,0 +1,354 @@
+import logging
+import os
+from app.models import db, Itinerary, ItineraryActivity, ItineraryChange, Recommendation
+from app.event_hub import event_hub
+from app.response_cache import response_cache, itinerary_key, recommendations_key
+from app.interval_index import DayIntervalIndex, parse_time, format_time, normalize_time
+from app.session_tokens import session_user
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Number of versions kept in each itinerary's change log; clients further
+# behind than this have to re-fetch the whole itinerary
+CHANGE_LOG_RETENTION = int(os.getenv('ITINERARY_CHANGE_LOG_RETENTION', 500))
+
+class ItineraryUpdateError(Exception):
+    """Raised when a batch of activity operations can't be applied"""
+
+    def __init__(self, message, status_code=400, **details):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.details = details
+
+    def to_dict(self):
+        return {"error": self.message, **self.details}
+
+class ActivityService:
+    @staticmethod
+    def apply_operations(trip_id, operations, expected_version=None):
+        """
+        Apply a batch of activity operations to an itinerary atomically.
+
+        Supported operations:
+            {"op": "add", "activity": {...}}
+            {"op": "move", "id": 3, "date": "...", "time": "...", "end_time": "..."}
+            {"op": "delete", "id": 3}
+
+        Activities on the same day may not overlap; an operation that would
+        make them overlap fails with a 409 naming the conflicting activity.
+
+        Args:
+            trip_id: The trip the itinerary belongs to
+            operations: List of operations, applied in order
+            expected_version: If given, the batch is only applied if the
+                itinerary is still at this version
+
+        Returns:
+            Tuple: (new version, list of change dicts)
+
+        Raises:
+            ItineraryUpdateError: If any operation fails; nothing is applied
+        """
+        if not isinstance(operations, list) or not operations:
+            raise ItineraryUpdateError("At least one operation is required")
+
+        # Lock the itinerary row so concurrent batches are serialised
+        itinerary = Itinerary.query.filter_by(trip_id=trip_id).with_for_update().first()
+        if not itinerary:
+            raise ItineraryUpdateError("Itinerary not found", 404)
+
+        if expected_version is not None and itinerary.version != expected_version:
+            db.session.rollback()
+            raise ItineraryUpdateError(
+                "Itinerary has been modified, fetch the latest changes and retry",
+                412,
+                version=itinerary.version
+            )
+
+        version = itinerary.version + 1
+        handlers = {
+            'add': ActivityService._add,
+            'move': ActivityService._move,
+            'delete': ActivityService._delete,
+        }
+
+        try:
+            changes = []
+            for index, operation in enumerate(operations):
+                handler = handlers.get(operation.get('op')) if isinstance(operation, dict) else None
+                if not handler:
+                    raise ItineraryUpdateError(f"Operation {index}: op must be one of {', '.join(handlers)}")
+
+                activity_id, activity = handler(trip_id, operation, index)
+                changes.append(ItineraryChange(
+                    trip_id=trip_id,
+                    version=version,
+                    op=operation['op'],
+                    activity_id=activity_id,
+                    activity=activity
+                ))
+
+            itinerary.version = version
+            db.session.add_all(changes)
+
+            # Trim the change log
+            ItineraryChange.query.filter(
+                ItineraryChange.trip_id == trip_id,
+                ItineraryChange.version <= version - CHANGE_LOG_RETENTION
+            ).delete(synchronize_session=False)
+
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        logger.info(f"Applied {len(changes)} activity operation(s) to trip_id {trip_id}, now at version {version}")
+        changes = [change.to_dict() for change in changes]
+        response_cache.invalidate(itinerary_key(trip_id))
+        event = {"version": version, "changes": changes}
+        # Lets collaborators see who made the change, if the caller is signed in
+        author = session_user()
+        if author:
+            event["by"] = author
+        event_hub.publish(trip_id, 'itinerary', event, event_id=version)
+        return version, changes
+
+    @staticmethod
+    def get_changes(trip_id, since_version):
+        """
+        Get the changes made to an itinerary after a version.
+
+        Returns:
+            Tuple: (success, result) where result holds the current version and the changes
+        """
+        itinerary = Itinerary.query.get(trip_id)
+        if not itinerary:
+            return False, {"error": "Itinerary not found"}
+
+        changes = (ItineraryChange.query
+                   .filter(ItineraryChange.trip_id == trip_id, ItineraryChange.version > since_version)
+                   .order_by(ItineraryChange.version, ItineraryChange.id)
+                   .all())
+
+        # The log has been trimmed past the client's version
+        if since_version < itinerary.version and (not changes or changes[0].version > since_version + 1):
+            return False, {"error": "Changes are no longer available, fetch the whole itinerary", "version": itinerary.version}
+
+        return True, {"version": itinerary.version, "changes": [change.to_dict() for change in changes]}
+
+    @staticmethod
+    def _add(trip_id, operation, index):
+        activity_data = operation.get('activity')
+        if not isinstance(activity_data, dict):
+            raise ItineraryUpdateError(f"Operation {index}: add requires an activity")
+
+        missing_fields = [field for field in ('name', 'date', 'time', 'end_time') if not activity_data.get(field)]
+        if missing_fields:
+            raise ItineraryUpdateError(f"Operation {index}: missing required fields: {', '.join(missing_fields)}")
+
+        activity_data = dict(activity_data)
+        activity_data['time'], activity_data['end_time'] = ActivityService._check_times(
+            activity_data['time'], activity_data['end_time'], index
+        )
+        ActivityService._check_conflict(trip_id, str(activity_data['date']), activity_data['time'],
+                                        activity_data['end_time'], index)
+
+        activity = ItineraryActivity.from_dict(trip_id, activity_data)
+        db.session.add(activity)
+        db.session.flush()
+        return activity.id, activity.to_dict()
+
+    @staticmethod
+    def _move(trip_id, operation, index):
+        activity = ActivityService._get_activity(trip_id, operation, index)
+
+        for field in ('date', 'time', 'end_time'):
+            if operation.get(field):
+                setattr(activity, field, str(operation[field]))
+        activity.time, activity.end_time = ActivityService._check_times(activity.time, activity.end_time, index)
+        ActivityService._check_conflict(trip_id, activity.date, activity.time, activity.end_time, index,
+                                        exclude_id=activity.id)
+
+        db.session.flush()
+        return activity.id, activity.to_dict()
+
+    @staticmethod
+    def _delete(trip_id, operation, index):
+        activity = ActivityService._get_activity(trip_id, operation, index)
+        db.session.delete(activity)
+        db.session.flush()
+        return activity.id, None
+
+    @staticmethod
+    def _get_activity(trip_id, operation, index):
+        activity_id = operation.get('id')
+        activity = ItineraryActivity.query.filter_by(id=activity_id, trip_id=trip_id).first() if activity_id else None
+        if not activity:
+            raise ItineraryUpdateError(f"Operation {index}: activity {activity_id} not found", 404)
+        return activity
+
+    @staticmethod
+    def _check_times(time, end_time, index):
+        """Validate and zero-pad an activity's times, so they sort and compare as strings"""
+        try:
+            time, end_time = normalize_time(time), normalize_time(end_time)
+        except ValueError as e:
+            raise ItineraryUpdateError(f"Operation {index}: {e}")
+        if end_time <= time:
+            raise ItineraryUpdateError(f"Operation {index}: end time must be later than start time")
+        return time, end_time
+
+    @staticmethod
+    def _check_conflict(trip_id, date, time, end_time, index, exclude_id=None):
+        """
+        Fail if [time, end_time) overlaps another activity on the same day.
+
+        The day's activities are loaded with one query on the (trip_id, date,
+        time) index and checked through a DayIntervalIndex, whose running
+        maximum of end times finds an overlap however early the other
+        activity starts. An activity with a start but no end time occupies
+        its start minute.
+        """
+        query = ItineraryActivity.query.filter_by(trip_id=trip_id, date=str(date))
+        if exclude_id is not None:
+            query = query.filter(ItineraryActivity.id != exclude_id)
+
+        day_index = DayIntervalIndex.from_activities(query.order_by(ItineraryActivity.time).all())
+        conflict = day_index.overlapping(parse_time(time), parse_time(end_time))
+        if conflict:
+            raise ItineraryUpdateError(
+                f"Operation {index}: overlaps with {conflict.name} ({conflict.time}-{conflict.end_time or conflict.time})",
+                409,
+                conflict=conflict.to_dict()
+            )
+
+    @staticmethod
+    def migrated_day_values(trip_id, date, activities):
+        """
+        Column values of one day of a legacy daily_activities document,
+        checked the way every write is.
+
+        Times are zero-padded as in _check_times. An activity with missing or
+        invalid times, or overlapping an earlier one that day, is kept without
+        times, its original ones under details["unscheduled"], so that the
+        day's scheduled activities never overlap and it can be rescheduled.
+
+        Returns:
+            List: Column value dicts, in the document's order
+        """
+        values = []
+        scheduled = []
+        for activity in activities or []:
+            if not isinstance(activity, dict):
+                logger.warning(f"Skipping malformed activity of trip_id {trip_id} on {date}: {activity!r}")
+                continue
+            value = ItineraryActivity.values_from_dict(trip_id, activity, date)
+            values.append(value)
+            try:
+                start, end = parse_time(value['time']), parse_time(value['end_time'])
+            except ValueError as e:
+                ActivityService._unschedule(value, str(e))
+                continue
+            if end <= start:
+                ActivityService._unschedule(value, "End time must be later than start time")
+                continue
+            scheduled.append((start, end, value))
+
+        # The activities kept don't overlap, so the last one kept ends latest
+        latest_end = None
+        for start, end, value in sorted(scheduled, key=lambda interval: (interval[0], interval[1])):
+            if latest_end is not None and start < latest_end:
+                ActivityService._unschedule(value, "Overlaps with another activity")
+                continue
+            value['time'], value['end_time'] = format_time(start), format_time(end)
+            latest_end = end
+        return values
+
+    @staticmethod
+    def _unschedule(value, reason):
+        logger.warning(f"Unscheduling activity {value['name']!r} of trip_id {value['trip_id']} on {value['date']}: {reason}")
+        value['details'] = {
+            **value['details'],
+            "unscheduled": {"time": value['time'], "end_time": value['end_time'], "reason": reason}
+        }
+        value['time'] = value['end_time'] = None
+
+    @staticmethod
+    def get_day_index(trip_id, date):
+        """Build the interval index of an itinerary day"""
+        activities = (ItineraryActivity.query
+                      .filter_by(trip_id=trip_id, date=str(date))
+                      .order_by(ItineraryActivity.time)
+                      .all())
+        return DayIntervalIndex.from_activities(activities)
+
+    @staticmethod
+    def find_conflicts(trip_id, activities):
+        """
+        Check many new activities for overlaps, with the existing activities
+        and with each other, without changing anything.
+
+        Args:
+            trip_id: The trip the itinerary belongs to
+            activities: List of activity dicts with date, time and end_time
+
+        Returns:
+            List: One {"index", "activity", "conflict"} dict per conflicting activity,
+                where conflict is the activity it overlaps
+
+        Raises:
+            ItineraryUpdateError: If an activity has missing or invalid times
+        """
+        by_date = {}
+        for index, activity in enumerate(activities):
+            if not activity.get('date'):
+                raise ItineraryUpdateError(f"Operation {index}: missing required fields: date")
+            time, end_time = ActivityService._check_times(activity.get('time'), activity.get('end_time'), index)
+            by_date.setdefault(str(activity['date']), []).append(
+                (parse_time(time), parse_time(end_time), (index, {**activity, 'time': time, 'end_time': end_time}))
+            )
+
+        conflicts = []
+        for date, candidates in by_date.items():
+            day_index = ActivityService.get_day_index(trip_id, date)
+            for (index, activity), other in day_index.conflicts(candidates):
+                # Conflicts within the batch are reported by the other activity's index
+                if isinstance(other, tuple):
+                    conflict = {"index": other[0], **other[1]}
+                else:
+                    conflict = other.to_dict()
+                conflicts.append({"index": index, "activity": activity, "conflict": conflict})
+
+        conflicts.sort(key=lambda conflict: conflict["index"])
+        return conflicts
+
+    @staticmethod
+    def delete_trips(trip_ids):
+        """
+        Delete the itineraries, activities, change logs and recommendations
+        of many trips in one transaction.
+
+        Returns:
+            int: Number of itineraries deleted
+        """
+        trip_ids = [str(trip_id) for trip_id in trip_ids]
+        if not trip_ids:
+            return 0
+
+        ItineraryActivity.query.filter(ItineraryActivity.trip_id.in_(trip_ids)).delete(synchronize_session=False)
+        ItineraryChange.query.filter(ItineraryChange.trip_id.in_(trip_ids)).delete(synchronize_session=False)
+        deleted = Itinerary.query.filter(Itinerary.trip_id.in_(trip_ids)).delete(synchronize_session=False)
+        Recommendation.query.filter(Recommendation.trip_id.in_(trip_ids)).delete(synchronize_session=False)
+        db.session.commit()
+
+        for trip_id in trip_ids:
+            response_cache.invalidate(itinerary_key(trip_id), recommendations_key(trip_id))
+            event_hub.publish(trip_id, 'deleted', {"tripId": trip_id})
+        logger.info(f"Deleted {deleted} itineraries of {len(trip_ids)} trips")
+        return deleted
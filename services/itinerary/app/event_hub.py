@@ -0,0 +1,201 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import traceback
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Events buffered per subscriber; a client falling further behind is
+# disconnected and told to resync when it reconnects
+EVENT_QUEUE_SIZE = int(os.getenv('EVENT_QUEUE_SIZE', 100))
+
+# Seconds between keep-alive comments on idle streams, so proxies don't
+# close them and dead clients are noticed
+EVENT_HEARTBEAT_SECONDS = int(os.getenv('EVENT_HEARTBEAT_SECONDS', 15))
+
+# Event streams open at once in each process. Every stream holds one of the
+# worker's WEB_THREADS threads for as long as it's open, so the rest are
+# left to serve requests; clients over the limit get a 503 telling them to
+# retry after EVENT_RETRY_MS milliseconds
+EVENT_MAX_STREAMS = int(os.getenv('EVENT_MAX_STREAMS', max(1, int(os.getenv('WEB_THREADS', 32)) * 3 // 4)))
+EVENT_RETRY_MS = int(os.getenv('EVENT_RETRY_MS', 5000))
+
+# Optional Redis relaying events between all itinerary processes, so clients
+# get the events of a trip whichever process they're connected to; the
+# response cache's Redis by default
+EVENT_REDIS_URL = os.getenv('EVENT_REDIS_URL', os.getenv('CACHE_REDIS_URL', ''))
+EVENT_CHANNEL = 'itinerary-events'
+
+def format_event(event, data, event_id=None):
+    """Format an event for a text/event-stream response"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return '\n'.join(lines) + '\n\n'
+
+class TooManySubscriptions(Exception):
+    """Raised when this process already has as many event streams open as it allows"""
+    pass
+
+class Subscription:
+    """The events of one trip, queued for one connected client"""
+
+    def __init__(self, hub, trip_id):
+        self.hub = hub
+        self.trip_id = trip_id
+        self.overflowed = False
+        self._queue = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+
+    def put(self, message):
+        """Queue a formatted event; returns False if the client has fallen too far behind"""
+        try:
+            self._queue.put_nowait(message)
+            return True
+        except queue.Full:
+            self.overflowed = True
+            return False
+
+    def get(self, timeout=EVENT_HEARTBEAT_SECONDS):
+        """Wait for the next formatted event, or return None after timeout seconds"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+class EventHub:
+    """
+    Fans out itinerary and recommendation events to the clients subscribed
+    to a trip: those of this process, or, with Redis configured, those of
+    every process, each process relaying the events of the channel to its
+    own clients.
+    """
+
+    def __init__(self, redis_url=EVENT_REDIS_URL, max_subscriptions=EVENT_MAX_STREAMS):
+        self.max_subscriptions = max_subscriptions
+        self._lock = threading.Lock()
+        # Format: {trip_id: set of Subscription}
+        self._subscriptions = {}
+
+        self._redis = None
+        if redis_url:
+            if redis is None:
+                logger.warning("EVENT_REDIS_URL is set but the redis package is not installed, relaying events within this process only")
+            else:
+                self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+                self._redis_url = redis_url
+                self._start_relay_listener()
+
+    def after_fork(self):
+        """Start over in a forked worker process, whose parent's threads didn't come along"""
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+        if self._redis is not None:
+            self._start_relay_listener()
+
+    def subscribe(self, trip_id):
+        """
+        Subscribe a client to the events of a trip.
+
+        Raises:
+            TooManySubscriptions: If max_subscriptions clients are subscribed already
+        """
+        subscription = Subscription(self, str(trip_id))
+        with self._lock:
+            count = sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+            if count >= self.max_subscriptions:
+                raise TooManySubscriptions(f"{count} event streams are open already")
+            self._subscriptions.setdefault(subscription.trip_id, set()).add(subscription)
+        logger.info(f"Client subscribed to events for trip_id: {trip_id}")
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.trip_id)
+            if subscriptions is None or subscription not in subscriptions:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.trip_id]
+        logger.info(f"Client unsubscribed from events for trip_id: {subscription.trip_id}")
+
+    def publish(self, trip_id, event, data, event_id=None):
+        """
+        Send an event to every client subscribed to a trip.
+
+        Returns:
+            int: Number of clients reached, or with Redis, of processes
+        """
+        if self._redis is not None:
+            message = format_event(event, data, event_id)
+            try:
+                return self._redis.publish(EVENT_CHANNEL, json.dumps({"trip_id": str(trip_id), "message": message}))
+            except Exception as e:
+                logger.warning(f"Error relaying event for trip_id {trip_id}, sending it to this process's clients only: {e}")
+                return self._deliver(str(trip_id), message)
+
+        with self._lock:
+            if str(trip_id) not in self._subscriptions:
+                return 0
+        return self._deliver(str(trip_id), format_event(event, data, event_id))
+
+    def _deliver(self, trip_id, message):
+        """Queue a formatted event for the clients of this process subscribed to a trip"""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(trip_id, ()))
+
+        delivered = 0
+        for subscription in subscriptions:
+            if subscription.put(message):
+                delivered += 1
+            else:
+                logger.warning(f"Dropping slow event subscriber for trip_id: {trip_id}")
+                self.unsubscribe(subscription)
+        return delivered
+
+    def subscriber_count(self, trip_id=None):
+        with self._lock:
+            if trip_id is not None:
+                return len(self._subscriptions.get(str(trip_id), ()))
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def _start_relay_listener(self):
+        """Deliver the events published by every process to this process's clients"""
+        def listen():
+            while True:
+                try:
+                    # Without the socket timeout, which an idle channel would hit
+                    client = redis.Redis.from_url(self._redis_url, socket_connect_timeout=0.5)
+                    pubsub = client.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(EVENT_CHANNEL)
+                    for message in pubsub.listen():
+                        event = json.loads(message['data'])
+                        self._deliver(event['trip_id'], event['message'])
+                except Exception as e:
+                    logger.error(f"Event relay listener disconnected: {e}")
+                    logger.error(traceback.format_exc())
+                    time.sleep(5)
+
+        listener_thread = threading.Thread(target=listen)
+        listener_thread.daemon = True
+        listener_thread.start()
+
+# Shared by the routes streaming events and the code producing them
+event_hub = EventHub()
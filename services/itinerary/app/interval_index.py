@@ -0,0 +1,121 @@
+import bisect
+import re
+
+MINUTES_PER_DAY = 24 * 60
+
+_TIME = re.compile(r'^(\d{1,2}):(\d{2})$')
+
+def parse_time(value):
+    """Parse an "HH:MM" time into minutes after midnight; 24:00 is allowed as an end time"""
+    match = _TIME.match(str(value).strip()) if value is not None else None
+    if not match:
+        raise ValueError(f"Invalid time: {value!r}, expected HH:MM")
+
+    hours, minutes = int(match.group(1)), int(match.group(2))
+    if minutes > 59 or hours > 24 or (hours == 24 and minutes):
+        raise ValueError(f"Invalid time: {value!r}, expected HH:MM")
+    return hours * 60 + minutes
+
+def format_time(minutes):
+    """Format minutes after midnight as a zero-padded "HH:MM" time"""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def normalize_time(value):
+    """Zero-pad a time so that times compare correctly as strings"""
+    return format_time(parse_time(value))
+
+class DayIntervalIndex:
+    """
+    The activities of one itinerary day as half-open [start, end) minute
+    intervals sorted by start time.
+
+    A running maximum of end times (and where it occurs) is kept alongside,
+    so checking a new interval for overlaps is a single binary search.
+    """
+
+    def __init__(self, intervals):
+        """
+        Args:
+            intervals: Iterable of (start, end, item) tuples, in minutes
+        """
+        self._intervals = sorted(intervals, key=lambda interval: (interval[0], interval[1]))
+        self._starts = [start for start, _, _ in self._intervals]
+
+        # Format: _max_end[i] is the latest end among intervals[0..i],
+        # reached by intervals[_max_end_at[i]]
+        self._max_end = []
+        self._max_end_at = []
+        for index, (_, end, _) in enumerate(self._intervals):
+            if not self._max_end or end > self._max_end[-1]:
+                self._max_end.append(end)
+                self._max_end_at.append(index)
+            else:
+                self._max_end.append(self._max_end[-1])
+                self._max_end_at.append(self._max_end_at[-1])
+
+    @classmethod
+    def from_activities(cls, activities):
+        """
+        Build the index from ItineraryActivity rows, skipping ones without a
+        valid start time; one without an end time occupies its start minute
+        """
+        intervals = []
+        for activity in activities:
+            try:
+                start = parse_time(activity.time)
+                end = parse_time(activity.end_time) if activity.end_time is not None else start + 1
+            except ValueError:
+                continue
+            if end > start:
+                intervals.append((start, end, activity))
+        return cls(intervals)
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def overlapping(self, start, end):
+        """Return an item overlapping [start, end), or None"""
+        # Only intervals starting before `end` can overlap
+        count = bisect.bisect_left(self._starts, end)
+        if count == 0 or self._max_end[count - 1] <= start:
+            return None
+        return self._intervals[self._max_end_at[count - 1]][2]
+
+    def conflicts(self, candidates):
+        """
+        Validate many new intervals at once, against the index and each other.
+
+        Args:
+            candidates: List of (start, end, item) tuples
+
+        Returns:
+            List: (item, conflicting item) pairs, in candidate start order
+        """
+        conflicts = []
+        previous = None
+        for start, end, item in sorted(candidates, key=lambda candidate: (candidate[0], candidate[1])):
+            existing = self.overlapping(start, end)
+            if existing is not None:
+                conflicts.append((item, existing))
+            elif previous is not None and previous[0] > start:
+                conflicts.append((item, previous[1]))
+
+            # Keep the candidate reaching furthest, to check later candidates against
+            if previous is None or end > previous[0]:
+                previous = (end, item)
+        return conflicts
+
+    def free_slots(self, day_start=0, day_end=MINUTES_PER_DAY, min_length=1):
+        """Return the (start, end) gaps of at least min_length minutes between day_start and day_end"""
+        slots = []
+        cursor = day_start
+        for start, end, _ in self._intervals:
+            if start >= day_end:
+                break
+            if start - cursor >= min_length:
+                slots.append((cursor, start))
+            cursor = max(cursor, end)
+
+        if day_end - cursor >= min_length:
+            slots.append((cursor, day_end))
+        return slots
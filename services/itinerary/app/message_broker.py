@@ -2,8 +2,12 @@ import pika
 import json
 import logging
 import os
+import threading
 import time
 import traceback
+from app.models import db
+from app.consumer_runtime import ConsumerRuntime, RejectMessage, RetryLater
+from app.recommendation_schema import parse_recommendation_message, RecommendationValidationError
 
 # Configure logging
 logging.basicConfig(
@@ -12,67 +16,78 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Minimum number of seconds between two re-requests for the same trip
+RECOMMENDATION_REQUEST_COOLDOWN = int(os.getenv('RECOMMENDATION_REQUEST_COOLDOWN', 120))
+
+# Seconds publishing is skipped after failing to connect to RabbitMQ, so
+# lookups don't each wait for the connection attempts while it's down
+PUBLISH_RETRY_INTERVAL = int(os.getenv('PUBLISH_RETRY_INTERVAL', 30))
+
+# Recommendation requests go to a priority queue: requests made while a user is
+# looking at the itinerary jump ahead of the ones sent when a trip is created.
+# The queue arguments must match the ones the recommendation service declares
+RECOMMENDATION_REQUESTS_QUEUE_ARGUMENTS = {'x-max-priority': 10}
+PRIORITY_INTERACTIVE = 8
+PRIORITY_BACKGROUND = 1
+
+# Trip deletions are broadcast by the trip management service on a fanout
+# exchange; this service reports what it deleted on the results queue
+DELETION_EVENTS_EXCHANGE = 'deletion_events'
+DELETION_EVENTS_QUEUE = 'itinerary.deletion_events'
+DELETION_RESULTS_QUEUE = 'deletion_results'
+
 class MessageBroker:
     def __init__(self, app):
         self.app = app
-        self.connection = None
-        self.channel = None
-        self.recommendations_queue = 'recommendation_responses'
+        # Responses are broadcast on a fanout exchange; this service reads them
+        # from its own durable queue so it sees every response
+        self.recommendations_exchange = 'recommendation_responses'
+        self.recommendations_queue = 'itinerary.recommendation_responses'
         self.recommendation_requests_queue = 'recommendation_requests'
+        # Format: {trip_id: (timestamp of the last request, its priority)}
+        self._requested_trip_ids = {}
+        self._requested_trip_ids_lock = threading.Lock()
+        # When this process last failed to publish, None once it succeeds
+        self._publish_failed_at = None
+
+        def dispose_engine():
+            # Drop the database connections a forked consumer process inherited
+            with self.app.app_context():
+                db.engine.dispose(close=False)
+
+        # Registered here but started by start_consumers, in one worker only.
+        # Created before gunicorn forks its workers, so every worker reads
+        # the same queue metrics
+        self.consumers = ConsumerRuntime('itinerary', app=self.app, after_fork=dispose_engine)
+        self.consumers.register(
+            self.recommendations_queue,
+            self._process_recommendations,
+            exchange=self.recommendations_exchange,
+            prefetch=1
+        )
+        self.consumers.register(DELETION_EVENTS_QUEUE, self._process_deletion, exchange=DELETION_EVENTS_EXCHANGE)
+        # Whether this process runs the consumers
+        self.consuming = False
         
-    def connect(self):
-        """Establish connection to RabbitMQ."""
-        try:
-            # Get RabbitMQ URL from environment or use default
-            rabbitmq_host = os.getenv('RABBITMQ_HOST', 'rabbitmq')
-            rabbitmq_port = os.getenv('RABBITMQ_PORT', '5672')
-            rabbitmq_user = os.getenv('RABBITMQ_USER', 'guest')
-            rabbitmq_pass = os.getenv('RABBITMQ_PASS', 'guest')
-            
-            rabbitmq_url = os.getenv('RABBITMQ_URL', f'amqp://{rabbitmq_user}:{rabbitmq_pass}@{rabbitmq_host}:{rabbitmq_port}/')
-            
-            logger.info(f"Connecting to RabbitMQ with URL: {rabbitmq_url.replace(rabbitmq_pass, '******')}")
-            
-            # Create a connection parameters object
-            parameters = pika.URLParameters(rabbitmq_url)
-            parameters.heartbeat = 600
-            parameters.blocked_connection_timeout = 300
-            parameters.connection_attempts = 3
-            parameters.retry_delay = 5
-            parameters.socket_timeout = 10.0  # Add socket timeout
-            
-            # Close any existing connection first
-            self.close()
-            
-            # Create a connection
-            self.connection = pika.BlockingConnection(parameters)
-            
-            # Create a channel
-            self.channel = self.connection.channel()
-            
-            # Declare queues
-            self.channel.queue_declare(queue=self.recommendations_queue, durable=True)
-            self.channel.queue_declare(queue=self.recommendation_requests_queue, durable=True)
-            
-            logger.info(f"Successfully declared queues: {self.recommendations_queue}, {self.recommendation_requests_queue}")
-            
-            # Set up consumer for recommendations queue
-            self.channel.basic_consume(
-                queue=self.recommendations_queue,
-                on_message_callback=self._process_recommendations,
-                auto_ack=True
-            )
-            
-            logger.info("Connected to RabbitMQ successfully")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Error connecting to RabbitMQ: {str(e)}")
-            logger.error(traceback.format_exc())
-            return False
+    def start_consumers(self):
+        """Consume recommendation responses and deletion requests, see app/consumer_runtime.py"""
+        self.consumers.start()
+        self.consuming = True
+
+    def is_connected(self):
+        """Whether the consumers of this process are connected to RabbitMQ"""
+        return self.consuming and self.consumers.is_connected()
 
-    def send_recommendation_request(self, trip_id, destination, start_date, end_date):
-        """Send a recommendation request to the recommendation service."""
+    def can_publish(self):
+        """Whether to try publishing, i.e. unless it failed within PUBLISH_RETRY_INTERVAL"""
+        failed_at = self._publish_failed_at
+        return failed_at is None or time.monotonic() - failed_at >= PUBLISH_RETRY_INTERVAL
+
+    def send_recommendation_request(self, trip_id, destination, start_date, end_date, priority=PRIORITY_BACKGROUND):
+        """
+        Send a recommendation request to the recommendation service, over a
+        connection of its own, so from any worker. Returns True if it was sent.
+        """
         try:
             recommendation_data = {
                 "trip_id": trip_id,
@@ -106,7 +121,8 @@ class MessageBroker:
                 # Declare the queue
                 channel.queue_declare(
                     queue=self.recommendation_requests_queue,
-                    durable=True
+                    durable=True,
+                    arguments=RECOMMENDATION_REQUESTS_QUEUE_ARGUMENTS
                 )
                 
                 # Publish message to recommendation requests queue
@@ -117,147 +133,93 @@ class MessageBroker:
                     body=message_body,
                     properties=pika.BasicProperties(
                         delivery_mode=2,  # make message persistent
-                        content_type='application/json'
+                        content_type='application/json',
+                        priority=priority
                     )
                 )
                 
-                logger.info(f"Successfully sent recommendation request message for trip_id: {trip_id}")
+                logger.info(f"Successfully sent recommendation request message for trip_id: {trip_id} with priority {priority}")
                 logger.info(f"Message body: {message_body}")
             
+            # Remember the request so repeated lookups don't trigger duplicates
+            with self._requested_trip_ids_lock:
+                self._requested_trip_ids[trip_id] = (time.monotonic(), priority)
+            self._publish_failed_at = None
+            return True
+            
         except Exception as e:
             logger.error(f"Error requesting recommendations for trip_id {trip_id}: {str(e)}")
             logger.error(traceback.format_exc())
+            self._publish_failed_at = time.monotonic()
+            return False
 
-    def _process_recommendations(self, ch, method, properties, body):
+    def request_recommendations_if_due(self, trip_id, destination, start_date, end_date, priority=PRIORITY_INTERACTIVE):
+        """
+        Send a recommendation request unless one with at least the same priority
+        was already sent for this trip within the cooldown window, so a pending
+        background request is escalated once. Returns True if a request was sent.
+        """
+        now = time.monotonic()
+        with self._requested_trip_ids_lock:
+            # Clean up expired entries
+            expired_trip_ids = [t_id for t_id, (timestamp, _) in self._requested_trip_ids.items()
+                                if now - timestamp > RECOMMENDATION_REQUEST_COOLDOWN]
+            for expired_id in expired_trip_ids:
+                del self._requested_trip_ids[expired_id]
+            
+            pending = self._requested_trip_ids.get(trip_id)
+            if pending and pending[1] >= priority:
+                logger.info(f"Recommendation request for trip_id {trip_id} already pending, not re-requesting")
+                return False
+        
+        return self.send_recommendation_request(trip_id, destination, start_date, end_date, priority=priority)
+
+    def _process_recommendations(self, delivery):
         """Process recommendation responses and update the itinerary."""
-        with self.app.app_context():
-            try:
-                recommendations = json.loads(body)
-                trip_id = recommendations.get('trip_id')
-                logger.info(f"Received recommendation response for trip_id: {trip_id}")
-                
-                # Store the recommendations in database
-                from app.models import db, Recommendation
-                
-                # Extract recommendation data
-                recommendation_data = recommendations.get('recommendations', {})
-                
-                # Check if recommendations already exist for this trip
-                existing_recommendation = Recommendation.query.filter_by(trip_id=trip_id).first()
-                
-                if existing_recommendation:
-                    # Update existing record
-                    existing_recommendation.destination = recommendations.get('destination', '')
-                    existing_recommendation.attractions = recommendation_data.get('attractions', [])
-                    existing_recommendation.restaurants = recommendation_data.get('restaurants', [])
-                    existing_recommendation.activities = recommendation_data.get('activities', [])
-                    existing_recommendation.events = recommendation_data.get('events', [])
-                    existing_recommendation.tips = recommendation_data.get('tips', [])
-                    db.session.commit()
-                    logger.info(f"Updated existing recommendations in database for trip_id: {trip_id}")
-                else:
-                    # Create new recommendation record
-                    new_recommendation = Recommendation(
-                        trip_id=trip_id,
-                        destination=recommendations.get('destination', ''),
-                        attractions=recommendation_data.get('attractions', []),
-                        restaurants=recommendation_data.get('restaurants', []),
-                        activities=recommendation_data.get('activities', []),
-                        events=recommendation_data.get('events', []),
-                        tips=recommendation_data.get('tips', [])
-                    )
-                    db.session.add(new_recommendation)
-                    db.session.commit()
-                    logger.info(f"Stored new recommendations in database for trip_id: {trip_id}")
-                
-            except Exception as e:
-                logger.error(f"Error processing recommendations: {str(e)}")
-                logger.error(traceback.format_exc())
+        # Parse and validate the response against the shared schema
+        try:
+            message = parse_recommendation_message(delivery.body)
+        except RecommendationValidationError as e:
+            raise RejectMessage(f"Invalid recommendation response: {e}")
+        trip_id = str(message['trip_id'])
+        logger.info(f"Received recommendation response for trip_id: {trip_id}")
+        
+        # Store the recommendations in database
+        from app.recommendation_service import RecommendationService
+        success, result = RecommendationService.save_recommendations(
+            trip_id,
+            message['destination'],
+            message['recommendations']
+        )
+        if not success:
+            raise RetryLater(result)
 
-    def publish_message(self, queue, message):
-        """Publish a message to a RabbitMQ queue."""
+    def _process_deletion(self, delivery):
+        """Delete the data of deleted trips and report back to the trip management service."""
+        message = delivery.json()
+        result = {"job_id": message.get("job_id"), "service": "itinerary"}
+        logger.info(f"Received deletion request for job {result['job_id']}")
+        
         try:
-            # Check if we have a valid connection and channel
-            if self.connection is None or self.connection.is_closed or self.channel is None or self.channel.is_closed:
-                logger.info("Connection is not valid, attempting to reconnect...")
-                if not self.connect():
-                    logger.error("Failed to connect to RabbitMQ, cannot publish message")
-                    return False
-            
-            # Convert message to JSON if it's a dict
-            if isinstance(message, dict):
-                message = json.dumps(message)
-                
-            # Publish message
-            self.channel.basic_publish(
-                exchange='',
-                routing_key=queue,
-                body=message,
-                properties=pika.BasicProperties(
-                    delivery_mode=2,  # make message persistent
-                    content_type='application/json'
-                )
-            )
-            
-            logger.info(f"Published message to queue: {queue}")
-            return True
-            
+            from app.activity_service import ActivityService
+            deleted = ActivityService.delete_trips(message.get("trip_ids") or [])
+            result.update(status="completed", deleted=deleted)
         except Exception as e:
-            logger.error(f"Error publishing message to RabbitMQ: {str(e)}")
-            logger.error(traceback.format_exc())
-            return False
-
-    def start_consuming(self):
-        """Start consuming messages from RabbitMQ."""
-        max_retries = 5
-        retry_count = 0
+            db.session.rollback()
+            # Retried first; the failure is only reported once retries run out
+            if not delivery.final_attempt:
+                raise
+            logger.error(f"Error processing deletion request: {str(e)}")
+            result.update(status="failed", error=str(e))
         
-        while retry_count < max_retries:
-            try:
-                logger.info("Starting to consume messages from RabbitMQ")
-                
-                # Check if we have a valid connection and channel
-                if self.connection is None or self.connection.is_closed or self.channel is None or self.channel.is_closed:
-                    logger.info("Connection is not valid, attempting to reconnect...")
-                    if not self.connect():
-                        logger.error("Failed to connect to RabbitMQ, retrying in 5 seconds...")
-                        time.sleep(5)
-                        retry_count += 1
-                        continue
-                
-                # Start consuming messages
-                logger.info("Starting to consume messages")
-                self.channel.start_consuming()
-                
-                logger.info("Message consumption ended")
-                
-            except pika.exceptions.AMQPConnectionError as e:
-                logger.error(f"AMQP connection error: {str(e)}")
-                logger.info("Reconnecting in 5 seconds...")
-                time.sleep(5)
-                retry_count += 1
-                
-            except pika.exceptions.ChannelClosedByBroker as e:
-                logger.error(f"Channel closed by broker: {str(e)}")
-                logger.info("Reconnecting in 5 seconds...")
-                time.sleep(5)
-                retry_count += 1
-                
-            except Exception as e:
-                logger.error(f"Unexpected error: {str(e)}")
-                logger.error(traceback.format_exc())
-                logger.info("Reconnecting in 5 seconds...")
-                time.sleep(5)
-                retry_count += 1
-                
-        logger.error(f"Failed to consume messages after {max_retries} retries")
+        delivery.channel.basic_publish(
+            exchange='',
+            routing_key=DELETION_RESULTS_QUEUE,
+            body=json.dumps(result),
+            properties=pika.BasicProperties(delivery_mode=2, content_type='application/json')
+        )
 
     def close(self):
-        """Close the connection to RabbitMQ."""
-        try:
-            if self.connection and self.connection.is_open:
-                self.connection.close()
-                logger.info("Closed RabbitMQ connection")
-        except Exception as e:
-            logger.error(f"Error closing RabbitMQ connection: {str(e)}")
-            logger.error(traceback.format_exc()) 
\ No newline at end of file
+        """Stop the consumers, letting in-flight messages finish."""
+        if self.consuming:
+            self.consumers.stop()
@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import JSONB
 from datetime import datetime
 
 # Initialize database
@@ -10,7 +11,23 @@ class Itinerary(db.Model):
     destination = db.Column(db.String, nullable=False)
     start_date = db.Column(db.Date, nullable=False)
     end_date = db.Column(db.Date, nullable=False)
-    daily_activities = db.Column(db.JSON, nullable=False, default={})
+    # Bumped by every change to the itinerary's activities
+    version = db.Column(db.Integer, nullable=False, default=1)
+    activities = db.relationship('ItineraryActivity', backref='itinerary', lazy=True,
+                                 cascade='all, delete-orphan', passive_deletes=True)
+    changes = db.relationship('ItineraryChange', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    
+    def get_daily_activities(self):
+        """Group the itinerary's activities by date, each day ordered by time"""
+        activities = (ItineraryActivity.query
+                      .filter_by(trip_id=self.trip_id)
+                      .order_by(ItineraryActivity.date, ItineraryActivity.time, ItineraryActivity.id)
+                      .all())
+        
+        daily_activities = {}
+        for activity in activities:
+            daily_activities.setdefault(activity.date, []).append(activity.to_dict())
+        return daily_activities
     
     def to_dict(self):
         return {
@@ -18,29 +35,89 @@ class Itinerary(db.Model):
             "destination": self.destination,
             "startDate": self.start_date.isoformat(),
             "endDate": self.end_date.isoformat(),
-            "dailyActivities": self.daily_activities
+            "version": self.version,
+            "dailyActivities": self.get_daily_activities()
+        }
+
+class ItineraryActivity(db.Model):
+    __tablename__ = 'itinerary_activities'
+    id = db.Column(db.Integer, primary_key=True)
+    trip_id = db.Column(db.String, db.ForeignKey('itineraries.trip_id', ondelete='CASCADE'), nullable=False)
+    date = db.Column(db.String, nullable=False)
+    time = db.Column(db.String, nullable=True)
+    end_time = db.Column(db.String, nullable=True)
+    name = db.Column(db.String, nullable=False, default='')
+    location = db.Column(db.String, nullable=True)
+    # Any other fields of the activity (description, type, cuisine, notes, ...)
+    details = db.Column(db.JSON, nullable=False, default=dict)
+    
+    __table_args__ = (
+        db.Index('ix_itinerary_activities_trip_date_time', 'trip_id', 'date', 'time'),
+    )
+    
+    CORE_FIELDS = ('date', 'time', 'end_time', 'name', 'location')
+    
+    @classmethod
+    def values_from_dict(cls, trip_id, activity, date=None):
+        """Split an activity dict into column values, keeping unknown fields in details"""
+        values = {field: activity.get(field) for field in cls.CORE_FIELDS}
+        values['trip_id'] = trip_id
+        values['date'] = str(date if date is not None else activity.get('date'))
+        values['name'] = values['name'] or ''
+        values['details'] = {key: value for key, value in activity.items()
+                             if key not in cls.CORE_FIELDS and key != 'id'}
+        return values
+    
+    @classmethod
+    def from_dict(cls, trip_id, activity, date=None):
+        return cls(**cls.values_from_dict(trip_id, activity, date))
+    
+    def to_dict(self):
+        return {
+            **(self.details or {}),
+            "id": self.id,
+            "name": self.name,
+            "date": self.date,
+            "time": self.time,
+            "end_time": self.end_time,
+            "location": self.location
+        }
+
+class ItineraryChange(db.Model):
+    __tablename__ = 'itinerary_changes'
+    id = db.Column(db.Integer, primary_key=True)
+    trip_id = db.Column(db.String, db.ForeignKey('itineraries.trip_id', ondelete='CASCADE'), nullable=False)
+    # Itinerary version the change produced
+    version = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(16), nullable=False)
+    activity_id = db.Column(db.Integer, nullable=False)
+    # The activity after the change, or null if it was deleted
+    activity = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_itinerary_changes_trip_version', 'trip_id', 'version'),
+    )
+    
+    def to_dict(self):
+        return {
+            "version": self.version,
+            "op": self.op,
+            "id": self.activity_id,
+            "activity": self.activity
         }
 
 class Recommendation(db.Model):
     __tablename__ = 'recommendations'
     trip_id = db.Column(db.String, primary_key=True)
     destination = db.Column(db.String, nullable=False)
-    attractions = db.Column(db.JSON, nullable=False, default=[])
-    restaurants = db.Column(db.JSON, nullable=False, default=[])
-    activities = db.Column(db.JSON, nullable=False, default=[])
-    events = db.Column(db.JSON, nullable=False, default=[])
-    tips = db.Column(db.JSON, nullable=False, default=[])
+    # Validated recommendations (see recommendation_schema), stored as one JSONB document
+    payload = db.Column(db.JSON().with_variant(JSONB, 'postgresql'), nullable=False, default=dict)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def to_dict(self):
         return {
             "tripId": self.trip_id,
             "destination": self.destination,
-            "recommendations": {
-                "attractions": self.attractions,
-                "restaurants": self.restaurants,
-                "activities": self.activities,
-                "events": self.events,
-                "tips": self.tips
-            }
-        } 
\ No newline at end of file
+            "recommendations": self.payload
+        }
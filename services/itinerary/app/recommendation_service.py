@@ -2,7 +2,10 @@ import json
 import logging
 import os
 import traceback
-from app.models import Recommendation
+from datetime import datetime
+from app.models import db, Recommendation
+from app.event_hub import event_hub
+from app.response_cache import response_cache, recommendations_key
 
 # Configure logging
 logging.basicConfig(
@@ -11,6 +14,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Format: {activity type: recommendations section}
+RECOMMENDATION_SECTIONS = {
+    'attraction': 'attractions',
+    'restaurant': 'restaurants',
+    'activity': 'activities',
+    'event': 'events',
+}
+
 class RecommendationService:
     @staticmethod
     def get_recommendations(trip_data):
@@ -34,21 +45,22 @@ class RecommendationService:
                 
                 # Request recommendations via message broker if not found
                 try:
+                    # Published over a connection of its own, so whether this
+                    # worker runs the consumers doesn't matter
                     from app import message_broker
-                    if message_broker and message_broker.connection and message_broker.connection.is_open:
+                    if message_broker and message_broker.can_publish():
                         # Format data for recommendation service
                         destination = trip_data.get('destination', '')
                         start_date = trip_data.get('startDate', '')
                         end_date = trip_data.get('endDate', '')
                         
-                        # Send recommendation request
-                        message_broker.send_recommendation_request(
+                        # Send recommendation request unless one is already pending
+                        message_broker.request_recommendations_if_due(
                             trip_id=trip_id,
                             destination=destination,
                             start_date=start_date,
                             end_date=end_date
                         )
-                        logger.info(f"Sent recommendation request for trip_id: {trip_id}")
                     else:
                         logger.warning("Message broker not available, cannot request recommendations")
                 except Exception as e:
@@ -75,20 +87,19 @@ class RecommendationService:
                 # Try to request recommendations if not found
                 try:
                     from app import message_broker
-                    if message_broker and message_broker.connection and message_broker.connection.is_open:
+                    if message_broker and message_broker.can_publish():
                         # Get trip details from itinerary
                         from app.models import Itinerary
                         itinerary = Itinerary.query.get(trip_id)
                         
                         if itinerary:
-                            # Send recommendation request
-                            message_broker.send_recommendation_request(
+                            # Send recommendation request unless one is already pending
+                            message_broker.request_recommendations_if_due(
                                 trip_id=trip_id,
                                 destination=itinerary.destination,
                                 start_date=itinerary.start_date.isoformat(),
                                 end_date=itinerary.end_date.isoformat()
                             )
-                            logger.info(f"Sent recommendation request for trip_id: {trip_id}")
                 except Exception as e:
                     logger.error(f"Error requesting recommendations via message broker: {e}")
                     logger.error(traceback.format_exc())
@@ -100,4 +111,97 @@ class RecommendationService:
         except Exception as e:
             logger.error(f"Error in retrieve_recommendations: {e}")
             logger.error(traceback.format_exc())
-            return False, {"error": f"Error retrieving recommendations: {str(e)}"} 
\ No newline at end of file
+            return False, {"error": f"Error retrieving recommendations: {str(e)}"} 
+    
+    @staticmethod
+    def save_recommendations(trip_id, destination, payload):
+        """
+        Store recommendations for a trip, replacing any existing ones.
+        The payload must already be validated against recommendation_schema.
+        """
+        try:
+            existing_recommendation = Recommendation.query.filter_by(trip_id=trip_id).first()
+            
+            if existing_recommendation:
+                # Update existing record
+                existing_recommendation.destination = destination
+                existing_recommendation.payload = payload
+                logger.info(f"Updated existing recommendations in database for trip_id: {trip_id}")
+            else:
+                # Create new recommendation record
+                db.session.add(Recommendation(trip_id=trip_id, destination=destination, payload=payload))
+                logger.info(f"Stored new recommendations in database for trip_id: {trip_id}")
+            
+            db.session.commit()
+            response_cache.invalidate(recommendations_key(trip_id))
+            
+            # Push the recommendations to clients waiting for them
+            event_hub.publish(trip_id, 'recommendations', {
+                "tripId": trip_id,
+                "destination": destination,
+                "recommendations": payload
+            })
+            return True, {"message": "Recommendations saved successfully"}
+        except Exception as e:
+            logger.error(f"Error saving recommendations for trip_id {trip_id}: {e}")
+            logger.error(traceback.format_exc())
+            db.session.rollback()
+            return False, {"error": f"Error saving recommendations: {str(e)}"}
+
+    @staticmethod
+    def build_activity(recommendations, data):
+        """
+        Build an itinerary activity from one recommended item.
+
+        Args:
+            recommendations: The trip's recommendations payload
+            data: Dict with type, index and optionally date, time and end_time
+
+        Returns:
+            Tuple: (success, result) where result is the activity or an error
+        """
+        activity_type = data.get('type', 'attraction')  # Default to attraction if not specified
+        activity_index = data.get('index')
+
+        if activity_index is None:
+            return False, {"error": "Activity index is required"}
+
+        # Get the correct category of recommendations based on type
+        section = RECOMMENDATION_SECTIONS.get(activity_type)
+        if not section:
+            return False, {"error": f"Invalid activity type: {activity_type}"}
+        items = recommendations.get(section, [])
+
+        # Make sure the index is valid
+        if not isinstance(activity_index, int) or activity_index < 0 or activity_index >= len(items):
+            return False, {"error": f"Invalid index for {activity_type}: {activity_index}"}
+
+        # Get the recommended activity
+        recommended_activity = items[activity_index]
+
+        # Use the given date, else suggested_day from the recommendation or today's date
+        date = data.get('date') or recommended_activity.get('suggested_day', datetime.now().date().isoformat())
+
+        # Add the activity with appropriate structure based on type
+        activity_entry = {
+            "name": recommended_activity.get('name', ''),
+            "description": recommended_activity.get('description', ''),
+            "time": data.get('time', '09:00'),
+            "end_time": data.get('end_time', '11:00'),
+            "location": recommended_activity.get('location', ''),
+            "date": date,
+            "type": activity_type
+        }
+
+        # Add specific fields based on activity type
+        if activity_type == 'restaurant':
+            activity_entry.update({
+                "cuisine": recommended_activity.get('cuisine', ''),
+                "price_range": recommended_activity.get('price_range', '')
+            })
+        elif activity_type == 'event':
+            activity_entry.update({
+                "event_date": recommended_activity.get('date', '')
+            })
+
+        return True, activity_entry
@@ -0,0 +1,298 @@
+import logging
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict, namedtuple
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Responses kept in each process, and for how long
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 1024))
+CACHE_TTL_SECONDS = int(os.getenv('CACHE_TTL_SECONDS', 300))
+
+# Optional Redis shared by all itinerary processes, e.g. redis://redis:6379/0.
+# Invalidations are broadcast on CACHE_INVALIDATION_CHANNEL so every process
+# also drops its local copy
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', '')
+CACHE_KEY_PREFIX = 'itinerary-cache:'
+CACHE_INVALIDATION_CHANNEL = 'itinerary-cache-invalidations'
+
+# Per-key versions in the shared Redis, bumped by every invalidation, and
+# how long one is kept after its last bump; far longer than any read takes
+CACHE_VERSION_PREFIX = 'itinerary-cache-version:'
+CACHE_VERSION_TTL_SECONDS = 86400
+
+# Stores a response in the shared Redis only if its key's version is still
+# the one read before the database was: KEYS = (version key, entry key),
+# ARGV = (version, body, etag or '', ttl)
+_SET_IF_VERSION_SCRIPT = """
+if tonumber(redis.call('GET', KEYS[1]) or '0') ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('DEL', KEYS[2])
+if ARGV[3] == '' then
+    redis.call('HSET', KEYS[2], 'body', ARGV[2])
+else
+    redis.call('HSET', KEYS[2], 'body', ARGV[2], 'etag', ARGV[3])
+end
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return 1
+"""
+
+# A serialized JSON response and its ETag, if any
+CachedResponse = namedtuple('CachedResponse', ['body', 'etag'])
+
+def itinerary_key(trip_id):
+    return f"itinerary:{trip_id}"
+
+def recommendations_key(trip_id):
+    return f"recommendations:{trip_id}"
+
+class ResponseCache:
+    """
+    Read-through cache of serialized responses keyed by trip.
+
+    Entries live in a bounded in-process LRU and, if configured, in a shared
+    Redis. Writers invalidate the keys they change after committing; readers
+    take a generation() token for the key before reading the database and
+    pass it to set(), which skips the store if the key may have been
+    invalidated in between, so a slow reader can't put back data a writer
+    just replaced.
+
+    Locally the token is a counter of this process's invalidations. In Redis
+    every key has a version, bumped by invalidate() in whichever process,
+    and the entry is only written if the version is still the token's.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS, redis_url=CACHE_REDIS_URL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # Format: {key: (expires_at, CachedResponse)}, least recently used first
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._metrics = {
+            "hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "skipped_stores": 0,
+            "invalidations": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "shared_errors": 0,
+        }
+
+        self._redis = None
+        if redis_url:
+            if redis is None:
+                logger.warning("CACHE_REDIS_URL is set but the redis package is not installed, using the local cache only")
+            else:
+                self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+                self._redis_url = redis_url
+                self._set_if_version = self._redis.register_script(_SET_IF_VERSION_SCRIPT)
+                self._start_invalidation_listener()
+
+    def generation(self, key):
+        """Token to pass to set() for an entry of key read from the database after this call"""
+        with self._lock:
+            generation = self._generation
+        return generation, self._shared_version(key)
+
+    def get(self, key):
+        """Return the CachedResponse for a key, or None on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._metrics["hits"] += 1
+                    return entry[1]
+                del self._entries[key]
+                self._metrics["expirations"] += 1
+            generation = self._generation
+
+        response = self._get_shared(key)
+        with self._lock:
+            if response is None:
+                self._metrics["misses"] += 1
+                return None
+            self._metrics["shared_hits"] += 1
+            if generation == self._generation:
+                self._store_local(key, response, now)
+        return response
+
+    def set(self, key, response, generation=None):
+        """Cache a response, unless the key may have been invalidated since generation(key)"""
+        local_generation, shared_version = generation if generation is not None else (None, None)
+        if self._redis is not None and not self._set_shared(key, response, shared_version, generation is not None):
+            with self._lock:
+                self._metrics["skipped_stores"] += 1
+            return False
+
+        with self._lock:
+            if local_generation is not None and local_generation != self._generation:
+                self._metrics["skipped_stores"] += 1
+                return False
+            self._store_local(key, response, time.monotonic())
+            self._metrics["stores"] += 1
+        return True
+
+    def invalidate(self, *keys):
+        """Drop keys from this process, the shared backend and the other processes"""
+        with self._lock:
+            self._invalidate_local(keys)
+
+        if self._redis is not None:
+            try:
+                pipeline = self._redis.pipeline()
+                # Bumped first, so a reader can't write back what it read before
+                for key in keys:
+                    pipeline.incr(CACHE_VERSION_PREFIX + key)
+                    pipeline.expire(CACHE_VERSION_PREFIX + key, CACHE_VERSION_TTL_SECONDS)
+                pipeline.delete(*[CACHE_KEY_PREFIX + key for key in keys])
+                for key in keys:
+                    pipeline.publish(CACHE_INVALIDATION_CHANNEL, key)
+                pipeline.execute()
+            except Exception as e:
+                self._shared_error(f"Error invalidating shared cache keys {keys}: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def after_fork(self):
+        """
+        Start over in a forked worker process: the parent's threads didn't
+        come along, neither the invalidation listener nor whichever may have
+        held the lock.
+        """
+        self._lock = threading.Lock()
+        self.clear()
+        if self._redis is not None:
+            self._start_invalidation_listener()
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["size"] = len(self._entries)
+        lookups = metrics["hits"] + metrics["shared_hits"] + metrics["misses"]
+        metrics["hit_ratio"] = round((metrics["hits"] + metrics["shared_hits"]) / lookups, 4) if lookups else None
+        metrics["max_entries"] = self.max_entries
+        metrics["ttl_seconds"] = self.ttl
+        metrics["backend"] = "local+redis" if self._redis is not None else "local"
+        return metrics
+
+    def _store_local(self, key, response, now):
+        # Callers hold the lock
+        self._entries[key] = (now + self.ttl, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._metrics["evictions"] += 1
+
+    def _invalidate_local(self, keys):
+        # Callers hold the lock
+        self._generation += 1
+        for key in keys:
+            if self._entries.pop(key, None) is not None:
+                self._metrics["invalidations"] += 1
+
+    def _get_shared(self, key):
+        if self._redis is None:
+            return None
+        try:
+            values = self._redis.hgetall(CACHE_KEY_PREFIX + key)
+        except Exception as e:
+            self._shared_error(f"Error reading shared cache key {key}: {e}")
+            return None
+        if not values or b'body' not in values:
+            return None
+        etag = values.get(b'etag')
+        return CachedResponse(values[b'body'], etag.decode() if etag else None)
+
+    def _shared_version(self, key):
+        """The key's version in Redis, 0 if it was never invalidated, or None if unknown"""
+        if self._redis is None:
+            return None
+        try:
+            return int(self._redis.get(CACHE_VERSION_PREFIX + key) or 0)
+        except Exception as e:
+            self._shared_error(f"Error reading shared cache version of {key}: {e}")
+            return None
+
+    def _set_shared(self, key, response, version, checked):
+        """
+        Write an entry to Redis, if checked only while key is still at version.
+
+        Returns:
+            bool: False if the key was invalidated since, or Redis couldn't
+                tell; the entry is then not cached locally either
+        """
+        if checked and version is None:
+            return False
+        try:
+            if checked:
+                return bool(self._set_if_version(
+                    keys=[CACHE_VERSION_PREFIX + key, CACHE_KEY_PREFIX + key],
+                    args=[version, response.body, response.etag or '', self.ttl]
+                ))
+
+            mapping = {'body': response.body}
+            if response.etag:
+                mapping['etag'] = response.etag
+            pipeline = self._redis.pipeline()
+            pipeline.delete(CACHE_KEY_PREFIX + key)
+            pipeline.hset(CACHE_KEY_PREFIX + key, mapping=mapping)
+            pipeline.expire(CACHE_KEY_PREFIX + key, self.ttl)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            self._shared_error(f"Error writing shared cache key {key}: {e}")
+            return not checked
+
+    def _shared_error(self, message):
+        with self._lock:
+            self._metrics["shared_errors"] += 1
+        logger.warning(message)
+
+    def _start_invalidation_listener(self):
+        """Drop local entries invalidated by other processes"""
+        def listen():
+            while True:
+                try:
+                    # Without the socket timeout, which an idle channel would hit
+                    client = redis.Redis.from_url(self._redis_url, socket_connect_timeout=0.5)
+                    pubsub = client.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+                    # Anything cached locally may have been missed while disconnected
+                    self.clear()
+                    for message in pubsub.listen():
+                        key = message['data']
+                        with self._lock:
+                            self._invalidate_local([key.decode() if isinstance(key, bytes) else key])
+                except Exception as e:
+                    logger.error(f"Cache invalidation listener disconnected: {e}")
+                    logger.error(traceback.format_exc())
+                    self.clear()
+                    time.sleep(5)
+
+        listener_thread = threading.Thread(target=listen)
+        listener_thread.daemon = True
+        listener_thread.start()
+
+# Shared by the routes serving cached responses and the code invalidating them
+response_cache = ResponseCache()
@@ -1,14 +1,19 @@
-from flask import jsonify, request, current_app
+from flask import jsonify, request, current_app, Response
 from datetime import datetime
 import requests
 import json
 import logging
 import traceback
-from app.models import db, Itinerary, Recommendation
+from app.models import db, Itinerary, ItineraryActivity, Recommendation
 from app.recommendation_service import RecommendationService
+from app.activity_service import ActivityService, ItineraryUpdateError
+from app.interval_index import parse_time, format_time
+from app.event_hub import event_hub, format_event, TooManySubscriptions, EVENT_RETRY_MS
+from app.response_cache import response_cache, CachedResponse, itinerary_key, recommendations_key
+from app.message_broker import PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from app.recommendation_schema import validate_recommendations, RecommendationValidationError
 import os
 import pika
-from sqlalchemy.orm.attributes import flag_modified
 
 # Configure logging
 logging.basicConfig(
@@ -20,11 +25,47 @@ logger = logging.getLogger(__name__)
 # Configure service URLs
 TRIP_MANAGEMENT_URL = os.getenv('TRIP_MANAGEMENT_URL', 'http://trip-management:5005')
 
+# Part of the day searched for free slots unless the request says otherwise
+DEFAULT_DAY_START = '08:00'
+DEFAULT_DAY_END = '22:00'
+
+def version_etag(version):
+    return f'"{version}"'
+
+def parse_version_header(value):
+    """Parse an itinerary version from an If-Match / If-None-Match header, or None"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.startswith('W/'):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        return None
+
+def cached_json_response(cached, status=200):
+    headers = {'ETag': cached.etag} if cached.etag else {}
+    return Response(cached.body, status=status, mimetype='application/json', headers=headers)
+
+def cache_json(key, data, generation, etag=None):
+    """Serialize a response body once and cache it"""
+    cached = CachedResponse(current_app.json.dumps(data).encode('utf-8'), etag)
+    response_cache.set(key, cached, generation)
+    return cached
+
 def register_routes(app):
     @app.route('/api/itinerary/<trip_id>', methods=['GET'])
     def get_itinerary(trip_id):
         try:
+            cached = response_cache.get(itinerary_key(trip_id))
+            if cached:
+                if parse_version_header(request.headers.get('If-None-Match')) == parse_version_header(cached.etag):
+                    return '', 304, {'ETag': cached.etag}
+                return cached_json_response(cached)
+
             logger.info(f"Fetching itinerary for trip_id: {trip_id}")
+            generation = response_cache.generation(itinerary_key(trip_id))
             itinerary = Itinerary.query.get(trip_id)
 
             if not itinerary:
@@ -42,8 +83,7 @@ def register_routes(app):
                     trip_id=trip_id,
                     destination=trip_data['city'],
                     start_date=datetime.fromisoformat(trip_data['start_date']).date(),
-                    end_date=datetime.fromisoformat(trip_data['end_date']).date(),
-                    daily_activities={}
+                    end_date=datetime.fromisoformat(trip_data['end_date']).date()
                 )
                 db.session.add(itinerary)
                 db.session.commit()
@@ -59,7 +99,8 @@ def register_routes(app):
                         trip_id=trip_id,
                         destination=trip_data['city'],
                         start_date=trip_data['start_date'],
-                        end_date=trip_data['end_date']
+                        end_date=trip_data['end_date'],
+                        priority=PRIORITY_INTERACTIVE
                     )
                     
                     logger.info(f"Sent recommendation request via message broker for trip_id: {trip_id}")
@@ -68,7 +109,12 @@ def register_routes(app):
                     logger.error(traceback.format_exc())
                     # Continue even if recommendation request fails
 
-            return jsonify(itinerary.to_dict()), 200
+            # Clients already holding this version don't need the document again
+            etag = version_etag(itinerary.version)
+            if parse_version_header(request.headers.get('If-None-Match')) == itinerary.version:
+                return '', 304, {'ETag': etag}
+
+            return cached_json_response(cache_json(itinerary_key(trip_id), itinerary.to_dict(), generation, etag))
         except Exception as e:
             logger.error(f"Error fetching itinerary for trip_id {trip_id}: {str(e)}")
             logger.error(traceback.format_exc())
@@ -97,11 +143,11 @@ def register_routes(app):
                 trip_id=data['trip_id'],
                 destination=data['destination'],
                 start_date=datetime.fromisoformat(data['start_date']).date(),
-                end_date=datetime.fromisoformat(data['end_date']).date(),
-                daily_activities={}
+                end_date=datetime.fromisoformat(data['end_date']).date()
             )
             db.session.add(itinerary)
             db.session.commit()
+            response_cache.invalidate(itinerary_key(data['trip_id']))
             logger.info(f"Created new itinerary for trip_id: {data['trip_id']}")
             
             # Request recommendations for the new itinerary via message broker
@@ -114,7 +160,8 @@ def register_routes(app):
                     trip_id=data['trip_id'],
                     destination=data['destination'],
                     start_date=data['start_date'],
-                    end_date=data['end_date']
+                    end_date=data['end_date'],
+                    priority=PRIORITY_BACKGROUND
                 )
                 
                 logger.info(f"Sent recommendation request via message broker for trip_id: {data['trip_id']}")
@@ -139,42 +186,145 @@ def register_routes(app):
         if missing_fields:
             return jsonify({"error": f"Missing required fields: {', '.join(missing_fields)}"}), 400
 
-        if activity_data['end_time'] <= activity_data['time']:
-            return jsonify({"error": "End time must be later than start time"}), 400
-
         try:
             logger.info(f"Adding activity to itinerary for trip_id: {trip_id}")
-            itinerary = Itinerary.query.get(trip_id)
-            if not itinerary:
-                logger.warning(f"Itinerary not found for trip_id: {trip_id}")
-                return jsonify({"error": "Itinerary not found"}), 404
-
-            daily_activities = itinerary.daily_activities
-            if activity_data['date'] not in daily_activities:
-                daily_activities[activity_data['date']] = []
-
-            daily_activities[activity_data['date']].append(activity_data)
-            itinerary.daily_activities = daily_activities
-
-            flag_modified(itinerary, "daily_activities")
-            db.session.commit()
+            version, changes = ActivityService.apply_operations(trip_id, [{"op": "add", "activity": activity_data}])
             logger.info(f"Activity added successfully for trip_id: {trip_id}")
-            return jsonify({"message": "Activity added successfully"}), 200
+            return jsonify({
+                "message": "Activity added successfully",
+                "activity": changes[0]["activity"],
+                "version": version
+            }), 200, {'ETag': version_etag(version)}
+        except ItineraryUpdateError as e:
+            logger.warning(f"Could not add activity for trip_id {trip_id}: {e.message}")
+            return jsonify(e.to_dict()), e.status_code
         except Exception as e:
             logger.error(f"Error adding activity for trip_id {trip_id}: {str(e)}")
             logger.error(traceback.format_exc())
             return jsonify({"error": "Failed to add activity"}), 500
 
+    @app.route('/api/itinerary/<trip_id>/activities', methods=['PATCH'])
+    def patch_activities(trip_id):
+        """
+        Apply a batch of add/move/delete operations atomically.
+        The If-Match header must hold the itinerary version the client last saw.
+        """
+        expected_version = parse_version_header(request.headers.get('If-Match'))
+        if expected_version is None:
+            return jsonify({"error": "If-Match header with the itinerary version is required"}), 428
+
+        data = request.get_json(silent=True) or {}
+        try:
+            version, changes = ActivityService.apply_operations(trip_id, data.get('ops'), expected_version)
+            return jsonify({"version": version, "changes": changes}), 200, {'ETag': version_etag(version)}
+        except ItineraryUpdateError as e:
+            logger.warning(f"Could not apply operations for trip_id {trip_id}: {e.message}")
+            headers = {'ETag': version_etag(e.details['version'])} if 'version' in e.details else {}
+            return jsonify(e.to_dict()), e.status_code, headers
+        except Exception as e:
+            logger.error(f"Error applying operations for trip_id {trip_id}: {str(e)}")
+            logger.error(traceback.format_exc())
+            return jsonify({"error": "Failed to apply operations"}), 500
+
+    @app.route('/api/itinerary/<trip_id>/changes', methods=['GET'])
+    def get_itinerary_changes(trip_id):
+        """Get the activity changes made after the version given by ?since="""
+        since_version = request.args.get('since', type=int)
+        if since_version is None:
+            return jsonify({"error": "since query parameter is required"}), 400
+
+        try:
+            success, result = ActivityService.get_changes(trip_id, since_version)
+            if not success:
+                # 404 if the itinerary doesn't exist, 410 if the log no longer covers the version
+                return jsonify(result), 410 if "version" in result else 404
+
+            return jsonify(result), 200, {'ETag': version_etag(result["version"])}
+        except Exception as e:
+            logger.error(f"Error fetching changes for trip_id {trip_id}: {str(e)}")
+            logger.error(traceback.format_exc())
+            return jsonify({"error": "Failed to fetch changes"}), 500
+
+    @app.route('/api/itinerary/<trip_id>/events', methods=['GET'])
+    def stream_itinerary_events(trip_id):
+        """
+        Stream itinerary and recommendation updates as Server-Sent Events.
+
+        The stream starts with the current itinerary version and, if they
+        exist, the recommendations; missing recommendations are requested
+        once and pushed when they arrive. Events:
+            itinerary: {"version", "changes"} after every write
+            recommendations: {"tripId", "destination", "recommendations"}
+            deleted: the itinerary was deleted, the stream ends
+            resync: the client fell behind and should re-fetch, the stream ends
+
+        With EVENT_MAX_STREAMS streams open in this process already, the
+        response is a 503 with a retry: field instead.
+        """
+        itinerary = Itinerary.query.get(trip_id)
+        if not itinerary:
+            return jsonify({"error": "Itinerary not found"}), 404
+
+        # Subscribe before reading the current state so no update is missed
+        try:
+            subscription = event_hub.subscribe(trip_id)
+        except TooManySubscriptions as e:
+            logger.warning(f"Refusing event stream for trip_id {trip_id}: {e}")
+            return Response(f"retry: {EVENT_RETRY_MS}\n\n", status=503, mimetype='text/event-stream', headers={
+                'Retry-After': str(max(1, EVENT_RETRY_MS // 1000)),
+                'Cache-Control': 'no-cache'
+            })
+        try:
+            initial_events = [format_event('itinerary', {"version": itinerary.version, "changes": []}, itinerary.version)]
+            success, result = RecommendationService.retrieve_recommendations(trip_id)
+            if success:
+                initial_events.append(format_event('recommendations', result))
+        except Exception:
+            subscription.close()
+            raise
+
+        def generate():
+            try:
+                yield from initial_events
+                while True:
+                    message = subscription.get()
+                    if subscription.overflowed:
+                        yield format_event('resync', {})
+                        return
+                    if message is None:
+                        yield ': keep-alive\n\n'
+                        continue
+                    yield message
+                    if message.startswith('event: deleted'):
+                        return
+            finally:
+                subscription.close()
+
+        return Response(generate(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+
+    @app.route('/api/cache/metrics', methods=['GET'])
+    def get_cache_metrics():
+        """Hit/miss counters of this process's response cache"""
+        return jsonify(response_cache.metrics()), 200
+
     @app.route('/api/recommendations/<trip_id>', methods=['GET'])
     def retrieve_recommendations(trip_id):
         """Retrieve recommendations for a specific trip from database."""
         try:
+            cached = response_cache.get(recommendations_key(trip_id))
+            if cached:
+                return cached_json_response(cached)
+
             # Check for recommendations in database
+            generation = response_cache.generation(recommendations_key(trip_id))
             success, result = RecommendationService.retrieve_recommendations(trip_id)
             
             if success:
                 logger.info(f"Retrieved recommendations for trip_id: {trip_id}")
-                return jsonify(result), 200
+                return cached_json_response(cache_json(recommendations_key(trip_id), result, generation))
             else:
                 logger.warning(f"No recommendations found for trip_id: {trip_id}")
                 return jsonify(result), 404
@@ -189,95 +339,126 @@ def register_routes(app):
         """Add an activity to the itinerary based on a recommendation."""
         try:
             data = request.json
-            activity_type = data.get('type', 'attraction')  # Default to attraction if not specified
-            activity_index = data.get('index')
-            
-            if activity_index is None:
-                return jsonify({"error": "Activity index is required"}), 400
-                
-            # Get date from request or use suggested day if available
-            date = data.get('date')
-            
+            activity_type = data.get('type', 'attraction')
+
             # Retrieve recommendations from database
             success, result = RecommendationService.retrieve_recommendations(trip_id)
             if not success:
                 logger.warning(f"No recommendations found for trip_id: {trip_id}")
                 return jsonify({"error": "No recommendations found for this trip. Please wait for recommendations to be processed."}), 404
-            
-            recommendations = result.get('recommendations', {})
-            
-            # Get the correct category of recommendations based on type
-            if activity_type == 'attraction':
-                items = recommendations.get('attractions', [])
-            elif activity_type == 'restaurant':
-                items = recommendations.get('restaurants', [])
-            elif activity_type == 'activity':
-                items = recommendations.get('activities', [])
-            elif activity_type == 'event':
-                items = recommendations.get('events', [])
-            else:
-                return jsonify({"error": f"Invalid activity type: {activity_type}"}), 400
-                
-            # Make sure the index is valid
-            if activity_index < 0 or activity_index >= len(items):
-                return jsonify({"error": f"Invalid index for {activity_type}: {activity_index}"}), 400
-                
-            # Get the recommended activity
-            recommended_activity = items[activity_index]
-            
-            # If date not provided, use suggested_day from the recommendation or today's date
-            if not date:
-                date = recommended_activity.get('suggested_day', datetime.now().date().isoformat())
-            
-            # Retrieve the itinerary
-            itinerary = Itinerary.query.get(trip_id)
-            if not itinerary:
-                return jsonify({"error": "Itinerary not found"}), 404
 
-            # Add to daily activities
-            daily_activities = itinerary.daily_activities
-            logger.info(f"Daily activities: {daily_activities}")
-            if date not in daily_activities:
-                daily_activities[date] = []
-
-            # Add the activity with appropriate structure based on type
-            activity_entry = {
-                "name": recommended_activity.get('name', ''),
-                "description": recommended_activity.get('description', ''),
-                "time": data.get('time', '09:00'),
-                "end_time": data.get('end_time', '11:00'),
-                "location": recommended_activity.get('location', ''),
-                "date": date,
-                "type": activity_type
-            }
-            
-            # Add specific fields based on activity type
-            if activity_type == 'restaurant':
-                activity_entry.update({
-                    "cuisine": recommended_activity.get('cuisine', ''),
-                    "price_range": recommended_activity.get('price_range', '')
-                })
-            elif activity_type == 'event':
-                activity_entry.update({
-                    "event_date": recommended_activity.get('date', '')
-                })
+            success, activity_entry = RecommendationService.build_activity(result.get('recommendations', {}), data)
+            if not success:
+                return jsonify(activity_entry), 400
 
             # Add the activity to the itinerary
-            daily_activities[date].append(activity_entry)
-
-            itinerary.daily_activities = daily_activities
-            from sqlalchemy.orm.attributes import flag_modified
-            flag_modified(itinerary, "daily_activities")
-            db.session.commit()
-            
+            version, changes = ActivityService.apply_operations(trip_id, [{"op": "add", "activity": activity_entry}])
 
             logger.info(f"Added recommended {activity_type} to itinerary for trip_id: {trip_id}")
-            return jsonify({"message": f"Recommended {activity_type} added successfully"}), 200
+            return jsonify({
+                "message": f"Recommended {activity_type} added successfully",
+                "activity": changes[0]["activity"],
+                "version": version
+            }), 200, {'ETag': version_etag(version)}
             
+        except ItineraryUpdateError as e:
+            logger.warning(f"Could not add recommended activity for trip_id {trip_id}: {e.message}")
+            return jsonify(e.to_dict()), e.status_code
         except Exception as e:
             logger.error(f"Error adding recommended activity for trip_id {trip_id}: {str(e)}")
             return jsonify({"error": f"Failed to add recommended activity: {str(e)}"}), 500
 
+    @app.route('/api/itinerary/<trip_id>/add_recommended_activities', methods=['POST'])
+    def add_recommended_activities(trip_id):
+        """
+        Add many recommended activities at once.
+        They are checked for overlaps with the itinerary and with each other
+        first; if any overlap nothing is added and the conflicts are returned.
+        With "validate_only" the conflicts are reported without adding anything.
+        """
+        data = request.get_json(silent=True) or {}
+        items = data.get('activities')
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "activities must be a non-empty list"}), 400
+
+        try:
+            success, result = RecommendationService.retrieve_recommendations(trip_id)
+            if not success:
+                logger.warning(f"No recommendations found for trip_id: {trip_id}")
+                return jsonify({"error": "No recommendations found for this trip. Please wait for recommendations to be processed."}), 404
+
+            recommendations = result.get('recommendations', {})
+            activities = []
+            for index, item in enumerate(items):
+                success, activity = RecommendationService.build_activity(recommendations, item if isinstance(item, dict) else {})
+                if not success:
+                    return jsonify({"error": f"Activity {index}: {activity['error']}"}), 400
+                activities.append(activity)
+
+            conflicts = ActivityService.find_conflicts(trip_id, activities)
+            if conflicts:
+                logger.info(f"Rejected {len(conflicts)} conflicting recommended activities for trip_id: {trip_id}")
+                return jsonify({"error": "Some activities overlap", "conflicts": conflicts}), 409
+            if data.get('validate_only'):
+                return jsonify({"conflicts": []}), 200
+
+            version, changes = ActivityService.apply_operations(
+                trip_id, [{"op": "add", "activity": activity} for activity in activities]
+            )
+
+            logger.info(f"Added {len(changes)} recommended activities to itinerary for trip_id: {trip_id}")
+            return jsonify({
+                "message": f"{len(changes)} recommended activities added successfully",
+                "activities": [change["activity"] for change in changes],
+                "version": version
+            }), 200, {'ETag': version_etag(version)}
+
+        except ItineraryUpdateError as e:
+            logger.warning(f"Could not add recommended activities for trip_id {trip_id}: {e.message}")
+            return jsonify(e.to_dict()), e.status_code
+        except Exception as e:
+            logger.error(f"Error adding recommended activities for trip_id {trip_id}: {str(e)}")
+            logger.error(traceback.format_exc())
+            return jsonify({"error": "Failed to add recommended activities"}), 500
+
+    @app.route('/api/itinerary/<trip_id>/free_slots', methods=['GET'])
+    def get_free_slots(trip_id):
+        """
+        Get the free time slots of an itinerary day.
+        Query parameters: date (required), start and end of the day (default
+        08:00-22:00) and min_minutes, the shortest slot returned (default 30).
+        """
+        date = request.args.get('date')
+        if not date:
+            return jsonify({"error": "date query parameter is required"}), 400
+
+        try:
+            day_start = parse_time(request.args.get('start', DEFAULT_DAY_START))
+            day_end = parse_time(request.args.get('end', DEFAULT_DAY_END))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        min_minutes = request.args.get('min_minutes', 30, type=int)
+        if day_end <= day_start or min_minutes is None or min_minutes < 1:
+            return jsonify({"error": "end must be later than start and min_minutes at least 1"}), 400
+
+        try:
+            if not Itinerary.query.get(trip_id):
+                return jsonify({"error": "Itinerary not found"}), 404
+
+            day_index = ActivityService.get_day_index(trip_id, date)
+            slots = day_index.free_slots(day_start, day_end, min_minutes)
+            return jsonify({
+                "date": date,
+                "free_slots": [
+                    {"start": format_time(start), "end": format_time(end), "minutes": end - start}
+                    for start, end in slots
+                ]
+            }), 200
+        except Exception as e:
+            logger.error(f"Error fetching free slots for trip_id {trip_id}: {str(e)}")
+            logger.error(traceback.format_exc())
+            return jsonify({"error": "Failed to fetch free slots"}), 500
+
     @app.route('/api/itinerary/<trip_id>/activities', methods=['DELETE'])
     def delete_activity(trip_id):
         """Delete an activity from the itinerary."""
@@ -294,37 +475,45 @@ def register_routes(app):
                 logger.warning(f"Itinerary not found for trip_id: {trip_id}")
                 return jsonify({"error": "Itinerary not found"}), 404
 
-            daily_activities = itinerary.daily_activities
+            # Uses the (trip_id, date, time) index
             date = activity_data['date']
-            if date not in daily_activities:
-                logger.warning(f"No activities found for date {date} in trip_id: {trip_id}")
-                return jsonify({"error": "No activities found for this date"}), 404
-
-            # Find and remove the activity
-            activities = daily_activities[date]
-            for i, activity in enumerate(activities):
-                if activity['time'] == activity_data['time'] and activity['name'] == activity_data['name']:
-                    del activities[i]
-                    break
-            else:
+            activity = ItineraryActivity.query.filter_by(
+                trip_id=trip_id,
+                date=date,
+                time=activity_data['time'],
+                name=activity_data['name']
+            ).order_by(ItineraryActivity.id).first()
+            if not activity:
                 logger.warning(f"Activity not found for trip_id: {trip_id}, date: {date}, time: {activity_data['time']}")
                 return jsonify({"error": "Activity not found"}), 404
 
-            # Remove the date if no more activities
-            if not activities:
-                del daily_activities[date]
-
-            itinerary.daily_activities = daily_activities
-            from sqlalchemy.orm.attributes import flag_modified
-            flag_modified(itinerary, "daily_activities")
-            db.session.commit()
+            version, _ = ActivityService.apply_operations(trip_id, [{"op": "delete", "id": activity.id}])
 
             logger.info(f"Activity deleted successfully for trip_id: {trip_id}")
-            return jsonify({"message": "Activity deleted successfully"}), 200
+            return jsonify({"message": "Activity deleted successfully", "version": version}), 200, {'ETag': version_etag(version)}
+        except ItineraryUpdateError as e:
+            logger.warning(f"Could not delete activity for trip_id {trip_id}: {e.message}")
+            return jsonify(e.to_dict()), e.status_code
         except Exception as e:
             logger.error(f"Error deleting activity for trip_id {trip_id}: {str(e)}")
             return jsonify({"error": "Failed to delete activity"}), 500
 
+    @app.route('/api/itinerary/<trip_id>/activities/<int:activity_id>', methods=['DELETE'])
+    def delete_activity_by_id(trip_id, activity_id):
+        """Delete an activity from the itinerary by its id."""
+        try:
+            logger.info(f"Deleting activity {activity_id} from itinerary for trip_id: {trip_id}")
+            version, _ = ActivityService.apply_operations(trip_id, [{"op": "delete", "id": activity_id}])
+
+            logger.info(f"Activity {activity_id} deleted successfully for trip_id: {trip_id}")
+            return jsonify({"message": "Activity deleted successfully", "version": version}), 200, {'ETag': version_etag(version)}
+        except ItineraryUpdateError as e:
+            logger.warning(f"Could not delete activity {activity_id} for trip_id {trip_id}: {e.message}")
+            return jsonify(e.to_dict()), e.status_code
+        except Exception as e:
+            logger.error(f"Error deleting activity {activity_id} for trip_id {trip_id}: {str(e)}")
+            return jsonify({"error": "Failed to delete activity"}), 500
+
     @app.route('/api/itinerary/<trip_id>', methods=['DELETE'])
     def delete_itinerary(trip_id):
         """Delete an itinerary."""
@@ -340,6 +529,8 @@ def register_routes(app):
             # Delete the itinerary
             db.session.delete(itinerary)
             db.session.commit()
+            response_cache.invalidate(itinerary_key(trip_id))
+            event_hub.publish(trip_id, 'deleted', {"tripId": trip_id})
             
             logger.info(f"Successfully deleted itinerary for trip_id: {trip_id}")
             return jsonify({"message": "Itinerary deleted successfully"}), 200
@@ -358,38 +549,19 @@ def register_routes(app):
             if 'recommendations' not in recommendations_data:
                 return jsonify({"error": "Missing recommendations data"}), 400
                 
-            recommendation_data = recommendations_data['recommendations']
+            try:
+                payload = validate_recommendations(recommendations_data['recommendations'])
+            except RecommendationValidationError as e:
+                return jsonify({"error": f"Invalid recommendations: {str(e)}"}), 400
             
             # Store recommendations in database
-            from app.models import db, Recommendation
-            
-            # Check if recommendations already exist for this trip
-            existing_recommendation = Recommendation.query.filter_by(trip_id=trip_id).first()
-            
-            if existing_recommendation:
-                # Update existing record
-                existing_recommendation.destination = recommendations_data.get('destination', '')
-                existing_recommendation.attractions = recommendation_data.get('attractions', [])
-                existing_recommendation.restaurants = recommendation_data.get('restaurants', [])
-                existing_recommendation.activities = recommendation_data.get('activities', [])
-                existing_recommendation.events = recommendation_data.get('events', [])
-                existing_recommendation.tips = recommendation_data.get('tips', [])
-                db.session.commit()
-                logger.info(f"Updated existing recommendations in database for trip_id: {trip_id}")
-            else:
-                # Create new recommendation record
-                new_recommendation = Recommendation(
-                    trip_id=trip_id,
-                    destination=recommendations_data.get('destination', ''),
-                    attractions=recommendation_data.get('attractions', []),
-                    restaurants=recommendation_data.get('restaurants', []),
-                    activities=recommendation_data.get('activities', []),
-                    events=recommendation_data.get('events', []),
-                    tips=recommendation_data.get('tips', [])
-                )
-                db.session.add(new_recommendation)
-                db.session.commit()
-                logger.info(f"Stored new recommendations in database for trip_id: {trip_id}")
+            success, result = RecommendationService.save_recommendations(
+                trip_id,
+                recommendations_data.get('destination', ''),
+                payload
+            )
+            if not success:
+                return jsonify(result), 500
             
             return jsonify({"message": "Recommendations added successfully"}), 200
         except Exception as e:
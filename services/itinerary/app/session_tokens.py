@@ -0,0 +1,157 @@
+"""
+Verifies the session tokens issued by the user service, without calling it.
+
+Tokens are Ed25519-signed JWTs carrying the user's public profile. The user
+service's public keys are fetched once and cached; a token signed with a
+key that isn't cached yet triggers a refetch, so key rotations are picked
+up without a restart.
+
+The same module is used by every service verifying session tokens
+(finance, group-management and itinerary), so keep the copies identical.
+"""
+import os
+import logging
+import threading
+import time
+
+import jwt
+import requests
+from flask import request, g, jsonify, has_request_context
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+USER_SERVICE_URL = os.getenv('USER_SERVICE_URL', 'http://user:5001')
+SESSION_KEYS_URL = os.getenv('SESSION_KEYS_URL', f"{USER_SERVICE_URL}/api/users/.well-known/jwks.json")
+SESSION_TOKEN_ISSUER = os.getenv('SESSION_TOKEN_ISSUER', 'user-service')
+
+# Cached keys are refreshed every SESSION_KEYS_TTL seconds, and unknown key
+# IDs refetch them at most every SESSION_KEYS_MIN_REFRESH seconds
+SESSION_KEYS_TTL = float(os.getenv('SESSION_KEYS_TTL', 3600))
+SESSION_KEYS_MIN_REFRESH = float(os.getenv('SESSION_KEYS_MIN_REFRESH', 30))
+
+# Clock skew tolerated between services, in seconds
+SESSION_TOKEN_LEEWAY = int(os.getenv('SESSION_TOKEN_LEEWAY', 30))
+
+ALGORITHMS = ['EdDSA']
+
+# Claims copied into the public profile returned by session_user
+PROFILE_CLAIMS = ('email', 'first_name', 'last_name', 'profile_picture')
+
+class SessionTokenError(Exception):
+    """Raised when a session token is malformed, expired or forged"""
+
+class SessionKeysUnavailable(SessionTokenError):
+    """Raised when the signing keys can't be fetched from the user service"""
+
+class KeySet:
+    """The user service's public keys, by key ID"""
+
+    def __init__(self, url):
+        self.url = url
+        self._keys = {}
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+    def get(self, kid):
+        if self._fresh(kid):
+            return self._keys[kid]
+
+        with self._lock:
+            # Another thread may have refreshed the keys while we waited
+            if self._fresh(kid):
+                return self._keys[kid]
+            if self._fetched_at is None or time.monotonic() - self._fetched_at >= SESSION_KEYS_MIN_REFRESH:
+                self._refresh()
+
+        if kid not in self._keys:
+            raise SessionTokenError(f"Unknown signing key {kid}")
+        return self._keys[kid]
+
+    def _fresh(self, kid):
+        return kid in self._keys and time.monotonic() - self._fetched_at < SESSION_KEYS_TTL
+
+    def _refresh(self):
+        try:
+            response = requests.get(self.url, timeout=2)
+            response.raise_for_status()
+            keys = {jwk['kid']: jwt.PyJWK(jwk).key for jwk in response.json()['keys']}
+        except (requests.RequestException, ValueError, KeyError, jwt.PyJWTError) as e:
+            # Keep serving the keys we have rather than rejecting every caller
+            if self._keys:
+                logger.warning(f"Could not refresh session signing keys, keeping cached ones: {e}")
+                self._fetched_at = time.monotonic()
+                return
+            raise SessionKeysUnavailable(f"Could not fetch session signing keys: {e}")
+
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+        logger.info(f"Loaded {len(keys)} session signing keys")
+
+_key_set = KeySet(SESSION_KEYS_URL)
+
+def verify_token(token):
+    """
+    Check a session token's signature, issuer and expiry, and return its claims.
+
+    Raises:
+        SessionTokenError: If the token is invalid
+        SessionKeysUnavailable: If the signing keys can't be fetched
+    """
+    try:
+        kid = jwt.get_unverified_header(token).get('kid')
+        return jwt.decode(
+            token, _key_set.get(kid), algorithms=ALGORITHMS, issuer=SESSION_TOKEN_ISSUER,
+            leeway=SESSION_TOKEN_LEEWAY, options={'require': ['sub', 'iat', 'exp']}
+        )
+    except jwt.PyJWTError as e:
+        raise SessionTokenError(str(e))
+
+def _authenticate():
+    """Verify the bearer token of the request, if any, into g.session"""
+    g.session = None
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None
+
+    try:
+        g.session = verify_token(token.strip())
+    except SessionKeysUnavailable as e:
+        logger.error(str(e))
+        return jsonify({'error': 'Could not verify session token'}), 503
+    except SessionTokenError as e:
+        return jsonify({'error': 'Invalid session token', 'details': str(e)}), 401, {
+            'WWW-Authenticate': 'Bearer error="invalid_token"'
+        }
+    return None
+
+def init_app(app):
+    """
+    Authenticate requests carrying an `Authorization: Bearer` session token.
+
+    Requests without one are let through as before; requests with an
+    invalid one are rejected with a 401.
+    """
+    app.before_request(_authenticate)
+
+def session_claims():
+    """The verified claims of the current request's token, or None"""
+    if not has_request_context():
+        return None
+    return g.get('session')
+
+def session_user(user_id=None):
+    """
+    The caller's public profile from their token, in the user service's
+    format, or None if there's no token or it belongs to another user.
+    """
+    claims = session_claims()
+    if not claims or (user_id is not None and str(claims['sub']) != str(user_id)):
+        return None
+    return {'id': int(claims['sub']), **{claim: claims.get(claim) for claim in PROFILE_CLAIMS}}
+
+def is_other_user(user_id):
+    """Whether the request is authenticated as someone other than user_id"""
+    claims = session_claims()
+    return claims is not None and str(claims['sub']) != str(user_id)
@@ -0,0 +1,23 @@
+"""gunicorn settings of the itinerary service: `gunicorn wsgi:app`, see app/serving.py"""
+import os
+
+from app import serving
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5006)}"
+worker_class = 'gthread'
+# Without Redis, the response cache and the event streams are shared within
+# a process only, see app/response_cache.py and app/event_hub.py
+workers = serving.WEB_CONCURRENCY if os.getenv('CACHE_REDIS_URL') else int(os.getenv('WEB_CONCURRENCY', 1))
+# Every open event stream holds a thread
+threads = int(os.getenv('WEB_THREADS', 32))
+preload_app = serving.WEB_PRELOAD
+max_requests = serving.WEB_MAX_REQUESTS
+max_requests_jitter = serving.WEB_MAX_REQUESTS_JITTER
+timeout = serving.WEB_TIMEOUT
+graceful_timeout = serving.WEB_GRACEFUL_TIMEOUT
+keepalive = serving.WEB_KEEPALIVE
+accesslog = '-'
+
+post_fork = serving.post_fork
+post_worker_init = serving.post_worker_init
+worker_exit = serving.worker_exit
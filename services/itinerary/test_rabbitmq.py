@@ -47,10 +47,13 @@ def send_test_recommendation_request():
         
         # Declare queues
         recommendation_requests_queue = 'recommendation_requests'
-        recommendation_responses_queue = 'recommendation_responses'
+        channel.queue_declare(queue=recommendation_requests_queue, durable=True, arguments={'x-max-priority': 10})
         
-        channel.queue_declare(queue=recommendation_requests_queue, durable=True)
-        channel.queue_declare(queue=recommendation_responses_queue, durable=True)
+        # Bind a private queue to the response fanout exchange
+        channel.exchange_declare(exchange='recommendation_responses', exchange_type='fanout', durable=True)
+        result = channel.queue_declare(queue='', exclusive=True)
+        recommendation_responses_queue = result.method.queue
+        channel.queue_bind(exchange='recommendation_responses', queue=recommendation_responses_queue)
         
         # Create unique trip ID for the test
         trip_id = f"test-{uuid.uuid4()}"
@@ -0,0 +1,160 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+from flask import Flask
+
+from app import activity_service
+from app.models import db, Itinerary, ItineraryActivity
+from app.routes import register_routes
+
+def create_test_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    register_routes(app)
+    return app
+
+class ActivityApiTest(unittest.TestCase):
+    def setUp(self):
+        self.app = create_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+        db.create_all()
+        db.session.add(Itinerary(trip_id='1', destination='Tokyo', start_date=date(2025, 4, 1), end_date=date(2025, 4, 3)))
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def patch(self, ops, version=None):
+        headers = {'If-Match': f'"{version}"'} if version is not None else {}
+        return self.client.patch('/api/itinerary/1/activities', json={'ops': ops}, headers=headers)
+
+    def add(self, name, time, end_time, version):
+        activity = {'name': name, 'date': '2025-04-01', 'time': time, 'end_time': end_time}
+        return self.patch([{'op': 'add', 'activity': activity}], version)
+
+class VersionedPatchTest(ActivityApiTest):
+    def test_if_match_is_required(self):
+        response = self.add('Museum', '09:00', '11:00', None)
+        self.assertEqual(response.status_code, 428)
+        response = self.client.patch('/api/itinerary/1/activities', json={'ops': []}, headers={'If-Match': 'soon'})
+        self.assertEqual(response.status_code, 428)
+
+    def test_stale_version_is_rejected(self):
+        response = self.add('Museum', '09:00', '11:00', 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], '"2"')
+
+        # Another client still at version 1
+        response = self.add('Lunch', '12:00', '13:00', 1)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(response.get_json()['version'], 2)
+        self.assertEqual(response.headers['ETag'], '"2"')
+
+        response = self.add('Lunch', '12:00', '13:00', 2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['version'], 3)
+
+    def test_failed_batch_changes_nothing(self):
+        museum = self.add('Museum', '09:00', '11:00', 1).get_json()['changes'][0]['id']
+        response = self.patch([
+            {'op': 'move', 'id': museum, 'time': '14:00', 'end_time': '15:00'},
+            {'op': 'delete', 'id': 999},
+        ], 2)
+        self.assertEqual(response.status_code, 404)
+        changes = self.client.get('/api/itinerary/1/changes?since=1').get_json()
+        self.assertEqual(changes['version'], 2)
+        self.assertEqual(changes['changes'][0]['activity']['time'], '09:00')
+
+class ChangesTest(ActivityApiTest):
+    def test_changes_since_a_version(self):
+        self.add('Museum', '09:00', '11:00', 1)
+        self.add('Lunch', '12:00', '13:00', 2)
+
+        response = self.client.get('/api/itinerary/1/changes?since=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], '"3"')
+        [change] = response.get_json()['changes']
+        self.assertEqual((change['version'], change['op'], change['activity']['name']), (3, 'add', 'Lunch'))
+
+        self.assertEqual(self.client.get('/api/itinerary/1/changes?since=3').get_json()['changes'], [])
+        self.assertEqual(self.client.get('/api/itinerary/1/changes').status_code, 400)
+        self.assertEqual(self.client.get('/api/itinerary/2/changes?since=1').status_code, 404)
+
+    def test_trimmed_log_is_gone(self):
+        with patch.object(activity_service, 'CHANGE_LOG_RETENTION', 2):
+            for version, hour in enumerate(range(8, 12), start=1):
+                self.add(f"Activity {hour}", f"{hour}:00", f"{hour}:30", version)
+
+        # Versions 2 to 5 were made, only 4 and 5 are kept
+        response = self.client.get('/api/itinerary/1/changes?since=1')
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.get_json()['version'], 5)
+        response = self.client.get('/api/itinerary/1/changes?since=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([change['version'] for change in response.get_json()['changes']], [4, 5])
+
+class ConflictTest(ActivityApiTest):
+    def insert(self, name, time, end_time):
+        """Insert an activity directly, as the migration or older code may have"""
+        activity = ItineraryActivity(trip_id='1', date='2025-04-01', time=time, end_time=end_time, name=name, details={})
+        db.session.add(activity)
+        db.session.commit()
+        return activity.id
+
+    def test_overlap_is_rejected(self):
+        self.add('Museum', '09:00', '11:00', 1)
+        response = self.add('Coffee', '10:30', '11:30', 2)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.get_json()['conflict']['name'], 'Museum')
+        # Touching is fine
+        self.assertEqual(self.add('Lunch', '11:00', '12:00', 2).status_code, 200)
+
+    def test_longer_activity_hidden_behind_a_later_one(self):
+        # Overlapping rows from before every write was checked
+        self.insert('Museum', '09:00', '17:00')
+        self.insert('Coffee', '10:00', '10:30')
+
+        # The latest activity starting before 13:00 ends at 10:30, the museum at 17:00
+        response = self.add('Lunch', '12:00', '13:00', 1)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.get_json()['conflict']['name'], 'Museum')
+
+        lunch = self.insert('Lunch', '17:00', '18:00')
+        response = self.patch([{'op': 'move', 'id': lunch, 'time': '16:30', 'end_time': '17:30'}], 1)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.add('Dinner', '18:00', '19:00', 1).status_code, 200)
+
+    def test_move_is_not_checked_against_itself(self):
+        museum = self.insert('Museum', '09:00', '11:00')
+        self.insert('Lunch', '12:00', '13:00')
+
+        response = self.patch([{'op': 'move', 'id': museum, 'time': '10:00', 'end_time': '12:00'}], 1)
+        self.assertEqual(response.status_code, 200)
+        response = self.patch([{'op': 'move', 'id': museum, 'time': '11:00', 'end_time': '12:30'}], 2)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.get_json()['conflict']['name'], 'Lunch')
+
+    def test_activity_without_an_end_time(self):
+        self.insert('Walk', '15:00', None)
+
+        response = self.add('Tea', '14:30', '15:30', 1)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.get_json()['conflict']['name'], 'Walk')
+        self.assertEqual(self.add('Tea', '15:00', '15:30', 1).status_code, 409)
+        # Only its start minute is taken
+        self.assertEqual(self.add('Tea', '14:00', '15:00', 1).status_code, 200)
+        self.assertEqual(self.add('Show', '15:01', '16:00', 2).status_code, 200)
+
+        # Unscheduled activities take no time at all
+        self.insert('Someday', None, None)
+        self.assertEqual(self.add('Dinner', '18:00', '19:00', 3).status_code, 200)
+
+if __name__ == '__main__':
+    unittest.main()
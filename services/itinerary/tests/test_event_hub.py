@@ -0,0 +1,92 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+from flask import Flask
+
+import app as app_package
+from app import routes
+from app.event_hub import EventHub, TooManySubscriptions, EVENT_RETRY_MS
+from app.models import db, Itinerary
+
+class EventHubTest(unittest.TestCase):
+    def test_events_reach_the_trips_subscribers(self):
+        hub = EventHub(redis_url='')
+        first, second, other = hub.subscribe('1'), hub.subscribe('1'), hub.subscribe('2')
+        self.assertEqual(hub.publish('1', 'itinerary', {'version': 2}, event_id=2), 2)
+        self.assertEqual(first.get(timeout=0), 'id: 2\nevent: itinerary\ndata: {"version":2}\n\n')
+        self.assertIsNotNone(second.get(timeout=0))
+        self.assertIsNone(other.get(timeout=0))
+
+        first.close()
+        self.assertEqual(hub.subscriber_count('1'), 1)
+
+    def test_streams_are_capped(self):
+        hub = EventHub(redis_url='', max_subscriptions=2)
+        first = hub.subscribe('1')
+        hub.subscribe('2')
+        with self.assertRaises(TooManySubscriptions):
+            hub.subscribe('3')
+        # Closing a stream makes room
+        first.close()
+        hub.subscribe('3')
+        self.assertEqual(hub.subscriber_count(), 2)
+
+    def test_slow_subscriber_is_dropped(self):
+        hub = EventHub(redis_url='')
+        subscription = hub.subscribe('1')
+        with patch.object(subscription._queue, 'maxsize', 1):
+            hub.publish('1', 'itinerary', {'version': 2})
+            self.assertEqual(hub.publish('1', 'itinerary', {'version': 3}), 0)
+        self.assertTrue(subscription.overflowed)
+        self.assertEqual(hub.subscriber_count(), 0)
+
+class EventStreamRouteTest(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(app)
+        routes.register_routes(app)
+        context = app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+        db.create_all()
+        db.session.add(Itinerary(trip_id='1', destination='Tokyo', start_date=date(2025, 4, 1), end_date=date(2025, 4, 3)))
+        db.session.commit()
+        self.client = app.test_client()
+
+        self.hub = EventHub(redis_url='', max_subscriptions=1)
+        patchers = [
+            patch.object(routes, 'event_hub', self.hub),
+            # Other tests load app.py, whose broker would request recommendations
+            patch.object(app_package, 'message_broker', None),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_stream_over_the_limit_is_told_to_retry(self):
+        stream = self.client.get('/api/itinerary/1/events', buffered=False)
+        self.addCleanup(stream.close)
+        self.assertEqual(stream.status_code, 200)
+        self.assertTrue(next(stream.response).startswith(b'id: 1\nevent: itinerary'))
+
+        response = self.client.get('/api/itinerary/1/events')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertEqual(response.get_data(as_text=True), f"retry: {EVENT_RETRY_MS}\n\n")
+        self.assertIn('Retry-After', response.headers)
+
+        # The slot is freed when the first stream ends
+        stream.close()
+        self.assertEqual(self.hub.subscriber_count(), 0)
+        stream = self.client.get('/api/itinerary/1/events', buffered=False)
+        self.assertEqual(stream.status_code, 200)
+        stream.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+from types import SimpleNamespace
+from app.interval_index import DayIntervalIndex, parse_time, format_time, normalize_time
+
+class IntervalIndexTest(unittest.TestCase):
+    def setUp(self):
+        # 09:00-12:00 (with 10:00-10:30 inside it), then 14:00-15:00
+        self.index = DayIntervalIndex([
+            (540, 720, 'museum'),
+            (600, 630, 'coffee'),
+            (840, 900, 'lunch'),
+        ])
+
+    def test_parse_and_format_time(self):
+        self.assertEqual(parse_time('9:05'), 545)
+        self.assertEqual(parse_time('24:00'), 1440)
+        self.assertEqual(format_time(545), '09:05')
+        self.assertEqual(normalize_time('7:30'), '07:30')
+        for value in ('09:75', '25:00', '24:30', 'noon', None):
+            with self.assertRaises(ValueError):
+                parse_time(value)
+
+    def test_overlapping(self):
+        self.assertEqual(self.index.overlapping(700, 760), 'museum')
+        self.assertEqual(self.index.overlapping(850, 860), 'lunch')
+        # Touching intervals don't overlap
+        self.assertIsNone(self.index.overlapping(720, 840))
+        self.assertIsNone(self.index.overlapping(480, 540))
+        self.assertIsNone(self.index.overlapping(900, 960))
+
+    def test_conflicts(self):
+        conflicts = self.index.conflicts([
+            (960, 1020, 'dinner'),
+            (1000, 1080, 'show'),
+            (700, 800, 'walk'),
+            (1080, 1140, 'bar'),
+        ])
+        self.assertEqual(conflicts, [('walk', 'museum'), ('show', 'dinner')])
+
+    def test_free_slots(self):
+        self.assertEqual(self.index.free_slots(480, 1320, 30), [(480, 540), (720, 840), (900, 1320)])
+        self.assertEqual(self.index.free_slots(480, 1320, 90), [(720, 840), (900, 1320)])
+        self.assertEqual(DayIntervalIndex([]).free_slots(480, 600), [(480, 600)])
+
+    def test_from_activities(self):
+        index = DayIntervalIndex.from_activities([
+            SimpleNamespace(time='09:00', end_time='10:00'),
+            SimpleNamespace(time='11:00', end_time=None),
+            SimpleNamespace(time=None, end_time=None),
+            SimpleNamespace(time='evening', end_time='22:00'),
+        ])
+        self.assertEqual(len(index), 2)
+        # Without an end time, only the start minute is taken
+        self.assertIsNotNone(index.overlapping(630, 661))
+        self.assertIsNone(index.overlapping(600, 660))
+        self.assertIsNone(index.overlapping(661, 720))
+
+if __name__ == '__main__':
+    unittest.main()
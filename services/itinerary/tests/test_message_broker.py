@@ -0,0 +1,128 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import importlib.util
+import json
+import time
+import unittest
+from unittest.mock import patch
+
+from flask import Flask
+
+import app as app_package
+from app import message_broker as message_broker_module
+from app.message_broker import MessageBroker, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+from app.models import db
+from app.recommendation_service import RecommendationService
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+class FakeConnection:
+    """Stands in for pika.BlockingConnection, recording what's published"""
+
+    published = []
+
+    def __init__(self, parameters):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def channel(self):
+        return self
+
+    def queue_declare(self, queue, durable=False, arguments=None):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.published.append((routing_key, json.loads(body), properties.priority))
+
+def unreachable(parameters):
+    raise ConnectionError('refused')
+
+class PublishingTest(unittest.TestCase):
+    def setUp(self):
+        FakeConnection.published = []
+        patcher = patch.object(message_broker_module.pika, 'BlockingConnection', FakeConnection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # A worker that doesn't run the consumers
+        self.broker = MessageBroker(Flask(__name__))
+
+    def request(self, priority=PRIORITY_INTERACTIVE):
+        return self.broker.request_recommendations_if_due('1', 'Tokyo', '2025-04-01', '2025-04-03', priority=priority)
+
+    def test_workers_without_consumers_publish(self):
+        self.assertFalse(self.broker.consuming)
+        self.assertTrue(self.request())
+        self.assertEqual(FakeConnection.published, [('recommendation_requests', {
+            'trip_id': '1', 'destination': 'Tokyo', 'start_date': '2025-04-01', 'end_date': '2025-04-03'
+        }, PRIORITY_INTERACTIVE)])
+
+    def test_requests_within_the_cooldown(self):
+        self.assertTrue(self.request(PRIORITY_BACKGROUND))
+        # Escalated once, then not repeated
+        self.assertTrue(self.request())
+        self.assertFalse(self.request())
+        self.assertEqual([priority for _, _, priority in FakeConnection.published], [PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE])
+
+    def test_publishing_pauses_after_a_failure(self):
+        with patch.object(message_broker_module.pika, 'BlockingConnection', unreachable):
+            self.assertFalse(self.request())
+        self.assertFalse(self.broker.can_publish())
+
+        # Retried once the interval has passed, as the failed request wasn't remembered
+        with patch.object(message_broker_module, 'PUBLISH_RETRY_INTERVAL', 0):
+            self.assertTrue(self.broker.can_publish())
+            self.assertTrue(self.request())
+        self.assertTrue(self.broker.can_publish())
+
+    def test_missing_recommendations_are_requested(self):
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(app)
+        with app.app_context(), patch.object(app_package, 'message_broker', self.broker):
+            db.create_all()
+            found, _ = RecommendationService.get_recommendations({'tripId': '1', 'destination': 'Tokyo'})
+            self.assertFalse(found)
+            self.assertEqual(len(FakeConnection.published), 1)
+
+            # Not while publishing is paused
+            self.broker._requested_trip_ids.clear()
+            self.broker._publish_failed_at = time.monotonic()
+            RecommendationService.get_recommendations({'tripId': '1', 'destination': 'Tokyo'})
+            self.assertEqual(len(FakeConnection.published), 1)
+
+class WorkerStatusTest(unittest.TestCase):
+    """Health and consumer metrics from a worker not running the consumers"""
+
+    @classmethod
+    def setUpClass(cls):
+        # app.py is loaded from its path, as in wsgi.py
+        spec = importlib.util.spec_from_file_location(
+            'service', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app.py')
+        )
+        cls.service = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(cls.service)
+
+    def test_health(self):
+        client = self.service.app.test_client()
+        self.assertEqual(client.get('/health').get_json()['rabbitmq_status'], 'not responsible for consumers')
+
+        with patch.object(self.service.message_broker, 'consuming', True):
+            self.assertEqual(client.get('/health').get_json()['rabbitmq_status'], 'disconnected')
+
+    def test_consumer_metrics_are_shared(self):
+        runtime = self.service.message_broker.consumers
+        # As counted by the worker running the consumers
+        runtime.consumers[0].metrics.increment('received')
+        metrics = self.service.app.test_client().get('/api/consumers').get_json()
+        self.assertEqual(set(metrics), {'itinerary.recommendation_responses', 'itinerary.deletion_events'})
+        self.assertEqual(metrics['itinerary.recommendation_responses']['received'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
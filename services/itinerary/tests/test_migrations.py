@@ -0,0 +1,106 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import importlib.util
+import json
+import tempfile
+import unittest
+
+from sqlalchemy import inspect, text
+
+_database = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+_database.close()
+os.environ['DATABASE_URL'] = f"sqlite:///{_database.name}"
+
+# app.py is loaded from its path, as in wsgi.py
+_spec = importlib.util.spec_from_file_location(
+    'service', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app.py')
+)
+service = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(service)
+
+from app.models import db, ItineraryActivity
+
+def tearDownModule():
+    os.unlink(_database.name)
+
+class MigrateDailyActivitiesTest(unittest.TestCase):
+    def setUp(self):
+        self.context = service.app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+        db.drop_all()
+        db.create_all()
+        # The itineraries table as it was, activities in a JSON column
+        with db.engine.begin() as connection:
+            connection.execute(text('ALTER TABLE itineraries ADD COLUMN daily_activities JSON'))
+
+    def add_itinerary(self, trip_id, daily_activities):
+        with db.engine.begin() as connection:
+            connection.execute(
+                text("INSERT INTO itineraries (trip_id, destination, start_date, end_date, version, daily_activities) "
+                     "VALUES (:trip_id, 'Tokyo', '2025-04-01', '2025-04-03', 1, :daily_activities)"),
+                {'trip_id': trip_id, 'daily_activities': json.dumps(daily_activities)}
+            )
+
+    def activities(self, trip_id):
+        return {activity.name: activity
+                for activity in ItineraryActivity.query.filter_by(trip_id=trip_id).order_by(ItineraryActivity.id)}
+
+    def test_moves_activities_into_the_table(self):
+        self.add_itinerary('1', {
+            '2025-04-01': [
+                {'name': 'Museum', 'time': '9:00', 'end_time': '11:30', 'location': 'Ueno', 'notes': 'Buy tickets'},
+                {'name': 'Lunch', 'time': '12:00', 'end_time': '13:00', 'location': 'Asakusa'},
+            ],
+            '2025-04-02': [{'name': 'Hike', 'time': '08:00', 'end_time': '17:00'}],
+        })
+        self.add_itinerary('2', None)
+        service.migrate_daily_activities()
+
+        columns = [column['name'] for column in inspect(db.engine).get_columns('itineraries')]
+        self.assertNotIn('daily_activities', columns)
+
+        activities = self.activities('1')
+        self.assertEqual(sorted(activities), ['Hike', 'Lunch', 'Museum'])
+        museum = activities['Museum']
+        # Zero-padded like every write
+        self.assertEqual((museum.date, museum.time, museum.end_time), ('2025-04-01', '09:00', '11:30'))
+        self.assertEqual(museum.to_dict()['notes'], 'Buy tickets')
+        self.assertEqual(activities['Hike'].date, '2025-04-02')
+        self.assertEqual(self.activities('2'), {})
+
+        # Running it again does nothing
+        service.migrate_daily_activities()
+        self.assertEqual(len(self.activities('1')), 3)
+
+    def test_invalid_and_overlapping_activities_are_unscheduled(self):
+        self.add_itinerary('1', {'2025-04-01': [
+            {'name': 'Museum', 'time': '09:00', 'end_time': '12:00'},
+            {'name': 'Coffee', 'time': '10:00', 'end_time': '10:30'},
+            {'name': 'Lunch', 'time': '12:00', 'end_time': '13:00'},
+            {'name': 'Show', 'time': 'evening', 'end_time': '22:00'},
+            {'name': 'Walk', 'time': '15:00'},
+            {'name': 'Backwards', 'time': '18:00', 'end_time': '17:00'},
+            'not an activity',
+        ]})
+        service.migrate_daily_activities()
+
+        activities = self.activities('1')
+        self.assertEqual(sorted(activities), ['Backwards', 'Coffee', 'Lunch', 'Museum', 'Show', 'Walk'])
+        scheduled = {name: (activity.time, activity.end_time)
+                     for name, activity in activities.items() if activity.time is not None}
+        self.assertEqual(scheduled, {'Museum': ('09:00', '12:00'), 'Lunch': ('12:00', '13:00')})
+
+        # The others keep their original times, and why they were dropped
+        coffee = activities['Coffee'].to_dict()
+        self.assertIsNone(coffee['end_time'])
+        self.assertEqual(coffee['unscheduled']['time'], '10:00')
+        self.assertIn('Overlaps', coffee['unscheduled']['reason'])
+        self.assertEqual(activities['Show'].to_dict()['unscheduled']['time'], 'evening')
+        self.assertIsNone(activities['Walk'].to_dict()['unscheduled']['end_time'])
+        self.assertIn('later', activities['Backwards'].to_dict()['unscheduled']['reason'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+from unittest.mock import patch
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from app import response_cache as response_cache_module
+from app.response_cache import ResponseCache, CachedResponse, CACHE_VERSION_PREFIX
+
+OLD = CachedResponse(b'{"version": 1}', '"1"')
+NEW = CachedResponse(b'{"version": 2}', '"2"')
+
+class LocalCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(max_entries=2, ttl=60, redis_url='')
+
+    def test_read_through(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.assertTrue(self.cache.set('a', OLD, self.cache.generation('a')))
+        self.assertEqual(self.cache.get('a'), OLD)
+
+        self.cache.set('b', OLD)
+        self.cache.set('c', OLD)
+        # Least recently used first out
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.metrics()['evictions'], 1)
+
+    def test_invalidation_racing_a_read(self):
+        # A reader takes its token and queries the database...
+        generation = self.cache.generation('a')
+        # ...while a writer commits and invalidates
+        self.cache.invalidate('a')
+        self.assertFalse(self.cache.set('a', OLD, generation))
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.metrics()['skipped_stores'], 1)
+
+        self.assertTrue(self.cache.set('a', NEW, self.cache.generation('a')))
+        self.assertEqual(self.cache.get('a'), NEW)
+
+@unittest.skipIf(fakeredis is None, "needs the fakeredis package")
+class SharedCacheTest(unittest.TestCase):
+    """Two processes' caches sharing one Redis"""
+
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        patchers = [
+            patch.object(response_cache_module.redis.Redis, 'from_url',
+                         lambda url, **kwargs: fakeredis.FakeRedis(server=self.server)),
+            # The other process's invalidations are what's tested here, not their broadcast
+            patch.object(ResponseCache, '_start_invalidation_listener', lambda cache: None),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.reader = ResponseCache(ttl=60, redis_url='redis://redis:6379/0')
+        self.writer = ResponseCache(ttl=60, redis_url='redis://redis:6379/0')
+
+    def test_shared_between_processes(self):
+        self.assertTrue(self.reader.set('a', OLD, self.reader.generation('a')))
+        self.assertEqual(self.writer.get('a'), OLD)
+        self.assertEqual(self.writer.metrics()['shared_hits'], 1)
+
+    def test_invalidation_in_another_process_racing_a_read(self):
+        self.reader.set('a', OLD, self.reader.generation('a'))
+
+        generation = self.reader.generation('a')
+        # The writer commits and invalidates before the reader's write-back;
+        # the reader's own process hasn't heard of it yet
+        self.writer.invalidate('a')
+        self.assertFalse(self.reader.set('a', OLD, generation))
+
+        self.assertIsNone(self.writer.get('a'))
+        self.assertIsNone(fakeredis.FakeRedis(server=self.server).hgetall('itinerary-cache:a') or None)
+        self.assertEqual(self.reader.metrics()['skipped_stores'], 1)
+
+        # The next read stores what it read
+        self.assertTrue(self.reader.set('a', NEW, self.reader.generation('a')))
+        self.assertEqual(self.writer.get('a'), NEW)
+
+    def test_versions_are_per_key(self):
+        generation = self.reader.generation('a')
+        self.writer.invalidate('b')
+        self.assertTrue(self.reader.set('a', OLD, generation))
+
+        client = fakeredis.FakeRedis(server=self.server)
+        self.assertEqual(int(client.get(CACHE_VERSION_PREFIX + 'b')), 1)
+        self.assertGreater(client.ttl(CACHE_VERSION_PREFIX + 'b'), 0)
+        self.assertIsNone(client.get(CACHE_VERSION_PREFIX + 'a'))
+
+    def test_redis_errors_skip_the_store(self):
+        generation = self.reader.generation('a')
+        with patch.object(self.reader, '_set_if_version', side_effect=ConnectionError('redis is down')):
+            self.assertFalse(self.reader.set('a', OLD, generation))
+        self.assertIsNone(self.reader.get('a'))
+        self.assertEqual(self.reader.metrics()['shared_errors'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,15 @@ import logging
 import traceback
 import threading
 import time
-from app.message_broker import start_consumer_thread, processed_trip_ids, connect_to_rabbitmq
+import pika
+from app.message_broker import (
+    register_consumers, processed_trip_ids, connect_to_rabbitmq,
+    declare_request_queue, RECOMMENDATION_REQUESTS_QUEUE
+)
+from app.consumer_runtime import ConsumerRuntime, CONSUMER_PROCESSES
+from app.catalogue import catalogue
+from app.catalogue_warmer import start_catalogue_warmer
+from app import openai_service
 
 # Configure logging
 logging.basicConfig(
@@ -33,6 +41,16 @@ def clear_processed_trip_ids_cache():
             logger.error(f"Error clearing processed_trip_ids cache: {e}")
             logger.error(traceback.format_exc())
 
+# With CONSUMER_PROCESSES above 1, the requests queue is consumed by forked
+# worker processes while the catalogue warmer keeps running in this one, and
+# each of them gets an equal share of the model call rate
+MODEL_CALLING_PROCESSES = CONSUMER_PROCESSES + 1 if CONSUMER_PROCESSES > 1 else 1
+
+def after_fork():
+    """Start a consumer worker process without its parent's catalogue connections and rate limiter"""
+    catalogue.after_fork()
+    openai_service.split_rate_limit(MODEL_CALLING_PROCESSES)
+
 # Check OpenAI API Key
 openai_api_key = os.getenv('OPENAI_API_KEY')
 if not openai_api_key:
@@ -49,10 +67,20 @@ def purge_recommendation_requests_queue():
     """Purge the recommendation_requests queue to avoid processing old messages"""
     try:
         conn, channel = connect_to_rabbitmq()
-        queue_name = 'recommendation_requests'
+        queue_name = RECOMMENDATION_REQUESTS_QUEUE
         
         # Declare the queue (this won't delete it)
-        channel.queue_declare(queue=queue_name, durable=True)
+        try:
+            declare_request_queue(channel)
+        except pika.exceptions.ChannelClosedByBroker as e:
+            if e.reply_code != 406:
+                raise
+            # The queue predates priority support, so its arguments differ.
+            # It is about to be purged anyway, so recreate it as a priority queue
+            logger.info(f"Recreating {queue_name} queue as a priority queue")
+            channel = conn.channel()
+            channel.queue_delete(queue=queue_name)
+            declare_request_queue(channel)
         
         # Purge the queue
         message_count = channel.queue_purge(queue=queue_name)
@@ -83,21 +111,31 @@ def main():
     else:
         logger.warning("Failed to purge recommendation_requests queue")
     
-    # Start RabbitMQ consumer thread
+    if MODEL_CALLING_PROCESSES > 1:
+        openai_service.split_rate_limit(MODEL_CALLING_PROCESSES)
+        logger.info(f"Model call rate split between {MODEL_CALLING_PROCESSES} processes")
+    
+    # Keep the precomputed destination catalogue warm
+    start_catalogue_warmer()
+    logger.info("Started destination catalogue warmer thread")
+    
+    # Start the RabbitMQ consumers
     try:
-        # We pass None instead of Flask app since we no longer use Flask
-        consumer_thread = start_consumer_thread(None)
-        logger.info("RabbitMQ consumer thread started successfully")
+        consumers = ConsumerRuntime('recommendation-management', after_fork=after_fork)
+        register_consumers(consumers)
+        consumers.start()
+        logger.info("RabbitMQ consumers started successfully")
         
-        # Keep the main thread alive
+        # Keep the main thread alive, logging the consumers' throughput and lag
         while True:
             time.sleep(60)
-            logger.debug("Service is running...")
+            logger.info(f"Consumer metrics: {consumers.metrics()}")
     except Exception as e:
         logger.error(f"Error in main service loop: {e}")
         logger.error(traceback.format_exc())
     except KeyboardInterrupt:
         logger.info("Service shutting down gracefully...")
+        consumers.stop()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,74 @@
+import logging
+import time
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class RecommendationBatcher:
+    """
+    Gathers recommendation requests into micro-batches.
+
+    A batch is flushed once it holds max_batch_size requests, or max_wait_ms
+    milliseconds after its first request arrived, whichever comes first.
+    The timer is scheduled on the pika connection, so the flush handler runs
+    on the consumer thread and can safely use the channel to publish and ack.
+    """
+
+    def __init__(self, connection, handler, max_batch_size=5, max_wait_ms=500):
+        """
+        Args:
+            connection: The pika BlockingConnection the requests are consumed on
+            handler: Callable receiving a list of (delivery, request) tuples
+            max_batch_size: Maximum number of requests per batch
+            max_wait_ms: Maximum time the first request of a batch waits for others
+        """
+        self.connection = connection
+        self.handler = handler
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max(0, max_wait_ms)
+        self._pending = []
+        self._timer = None
+        self._deadline = None
+
+    def add(self, delivery, request, max_wait_ms=None):
+        """
+        Add a request to the current batch, flushing it if it is full.
+
+        max_wait_ms overrides the batch wait for this request; the batch is
+        flushed by the earliest deadline of the requests it holds.
+        """
+        self._pending.append((delivery, request))
+
+        wait_ms = self.max_wait_ms if max_wait_ms is None else max(0, min(max_wait_ms, self.max_wait_ms))
+        if len(self._pending) >= self.max_batch_size or wait_ms == 0:
+            self.flush()
+            return
+
+        deadline = time.monotonic() + wait_ms / 1000.0
+        if self._timer is not None and deadline >= self._deadline:
+            return
+
+        if self._timer is not None:
+            self.connection.remove_timeout(self._timer)
+        self._deadline = deadline
+        self._timer = self.connection.call_later(wait_ms / 1000.0, self._on_timer)
+
+    def flush(self):
+        """Hand the pending requests to the handler as one batch"""
+        if self._timer is not None:
+            self.connection.remove_timeout(self._timer)
+            self._timer = None
+            self._deadline = None
+
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        logger.info(f"Flushing batch of {len(batch)} recommendation request(s)")
+        self.handler(batch)
+
+    def _on_timer(self):
+        self._timer = None
+        self._deadline = None
+        self.flush()
@@ -0,0 +1,248 @@
+import os
+import logging
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+import psycopg2
+import psycopg2.extras
+import psycopg2.pool
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Get database connection details from environment variables
+DB_HOST = os.getenv('DB_HOST', 'recommendation-db')
+DB_PORT = os.getenv('DB_PORT', '5432')
+DB_NAME = os.getenv('DB_NAME', 'recommendation_db')
+DB_USER = os.getenv('DB_USER', 'postgres')
+DB_PASS = os.getenv('DB_PASS', 'postgres')
+
+# How long a catalogue entry is served before it has to be regenerated
+CATALOGUE_TTL_DAYS = int(os.getenv('CATALOGUE_TTL_DAYS', 30))
+
+# Trip lengths are grouped into buckets; each bucket is generated for a
+# representative number of days. Format: (bucket, max trip days, representative days)
+LENGTH_BUCKETS = [
+    ('short', 3, 3),
+    ('medium', 7, 7),
+    ('long', None, 14),
+]
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS destination_catalogue (
+        destination_key TEXT NOT NULL,
+        month SMALLINT NOT NULL,
+        length_bucket TEXT NOT NULL,
+        destination TEXT NOT NULL,
+        recommendations JSONB NOT NULL,
+        request_count INTEGER NOT NULL DEFAULT 0,
+        refreshed_at TIMESTAMP NOT NULL,
+        expires_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (destination_key, month, length_bucket)
+    );
+    CREATE INDEX IF NOT EXISTS ix_destination_catalogue_expires_at
+        ON destination_catalogue (expires_at);
+"""
+
+def destination_key(destination):
+    """Normalise a destination name for catalogue lookups"""
+    return ' '.join(destination.split()).lower()
+
+def length_bucket(start_date, end_date):
+    """Return the length bucket a trip falls into"""
+    trip_duration = (end_date - start_date).days + 1
+    for bucket, max_days, _ in LENGTH_BUCKETS:
+        if max_days is None or trip_duration <= max_days:
+            return bucket
+
+def representative_length(bucket):
+    """Return the trip length catalogue entries of a bucket are generated for"""
+    for name, _, days in LENGTH_BUCKETS:
+        if name == bucket:
+            return days
+    raise ValueError(f"Unknown length bucket: {bucket}")
+
+class DestinationCatalogue:
+    """
+    Precomputed recommendations in the recommendation DB, keyed by
+    destination, month of travel and trip length bucket.
+
+    Every method degrades to a miss when the database is unavailable,
+    so the service keeps working without its catalogue.
+    """
+
+    def __init__(self):
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def after_fork(self):
+        """
+        Drop the connection pool inherited from the parent process, without
+        closing its connections, which the parent is still using
+        """
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = psycopg2.pool.ThreadedConnectionPool(
+                    1, 4,
+                    host=DB_HOST,
+                    port=DB_PORT,
+                    dbname=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASS
+                )
+                logger.info(f"Connected to catalogue database {DB_NAME} on {DB_HOST}")
+            return self._pool
+
+    def _execute(self, sql, params=None, fetch=None):
+        """Run a statement in its own transaction, returning 'one' or 'all' rows if asked"""
+        pool = self._get_pool()
+        conn = pool.getconn()
+        try:
+            with conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(sql, params)
+                    if fetch == 'one':
+                        return cursor.fetchone()
+                    if fetch == 'all':
+                        return cursor.fetchall()
+                    return None
+        finally:
+            pool.putconn(conn)
+
+    def ensure_schema(self):
+        """Create the catalogue table if it doesn't exist"""
+        try:
+            self._execute(CREATE_TABLE_SQL)
+            logger.info("Destination catalogue table is ready")
+            return True
+        except Exception as e:
+            logger.error(f"Error creating destination catalogue table: {e}")
+            logger.error(traceback.format_exc())
+            return False
+
+    def lookup(self, destination, start_date, end_date):
+        """
+        Return the unexpired catalogue recommendations for a trip, or None on a miss.
+        Hits are counted so the warmer knows which destinations are popular.
+        """
+        try:
+            row = self._execute(
+                """
+                UPDATE destination_catalogue
+                SET request_count = request_count + 1
+                WHERE destination_key = %s AND month = %s AND length_bucket = %s AND expires_at > %s
+                RETURNING recommendations
+                """,
+                (destination_key(destination), start_date.month, length_bucket(start_date, end_date), datetime.utcnow()),
+                fetch='one'
+            )
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Error looking up catalogue for {destination}: {e}")
+            return None
+
+    def lookup_any(self, destination, month=None):
+        """
+        Return the best catalogue recommendations for a destination regardless
+        of expiry or trip length, preferring the given month. Used as a
+        fallback when the model is unavailable.
+        """
+        try:
+            row = self._execute(
+                """
+                SELECT recommendations FROM destination_catalogue
+                WHERE destination_key = %s
+                ORDER BY (month = %s) DESC, refreshed_at DESC
+                LIMIT 1
+                """,
+                (destination_key(destination), month),
+                fetch='one'
+            )
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Error looking up fallback catalogue entry for {destination}: {e}")
+            return None
+
+    def store(self, destination, month, bucket, recommendations, ttl_days=CATALOGUE_TTL_DAYS):
+        """Insert or refresh a catalogue entry"""
+        now = datetime.utcnow()
+        try:
+            self._execute(
+                """
+                INSERT INTO destination_catalogue
+                    (destination_key, month, length_bucket, destination, recommendations, refreshed_at, expires_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (destination_key, month, length_bucket) DO UPDATE
+                SET recommendations = EXCLUDED.recommendations,
+                    refreshed_at = EXCLUDED.refreshed_at,
+                    expires_at = EXCLUDED.expires_at
+                """,
+                (destination_key(destination), month, bucket, destination,
+                 psycopg2.extras.Json(recommendations), now, now + timedelta(days=ttl_days))
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Error storing catalogue entry for {destination}: {e}")
+            return False
+
+    def store_for_trip(self, destination, start_date, end_date, recommendations):
+        """Store freshly generated recommendations for a trip in the catalogue"""
+        return self.store(destination, start_date.month, length_bucket(start_date, end_date), recommendations)
+
+    def popular_destinations(self, limit):
+        """Return the destinations with the most catalogue hits"""
+        try:
+            rows = self._execute(
+                """
+                SELECT MAX(destination) FROM destination_catalogue
+                GROUP BY destination_key
+                ORDER BY SUM(request_count) DESC
+                LIMIT %s
+                """,
+                (limit,),
+                fetch='all'
+            )
+            return [row[0] for row in rows]
+        except Exception as e:
+            logger.error(f"Error listing popular destinations: {e}")
+            return []
+
+    def entries_due(self, destinations, months, refresh_before):
+        """
+        Return the (destination, month, bucket) entries that are missing or
+        expire before refresh_before, missing ones first, then soonest to expire.
+        """
+        keys = {destination_key(destination): destination for destination in destinations}
+        try:
+            rows = self._execute(
+                """
+                SELECT destination_key, month, length_bucket, expires_at FROM destination_catalogue
+                WHERE destination_key = ANY(%s)
+                """,
+                (list(keys),),
+                fetch='all'
+            )
+        except Exception as e:
+            logger.error(f"Error listing catalogue entries: {e}")
+            return []
+
+        expiries = {(row[0], row[1], row[2]): row[3] for row in rows}
+        due = []
+        for key, destination in keys.items():
+            for month in months:
+                for bucket, _, _ in LENGTH_BUCKETS:
+                    expires_at = expiries.get((key, month, bucket))
+                    if expires_at is None or expires_at < refresh_before:
+                        due.append((expires_at or datetime.min, destination, month, bucket))
+
+        due.sort(key=lambda entry: entry[0])
+        return [(destination, month, bucket) for _, destination, month, bucket in due]
+
+# Shared by the request path, the fallback path and the warmer
+catalogue = DestinationCatalogue()
@@ -0,0 +1,108 @@
+import os
+import logging
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta, date
+
+from app.catalogue import catalogue, representative_length
+from app.openai_service import get_batch_recommendations
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Destinations that are always kept in the catalogue; the most requested
+# destinations are added to them up to CATALOGUE_TOP_N
+DEFAULT_CATALOGUE_DESTINATIONS = 'Tokyo,Paris,London,New York,Singapore,Bangkok,Seoul,Bali,Sydney,Rome'
+CATALOGUE_DESTINATIONS = [
+    destination.strip()
+    for destination in os.getenv('CATALOGUE_DESTINATIONS', DEFAULT_CATALOGUE_DESTINATIONS).split(',')
+    if destination.strip()
+]
+CATALOGUE_TOP_N = int(os.getenv('CATALOGUE_TOP_N', 20))
+
+# Entries are kept for the next CATALOGUE_MONTHS_AHEAD months of travel
+CATALOGUE_MONTHS_AHEAD = int(os.getenv('CATALOGUE_MONTHS_AHEAD', 3))
+
+# The warmer wakes up every CATALOGUE_REFRESH_INTERVAL seconds and regenerates
+# at most CATALOGUE_REFRESH_LIMIT entries that are missing or expire within
+# CATALOGUE_REFRESH_MARGIN_DAYS, CATALOGUE_BATCH_SIZE entries per model call
+CATALOGUE_REFRESH_INTERVAL = int(os.getenv('CATALOGUE_REFRESH_INTERVAL', 3600))
+CATALOGUE_REFRESH_LIMIT = int(os.getenv('CATALOGUE_REFRESH_LIMIT', 30))
+CATALOGUE_REFRESH_MARGIN_DAYS = int(os.getenv('CATALOGUE_REFRESH_MARGIN_DAYS', 3))
+CATALOGUE_BATCH_SIZE = int(os.getenv('CATALOGUE_BATCH_SIZE', 5))
+
+def upcoming_months(today, count):
+    """Return the next `count` months of travel, starting with the current one"""
+    return [((today.month - 1 + offset) % 12) + 1 for offset in range(count)]
+
+def representative_dates(month, bucket, today):
+    """Pick the trip dates a catalogue entry is generated for"""
+    year = today.year if month >= today.month else today.year + 1
+    start_date = max(date(year, month, 10), today)
+    end_date = start_date + timedelta(days=representative_length(bucket) - 1)
+    return start_date, end_date
+
+def warm_catalogue():
+    """Regenerate the catalogue entries that are missing or about to expire"""
+    today = datetime.utcnow().date()
+    destinations = list(dict.fromkeys(
+        CATALOGUE_DESTINATIONS + catalogue.popular_destinations(CATALOGUE_TOP_N)
+    ))[:max(CATALOGUE_TOP_N, len(CATALOGUE_DESTINATIONS))]
+
+    refresh_before = datetime.utcnow() + timedelta(days=CATALOGUE_REFRESH_MARGIN_DAYS)
+    due = catalogue.entries_due(
+        destinations,
+        upcoming_months(today, CATALOGUE_MONTHS_AHEAD),
+        refresh_before
+    )[:CATALOGUE_REFRESH_LIMIT]
+
+    if not due:
+        logger.info("Destination catalogue is up to date")
+        return 0
+
+    logger.info(f"Warming {len(due)} destination catalogue entries")
+    refreshed = 0
+    for offset in range(0, len(due), CATALOGUE_BATCH_SIZE):
+        requests = []
+        for index, (destination, month, bucket) in enumerate(due[offset:offset + CATALOGUE_BATCH_SIZE]):
+            start_date, end_date = representative_dates(month, bucket, today)
+            requests.append({
+                'request_id': f"c{index}",
+                'destination': destination,
+                'start_date': start_date,
+                'end_date': end_date,
+                'month': month,
+                'bucket': bucket,
+                'interactive': False
+            })
+
+        # Failed entries are left for the next run instead of storing fallbacks
+        results = get_batch_recommendations(requests, fallback=False)
+        for request in requests:
+            recommendations = results.get(request['request_id'])
+            if recommendations and catalogue.store(request['destination'], request['month'], request['bucket'], recommendations):
+                refreshed += 1
+
+    logger.info(f"Refreshed {refreshed}/{len(due)} destination catalogue entries")
+    return refreshed
+
+def run_catalogue_warmer():
+    """Keep the destination catalogue warm"""
+    catalogue.ensure_schema()
+    while True:
+        try:
+            warm_catalogue()
+        except Exception as e:
+            logger.error(f"Error warming destination catalogue: {e}")
+            logger.error(traceback.format_exc())
+        time.sleep(CATALOGUE_REFRESH_INTERVAL)
+
+def start_catalogue_warmer():
+    """Start a thread to keep the destination catalogue warm"""
+    warmer_thread = threading.Thread(target=run_catalogue_warmer)
+    warmer_thread.daemon = True
+    warmer_thread.start()
+
+    return warmer_thread
@@ -5,7 +5,10 @@ import logging
 import time
 import traceback
 from datetime import datetime, timedelta
-from app.openai_service import get_recommendations
+from app.openai_service import get_batch_recommendations, get_fallback_recommendations
+from app.catalogue import catalogue
+from app.recommendation_schema import dumps
+from app.batching import RecommendationBatcher
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,6 +19,51 @@ logger = logging.getLogger(__name__)
 processed_trip_ids = {}
 CACHE_EXPIRY_SECONDS = 60  # 5 minutes
 
+# Requests are sent to the model in micro-batches of up to
+# RECOMMENDATION_BATCH_SIZE requests, or whatever arrived within
+# RECOMMENDATION_BATCH_WAIT_MS milliseconds of the first one
+RECOMMENDATION_BATCH_SIZE = int(os.getenv('RECOMMENDATION_BATCH_SIZE', 5))
+RECOMMENDATION_BATCH_WAIT_MS = int(os.getenv('RECOMMENDATION_BATCH_WAIT_MS', 500))
+
+# A batch holding an interactive request waits at most this long for others
+RECOMMENDATION_INTERACTIVE_WAIT_MS = int(os.getenv('RECOMMENDATION_INTERACTIVE_WAIT_MS', 50))
+
+# Seconds a batch may spend on model calls, rate limiter waits included. It
+# runs on the consumer's connection thread, which handles no other message,
+# ack or heartbeat meanwhile; requests left without recommendations are
+# retried through the consumer runtime's delay queues
+RECOMMENDATION_BATCH_TIMEOUT = float(os.getenv('RECOMMENDATION_BATCH_TIMEOUT', 60))
+
+# Queue the recommendation requests are consumed from. It is a priority queue,
+# so interactive requests (a user has the itinerary page open) are delivered
+# ahead of background ones (a trip was just created). Every service declaring
+# it must pass the same arguments
+RECOMMENDATION_REQUESTS_QUEUE = 'recommendation_requests'
+RECOMMENDATION_REQUESTS_QUEUE_ARGUMENTS = {'x-max-priority': 10}
+PRIORITY_INTERACTIVE = 8
+PRIORITY_BACKGROUND = 1
+
+# Responses are broadcast through a fanout exchange so that every interested
+# service (trip-management, itinerary, ...) receives every response on its own
+# queue, instead of competing for messages on a single shared queue
+RECOMMENDATION_RESPONSES_EXCHANGE = 'recommendation_responses'
+
+def declare_response_exchange(channel):
+    """Declare the fanout exchange recommendation responses are published to"""
+    channel.exchange_declare(
+        exchange=RECOMMENDATION_RESPONSES_EXCHANGE,
+        exchange_type='fanout',
+        durable=True
+    )
+
+def declare_request_queue(channel):
+    """Declare the recommendation request priority queue"""
+    channel.queue_declare(
+        queue=RECOMMENDATION_REQUESTS_QUEUE,
+        durable=True,
+        arguments=RECOMMENDATION_REQUESTS_QUEUE_ARGUMENTS
+    )
+
 def connect_to_rabbitmq():
     """Connect to RabbitMQ and return connection and channel"""
     # Get RabbitMQ connection details
@@ -40,205 +88,215 @@ def connect_to_rabbitmq():
     logger.info(f"Connected to RabbitMQ at {rabbitmq_host}")
     return connection, channel
 
-def process_recommendation_request(ch, method, properties, body, app=None):
-    """Process incoming recommendation requests"""
+def parse_recommendation_request(body, priority=None, retried=False):
+    """
+    Parse and validate an incoming recommendation request.
+    Returns the request data, or None if the request should be dropped.
+    
+    Args:
+        retried: Whether the message is a retry of a request this service
+            failed, which the duplicate check lets through
+    """
+    logger.info(f"Received recommendation request: {body}")
+    
+    # Parse the request
     try:
-        logger.info(f"Received recommendation request: {body}")
-        
-        # Parse the request
-        try:
-            data = json.loads(body)
-            logger.info(f"Successfully parsed recommendation request data: {data}")
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse recommendation request JSON: {e}")
-            logger.error(f"Request body: {body}")
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            return
+        data = json.loads(body)
+        logger.info(f"Successfully parsed recommendation request data: {data}")
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to parse recommendation request JSON: {e}")
+        logger.error(f"Request body: {body}")
+        return None
+    
+    # Extract trip details
+    try:
+        trip_id = data.get('trip_id')
+        destination = data.get('destination')
+        start_date_str = data.get('start_date')
+        end_date_str = data.get('end_date')
         
-        # Extract trip details
-        try:
-            trip_id = data.get('trip_id')
-            destination = data.get('destination')
-            start_date_str = data.get('start_date')
-            end_date_str = data.get('end_date')
-            
-            # Validate required fields
-            if not all([trip_id, destination, start_date_str, end_date_str]):
-                missing_fields = []
-                if not trip_id: missing_fields.append('trip_id')
-                if not destination: missing_fields.append('destination')
-                if not start_date_str: missing_fields.append('start_date')
-                if not end_date_str: missing_fields.append('end_date')
-                
-                logger.error(f"Missing required fields in recommendation request: {', '.join(missing_fields)}")
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-                return
-            
-            # Check in-memory cache for recently processed trip_id to avoid duplicate processing
-            current_time = datetime.utcnow()
-            if trip_id in processed_trip_ids:
-                last_processed = processed_trip_ids[trip_id]
-                time_diff = current_time - last_processed
-                if time_diff.total_seconds() < CACHE_EXPIRY_SECONDS:
-                    logger.info(f"Skipping duplicate request for trip_id={trip_id} - processed {time_diff.total_seconds():.2f} seconds ago")
-                    ch.basic_ack(delivery_tag=method.delivery_tag)
-                    return
-            
-            # Update the in-memory cache
-            processed_trip_ids[trip_id] = current_time
+        # Validate required fields
+        if not all([trip_id, destination, start_date_str, end_date_str]):
+            missing_fields = []
+            if not trip_id: missing_fields.append('trip_id')
+            if not destination: missing_fields.append('destination')
+            if not start_date_str: missing_fields.append('start_date')
+            if not end_date_str: missing_fields.append('end_date')
             
-            # Clean up old entries from the cache
-            expired_trip_ids = [t_id for t_id, timestamp in processed_trip_ids.items() 
-                              if (current_time - timestamp).total_seconds() > CACHE_EXPIRY_SECONDS]
-            for expired_id in expired_trip_ids:
-                del processed_trip_ids[expired_id]
-            
-            # Convert string dates to date objects
-            start_date = datetime.fromisoformat(start_date_str).date()
-            end_date = datetime.fromisoformat(end_date_str).date()
-            
-            logger.info(f"Processing recommendation request for trip_id={trip_id}, destination={destination}")
-        except Exception as e:
-            logger.error(f"Error extracting trip details from request: {e}")
-            logger.error(f"Stack trace: {traceback.format_exc()}")
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            return
+            logger.error(f"Missing required fields in recommendation request: {', '.join(missing_fields)}")
+            return None
         
-        # Get recommendations from OpenAI
-        try:
-            logger.info(f"Calling OpenAI service for recommendations for trip_id={trip_id}")
-            recommendations = get_recommendations(destination, start_date, end_date)
-            logger.info(f"Received recommendations from OpenAI for trip_id={trip_id}: {json.dumps(recommendations)[:200]}...")
-        except Exception as e:
-            logger.error(f"Error getting recommendations from OpenAI: {e}")
-            logger.error(f"Stack trace: {traceback.format_exc()}")
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            return
+        # Check in-memory cache for recently processed trip_id to avoid duplicate processing
+        current_time = datetime.utcnow()
+        if trip_id in processed_trip_ids and not retried:
+            last_processed = processed_trip_ids[trip_id]
+            time_diff = current_time - last_processed
+            if time_diff.total_seconds() < CACHE_EXPIRY_SECONDS:
+                logger.info(f"Skipping duplicate request for trip_id={trip_id} - processed {time_diff.total_seconds():.2f} seconds ago")
+                return None
         
-        # Acknowledge the message first
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        # Update the in-memory cache
+        processed_trip_ids[trip_id] = current_time
         
-        # Prepare response - include all original data plus recommendations
-        try:
-            response = {
-                'trip_id': trip_id,
-                'destination': destination,
-                'start_date': start_date_str,
-                'end_date': end_date_str,
-                'recommendations': recommendations,
-                'timestamp': datetime.utcnow().isoformat()
-            }
-            
-            logger.info(f"Preparing to send response for trip_id: {trip_id}")
-            
-            # Send the response with a separate connection
-            response_connection, response_channel = connect_to_rabbitmq()
-            
-            # Ensure the response queue exists
-            response_queue = 'recommendation_responses'
-            response_channel.queue_declare(queue=response_queue, durable=True)
-            
-            # Publish the response
-            response_channel.basic_publish(
-                exchange='',
-                routing_key=response_queue,
-                body=json.dumps(response),
-                properties=pika.BasicProperties(
-                    delivery_mode=2,  # make message persistent
-                    content_type='application/json'
-                )
-            )
-            
-            logger.info(f"Sent recommendation response for trip_id: {trip_id}")
-            
-            # Close the connection
-            response_connection.close()
-        except Exception as e:
-            logger.error(f"Error sending recommendation response: {e}")
-            logger.error(f"Stack trace: {traceback.format_exc()}")
-            
+        # Clean up old entries from the cache
+        expired_trip_ids = [t_id for t_id, timestamp in processed_trip_ids.items() 
+                          if (current_time - timestamp).total_seconds() > CACHE_EXPIRY_SECONDS]
+        for expired_id in expired_trip_ids:
+            del processed_trip_ids[expired_id]
+        
+        # Convert string dates to date objects
+        start_date = datetime.fromisoformat(start_date_str).date()
+        end_date = datetime.fromisoformat(end_date_str).date()
+        
+        interactive = (priority or 0) >= PRIORITY_INTERACTIVE
+        
+        logger.info(f"Queued {'interactive' if interactive else 'background'} recommendation request for trip_id={trip_id}, destination={destination}")
+        return {
+            'trip_id': trip_id,
+            'destination': destination,
+            'start_date': start_date,
+            'end_date': end_date,
+            'start_date_str': start_date_str,
+            'end_date_str': end_date_str,
+            'interactive': interactive
+        }
     except Exception as e:
-        logger.error(f"Unhandled error processing recommendation request: {e}")
+        logger.error(f"Error extracting trip details from request: {e}")
         logger.error(f"Stack trace: {traceback.format_exc()}")
-        # Acknowledge the message even on error to avoid queue blockage
-        try:
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-        except Exception:
-            pass
+        return None
+
+def publish_recommendation_response(channel, request, recommendations):
+    """Publish the recommendations for a single request to the response exchange"""
+    trip_id = request['trip_id']
+    
+    # Prepare response - include all original data plus recommendations
+    response = {
+        'trip_id': trip_id,
+        'destination': request['destination'],
+        'start_date': request['start_date_str'],
+        'end_date': request['end_date_str'],
+        'recommendations': recommendations,
+        'timestamp': datetime.utcnow().isoformat()
+    }
+    
+    # Publish the response to every bound consumer queue
+    channel.basic_publish(
+        exchange=RECOMMENDATION_RESPONSES_EXCHANGE,
+        routing_key='',
+        body=dumps(response),
+        properties=pika.BasicProperties(
+            delivery_mode=2,  # make message persistent
+            content_type='application/json'
+        )
+    )
+    
+    logger.info(f"Sent recommendation response for trip_id: {trip_id}")
 
-def setup_rabbitmq_consumer(app=None):
-    """Set up RabbitMQ consumer for recommendation requests"""
-    def callback_wrapper(ch, method, properties, body):
-        process_recommendation_request(ch, method, properties, body, app)
-    
-    # Connection retry loop
-    max_retries = 10
-    retry_count = 0
-    while retry_count < max_retries:
-        connection = None
-        channel = None
+def process_recommendation_batch(batch):
+    """
+    Serve a batch of requests from the destination catalogue where possible,
+    generate the rest with a single model call, then publish each result
+    individually and acknowledge its message.
+    
+    Model calls are cut off after RECOMMENDATION_BATCH_TIMEOUT seconds.
+    Requests the model didn't answer are retried later, through the delay
+    queues, and get the fallback recommendations on their final attempt.
+    
+    Args:
+        batch: List of (delivery, request) tuples, see app/consumer_runtime.py
+    """
+    requests = []
+    for index, (_, request) in enumerate(batch):
+        requests.append({**request, 'request_id': f"r{index}"})
+    
+    # Serve from the precomputed catalogue first
+    results = {}
+    for request in requests:
+        recommendations = catalogue.lookup(request['destination'], request['start_date'], request['end_date'])
+        if recommendations is not None:
+            logger.info(f"Serving recommendations for trip_id={request['trip_id']} from the destination catalogue")
+            results[request['request_id']] = recommendations
+    
+    misses = [request for request in requests if request['request_id'] not in results]
+    
+    # Get recommendations from OpenAI for the catalogue misses
+    if misses:
         try:
-            logger.info(f"Attempting to connect to RabbitMQ (attempt {retry_count + 1}/{max_retries})")
-            connection, channel = connect_to_rabbitmq()
-            
-            # Declare queues with more explicit naming
-            request_queue = 'recommendation_requests'
-            channel.queue_declare(queue=request_queue, durable=True)
-            
-            # Also declare the response queue to ensure it exists
-            response_queue = 'recommendation_responses'
-            channel.queue_declare(queue=response_queue, durable=True)
-            
-            logger.info(f"Declared queues: {request_queue}, {response_queue}")
-            
-            # Set QoS to avoid overwhelming the consumer
-            channel.basic_qos(prefetch_count=1)
-            
-            # Set up consumer
-            channel.basic_consume(
-                queue=request_queue,
-                on_message_callback=callback_wrapper,
-                auto_ack=False
+            trip_ids = [request['trip_id'] for request in misses]
+            logger.info(f"Calling OpenAI service for recommendations for trip_ids={trip_ids}")
+            generated = get_batch_recommendations(
+                misses,
+                fallback=False,
+                retry_missing=False,
+                deadline=time.monotonic() + RECOMMENDATION_BATCH_TIMEOUT
             )
-            
-            logger.info(f"Consumer registered for queue: {request_queue}")
-            logger.info("Waiting for recommendation requests. To exit press CTRL+C")
-            
-            # Start consuming
-            channel.start_consuming()
-            
         except Exception as e:
-            logger.error(f"Error in RabbitMQ consumer: {e}")
+            logger.error(f"Error getting recommendations from OpenAI: {e}")
             logger.error(f"Stack trace: {traceback.format_exc()}")
-            
-            # Increment retry count
-            retry_count += 1
-            
-            # Wait before retrying
-            if retry_count < max_retries:
-                retry_delay = min(30, 2 ** retry_count)  # Exponential backoff, max 30 seconds
-                logger.info(f"Retrying connection in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-            
-            # Close any open connection
-            if connection and connection.is_open:
-                try:
-                    connection.close()
-                except Exception:
-                    pass
+            generated = {}
         
-        # If we reach here, we either had an error or the connection was closed
-        if retry_count >= max_retries:
-            logger.error(f"Failed to connect to RabbitMQ after {max_retries} attempts")
-            break
+        deliveries = {request['request_id']: delivery for (delivery, _), request in zip(batch, requests)}
+        for request in misses:
+            recommendations = generated.get(request['request_id'])
+            if recommendations is not None:
+                # Add fresh results to the catalogue for the next trip like this one
+                catalogue.store_for_trip(request['destination'], request['start_date'], request['end_date'], recommendations)
+            elif deliveries[request['request_id']].final_attempt:
+                recommendations = get_fallback_recommendations(request['destination'], request['start_date'].month)
+            else:
+                continue
+            results[request['request_id']] = recommendations
+    
+    for (delivery, _), request in zip(batch, requests):
+        recommendations = results.get(request['request_id'])
+        if recommendations is None:
+            logger.warning(f"No recommendations generated for trip_id={request['trip_id']}, retrying later")
+            delivery.retry("No recommendations generated")
+            continue
+        try:
+            logger.info(f"Received recommendations for trip_id={request['trip_id']}: {json.dumps(recommendations)[:200]}...")
+            publish_recommendation_response(delivery.channel, request, recommendations)
+        except Exception as e:
+            logger.error(f"Error sending recommendation response: {e}")
+            logger.error(f"Stack trace: {traceback.format_exc()}")
+            delivery.retry(e)
+        else:
+            delivery.ack()
 
-def start_consumer_thread(app=None):
-    """Start a thread to consume recommendation requests"""
-    import threading
+def register_consumers(runtime):
+    """Register the recommendation request queue, see app/consumer_runtime.py"""
+    # Format: {'batcher': RecommendationBatcher of the current connection}
+    state = {}
+    
+    def setup(connection, channel):
+        # Also declare the response exchange to ensure it exists
+        declare_response_exchange(channel)
+        
+        # Requests are gathered into micro-batches before calling the model
+        state['batcher'] = RecommendationBatcher(
+            connection,
+            process_recommendation_batch,
+            max_batch_size=RECOMMENDATION_BATCH_SIZE,
+            max_wait_ms=RECOMMENDATION_BATCH_WAIT_MS
+        )
     
-    # RabbitMQ consumer thread
-    consumer_thread = threading.Thread(target=setup_rabbitmq_consumer, args=(app,))
-    consumer_thread.daemon = True
-    consumer_thread.start()
+    def handle_request(delivery):
+        request = parse_recommendation_request(delivery.body, delivery.properties.priority, retried=delivery.retries > 0)
+        if request is None:
+            # Invalid and duplicate requests are acknowledged and dropped
+            return
+        
+        # Settled by process_recommendation_batch once its batch is flushed
+        delivery.defer()
+        # Don't hold an interactive request back waiting for a full batch
+        max_wait_ms = RECOMMENDATION_INTERACTIVE_WAIT_MS if request['interactive'] else None
+        state['batcher'].add(delivery, request, max_wait_ms=max_wait_ms)
     
-    return consumer_thread
\ No newline at end of file
+    runtime.register(
+        RECOMMENDATION_REQUESTS_QUEUE,
+        handle_request,
+        queue_arguments=RECOMMENDATION_REQUESTS_QUEUE_ARGUMENTS,
+        # Let enough messages in flight to fill a batch
+        prefetch=RECOMMENDATION_BATCH_SIZE,
+        setup=setup
+    )
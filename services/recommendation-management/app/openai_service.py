@@ -1,8 +1,12 @@
 import os
-from openai import OpenAI
-import json
-from datetime import date
+import time
+from openai import OpenAI, RateLimitError
 import logging
+from app.rate_limiter import AdaptiveTokenBucket, parse_duration
+from app.catalogue import catalogue
+from app.recommendation_schema import (
+    parse_recommendations, parse_batch_recommendations, RecommendationValidationError
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -23,7 +27,8 @@ def get_openai_client():
             logger.error("GEMINI_API_KEY is empty or not set")
             return None
         
-        client = OpenAI(api_key=api_key, base_url="https://generativelanguage.googleapis.com/v1beta/openai/")
+        # 429s are retried by create_completion through the shared rate limiter
+        client = OpenAI(api_key=api_key, base_url="https://generativelanguage.googleapis.com/v1beta/openai/", max_retries=0)
         logger.info("Successfully initialized OpenAI client")
         return client
     except Exception as e:
@@ -31,14 +36,135 @@ def get_openai_client():
         logger.error("Please ensure GEMINI_API_KEY is properly set in your environment")
         return None
 
-def get_recommendations(destination, start_date, end_date):
+# Model used for all recommendation prompts
+MODEL = "gemini-2.0-flash"
+
+# Outbound model calls are paced by a token bucket shared by every caller in
+# the process. Its rate starts at LLM_RATE_LIMIT_RPS calls per second and is
+# tuned from the provider's rate-limit headers and 429 responses. With
+# several processes calling the model, see split_rate_limit()
+LLM_RATE_LIMIT_RPS = float(os.getenv('LLM_RATE_LIMIT_RPS', 1.0))
+LLM_RATE_LIMIT_BURST = int(os.getenv('LLM_RATE_LIMIT_BURST', 5))
+LLM_MAX_ATTEMPTS = int(os.getenv('LLM_MAX_ATTEMPTS', 4))
+LLM_ACQUIRE_TIMEOUT = float(os.getenv('LLM_ACQUIRE_TIMEOUT', 120))
+
+rate_limiter = AdaptiveTokenBucket(rate=LLM_RATE_LIMIT_RPS, capacity=LLM_RATE_LIMIT_BURST)
+
+def split_rate_limit(processes):
+    """
+    Give this process an equal share of LLM_RATE_LIMIT_RPS and the burst,
+    so that the processes calling the model keep to them together.
+
+    Replaces the token bucket, so it's also how a forked process drops the
+    one it inherited, whose lock another thread of the parent may have held.
+    """
+    global rate_limiter
+    rate_limiter = AdaptiveTokenBucket(
+        rate=LLM_RATE_LIMIT_RPS / processes,
+        capacity=max(1, LLM_RATE_LIMIT_BURST // processes),
+        max_rate=AdaptiveTokenBucket().max_rate / processes,
+        share=1.0 / processes
+    )
+
+SYSTEM_PROMPT = "You are a helpful travel assistant that provides detailed recommendations only in JSON format, without any other text."
+
+# Shared between the single-trip and the batched prompt
+RECOMMENDATION_INSTRUCTIONS = """
+    Please provide:
+    1. Top 5 must-see attractions
+    2. 3 recommended restaurants or food experiences
+    3. 2 off-the-beaten-path activities
+    4. Any special events happening during these dates if known
+    5. Practical tips specific to this destination and time period
+    """
+
+RECOMMENDATION_FORMAT = """{
+        "attractions": [
+            {"name": "attraction name", "description": "brief description", "suggested_day": "day number or range"}
+        ],
+        "restaurants": [
+            {"name": "restaurant name", "cuisine": "cuisine type", "price_range": "$ or $$ or $$$"}
+        ],
+        "activities": [
+            {"name": "activity name", "description": "brief description", "suggested_day": "day number or range"}
+        ],
+        "events": [
+            {"name": "event name", "date": "date if known", "description": "brief description"}
+        ],
+        "tips": [
+            "tip 1", "tip 2", "tip 3"
+        ]
+    }"""
+
+def create_completion(client, prompt, interactive=True, deadline=None):
+    """
+    Send a prompt to the model through the rate limiter.
+    Rate-limited calls are retried after the provider's back-off instead of failing.
+    
+    Args:
+        client: OpenAI client
+        prompt: User prompt to send
+        interactive: Whether a user is waiting for the answer; interactive
+            calls are given tokens ahead of background ones
+        deadline: time.monotonic() by which the call, waits and retries
+            included, must be done, or None for no limit
+        
+    Returns:
+        str: The content of the model's reply
+    
+    Raises:
+        TimeoutError: If no token or no answer came in time
+    """
+    for attempt in range(1, LLM_MAX_ATTEMPTS + 1):
+        acquire_timeout = LLM_ACQUIRE_TIMEOUT
+        if deadline is not None:
+            acquire_timeout = min(acquire_timeout, max(0, deadline - time.monotonic()))
+        if not rate_limiter.acquire(interactive=interactive, timeout=acquire_timeout):
+            raise TimeoutError(f"Timed out after {acquire_timeout:g}s waiting for the rate limiter")
+        
+        options = {}
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("No time left for the model call")
+            options['timeout'] = remaining
+        
+        try:
+            raw_response = client.chat.completions.with_raw_response.create(
+                # model="gpt-4-turbo-preview",
+                model=MODEL,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                # temperature=0.7,
+                # max_tokens=800
+                **options
+            )
+        except RateLimitError as e:
+            retry_after = parse_duration(e.response.headers.get('retry-after')) if e.response is not None else None
+            rate_limiter.on_rate_limited(retry_after)
+            if attempt == LLM_MAX_ATTEMPTS:
+                raise
+            logger.warning(f"Model call rate limited (attempt {attempt}/{LLM_MAX_ATTEMPTS}), retrying")
+            continue
+        
+        rate_limiter.on_success(raw_response.headers)
+        response = raw_response.parse()
+        return response.choices[0].message.content
+
+def get_recommendations(destination, start_date, end_date, interactive=True, fallback=True, deadline=None):
+    """
+    Get recommendations for a single trip, by `deadline` if given, see create_completion.
+    On failure the fallback recommendations are returned, or None if fallback is False.
+    """
     logger.info(f"Getting recommendations for {destination} from {start_date} to {end_date}")
     
     # Initialize the OpenAI client within this function
     client = get_openai_client()
     if not client:
         logger.error("Failed to initialize OpenAI client, returning fallback recommendations")
-        return get_fallback_recommendations(destination)
+        return get_fallback_recommendations(destination, start_date.month) if fallback else None
 
     # Calculate trip duration
     trip_duration = (end_date - start_date).days + 1
@@ -46,68 +172,148 @@ def get_recommendations(destination, start_date, end_date):
     try:
         # Call OpenAI API
         logger.info("Sending request to OpenAI API")
-        response = client.chat.completions.create(
-            # model="gpt-4-turbo-preview",
-            model="gemini-2.0-flash",
-            messages=[
-                {"role": "system", "content": "You are a helpful travel assistant that provides detailed recommendations only in JSON format, without any other text."},
-                {"role": "user", "content": create_prompt(destination, start_date, end_date, trip_duration)}
-            ],
-            # temperature=0.7,
-            # max_tokens=800
+        result = create_completion(
+            client,
+            create_prompt(destination, start_date, end_date, trip_duration),
+            interactive=interactive,
+            deadline=deadline
         )
         
-        # Extract and parse the response
-        result = response.choices[0].message.content
+        # Extract, parse and validate the response
         logger.info("Received response from OpenAI API")
         
-        # Clean up the response to ensure it's valid JSON
-        result = result.replace("```json", "").replace("```", "").strip()
-        
         try:
-            recommendations = json.loads(result)
+            recommendations = parse_recommendations(result)
             logger.info("Successfully parsed OpenAI response")
             return recommendations
-        except json.JSONDecodeError as e:
+        except RecommendationValidationError as e:
             logger.error(f"Failed to parse OpenAI response: {e}")
-            return get_fallback_recommendations(destination)
+            return get_fallback_recommendations(destination, start_date.month) if fallback else None
     except Exception as e:
         logger.error(f"Error calling OpenAI API: {e}")
-        return get_fallback_recommendations(destination)
+        return get_fallback_recommendations(destination, start_date.month) if fallback else None
+
+def get_batch_recommendations(requests, fallback=True, retry_missing=True, deadline=None):
+    """
+    Get recommendations for several trips with a single model call.
+    
+    Args:
+        requests: List of dicts with request_id, destination, start_date and end_date,
+            and optionally an interactive flag
+        fallback: Whether failed requests get the fallback recommendations;
+            if False they are left out of the result
+        retry_missing: Whether requests missing from the batched answer are
+            sent to the model again one by one, before falling back
+        deadline: time.monotonic() by which every model call must be done,
+            see create_completion
+        
+    Returns:
+        Dict: Recommendations keyed by request_id
+    """
+    if not requests:
+        return {}
+    
+    # A single request doesn't need the batched prompt
+    if len(requests) == 1:
+        request = requests[0]
+        recommendations = get_recommendations(
+            request['destination'], request['start_date'], request['end_date'],
+            interactive=request.get('interactive', True),
+            fallback=fallback,
+            deadline=deadline
+        )
+        return {request['request_id']: recommendations} if recommendations is not None else {}
+    
+    logger.info(f"Getting batched recommendations for {len(requests)} trips")
+    
+    # Initialize the OpenAI client within this function
+    client = get_openai_client()
+    if not client:
+        logger.error("Failed to initialize OpenAI client, returning fallback recommendations")
+        if not fallback:
+            return {}
+        return {
+            request['request_id']: get_fallback_recommendations(request['destination'], request['start_date'].month)
+            for request in requests
+        }
+    
+    results = {}
+    try:
+        # Call OpenAI API once for the whole batch
+        # The batch is interactive if anyone in it is waiting for an answer
+        logger.info("Sending batched request to OpenAI API")
+        result = create_completion(
+            client,
+            create_batch_prompt(requests),
+            interactive=any(request.get('interactive', True) for request in requests),
+            deadline=deadline
+        )
+        
+        # Extract, parse and validate the response
+        logger.info("Received batched response from OpenAI API")
+        
+        results = parse_batch_recommendations(result, [request['request_id'] for request in requests])
+        logger.info(f"Parsed recommendations for {len(results)}/{len(requests)} batched trips")
+    except RecommendationValidationError as e:
+        logger.error(f"Failed to parse batched OpenAI response: {e}")
+    except Exception as e:
+        logger.error(f"Error calling OpenAI API for batch: {e}")
+    
+    # Requests missing from the batched answer are retried on their own
+    for request in requests:
+        if request['request_id'] in results:
+            continue
+        if retry_missing:
+            logger.warning(f"No batched recommendations for request {request['request_id']}, requesting individually")
+            recommendations = get_recommendations(
+                request['destination'], request['start_date'], request['end_date'],
+                interactive=request.get('interactive', True),
+                fallback=fallback,
+                deadline=deadline
+            )
+        elif fallback:
+            recommendations = get_fallback_recommendations(request['destination'], request['start_date'].month)
+        else:
+            recommendations = None
+        if recommendations is not None:
+            results[request['request_id']] = recommendations
+    
+    return results
 
 def create_prompt(destination, start_date, end_date, trip_duration):
     return f"""
     Create a detailed travel recommendation for a trip to {destination} from {start_date} to {end_date} ({trip_duration} days).
-    
-    Please provide:
-    1. Top 5 must-see attractions
-    2. 3 recommended restaurants or food experiences
-    3. 2 off-the-beaten-path activities
-    4. Any special events happening during these dates if known
-    5. Practical tips specific to this destination and time period
-    
+    {RECOMMENDATION_INSTRUCTIONS}
     Format the response as a JSON object with the following structure:
-    {{
-        "attractions": [
-            {{"name": "attraction name", "description": "brief description", "suggested_day": "day number or range"}}
-        ],
-        "restaurants": [
-            {{"name": "restaurant name", "cuisine": "cuisine type", "price_range": "$ or $$ or $$$"}}
-        ],
-        "activities": [
-            {{"name": "activity name", "description": "brief description", "suggested_day": "day number or range"}}
-        ],
-        "events": [
-            {{"name": "event name", "date": "date if known", "description": "brief description"}}
-        ],
-        "tips": [
-            "tip 1", "tip 2", "tip 3"
-        ]
-    }}
+    {RECOMMENDATION_FORMAT}
     """
 
-def get_fallback_recommendations(destination):
-    """Provide static recommendations when OpenAI API is unavailable"""
+def create_batch_prompt(requests):
+    trips = "\n".join(
+        f"    - {request['request_id']}: a trip to {request['destination']} from {request['start_date']} to {request['end_date']} "
+        f"({(request['end_date'] - request['start_date']).days + 1} days)"
+        for request in requests
+    )
+    return f"""
+    Create a detailed travel recommendation for each of the following trips, identified by request id:
+{trips}
+    
+    For each trip:{RECOMMENDATION_INSTRUCTIONS}
+    Format the response as a single JSON object whose keys are the request ids above,
+    where each value is a JSON object with the following structure:
+    {RECOMMENDATION_FORMAT}
+    """
+
+def get_fallback_recommendations(destination, month=None):
+    """
+    Provide recommendations when OpenAI API is unavailable, from the
+    destination catalogue if it has the destination, else static ones
+    """
+    recommendations = catalogue.lookup_any(destination, month)
+    if recommendations is not None:
+        logger.info(f"Serving fallback recommendations for {destination} from the catalogue")
+        return recommendations
+    
     city_recommendations = {
         "Tokyo": {
             "attractions": [
@@ -0,0 +1,144 @@
+import logging
+import re
+import threading
+import time
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class AdaptiveTokenBucket:
+    """
+    Token-bucket rate limiter for outbound model calls.
+
+    Tokens refill at `rate` per second up to `capacity`. The rate adapts to
+    the provider: it is halved and calls are paused after a 429, it creeps
+    back up after successful calls, and it is re-tuned from the provider's
+    rate-limit response headers whenever they are present.
+
+    Interactive callers take precedence: background callers wait while any
+    interactive caller is waiting for a token.
+
+    When several processes call the model, each paces itself with `share`
+    of the provider's quota, including the quota its headers report.
+    """
+
+    def __init__(self, rate=1.0, capacity=5, min_rate=0.05, max_rate=10.0, share=1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.share = share
+        self._tokens = float(capacity)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._interactive_waiting = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, interactive=True, timeout=None):
+        """
+        Block until a token is available.
+
+        Args:
+            interactive: Whether the call serves a user who is waiting for it
+            timeout: Maximum number of seconds to wait, or None to wait forever
+
+        Returns:
+            bool: True if a token was acquired, False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._condition:
+            if interactive:
+                self._interactive_waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+
+                    may_take = interactive or self._interactive_waiting == 0
+                    if may_take and now >= self._paused_until and self._tokens >= 1:
+                        self._tokens -= 1
+                        return True
+
+                    # Work out how long until a token could be available
+                    if now < self._paused_until:
+                        wait = self._paused_until - now
+                    elif self._tokens < 1:
+                        wait = (1 - self._tokens) / self.rate
+                    else:
+                        wait = 0.1  # Yielding to an interactive caller
+
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            return False
+                        wait = min(wait, remaining)
+
+                    self._condition.wait(wait)
+            finally:
+                if interactive:
+                    self._interactive_waiting -= 1
+                    self._condition.notify_all()
+
+    def on_success(self, headers=None):
+        """Record a successful call, tuning the rate from response headers if present"""
+        with self._condition:
+            tuned = self._tune_from_headers(headers) if headers else False
+            if not tuned:
+                # Additive increase
+                self.rate = min(self.max_rate, self.rate + 0.05)
+
+    def on_rate_limited(self, retry_after=None):
+        """Record a 429 from the provider: halve the rate and pause calls"""
+        with self._condition:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0.0
+
+            pause = retry_after if retry_after is not None else 1.0 / self.rate
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+            logger.warning(f"Rate limited by provider, pausing for {pause:.1f}s at {self.rate:.2f} calls/s")
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+
+    def _tune_from_headers(self, headers):
+        remaining = headers.get('x-ratelimit-remaining-requests')
+        reset = parse_duration(headers.get('x-ratelimit-reset-requests'))
+        if remaining is None or reset is None:
+            return False
+
+        try:
+            remaining = int(remaining)
+        except ValueError:
+            return False
+
+        if remaining <= 0:
+            self._tokens = 0.0
+            self._paused_until = max(self._paused_until, time.monotonic() + reset)
+        else:
+            # Spread this process's share of the remaining quota over the time left in the window
+            self.rate = min(self.max_rate, max(self.min_rate, remaining * self.share / max(reset, 1.0)))
+        return True
+
+def parse_duration(value):
+    """
+    Parse a rate-limit duration header into seconds.
+    Accepts plain seconds ("12", "0.5") and Go-style durations ("1m30s", "250ms").
+    """
+    if value is None:
+        return None
+
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    units = {'h': 3600.0, 'm': 60.0, 's': 1.0, 'ms': 0.001}
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if not parts:
+        return None
+    return sum(float(amount) * units[unit] for amount, unit in parts)
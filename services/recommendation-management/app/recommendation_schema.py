@@ -0,0 +1,142 @@
+"""
+Schema for recommendation payloads.
+
+The same module is used by the recommendation service, which validates model
+output before publishing it, and by the services consuming the responses,
+which validate messages before storing them. Keep the copies in sync.
+"""
+import json
+import re
+
+# Upper bounds on untrusted input, checked before parsing
+MAX_PAYLOAD_BYTES = 64 * 1024
+MAX_MESSAGE_BYTES = 256 * 1024
+MAX_ITEMS = 20
+MAX_TEXT_LENGTH = 500
+
+# Format: {section: fields of each item}; every field is a string and
+# `name` is required. tips is a plain list of strings
+ITEM_FIELDS = {
+    'attractions': ('name', 'description', 'suggested_day'),
+    'restaurants': ('name', 'cuisine', 'price_range'),
+    'activities': ('name', 'description', 'suggested_day'),
+    'events': ('name', 'date', 'description'),
+}
+SECTIONS = tuple(ITEM_FIELDS) + ('tips',)
+
+_FENCED_JSON = re.compile(r'```(?:json)?\s*(.*?)```', re.DOTALL)
+
+class RecommendationValidationError(ValueError):
+    """Raised when a recommendation payload doesn't match the schema"""
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = str(value)
+    if not isinstance(value, str):
+        raise RecommendationValidationError(f"Expected a string, got {type(value).__name__}")
+    return value.strip()[:MAX_TEXT_LENGTH]
+
+def _item(section, item):
+    if not isinstance(item, dict):
+        return None
+    try:
+        cleaned = {field: _text(item.get(field)) for field in ITEM_FIELDS[section]}
+    except RecommendationValidationError:
+        return None
+    return cleaned if cleaned['name'] else None
+
+def validate_recommendations(data):
+    """
+    Check a recommendations object against the schema and return a normalised
+    copy holding exactly the schema's sections. Malformed items are dropped,
+    strings are trimmed and lists are capped.
+
+    Raises:
+        RecommendationValidationError: If the object isn't a recommendations object
+    """
+    if not isinstance(data, dict):
+        raise RecommendationValidationError("Recommendations must be a JSON object")
+    if not any(section in data for section in SECTIONS):
+        raise RecommendationValidationError("Recommendations have none of the expected sections")
+
+    validated = {}
+    for section in SECTIONS:
+        items = data.get(section) or []
+        if not isinstance(items, list):
+            raise RecommendationValidationError(f"'{section}' must be a list")
+
+        if section == 'tips':
+            cleaned = [_text(tip) for tip in items if isinstance(tip, str) and tip.strip()]
+        else:
+            cleaned = [item for item in (_item(section, item) for item in items) if item]
+        validated[section] = cleaned[:MAX_ITEMS]
+    return validated
+
+def _loads(text, max_bytes, extract=False):
+    if not isinstance(text, (str, bytes, bytearray)):
+        raise RecommendationValidationError("Expected JSON text")
+    if len(text) > max_bytes:
+        raise RecommendationValidationError(f"Payload of {len(text)} bytes exceeds the {max_bytes} byte limit")
+
+    if extract:
+        if isinstance(text, (bytes, bytearray)):
+            text = text.decode('utf-8')
+
+        # Model output may wrap the JSON in a markdown fence or add prose around it
+        match = _FENCED_JSON.search(text)
+        if match:
+            text = match.group(1)
+        else:
+            start, end = text.find('{'), text.rfind('}')
+            if start != -1 and end > start:
+                text = text[start:end + 1]
+
+    try:
+        return json.loads(text)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise RecommendationValidationError(f"Invalid JSON: {e}") from e
+
+def parse_recommendations(text):
+    """Parse and validate the recommendations for a single trip from model output"""
+    return validate_recommendations(_loads(text, MAX_PAYLOAD_BYTES, extract=True))
+
+def parse_batch_recommendations(text, request_ids):
+    """
+    Parse a batched model answer keyed by request id.
+    Returns the valid recommendations keyed by request id; invalid or missing
+    entries are left out.
+    """
+    data = _loads(text, MAX_PAYLOAD_BYTES * max(1, len(request_ids)), extract=True)
+    if not isinstance(data, dict):
+        raise RecommendationValidationError("Batched recommendations must be a JSON object")
+
+    results = {}
+    for request_id in request_ids:
+        try:
+            results[request_id] = validate_recommendations(data.get(request_id))
+        except RecommendationValidationError:
+            continue
+    return results
+
+def parse_recommendation_message(body):
+    """
+    Parse and validate a recommendation response message.
+    Returns a dict with trip_id, destination and recommendations.
+    """
+    data = _loads(body, MAX_MESSAGE_BYTES)
+    if not isinstance(data, dict):
+        raise RecommendationValidationError("Message must be a JSON object")
+    if not data.get('trip_id'):
+        raise RecommendationValidationError("Message is missing trip_id")
+
+    return {
+        'trip_id': data['trip_id'],
+        'destination': _text(data.get('destination')),
+        'recommendations': validate_recommendations(data.get('recommendations')),
+    }
+
+def dumps(data):
+    """Serialise a payload as compact JSON"""
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
@@ -57,7 +57,7 @@ def publish_recommendation_request(trip_id, destination, start_date=None, end_da
         
         # Declare the queue
         queue_name = 'recommendation_requests'
-        channel.queue_declare(queue=queue_name, durable=True)
+        channel.queue_declare(queue=queue_name, durable=True, arguments={'x-max-priority': 10})
         
         # Create the request message
         message = {
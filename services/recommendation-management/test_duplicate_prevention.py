@@ -47,10 +47,13 @@ def send_duplicate_recommendation_requests(trip_id=None, destination="Paris", nu
         
         # Declare queues
         recommendation_requests_queue = 'recommendation_requests'
-        recommendation_responses_queue = 'recommendation_responses'
+        channel.queue_declare(queue=recommendation_requests_queue, durable=True, arguments={'x-max-priority': 10})
         
-        channel.queue_declare(queue=recommendation_requests_queue, durable=True)
-        channel.queue_declare(queue=recommendation_responses_queue, durable=True)
+        # Bind a private queue to the response fanout exchange
+        channel.exchange_declare(exchange='recommendation_responses', exchange_type='fanout', durable=True)
+        result = channel.queue_declare(queue='', exclusive=True)
+        recommendation_responses_queue = result.method.queue
+        channel.queue_bind(exchange='recommendation_responses', queue=recommendation_responses_queue)
         
         # Create unique trip ID for the test if not provided
         if not trip_id:
@@ -39,11 +39,13 @@ def send_test_recommendation_request():
         
         # Declare the request queue
         request_queue = 'recommendation_requests'
-        channel.queue_declare(queue=request_queue, durable=True)
+        channel.queue_declare(queue=request_queue, durable=True, arguments={'x-max-priority': 10})
         
-        # Declare the response queue
-        response_queue = 'recommendation_responses'
-        channel.queue_declare(queue=response_queue, durable=True)
+        # Bind a private queue to the response fanout exchange before publishing
+        channel.exchange_declare(exchange='recommendation_responses', exchange_type='fanout', durable=True)
+        result = channel.queue_declare(queue='', exclusive=True)
+        response_queue = result.method.queue
+        channel.queue_bind(exchange='recommendation_responses', queue=response_queue)
         
         # Create a test message
         test_message = {
@@ -0,0 +1,201 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json
+import time
+import unittest
+from datetime import date
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from app import message_broker, openai_service
+from app.batching import RecommendationBatcher
+from app.rate_limiter import AdaptiveTokenBucket
+
+RECOMMENDATIONS = {'attractions': [{'name': 'Senso-ji'}], 'tips': ['Carry cash']}
+FALLBACK = {'attractions': [], 'tips': ['Fallback']}
+
+class FakeConnection:
+    """The timer API of a pika BlockingConnection, fired by hand"""
+
+    def __init__(self):
+        self.timers = {}
+
+    def call_later(self, delay, callback):
+        handle = object()
+        self.timers[handle] = (delay, callback)
+        return handle
+
+    def remove_timeout(self, handle):
+        self.timers.pop(handle, None)
+
+    def fire(self):
+        for handle in list(self.timers):
+            _, callback = self.timers.pop(handle)
+            callback()
+
+class FakeDelivery:
+    def __init__(self, final_attempt=False):
+        self.final_attempt = final_attempt
+        self.channel = None
+        self.outcome = None
+
+    def ack(self):
+        self.outcome = 'acked'
+
+    def retry(self, error):
+        self.outcome = 'retried'
+
+def trip(trip_id, destination='Tokyo'):
+    return {
+        'trip_id': trip_id,
+        'destination': destination,
+        'start_date': date(2025, 4, 1),
+        'end_date': date(2025, 4, 3),
+        'start_date_str': '2025-04-01',
+        'end_date_str': '2025-04-03',
+        'interactive': False,
+    }
+
+def fake_client(answers, calls):
+    """An OpenAI client answering each call with the next of answers"""
+    def create(**kwargs):
+        calls.append(kwargs)
+        content = answers.pop(0)
+        return SimpleNamespace(
+            headers={},
+            parse=lambda: SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+        )
+    completions = SimpleNamespace(with_raw_response=SimpleNamespace(create=create))
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+class BatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = FakeConnection()
+        self.batches = []
+        self.batcher = RecommendationBatcher(self.connection, self.batches.append, max_batch_size=3, max_wait_ms=500)
+
+    def test_full_batch_is_flushed_at_once(self):
+        for number in range(4):
+            self.batcher.add(f"d{number}", trip(number))
+        self.assertEqual([[delivery for delivery, _ in batch] for batch in self.batches], [['d0', 'd1', 'd2']])
+        # The rest waits for the timer
+        self.connection.fire()
+        self.assertEqual([delivery for delivery, _ in self.batches[1]], ['d3'])
+
+    def test_interactive_request_shortens_the_wait(self):
+        self.batcher.add('d0', trip(0))
+        self.batcher.add('d1', trip(1), max_wait_ms=50)
+        self.assertEqual([delay for delay, _ in self.connection.timers.values()], [0.05])
+        self.connection.fire()
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(len(self.batches[0]), 2)
+
+class BatchRecommendationsTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        patchers = [
+            patch.object(openai_service, 'rate_limiter', AdaptiveTokenBucket(rate=100, capacity=100)),
+            patch.object(openai_service, 'get_fallback_recommendations', lambda destination, month=None: FALLBACK),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.requests = [{**trip(number), 'request_id': f"r{number}"} for number in range(2)]
+
+    def answer(self, *answers):
+        client = fake_client(list(answers), self.calls)
+        patcher = patch.object(openai_service, 'get_openai_client', lambda: client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_one_call_for_the_batch(self):
+        self.answer(json.dumps({'r0': RECOMMENDATIONS, 'r1': RECOMMENDATIONS}))
+        results = openai_service.get_batch_recommendations(self.requests, fallback=False)
+        self.assertEqual(sorted(results), ['r0', 'r1'])
+        self.assertEqual(len(self.calls), 1)
+        self.assertIn('r1: a trip to Tokyo', self.calls[0]['messages'][1]['content'])
+
+    def test_missing_request_retried_individually(self):
+        self.answer(json.dumps({'r0': RECOMMENDATIONS}), json.dumps(RECOMMENDATIONS))
+        results = openai_service.get_batch_recommendations(self.requests, fallback=False)
+        self.assertEqual(sorted(results), ['r0', 'r1'])
+        self.assertEqual(len(self.calls), 2)
+
+    def test_missing_request_left_out_or_falls_back(self):
+        self.answer(json.dumps({'r0': RECOMMENDATIONS}), json.dumps({'r0': RECOMMENDATIONS}))
+        results = openai_service.get_batch_recommendations(self.requests, fallback=False, retry_missing=False)
+        self.assertEqual(sorted(results), ['r0'])
+        results = openai_service.get_batch_recommendations(self.requests, fallback=True, retry_missing=False)
+        self.assertEqual(results['r1'], FALLBACK)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_deadline_bounds_the_rate_limiter_wait(self):
+        self.answer(json.dumps(RECOMMENDATIONS))
+        empty = AdaptiveTokenBucket(rate=0.01, capacity=1)
+        empty.acquire()
+        with patch.object(openai_service, 'rate_limiter', empty):
+            started = time.monotonic()
+            with self.assertRaises(TimeoutError):
+                openai_service.create_completion(object(), 'prompt', deadline=time.monotonic() + 0.2)
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_deadline_is_the_request_timeout(self):
+        self.answer(json.dumps(RECOMMENDATIONS))
+        openai_service.create_completion(openai_service.get_openai_client(), 'prompt', deadline=time.monotonic() + 30)
+        self.assertTrue(0 < self.calls[0]['timeout'] <= 30)
+
+class ProcessBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.published = []
+        self.stored = []
+        self.model_calls = []
+        catalogue = SimpleNamespace(
+            lookup=lambda destination, start_date, end_date: RECOMMENDATIONS if destination == 'Paris' else None,
+            store_for_trip=lambda *args: self.stored.append(args),
+        )
+        patchers = [
+            patch.object(message_broker, 'catalogue', catalogue),
+            patch.object(message_broker, 'get_batch_recommendations', self.generate),
+            patch.object(message_broker, 'get_fallback_recommendations', lambda destination, month=None: FALLBACK),
+            patch.object(message_broker, 'publish_recommendation_response',
+                         lambda channel, request, recommendations: self.published.append((request['trip_id'], recommendations))),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def generate(self, requests, fallback, retry_missing, deadline):
+        self.model_calls.append(([request['trip_id'] for request in requests], retry_missing, deadline))
+        # The model only answers the first request
+        return {requests[0]['request_id']: RECOMMENDATIONS}
+
+    def test_catalogue_hits_skip_the_model(self):
+        batch = [(FakeDelivery(), trip(1, 'Paris')), (FakeDelivery(), trip(2)), (FakeDelivery(), trip(3))]
+        message_broker.process_recommendation_batch(batch)
+
+        # One bounded call for the misses, without per-request retries
+        [(trip_ids, retry_missing, deadline)] = self.model_calls
+        self.assertEqual(trip_ids, [2, 3])
+        self.assertFalse(retry_missing)
+        self.assertLessEqual(deadline - time.monotonic(), message_broker.RECOMMENDATION_BATCH_TIMEOUT)
+
+        self.assertEqual(self.published, [(1, RECOMMENDATIONS), (2, RECOMMENDATIONS)])
+        self.assertEqual([args[0] for args in self.stored], ['Tokyo'])
+        self.assertEqual([delivery.outcome for delivery, _ in batch], ['acked', 'acked', 'retried'])
+
+    def test_final_attempt_falls_back(self):
+        batch = [(FakeDelivery(), trip(1)), (FakeDelivery(final_attempt=True), trip(2))]
+        message_broker.process_recommendation_batch(batch)
+        self.assertEqual(self.published, [(1, RECOMMENDATIONS), (2, FALLBACK)])
+        self.assertEqual([delivery.outcome for delivery, _ in batch], ['acked', 'acked'])
+
+    def test_retries_pass_the_duplicate_check(self):
+        body = json.dumps({'trip_id': 'dup', 'destination': 'Tokyo', 'start_date': '2025-04-01', 'end_date': '2025-04-03'})
+        self.assertIsNotNone(message_broker.parse_recommendation_request(body))
+        self.assertIsNone(message_broker.parse_recommendation_request(body))
+        self.assertIsNotNone(message_broker.parse_recommendation_request(body, retried=True))
+
+if __name__ == '__main__':
+    unittest.main()
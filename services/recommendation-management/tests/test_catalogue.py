@@ -0,0 +1,119 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+from datetime import date, datetime, timedelta
+
+from app.catalogue import DestinationCatalogue, destination_key, length_bucket, representative_length
+from app.catalogue_warmer import upcoming_months, representative_dates
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        if self.connection.error:
+            raise self.connection.error
+        self.connection.executed.append((' '.join(sql.split()), params))
+
+    def fetchone(self):
+        return self.connection.rows[0] if self.connection.rows else None
+
+    def fetchall(self):
+        return self.connection.rows
+
+class FakeConnection:
+    """A psycopg2 connection and pool in one, answering every query with rows"""
+
+    def __init__(self, rows=None, error=None):
+        self.rows = rows or []
+        self.error = error
+        self.executed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def getconn(self):
+        return self
+
+    def putconn(self, connection):
+        pass
+
+def catalogue_with(connection):
+    catalogue = DestinationCatalogue()
+    catalogue._pool = connection
+    return catalogue
+
+class BucketTest(unittest.TestCase):
+    def test_destination_key(self):
+        self.assertEqual(destination_key('  New   York '), 'new york')
+        self.assertEqual(destination_key('TOKYO'), destination_key('tokyo'))
+
+    def test_length_bucket(self):
+        start = date(2025, 4, 1)
+        self.assertEqual(length_bucket(start, start), 'short')
+        self.assertEqual(length_bucket(start, start + timedelta(days=2)), 'short')
+        self.assertEqual(length_bucket(start, start + timedelta(days=3)), 'medium')
+        self.assertEqual(length_bucket(start, start + timedelta(days=6)), 'medium')
+        self.assertEqual(length_bucket(start, start + timedelta(days=7)), 'long')
+        self.assertEqual(length_bucket(start, start + timedelta(days=60)), 'long')
+
+    def test_representative_dates_fall_in_their_bucket(self):
+        today = date(2025, 11, 20)
+        self.assertEqual(upcoming_months(today, 3), [11, 12, 1])
+        for bucket in ('short', 'medium', 'long'):
+            start_date, end_date = representative_dates(1, bucket, today)
+            self.assertEqual((start_date.year, start_date.month), (2026, 1))
+            self.assertEqual(length_bucket(start_date, end_date), bucket)
+            self.assertEqual((end_date - start_date).days + 1, representative_length(bucket))
+        # Never in the past
+        self.assertEqual(representative_dates(11, 'short', today)[0], today)
+
+class LookupTest(unittest.TestCase):
+    def test_lookup_hit_by_key_month_and_bucket(self):
+        connection = FakeConnection(rows=[({'tips': ['Carry cash']},)])
+        result = catalogue_with(connection).lookup(' Tokyo', date(2025, 4, 1), date(2025, 4, 5))
+        self.assertEqual(result, {'tips': ['Carry cash']})
+
+        [(sql, params)] = connection.executed
+        self.assertTrue(sql.startswith('UPDATE destination_catalogue SET request_count = request_count + 1'))
+        self.assertEqual(params[:3], ('tokyo', 4, 'medium'))
+        # Only unexpired entries are served
+        self.assertIn('expires_at > %s', sql)
+
+    def test_lookup_miss(self):
+        self.assertIsNone(catalogue_with(FakeConnection()).lookup('Tokyo', date(2025, 4, 1), date(2025, 4, 1)))
+
+    def test_database_errors_are_misses(self):
+        catalogue = catalogue_with(FakeConnection(error=RuntimeError('database is down')))
+        self.assertIsNone(catalogue.lookup('Tokyo', date(2025, 4, 1), date(2025, 4, 1)))
+        self.assertIsNone(catalogue.lookup_any('Tokyo', 4))
+        self.assertFalse(catalogue.store('Tokyo', 4, 'short', {}))
+        self.assertEqual(catalogue.entries_due(['Tokyo'], [4], datetime.utcnow()), [])
+
+    def test_entries_due_missing_first_then_soonest_to_expire(self):
+        now = datetime.utcnow()
+        connection = FakeConnection(rows=[
+            ('tokyo', 4, 'short', now + timedelta(days=30)),
+            ('tokyo', 4, 'medium', now + timedelta(days=2)),
+            ('tokyo', 4, 'long', now + timedelta(days=1)),
+        ])
+        due = catalogue_with(connection).entries_due(['Tokyo', 'Paris'], [4], now + timedelta(days=3))
+        self.assertEqual(due[:3], [('Paris', 4, 'short'), ('Paris', 4, 'medium'), ('Paris', 4, 'long')])
+        self.assertEqual(due[3:], [('Tokyo', 4, 'long'), ('Tokyo', 4, 'medium')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json
+import unittest
+from types import SimpleNamespace
+
+from app.consumer_runtime import ConsumerRuntime, RejectMessage, RETRY_COUNT_HEADER, LAST_ERROR_HEADER
+
+class FakeChannel:
+    """Records what a consumer publishes and acks"""
+
+    def __init__(self):
+        self.published = []
+        self.acked = []
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.published.append((routing_key, body, properties))
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+
+class QueueConsumerTest(unittest.TestCase):
+    def setUp(self):
+        self.runtime = ConsumerRuntime('test')
+        self.handled = []
+        self.outcome = None
+        self.consumer = self.runtime.register('requests', self.handle, max_retries=2, retry_delays=[1, 5])
+        self.channel = FakeChannel()
+        self.tag = 0
+
+    def handle(self, delivery):
+        self.handled.append(delivery)
+        if self.outcome is not None:
+            raise self.outcome
+
+    def deliver(self, body=b'{"trip_id": 1}', retries=None):
+        self.tag += 1
+        headers = {RETRY_COUNT_HEADER: retries} if retries is not None else None
+        properties = SimpleNamespace(headers=headers, content_type='application/json', priority=5, timestamp=1700000000)
+        self.consumer._on_message(self.channel, SimpleNamespace(delivery_tag=self.tag), properties, body)
+        return self.handled[-1] if self.handled else None
+
+    def counters(self):
+        metrics = self.runtime.metrics()['requests']
+        return {name: metrics[name] for name in ('received', 'acked', 'retried', 'dead_lettered')}
+
+    def test_handled_message_is_acked(self):
+        self.deliver()
+        self.assertEqual((self.channel.acked, self.channel.published), ([1], []))
+        self.assertEqual(self.counters(), {'received': 1, 'acked': 1, 'retried': 0, 'dead_lettered': 0})
+
+    def test_failed_message_is_retried_through_a_delay_queue(self):
+        self.outcome = ValueError('model is down')
+        self.deliver()
+        self.deliver(retries=1)
+
+        [(first_queue, body, first), (second_queue, _, second)] = self.channel.published
+        self.assertEqual((first_queue, second_queue), ('requests.retry.1000', 'requests.retry.5000'))
+        self.assertEqual(body, b'{"trip_id": 1}')
+        self.assertEqual((first.headers[RETRY_COUNT_HEADER], second.headers[RETRY_COUNT_HEADER]), (1, 2))
+        self.assertEqual(first.headers[LAST_ERROR_HEADER], 'model is down')
+        # The original message's properties are kept, and it stays persistent
+        self.assertEqual((first.priority, first.content_type, first.delivery_mode), (5, 'application/json', 2))
+        self.assertEqual(self.channel.acked, [1, 2])
+        self.assertEqual(self.counters()['retried'], 2)
+
+    def test_last_retry_is_dead_lettered(self):
+        self.outcome = ValueError('model is down')
+        self.deliver(retries=2)
+        [(queue, _, properties)] = self.channel.published
+        self.assertEqual(queue, 'requests.dead_letter')
+        self.assertEqual(properties.headers[RETRY_COUNT_HEADER], 2)
+        self.assertEqual(self.channel.acked, [1])
+        self.assertEqual(self.counters()['dead_lettered'], 1)
+
+    def test_rejected_message_is_dead_lettered_at_once(self):
+        self.outcome = RejectMessage('no destination')
+        self.deliver()
+        self.assertEqual(self.channel.published[0][0], 'requests.dead_letter')
+        self.assertEqual(self.channel.published[0][2].headers[LAST_ERROR_HEADER], 'no destination')
+
+        # As is invalid JSON
+        self.outcome = None
+        self.consumer.handler = lambda delivery: delivery.json()
+        self.deliver(body=b'not json')
+        self.assertEqual(self.channel.published[1][0], 'requests.dead_letter')
+        self.assertIn('Invalid JSON', self.channel.published[1][2].headers[LAST_ERROR_HEADER])
+        self.assertEqual(self.counters()['dead_lettered'], 2)
+
+    def test_deferred_message_is_settled_later(self):
+        self.consumer.handler = lambda delivery: (self.handled.append(delivery), delivery.defer())
+        delivery = self.deliver()
+        self.assertEqual((self.channel.acked, self.consumer.unsettled), ([], 1))
+
+        delivery.ack()
+        # Settling twice is a no-op
+        delivery.retry(ValueError('too late'))
+        self.assertEqual((self.channel.acked, self.channel.published, self.consumer.unsettled), ([1], [], 0))
+        self.assertEqual(json.loads(delivery.body), {'trip_id': 1})
+
+if __name__ == '__main__':
+    unittest.main()
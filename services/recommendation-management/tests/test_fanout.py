@@ -0,0 +1,88 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json
+import unittest
+from datetime import date
+from types import SimpleNamespace
+
+from app.consumer_runtime import ConsumerRuntime
+from app.message_broker import (
+    declare_response_exchange, publish_recommendation_response, RECOMMENDATION_RESPONSES_EXCHANGE
+)
+
+# Queues the trip-management and itinerary services bind to the exchange
+CONSUMER_QUEUES = ['trip-management.recommendation_responses', 'itinerary.recommendation_responses']
+
+class FakeBroker:
+    """The parts of RabbitMQ routing used here: the default exchange and fanout exchanges"""
+
+    def __init__(self):
+        self.exchanges = {}
+        # Format: {exchange: [bound queues]}
+        self.bindings = {}
+        # Format: {queue: [message bodies]}
+        self.queues = {}
+
+    def channel(self):
+        return FakeChannel(self)
+
+class FakeChannel:
+    def __init__(self, broker):
+        self.broker = broker
+
+    def exchange_declare(self, exchange, exchange_type, durable=True):
+        declared = self.broker.exchanges.setdefault(exchange, exchange_type)
+        assert declared == exchange_type, f"{exchange} redeclared as {exchange_type}"
+
+    def queue_declare(self, queue, durable=True, arguments=None, passive=False):
+        messages = self.broker.queues.setdefault(queue, [])
+        return SimpleNamespace(method=SimpleNamespace(message_count=len(messages), consumer_count=0))
+
+    def queue_bind(self, exchange, queue, routing_key=''):
+        self.broker.bindings.setdefault(exchange, []).append(queue)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        if exchange == '':
+            queues = [routing_key]
+        else:
+            assert self.broker.exchanges[exchange] == 'fanout'
+            queues = self.broker.bindings.get(exchange, [])
+        for queue in queues:
+            self.broker.queues[queue].append(body)
+
+class FanoutTest(unittest.TestCase):
+    def setUp(self):
+        self.broker = FakeBroker()
+        channel = self.broker.channel()
+        # Either side may declare the exchange first
+        runtime = ConsumerRuntime('test')
+        for queue in CONSUMER_QUEUES:
+            runtime.register(queue, lambda delivery: None, exchange=RECOMMENDATION_RESPONSES_EXCHANGE).declare(channel)
+        declare_response_exchange(channel)
+        self.channel = channel
+
+    def publish(self, trip_id):
+        request = {
+            'trip_id': trip_id,
+            'destination': 'Tokyo',
+            'start_date_str': date(2025, 4, 1).isoformat(),
+            'end_date_str': date(2025, 4, 3).isoformat(),
+        }
+        publish_recommendation_response(self.channel, request, {'attractions': [], 'tips': []})
+
+    def test_every_consumer_gets_every_response(self):
+        self.publish(1)
+        self.publish(2)
+        for queue in CONSUMER_QUEUES:
+            self.assertEqual([json.loads(body)['trip_id'] for body in self.broker.queues[queue]], [1, 2])
+
+    def test_consumers_share_nothing(self):
+        # A consumer taking its copy leaves the other's in place
+        self.publish(1)
+        self.broker.queues[CONSUMER_QUEUES[0]].clear()
+        self.assertEqual(len(self.broker.queues[CONSUMER_QUEUES[1]]), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import threading
+import time
+import unittest
+
+from app.rate_limiter import AdaptiveTokenBucket, parse_duration
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_refill(self):
+        bucket = AdaptiveTokenBucket(rate=20, capacity=2)
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.assertFalse(bucket.acquire(timeout=0))
+        # A token comes back every 50ms
+        self.assertTrue(bucket.acquire(timeout=1))
+
+    def test_rate_limited_halves_the_rate_and_pauses(self):
+        bucket = AdaptiveTokenBucket(rate=4, capacity=5)
+        bucket.on_rate_limited(retry_after=0.3)
+        self.assertEqual(bucket.rate, 2)
+        # The bucket is drained and paused for the provider's retry-after
+        started = time.monotonic()
+        self.assertFalse(bucket.acquire(timeout=0.1))
+        self.assertTrue(bucket.acquire(timeout=2))
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+
+        bucket.on_rate_limited()
+        bucket.on_rate_limited()
+        self.assertEqual(bucket.rate, 0.5)
+        # Never below the floor
+        for _ in range(10):
+            bucket.on_rate_limited(retry_after=0)
+        self.assertEqual(bucket.rate, bucket.min_rate)
+
+    def test_success_creeps_back_up(self):
+        bucket = AdaptiveTokenBucket(rate=1, max_rate=1.1)
+        bucket.on_success()
+        self.assertAlmostEqual(bucket.rate, 1.05)
+        bucket.on_success({})
+        bucket.on_success()
+        self.assertAlmostEqual(bucket.rate, 1.1)
+
+    def test_tuned_from_headers(self):
+        bucket = AdaptiveTokenBucket(rate=1)
+        # 30 calls left in the next minute
+        bucket.on_success({'x-ratelimit-remaining-requests': '30', 'x-ratelimit-reset-requests': '1m'})
+        self.assertAlmostEqual(bucket.rate, 0.5)
+
+        # No calls left: wait for the window to reset
+        bucket.on_success({'x-ratelimit-remaining-requests': '0', 'x-ratelimit-reset-requests': '300ms'})
+        self.assertFalse(bucket.acquire(timeout=0.1))
+        self.assertTrue(bucket.acquire(timeout=3))
+
+        # Unusable headers fall back to the additive increase
+        bucket.on_success({'x-ratelimit-remaining-requests': 'many', 'x-ratelimit-reset-requests': '1s'})
+        self.assertAlmostEqual(bucket.rate, 0.55)
+
+    def test_share_of_the_quota(self):
+        # One of three processes calling the model
+        bucket = AdaptiveTokenBucket(rate=1, share=1 / 3)
+        bucket.on_success({'x-ratelimit-remaining-requests': '30', 'x-ratelimit-reset-requests': '1m'})
+        self.assertAlmostEqual(bucket.rate, 0.5 / 3)
+
+    def test_interactive_callers_go_first(self):
+        bucket = AdaptiveTokenBucket(rate=2, capacity=1)
+        bucket.acquire()
+        order = []
+
+        def take(interactive):
+            bucket.acquire(interactive=interactive, timeout=5)
+            order.append('interactive' if interactive else 'background')
+
+        background = threading.Thread(target=take, args=(False,))
+        background.start()
+        time.sleep(0.05)
+        interactive = threading.Thread(target=take, args=(True,))
+        interactive.start()
+        background.join(5)
+        interactive.join(5)
+        self.assertEqual(order, ['interactive', 'background'])
+
+    def test_parse_duration(self):
+        self.assertEqual(parse_duration('12'), 12)
+        self.assertEqual(parse_duration('0.5'), 0.5)
+        self.assertEqual(parse_duration('1m30s'), 90)
+        self.assertEqual(parse_duration('250ms'), 0.25)
+        self.assertEqual(parse_duration('1h'), 3600)
+        self.assertIsNone(parse_duration(None))
+        self.assertIsNone(parse_duration('soon'))
+
+if __name__ == '__main__':
+    unittest.main()
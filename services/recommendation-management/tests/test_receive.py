@@ -110,8 +110,13 @@ def connect_to_rabbitmq():
             connection = pika.BlockingConnection(parameters)
             channel = connection.channel()
             
-            # Ensure the queue exists
-            channel.queue_declare(queue='recommendation_responses', durable=True)
+            # Responses are broadcast on a fanout exchange, so bind a private
+            # queue to it instead of stealing messages from the services' queues
+            global response_queue
+            channel.exchange_declare(exchange='recommendation_responses', exchange_type='fanout', durable=True)
+            result = channel.queue_declare(queue='', exclusive=True)
+            response_queue = result.method.queue
+            channel.queue_bind(exchange='recommendation_responses', queue=response_queue)
             
             print('🔍 Waiting for recommendation responses. Press CTRL+C to exit')
             return connection, channel
@@ -136,7 +141,7 @@ def start_consuming():
     # Set up consumer with prefetch count to avoid overwhelming the consumer
     channel.basic_qos(prefetch_count=1)
     channel.basic_consume(
-        queue='recommendation_responses',
+        queue=response_queue,
         on_message_callback=callback,
         auto_ack=False
     )
@@ -162,7 +167,7 @@ def start_consuming():
                 # Re-establish consumer
                 channel.basic_qos(prefetch_count=1)
                 channel.basic_consume(
-                    queue='recommendation_responses',
+                    queue=response_queue,
                     on_message_callback=callback,
                     auto_ack=False
                 )
@@ -178,6 +183,7 @@ def start_consuming():
 # Initialize global variables
 connection = None
 channel = None
+response_queue = None
 
 # Start the consumer
 if __name__ == "__main__":
@@ -0,0 +1,82 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json
+import unittest
+
+from app.recommendation_schema import (
+    validate_recommendations, parse_recommendations, parse_batch_recommendations,
+    parse_recommendation_message, RecommendationValidationError,
+    MAX_PAYLOAD_BYTES, MAX_MESSAGE_BYTES, MAX_ITEMS, MAX_TEXT_LENGTH, SECTIONS
+)
+
+class RecommendationSchemaTest(unittest.TestCase):
+    def test_normalises_to_the_schema(self):
+        validated = validate_recommendations({
+            'attractions': [
+                {'name': ' Senso-ji ', 'description': 'Temple', 'suggested_day': 1, 'rating': 5},
+                {'description': 'no name'},
+                'not an object',
+            ],
+            'tips': ['Carry cash', '', 42],
+            'unexpected': ['dropped'],
+        })
+        self.assertEqual(list(validated), list(SECTIONS))
+        self.assertEqual(validated['attractions'], [{'name': 'Senso-ji', 'description': 'Temple', 'suggested_day': '1'}])
+        self.assertEqual(validated['tips'], ['Carry cash'])
+        self.assertEqual(validated['restaurants'], [])
+
+    def test_rejects_what_isnt_recommendations(self):
+        for data in (None, [], 'text', {}, {'other': []}, {'attractions': 'Senso-ji'}):
+            with self.assertRaises(RecommendationValidationError):
+                validate_recommendations(data)
+
+    def test_caps_lists_and_strings(self):
+        validated = validate_recommendations({
+            'attractions': [{'name': f"a{number}"} for number in range(MAX_ITEMS + 5)],
+            'tips': ['x' * (MAX_TEXT_LENGTH + 100)],
+        })
+        self.assertEqual(len(validated['attractions']), MAX_ITEMS)
+        self.assertEqual(len(validated['tips'][0]), MAX_TEXT_LENGTH)
+
+    def test_model_output_around_the_json(self):
+        text = 'Here you go:\n```json\n{"tips": ["Carry cash"]}\n```\nEnjoy!'
+        self.assertEqual(parse_recommendations(text)['tips'], ['Carry cash'])
+        self.assertEqual(parse_recommendations('Sure! {"tips": ["a"]} Bye')['tips'], ['a'])
+        with self.assertRaises(RecommendationValidationError):
+            parse_recommendations('No JSON here')
+
+    def test_size_limits_are_checked_before_parsing(self):
+        oversized = json.dumps({'tips': ['x' * MAX_PAYLOAD_BYTES]})
+        with self.assertRaisesRegex(RecommendationValidationError, 'exceeds'):
+            parse_recommendations(oversized)
+
+        # A batch may be as large as its requests' payloads together
+        batch = json.dumps({'r0': {'tips': ['x' * (MAX_PAYLOAD_BYTES * 3 // 2)]}, 'r1': {'tips': ['y']}})
+        self.assertEqual(sorted(parse_batch_recommendations(batch, ['r0', 'r1'])), ['r0', 'r1'])
+        with self.assertRaisesRegex(RecommendationValidationError, 'exceeds'):
+            parse_batch_recommendations(batch, ['r0'])
+
+        message = json.dumps({'trip_id': 1, 'recommendations': {'tips': ['x' * MAX_MESSAGE_BYTES]}})
+        with self.assertRaisesRegex(RecommendationValidationError, 'exceeds'):
+            parse_recommendation_message(message)
+
+    def test_batch_drops_invalid_entries(self):
+        text = json.dumps({'r0': {'tips': ['a']}, 'r1': 'nothing', 'r3': {'tips': ['unrequested']}})
+        self.assertEqual(parse_batch_recommendations(text, ['r0', 'r1', 'r2']), {'r0': validate_recommendations({'tips': ['a']})})
+        with self.assertRaises(RecommendationValidationError):
+            parse_batch_recommendations('[1, 2]', ['r0'])
+
+    def test_response_messages(self):
+        message = parse_recommendation_message(json.dumps({
+            'trip_id': 7, 'destination': 'Tokyo', 'recommendations': {'tips': ['a']}, 'timestamp': 'now'
+        }))
+        self.assertEqual(message['trip_id'], 7)
+        self.assertEqual(message['recommendations']['tips'], ['a'])
+        for body in ('{"destination": "Tokyo", "recommendations": {"tips": []}}', '{"trip_id": 7}', '[]', b'\xff'):
+            with self.assertRaises(RecommendationValidationError):
+                parse_recommendation_message(body)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -48,7 +48,7 @@ except Exception as e:
     sys.exit(1)
 
 # Ensure the queue exists
-channel.queue_declare(queue='recommendation_requests', durable=True)
+channel.queue_declare(queue='recommendation_requests', durable=True, arguments={'x-max-priority': 10})
 
 # Create a test message
 today = datetime.now().date()
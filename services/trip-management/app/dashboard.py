@@ -0,0 +1,151 @@
+import os
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+
+import requests
+
+from app.models import Trip, Recommendation
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ITINERARY_SERVICE_URL = os.getenv('ITINERARY_SERVICE_URL', 'http://itinerary:5004')
+GROUP_SERVICE_URL = os.getenv('GROUP_MANAGEMENT_URL', 'http://group-management:5003')
+FINANCE_SERVICE_URL = os.getenv('FINANCE_SERVICE_URL', 'http://finance:5008')
+
+# Seconds each remote section may take before the dashboard is returned without it
+DASHBOARD_SECTION_TIMEOUT = float(os.getenv('DASHBOARD_SECTION_TIMEOUT', 2))
+
+# Complete dashboards are cached for DASHBOARD_CACHE_TTL seconds, for up to
+# DASHBOARD_CACHE_SIZE trips
+DASHBOARD_CACHE_TTL = float(os.getenv('DASHBOARD_CACHE_TTL', 10))
+DASHBOARD_CACHE_SIZE = int(os.getenv('DASHBOARD_CACHE_SIZE', 256))
+
+# Remote sections of all dashboards are fetched on this pool
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('DASHBOARD_MAX_WORKERS', 16)),
+    thread_name_prefix='dashboard'
+)
+
+# requests.Session isn't thread-safe, so each pool thread keeps its own
+# to reuse connections to the other services
+_local = threading.local()
+
+# Format: {(trip_id, base currency): (expires_at, dashboard)}
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _session():
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+def _get_json(url, params=None):
+    response = _session().get(url, params=params, timeout=DASHBOARD_SECTION_TIMEOUT)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+def _fetch_itinerary(trip, base_currency):
+    return _get_json(f"{ITINERARY_SERVICE_URL}/api/itinerary/{trip.id}")
+
+def _fetch_availability(trip, base_currency):
+    if not trip.group_id:
+        return None
+    return _get_json(f"{GROUP_SERVICE_URL}/api/groups/{trip.group_id}/availability")
+
+def _fetch_readiness(trip, base_currency):
+    return _get_json(f"{FINANCE_SERVICE_URL}/api/finance/readiness/{trip.id}")
+
+def _fetch_settlement(trip, base_currency):
+    return _get_json(f"{FINANCE_SERVICE_URL}/api/finance/calculate/{trip.id}", params={'base': base_currency})
+
+REMOTE_SECTIONS = {
+    'itinerary': _fetch_itinerary,
+    'availability': _fetch_availability,
+    'readiness': _fetch_readiness,
+    'settlement': _fetch_settlement,
+}
+
+def invalidate_dashboard(trip_id):
+    """Drop the cached dashboards of a trip"""
+    with _cache_lock:
+        for key in [key for key in _cache if key[0] == trip_id]:
+            del _cache[key]
+
+def get_dashboard(trip_id, base_currency='SGD'):
+    """
+    Compose everything the trip page needs in one payload.
+
+    The trip and its recommendations are read locally. Itinerary, group
+    availability, readiness and settlement are fetched concurrently from
+    their services. A section that fails or takes longer than
+    DASHBOARD_SECTION_TIMEOUT is reported with status "error" or "timeout"
+    and the rest of the dashboard is still returned.
+
+    Returns:
+        Tuple: (dashboard dict or None if the trip doesn't exist, whether it came from the cache)
+    """
+    key = (trip_id, base_currency)
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry and entry[0] > now:
+            _cache.move_to_end(key)
+            return entry[1], True
+
+    trip = Trip.query.get(trip_id)
+    if not trip:
+        return None, False
+
+    # Start the remote sections first so they run while the local ones are read
+    futures = {
+        _executor.submit(fetch, trip, base_currency): name
+        for name, fetch in REMOTE_SECTIONS.items()
+    }
+
+    sections = {'trip': {'status': 'ok', 'data': trip.to_dict()}}
+    recommendation = Recommendation.query.filter_by(trip_id=trip.id).first()
+    sections['recommendations'] = (
+        {'status': 'ok', 'data': recommendation.to_dict()} if recommendation
+        else {'status': 'pending', 'data': None}
+    )
+
+    # Sections share one deadline rather than adding up
+    done, not_done = wait(futures, timeout=DASHBOARD_SECTION_TIMEOUT)
+    for future in done:
+        name = futures[future]
+        try:
+            sections[name] = {'status': 'ok', 'data': future.result()}
+        except Exception as e:
+            logger.warning(f"Dashboard section {name} failed for trip {trip_id}: {e}")
+            sections[name] = {'status': 'error', 'error': str(e)}
+    for future in not_done:
+        name = futures[future]
+        future.cancel()
+        logger.warning(f"Dashboard section {name} timed out for trip {trip_id}")
+        sections[name] = {'status': 'timeout'}
+
+    complete = all(section['status'] in ('ok', 'pending') for section in sections.values())
+    dashboard = {
+        'trip_id': trip.id,
+        'generated_at': datetime.utcnow().isoformat(),
+        'complete': complete,
+        'sections': sections
+    }
+
+    # Partial dashboards aren't cached, so a recovered service shows up at once
+    if complete:
+        with _cache_lock:
+            _cache[key] = (time.monotonic() + DASHBOARD_CACHE_TTL, dashboard)
+            _cache.move_to_end(key)
+            while len(_cache) > DASHBOARD_CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    return dashboard, False
@@ -0,0 +1,134 @@
+import os
+import logging
+import uuid
+from datetime import datetime, timedelta
+
+from app.models import db, Trip, Recommendation, DeletionJob, DeletionTask
+from app.dashboard import invalidate_dashboard
+from app.outbox import enqueue_event, EVENT_DELETION_REQUEST
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Largest number of trips a single job may delete
+MAX_DELETION_BATCH = int(os.getenv('MAX_DELETION_BATCH', 500))
+
+# Tasks a service hasn't answered after this many seconds are reported as failed
+DELETION_TASK_TIMEOUT = int(os.getenv('DELETION_TASK_TIMEOUT', 600))
+
+# Services deleting the data of every job; groups also have a calendar
+TRIP_DELETION_SERVICES = ('itinerary', 'finance')
+GROUP_DELETION_SERVICES = TRIP_DELETION_SERVICES + ('calendar',)
+
+class DeletionJobError(ValueError):
+    """Raised when a deletion request is invalid"""
+
+def _parse_trip_ids(trip_ids):
+    if not isinstance(trip_ids, list) or not trip_ids:
+        raise DeletionJobError("trip_ids must be a non-empty list")
+    if len(trip_ids) > MAX_DELETION_BATCH:
+        raise DeletionJobError(f"At most {MAX_DELETION_BATCH} trips can be deleted at once")
+    try:
+        return sorted({int(trip_id) for trip_id in trip_ids})
+    except (TypeError, ValueError):
+        raise DeletionJobError("trip_ids must be integers")
+
+def create_deletion_job(trip_ids=None, group_id=None):
+    """
+    Delete trips, or all the trips of a group, and queue the deletion of
+    their data in the other services.
+
+    The trips and their recommendations are deleted here, in the caller's
+    transaction, along with an outbox event that the relay broadcasts to
+    the itinerary, finance and calendar services once it commits. Those
+    delete their data concurrently and report back on the deletion results
+    queue, which completes the job's tasks.
+
+    Returns:
+        DeletionJob, or None if none of the trips exist and no group was given
+
+    Raises:
+        DeletionJobError: If the request is invalid
+    """
+    if group_id is not None:
+        try:
+            group_id = int(group_id)
+        except (TypeError, ValueError):
+            raise DeletionJobError("group_id must be an integer")
+        trip_ids = [trip_id for (trip_id,) in db.session.query(Trip.id).filter(Trip.group_id == group_id)]
+        services = GROUP_DELETION_SERVICES
+    else:
+        trip_ids = _parse_trip_ids(trip_ids)
+        existing = {trip_id for (trip_id,) in db.session.query(Trip.id).filter(Trip.id.in_(trip_ids))}
+        if not existing:
+            return None
+        services = TRIP_DELETION_SERVICES
+
+    if trip_ids:
+        Recommendation.query.filter(Recommendation.trip_id.in_(trip_ids)).delete(synchronize_session=False)
+        Trip.query.filter(Trip.id.in_(trip_ids)).delete(synchronize_session=False)
+
+    job = DeletionJob(id=str(uuid.uuid4()), group_id=group_id, trip_ids=trip_ids, status='running')
+    job.tasks = [DeletionTask(service=service) for service in services]
+    db.session.add(job)
+    enqueue_event(EVENT_DELETION_REQUEST, {"job_id": job.id, "trip_ids": trip_ids, "group_id": group_id})
+
+    for trip_id in trip_ids:
+        invalidate_dashboard(trip_id)
+    logger.info(f"Created deletion job {job.id} for {len(trip_ids)} trips" + (f" of group {group_id}" if group_id else ""))
+    return job
+
+def _finish_job(job):
+    """Mark the job completed or partial once none of its tasks are pending"""
+    if any(task.status == 'pending' for task in job.tasks):
+        return
+    job.status = 'partial' if any(task.status == 'failed' for task in job.tasks) else 'completed'
+    job.completed_at = job.completed_at or datetime.utcnow()
+
+def get_deletion_job(job_id):
+    """Return a job, failing the tasks that timed out first"""
+    job = DeletionJob.query.get(job_id)
+    if job is None or job.status != 'running':
+        return job
+
+    cutoff = datetime.utcnow() - timedelta(seconds=DELETION_TASK_TIMEOUT)
+    if job.created_at < cutoff:
+        for task in job.tasks:
+            if task.status == 'pending':
+                task.status = 'failed'
+                task.error = f"No reply within {DELETION_TASK_TIMEOUT} seconds"
+        _finish_job(job)
+        db.session.commit()
+    return job
+
+def record_deletion_result(result):
+    """
+    Complete a task from a service's reply. A late or repeated reply
+    overrides an earlier failure, so jobs recover once a service catches up.
+
+    Args:
+        result: Dict with job_id, service, status (completed or failed), deleted and error
+    """
+    task = DeletionTask.query.filter_by(job_id=result.get('job_id'), service=result.get('service')).first()
+    if task is None:
+        logger.warning(f"Ignoring deletion result for unknown task: {result}")
+        return False
+    if task.status == 'completed':
+        return True
+
+    task.status = 'completed' if result.get('status') == 'completed' else 'failed'
+    task.deleted = result.get('deleted')
+    task.error = result.get('error')
+    _finish_job(task.job)
+    db.session.commit()
+    logger.info(f"Deletion task {task.service} of job {task.job_id} {task.status}")
+    return True
+
+def handle_deletion_result(delivery):
+    """Record a service's reply to a deletion request"""
+    try:
+        record_deletion_result(delivery.json())
+    except Exception:
+        db.session.rollback()
+        raise
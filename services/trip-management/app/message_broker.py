@@ -7,11 +7,46 @@ import traceback
 import threading
 from datetime import datetime
 from app.models import db, Recommendation
+from app.dashboard import invalidate_dashboard
+from app.recommendation_schema import parse_recommendation_message, RecommendationValidationError
+from app.consumer_runtime import RejectMessage
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Recommendation responses are broadcast on a fanout exchange; this service
+# consumes them from its own durable queue bound to that exchange
+RECOMMENDATION_RESPONSES_EXCHANGE = 'recommendation_responses'
+RECOMMENDATION_RESPONSES_QUEUE = 'trip-management.recommendation_responses'
+
+# Minimum number of seconds between two re-requests for the same trip, so that
+# clients polling for missing recommendations don't flood the recommendation service
+RECOMMENDATION_REQUEST_COOLDOWN = int(os.getenv('RECOMMENDATION_REQUEST_COOLDOWN', 120))
+
+# Recommendation requests go to a priority queue: requests made while a user is
+# waiting for them jump ahead of the ones sent in the background on trip creation.
+# The queue arguments must match the ones the recommendation service declares
+RECOMMENDATION_REQUESTS_QUEUE = 'recommendation_requests'
+RECOMMENDATION_REQUESTS_QUEUE_ARGUMENTS = {'x-max-priority': 10}
+PRIORITY_INTERACTIVE = 8
+PRIORITY_BACKGROUND = 1
+
+# Deletion requests are broadcast on a fanout exchange to every service holding
+# trip data. The queues are declared here too, so requests published while a
+# service is down wait for it. Services reply on DELETION_RESULTS_QUEUE
+DELETION_EVENTS_EXCHANGE = 'deletion_events'
+DELETION_EVENTS_QUEUES = {
+    'itinerary': 'itinerary.deletion_events',
+    'finance': 'finance.deletion_events',
+    'calendar': 'calendar.deletion_events',
+}
+DELETION_RESULTS_QUEUE = 'deletion_results'
+
+# Format: {trip_id: (timestamp of the last request, its priority)}
+_requested_trip_ids = {}
+_requested_trip_ids_lock = threading.Lock()
+
 def connect_to_rabbitmq():
     """Connect to RabbitMQ and return connection and channel"""
     # Get RabbitMQ connection details
@@ -36,203 +71,187 @@ def connect_to_rabbitmq():
     logger.info(f"Connected to RabbitMQ at {rabbitmq_host}")
     return connection, channel
 
-def process_recommendation_response(ch, method, properties, body, app=None):
-    """Process incoming recommendation responses"""
+def handle_recommendation_response(delivery):
+    """Store the recommendations of a response, see app/consumer_runtime.py for how failures are retried"""
+    logger.info(f"Received recommendation response: {delivery.body[:200]}...")
+    
+    # Parse and validate the response against the shared schema
     try:
-        logger.info(f"Received recommendation response: {body[:200]}...")
-        
-        # Parse the response
-        try:
-            data = json.loads(body)
-            logger.info(f"Successfully parsed recommendation response data for trip_id: {data.get('trip_id')}")
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse recommendation response JSON: {e}")
-            logger.error(f"Response body: {body}")
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            return
-        
-        # Extract recommendation details
-        try:
-            trip_id = data.get('trip_id')
-            recommendations = data.get('recommendations')
-            
-            # Validate required fields
-            if not all([trip_id, recommendations]):
-                missing_fields = []
-                if not trip_id: missing_fields.append('trip_id')
-                if not recommendations: missing_fields.append('recommendations')
-                
-                logger.error(f"Missing required fields in recommendation response: {', '.join(missing_fields)}")
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-                return
-            
-            logger.info(f"Processing recommendation response for trip_id={trip_id}")
-        except Exception as e:
-            logger.error(f"Error extracting recommendation details from response: {e}")
-            logger.error(f"Stack trace: {traceback.format_exc()}")
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            return
+        message = parse_recommendation_message(delivery.body)
+    except RecommendationValidationError as e:
+        raise RejectMessage(f"Invalid recommendation response: {e}")
+    trip_id = message['trip_id']
+    recommendations = message['recommendations']
+    logger.info(f"Processing recommendation response for trip_id={trip_id}")
+    
+    try:
+        # Check if recommendation already exists for this trip
+        existing_recommendation = Recommendation.query.filter_by(trip_id=trip_id).first()
         
-        # Save to database (within app context)
-        if app:
-            try:
-                with app.app_context():
-                    # Check if recommendation already exists for this trip
-                    existing_recommendation = Recommendation.query.filter_by(trip_id=trip_id).first()
-                    
-                    if existing_recommendation:
-                        # Update existing recommendation
-                        existing_recommendation.recommendations = recommendations
-                        existing_recommendation.updated_at = datetime.utcnow()
-                        db.session.commit()
-                        logger.info(f"Updated existing recommendation for trip_id: {trip_id}")
-                    else:
-                        # Create new recommendation
-                        new_recommendation = Recommendation(
-                            trip_id=trip_id,
-                            recommendations=recommendations
-                        )
-                        db.session.add(new_recommendation)
-                        db.session.commit()
-                        logger.info(f"Created new recommendation for trip_id: {trip_id}")
-            except Exception as e:
-                logger.error(f"Error saving recommendation to database: {e}")
-                logger.error(f"Stack trace: {traceback.format_exc()}")
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-                return
+        if existing_recommendation:
+            # Update existing recommendation
+            existing_recommendation.recommendations = recommendations
+            existing_recommendation.updated_at = datetime.utcnow()
+            db.session.commit()
+            logger.info(f"Updated existing recommendation for trip_id: {trip_id}")
         else:
-            logger.error("No Flask app context provided, cannot save to database")
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            return
-        
-        # Acknowledge the message
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-        
-    except Exception as e:
-        logger.error(f"Unhandled error processing recommendation response: {e}")
-        logger.error(f"Stack trace: {traceback.format_exc()}")
-        # Acknowledge the message even on error to avoid queue blockage
-        try:
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-        except Exception:
-            pass
-
-def setup_rabbitmq_consumer(app):
-    """Set up RabbitMQ consumer for recommendation responses"""
-    def callback_wrapper(ch, method, properties, body):
-        process_recommendation_response(ch, method, properties, body, app)
-    
-    # Connection retry loop
-    max_retries = 10
-    retry_count = 0
-    while retry_count < max_retries:
-        connection = None
-        channel = None
-        try:
-            logger.info(f"Attempting to connect to RabbitMQ (attempt {retry_count + 1}/{max_retries})")
-            connection, channel = connect_to_rabbitmq()
-            
-            # Declare the response queue
-            response_queue = 'recommendation_responses'
-            channel.queue_declare(queue=response_queue, durable=True)
-            
-            logger.info(f"Declared queue: {response_queue}")
-            
-            # Set QoS to avoid overwhelming the consumer
-            channel.basic_qos(prefetch_count=1)
-            
-            # Set up consumer
-            channel.basic_consume(
-                queue=response_queue,
-                on_message_callback=callback_wrapper,
-                auto_ack=False
+            # Create new recommendation
+            new_recommendation = Recommendation(
+                trip_id=trip_id,
+                recommendations=recommendations
             )
-            
-            logger.info(f"Consumer registered for queue: {response_queue}")
-            logger.info("Waiting for recommendation responses. To exit press CTRL+C")
-            
-            # Start consuming
-            channel.start_consuming()
-            
-        except Exception as e:
-            logger.error(f"Error in RabbitMQ consumer: {e}")
-            logger.error(f"Stack trace: {traceback.format_exc()}")
-            
-            # Increment retry count
-            retry_count += 1
-            
-            # Wait before retrying
-            if retry_count < max_retries:
-                retry_delay = min(30, 2 ** retry_count)  # Exponential backoff, max 30 seconds
-                logger.info(f"Retrying connection in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-            
-            # Close any open connection
-            if connection and connection.is_open:
-                try:
-                    connection.close()
-                except Exception:
-                    pass
-        
-        # If we reach here, we either had an error or the connection was closed
-        if retry_count >= max_retries:
-            logger.error(f"Failed to connect to RabbitMQ after {max_retries} attempts")
-            break
+            db.session.add(new_recommendation)
+            db.session.commit()
+            logger.info(f"Created new recommendation for trip_id: {trip_id}")
+    except Exception:
+        db.session.rollback()
+        raise
+    invalidate_dashboard(int(trip_id))
 
-def start_consumer_thread(app):
-    """Start a thread to consume recommendation responses"""
-    
-    # RabbitMQ consumer thread
-    consumer_thread = threading.Thread(target=setup_rabbitmq_consumer, args=(app,))
-    consumer_thread.daemon = True
-    consumer_thread.start()
-    
-    return consumer_thread
+def recommendation_request_due(trip_id, priority=PRIORITY_BACKGROUND):
+    """
+    Check whether a recommendation request may be sent for a trip.
+    Returns False if one with at least the same priority was already sent
+    within the cooldown window, so a pending background request is still
+    escalated once when a user starts waiting for it.
+    """
+    now = time.monotonic()
+    with _requested_trip_ids_lock:
+        # Clean up expired entries
+        expired_trip_ids = [t_id for t_id, (timestamp, _) in _requested_trip_ids.items()
+                            if now - timestamp > RECOMMENDATION_REQUEST_COOLDOWN]
+        for expired_id in expired_trip_ids:
+            del _requested_trip_ids[expired_id]
+        
+        if trip_id not in _requested_trip_ids:
+            return True
+        return priority > _requested_trip_ids[trip_id][1]
 
-def publish_recommendation_request(trip_id, destination, start_date, end_date):
+def publish_recommendation_request(trip_id, destination, start_date, end_date, priority=PRIORITY_BACKGROUND):
     """Publish a recommendation request to RabbitMQ"""
+    request = {
+        'trip_id': trip_id,
+        'destination': destination,
+        'start_date': start_date,
+        'end_date': end_date
+    }
+    return publish_recommendation_requests([request], priority) == 1
+
+def publish_recommendation_requests(requests, priority=PRIORITY_BACKGROUND):
+    """
+    Publish recommendation requests to RabbitMQ over a single connection.
+    Every message is confirmed by the broker before the next one is sent.
+
+    Args:
+        requests: List of dicts with trip_id, destination, start_date and end_date
+        priority: Message priority, see PRIORITY_INTERACTIVE and PRIORITY_BACKGROUND
+
+    Returns:
+        int: Number of requests published, in order; the rest failed
+    """
+    published = 0
+    connection = None
     try:
-        # Format dates as strings if they are date objects
-        if not isinstance(start_date, str):
-            start_date = start_date.isoformat()
-        if not isinstance(end_date, str):
-            end_date = end_date.isoformat()
-            
-        # Prepare request data
-        request_data = {
-            'trip_id': trip_id,
-            'destination': destination,
-            'start_date': start_date,
-            'end_date': end_date,
-            'timestamp': datetime.utcnow().isoformat()
-        }
-        
         # Connect to RabbitMQ
         connection, channel = connect_to_rabbitmq()
+        channel.confirm_delivery()
         
         # Declare the request queue
-        request_queue = 'recommendation_requests'
-        channel.queue_declare(queue=request_queue, durable=True)
+        request_queue = RECOMMENDATION_REQUESTS_QUEUE
+        channel.queue_declare(queue=request_queue, durable=True, arguments=RECOMMENDATION_REQUESTS_QUEUE_ARGUMENTS)
         
-        # Publish the request
-        channel.basic_publish(
-            exchange='',
-            routing_key=request_queue,
-            body=json.dumps(request_data),
-            properties=pika.BasicProperties(
-                delivery_mode=2,  # make message persistent
-                content_type='application/json',
-                headers={'source': 'trip-service'}
+        for request in requests:
+            # Format dates as strings if they are date objects
+            start_date, end_date = request['start_date'], request['end_date']
+            if not isinstance(start_date, str):
+                start_date = start_date.isoformat()
+            if not isinstance(end_date, str):
+                end_date = end_date.isoformat()
+                
+            # Prepare request data
+            request_data = {
+                'trip_id': request['trip_id'],
+                'destination': request['destination'],
+                'start_date': start_date,
+                'end_date': end_date,
+                'timestamp': datetime.utcnow().isoformat()
+            }
+            
+            # Publish the request
+            channel.basic_publish(
+                exchange='',
+                routing_key=request_queue,
+                body=json.dumps(request_data),
+                properties=pika.BasicProperties(
+                    delivery_mode=2,  # make message persistent
+                    content_type='application/json',
+                    priority=priority,
+                    headers={'source': 'trip-service'}
+                )
             )
-        )
-        
-        logger.info(f"Published recommendation request for trip_id: {trip_id}")
-        
+            published += 1
+            
+            logger.info(f"Published recommendation request for trip_id: {request['trip_id']} with priority {priority}")
+            
+            # Remember the request so polling clients don't trigger duplicates
+            with _requested_trip_ids_lock:
+                _requested_trip_ids[request['trip_id']] = (time.monotonic(), priority)
+    except Exception as e:
+        logger.error(f"Error publishing recommendation request: {e}")
+        logger.error(f"Stack trace: {traceback.format_exc()}")
+    finally:
         # Close the connection
-        connection.close()
+        if connection and connection.is_open:
+            try:
+                connection.close()
+            except Exception:
+                pass
+    
+    return published
+
+def publish_deletion_requests(requests):
+    """
+    Publish deletion requests to the deletion events exchange over a single
+    connection, with publisher confirms.
+
+    Args:
+        requests: List of dicts with job_id, trip_ids and group_id
+
+    Returns:
+        int: Number of requests published, in order; the rest failed
+    """
+    published = 0
+    connection = None
+    try:
+        connection, channel = connect_to_rabbitmq()
+        channel.confirm_delivery()
         
-        return True
+        channel.exchange_declare(exchange=DELETION_EVENTS_EXCHANGE, exchange_type='fanout', durable=True)
+        for queue in DELETION_EVENTS_QUEUES.values():
+            channel.queue_declare(queue=queue, durable=True)
+            channel.queue_bind(exchange=DELETION_EVENTS_EXCHANGE, queue=queue)
+        
+        for request in requests:
+            channel.basic_publish(
+                exchange=DELETION_EVENTS_EXCHANGE,
+                routing_key='',
+                body=json.dumps(request),
+                properties=pika.BasicProperties(
+                    delivery_mode=2,  # make message persistent
+                    content_type='application/json',
+                    headers={'source': 'trip-service'}
+                )
+            )
+            published += 1
+            logger.info(f"Published deletion request for job {request['job_id']}")
     except Exception as e:
-        logger.error(f"Error publishing recommendation request: {e}")
+        logger.error(f"Error publishing deletion request: {e}")
         logger.error(f"Stack trace: {traceback.format_exc()}")
-        return False 
\ No newline at end of file
+    finally:
+        if connection and connection.is_open:
+            try:
+                connection.close()
+            except Exception:
+                pass
+    
+    return published
@@ -1,5 +1,6 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import JSONB
 import json
 
 # Initialize database
@@ -18,8 +19,15 @@ class Trip(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    def to_dict(self):
-        return {
+    # Trip listings filter on the owner and page through (start_date, id)
+    __table_args__ = (
+        db.Index('ix_trips_user_id_start_date_id', 'user_id', 'start_date', 'id'),
+        db.Index('ix_trips_group_id_start_date_id', 'group_id', 'start_date', 'id'),
+    )
+
+    def to_dict(self, fields=None):
+        """Convert model to dictionary, optionally with only the given fields"""
+        data = {
             'id': self.id,
             'user_id': self.user_id,
             'group_id': self.group_id,
@@ -29,14 +37,19 @@ class Trip(db.Model):
             'itinerary_id': self.itinerary_id,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
-        }
+        } if fields is None else {}
+        for field in fields or ():
+            value = getattr(self, field)
+            data[field] = value.isoformat() if isinstance(value, datetime) else value
+        return data
 
 class Recommendation(db.Model):
     __tablename__ = 'recommendations'
     
     id = db.Column(db.Integer, primary_key=True)
     trip_id = db.Column(db.Integer, db.ForeignKey('trips.id'), nullable=False)
-    recommendations_json = db.Column(db.Text, nullable=False)
+    # Validated recommendations (see recommendation_schema), stored as one JSONB document
+    payload = db.Column(db.JSON().with_variant(JSONB, 'postgresql'), nullable=False, default=dict)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -45,28 +58,18 @@ class Recommendation(db.Model):
     
     @property
     def recommendations(self):
-        """Get the recommendations object from JSON"""
-        try:
-            return json.loads(self.recommendations_json)
-        except (json.JSONDecodeError, TypeError):
-            return {}
+        """Get the recommendations object"""
+        return self.payload or {}
             
     @recommendations.setter
     def recommendations(self, value):
-        """Store the recommendations object as JSON"""
-        if value is None:
-            self.recommendations_json = '{}'
-        elif isinstance(value, dict) or isinstance(value, list):
-            self.recommendations_json = json.dumps(value)
-        elif isinstance(value, str):
-            # Make sure it's valid JSON
+        """Store the recommendations object"""
+        if isinstance(value, str):
             try:
-                json.loads(value)
-                self.recommendations_json = value
+                value = json.loads(value)
             except json.JSONDecodeError:
-                self.recommendations_json = '{}'
-        else:
-            self.recommendations_json = '{}'
+                value = None
+        self.payload = value if isinstance(value, (dict, list)) else {}
     
     def to_dict(self):
         """Convert model to dictionary"""
@@ -76,4 +79,99 @@ class Recommendation(db.Model):
             'recommendations': self.recommendations,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
-        } 
\ No newline at end of file
+        }
+
+class OutboxEvent(db.Model):
+    """
+    A message to another service, written in the same transaction as the
+    change it announces and delivered by the outbox relay (see app/outbox.py)
+    """
+    __tablename__ = 'outbox_events'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.JSON().with_variant(JSONB, 'postgresql'), nullable=False)
+    # pending, delivered or failed (gave up after OUTBOX_MAX_ATTEMPTS)
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    # The next delivery attempt isn't made before this time
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    delivered_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_outbox_events_status_available_at', 'status', 'available_at'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'event_type': self.event_type,
+            'payload': self.payload,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'available_at': self.available_at.isoformat(),
+            'created_at': self.created_at.isoformat(),
+            'delivered_at': self.delivered_at.isoformat() if self.delivered_at else None
+        }
+
+
+class DeletionJob(db.Model):
+    """
+    A batch of trips, or a whole group, being deleted across services.
+    Each service that holds data about the trips has a DeletionTask, which
+    it completes by replying on the deletion results queue (see app/deletion_jobs.py)
+    """
+    __tablename__ = 'deletion_jobs'
+    
+    id = db.Column(db.String(36), primary_key=True)
+    group_id = db.Column(db.Integer, nullable=True)
+    trip_ids = db.Column(db.JSON().with_variant(JSONB, 'postgresql'), nullable=False, default=list)
+    # running, completed, or partial if any task failed
+    status = db.Column(db.String(16), nullable=False, default='running')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    
+    tasks = db.relationship('DeletionTask', backref='job', lazy='selectin', order_by='DeletionTask.id')
+    
+    def to_dict(self):
+        finished = [task for task in self.tasks if task.status != 'pending']
+        return {
+            'id': self.id,
+            'group_id': self.group_id,
+            'trip_ids': self.trip_ids,
+            'status': self.status,
+            'progress': {'finished': len(finished), 'total': len(self.tasks)},
+            'tasks': [task.to_dict() for task in self.tasks],
+            'created_at': self.created_at.isoformat(),
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+        }
+
+class DeletionTask(db.Model):
+    """The part of a deletion job carried out by one service"""
+    __tablename__ = 'deletion_tasks'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(36), db.ForeignKey('deletion_jobs.id', ondelete='CASCADE'), nullable=False)
+    service = db.Column(db.String(32), nullable=False)
+    # pending, completed or failed
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    # Number of rows the service deleted
+    deleted = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('job_id', 'service', name='uq_deletion_tasks_job_id_service'),
+    )
+    
+    def to_dict(self):
+        return {
+            'service': self.service,
+            'status': self.status,
+            'deleted': self.deleted,
+            'error': self.error,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
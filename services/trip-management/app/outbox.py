@@ -0,0 +1,228 @@
+import os
+import logging
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import requests
+from sqlalchemy import func
+
+from app.models import db, Trip, OutboxEvent
+from app import serving
+from app.dashboard import invalidate_dashboard
+from app.message_broker import (
+    publish_recommendation_requests, publish_deletion_requests, PRIORITY_BACKGROUND
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ITINERARY_SERVICE_URL = os.getenv('ITINERARY_SERVICE_URL', 'http://itinerary:5004')
+
+# Event types and the payloads they carry
+EVENT_ITINERARY_CREATE = 'itinerary.create'  # trip_id, destination, start_date, end_date, group_id
+EVENT_RECOMMENDATION_REQUEST = 'recommendation.request'  # trip_id, destination, start_date, end_date, priority
+EVENT_DELETION_REQUEST = 'deletion.request'  # job_id, trip_ids, group_id
+
+# The relay delivers up to OUTBOX_BATCH_SIZE events at a time, as soon as it
+# is woken up by a write or every OUTBOX_POLL_INTERVAL seconds
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 5))
+
+# Failed deliveries are retried with exponential backoff, up to
+# OUTBOX_MAX_ATTEMPTS times, after which the event is marked failed
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 10))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv('OUTBOX_RETRY_BASE_SECONDS', 2))
+OUTBOX_RETRY_MAX_SECONDS = float(os.getenv('OUTBOX_RETRY_MAX_SECONDS', 300))
+
+# Delivered events are deleted after OUTBOX_RETENTION_HOURS
+OUTBOX_RETENTION_HOURS = int(os.getenv('OUTBOX_RETENTION_HOURS', 24))
+OUTBOX_HTTP_TIMEOUT = float(os.getenv('OUTBOX_HTTP_TIMEOUT', 5))
+
+_relay = None
+# Set by whichever worker process committed events, see app/serving.py
+_wakeup = serving.Wakeup('trip-management-outbox')
+
+def enqueue_event(event_type, payload):
+    """Add an event to the outbox; it is written when the caller's transaction commits"""
+    event = OutboxEvent(event_type=event_type, payload=payload)
+    db.session.add(event)
+    return event
+
+def enqueue_trip_created(trip):
+    """Queue the itinerary creation and recommendation request for a new, flushed trip"""
+    itinerary_data = {
+        "trip_id": str(trip.id),
+        "destination": trip.city,
+        "start_date": trip.start_date.isoformat(),
+        "end_date": trip.end_date.isoformat()
+    }
+    # Add group_id to itinerary data if available
+    if trip.group_id:
+        itinerary_data["group_id"] = trip.group_id
+    enqueue_event(EVENT_ITINERARY_CREATE, itinerary_data)
+
+    enqueue_event(EVENT_RECOMMENDATION_REQUEST, {
+        "trip_id": trip.id,
+        "destination": trip.city,
+        "start_date": trip.start_date.isoformat(),
+        "end_date": trip.end_date.isoformat(),
+        "priority": PRIORITY_BACKGROUND
+    })
+
+def wake_outbox_relay():
+    """Ask the relay to deliver newly committed events now rather than at its next poll"""
+    _wakeup.set()
+
+def outbox_backlog():
+    """Return the number of pending and failed events"""
+    counts = dict(
+        db.session.query(OutboxEvent.status, func.count(OutboxEvent.id))
+        .filter(OutboxEvent.status != 'delivered')
+        .group_by(OutboxEvent.status)
+        .all()
+    )
+    return {"pending": counts.get('pending', 0), "failed": counts.get('failed', 0)}
+
+class OutboxRelay:
+    """Delivers outbox events to other services, in batches, with retries"""
+
+    def __init__(self, app):
+        self.app = app
+        # Reuses connections to the itinerary service across events
+        self._http = requests.Session()
+        self._last_purge = 0.0
+        self._handlers = {
+            EVENT_ITINERARY_CREATE: self._deliver_itineraries,
+            EVENT_RECOMMENDATION_REQUEST: self._deliver_recommendation_requests,
+            EVENT_DELETION_REQUEST: self._deliver_deletion_requests,
+        }
+
+    def run(self):
+        logger.info("Outbox relay started")
+        while True:
+            _wakeup.wait(OUTBOX_POLL_INTERVAL)
+            try:
+                with self.app.app_context():
+                    # Keep going while batches come back full
+                    while self.relay_batch() == OUTBOX_BATCH_SIZE:
+                        pass
+                    if time.monotonic() - self._last_purge > 3600:
+                        self.purge_delivered()
+                        self._last_purge = time.monotonic()
+            except Exception as e:
+                logger.error(f"Error relaying outbox events: {e}")
+                logger.error(traceback.format_exc())
+
+    def relay_batch(self):
+        """Deliver one batch of due events; returns the number of events attempted"""
+        try:
+            # Rows locked by another relay are skipped, so relays can run side by side
+            events = (OutboxEvent.query
+                      .filter(OutboxEvent.status == 'pending', OutboxEvent.available_at <= datetime.utcnow())
+                      .order_by(OutboxEvent.id)
+                      .limit(OUTBOX_BATCH_SIZE)
+                      .with_for_update(skip_locked=True)
+                      .all())
+            if not events:
+                db.session.rollback()
+                return 0
+
+            # Format: {event id: error message}, for the events that failed
+            errors = {}
+            by_type = {}
+            for event in events:
+                by_type.setdefault(event.event_type, []).append(event)
+            for event_type, typed_events in by_type.items():
+                handler = self._handlers.get(event_type)
+                if handler is None:
+                    errors.update({event.id: f"Unknown event type: {event_type}" for event in typed_events})
+                    continue
+                errors.update(handler(typed_events))
+
+            now = datetime.utcnow()
+            for event in events:
+                event.attempts += 1
+                if event.id not in errors:
+                    event.status = 'delivered'
+                    event.delivered_at = now
+                    event.last_error = None
+                    continue
+
+                event.last_error = errors[event.id]
+                if event.attempts >= OUTBOX_MAX_ATTEMPTS:
+                    event.status = 'failed'
+                    logger.error(f"Giving up on outbox event {event.id} ({event.event_type}) after {event.attempts} attempts: {event.last_error}")
+                else:
+                    delay = min(OUTBOX_RETRY_MAX_SECONDS, OUTBOX_RETRY_BASE_SECONDS * 2 ** (event.attempts - 1))
+                    event.available_at = now + timedelta(seconds=delay)
+
+            db.session.commit()
+            logger.info(f"Relayed {len(events) - len(errors)}/{len(events)} outbox events")
+            return len(events)
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def purge_delivered(self):
+        """Delete delivered events older than the retention period"""
+        cutoff = datetime.utcnow() - timedelta(hours=OUTBOX_RETENTION_HOURS)
+        deleted = (OutboxEvent.query
+                   .filter(OutboxEvent.status == 'delivered', OutboxEvent.delivered_at < cutoff)
+                   .delete(synchronize_session=False))
+        db.session.commit()
+        if deleted:
+            logger.info(f"Purged {deleted} delivered outbox events")
+
+    def _deliver_itineraries(self, events):
+        errors = {}
+        for event in events:
+            try:
+                response = self._http.post(
+                    f"{ITINERARY_SERVICE_URL}/api/itinerary",
+                    json=event.payload,
+                    timeout=OUTBOX_HTTP_TIMEOUT
+                )
+            except requests.exceptions.RequestException as e:
+                errors[event.id] = f"Error connecting to itinerary service: {e}"
+                continue
+
+            if response.status_code not in (200, 201):
+                errors[event.id] = f"Itinerary service returned {response.status_code}: {response.text[:500]}"
+                continue
+
+            # Update trip with itinerary ID
+            trip = Trip.query.get(int(event.payload['trip_id']))
+            if trip:
+                trip.itinerary_id = trip.id  # Using trip.id as itinerary_id
+                invalidate_dashboard(trip.id)
+        return errors
+
+    def _deliver_recommendation_requests(self, events):
+        errors = {}
+        by_priority = {}
+        for event in events:
+            by_priority.setdefault(event.payload.get('priority', PRIORITY_BACKGROUND), []).append(event)
+
+        for priority, priority_events in by_priority.items():
+            published = publish_recommendation_requests([event.payload for event in priority_events], priority)
+            for event in priority_events[published:]:
+                errors[event.id] = "Failed to publish recommendation request"
+        return errors
+
+    def _deliver_deletion_requests(self, events):
+        published = publish_deletion_requests([event.payload for event in events])
+        return {event.id: "Failed to publish deletion request" for event in events[published:]}
+
+def start_outbox_relay(app):
+    """Start a thread delivering outbox events"""
+    global _relay
+    _relay = OutboxRelay(app)
+
+    relay_thread = threading.Thread(target=_relay.run)
+    relay_thread.daemon = True
+    relay_thread.start()
+
+    return relay_thread
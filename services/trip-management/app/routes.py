@@ -1,8 +1,16 @@
 from flask import jsonify, request, current_app
 from datetime import datetime
+from urllib.parse import urlencode
 import requests
 from app.models import db, Trip, Recommendation
-from app.message_broker import publish_recommendation_request
+from app.message_broker import (
+    publish_recommendation_request, recommendation_request_due,
+    PRIORITY_INTERACTIVE
+)
+from app.outbox import enqueue_trip_created, wake_outbox_relay
+from app.trip_listing import list_trips, TripListingError
+from app.dashboard import get_dashboard, invalidate_dashboard
+from app.deletion_jobs import create_deletion_job, get_deletion_job, DeletionJobError
 import os
 import logging
 
@@ -13,6 +21,21 @@ logger = logging.getLogger(__name__)
 # Get itinerary service URL from environment or use default
 ITINERARY_SERVICE_URL = os.getenv('ITINERARY_SERVICE_URL', 'http://itinerary:5004')
 
+def trip_page_response(trips, next_cursor):
+    """A page of trips; the cursor of the next page goes in X-Next-Cursor and Link"""
+    headers = {}
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        headers['Link'] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+    return jsonify(trips), 200, headers
+
+def deletion_job_response(job):
+    """202 with the job, whose progress can be followed at the Location URL"""
+    location = f"{request.host_url.rstrip('/')}/api/trips/deletions/{job.id}"
+    return jsonify(job.to_dict()), 202, {'Location': location}
+
 def register_routes(app):
     @app.route('/api/trips', methods=['POST'])
     def create_trip():
@@ -36,67 +59,16 @@ def register_routes(app):
                 group_id=data.get('group_id')  # Optional group_id field
             )
             db.session.add(trip)
+            db.session.flush()
+
+            # The itinerary and recommendations are requested by the outbox
+            # relay once the trip is committed, in the same transaction
+            enqueue_trip_created(trip)
             db.session.commit()
+            wake_outbox_relay()
             
             logger.info(f"Created trip with ID: {trip.id}")
 
-            # Skip external service calls in testing environment
-            if not current_app.config['TESTING']:
-                try:
-                    # Create itinerary via the itinerary service
-                    itinerary_data = {
-                        "trip_id": str(trip.id),
-                        "destination": trip.city,
-                        "start_date": trip.start_date.isoformat(),
-                        "end_date": trip.end_date.isoformat()
-                    }
-                    
-                    # Add group_id to itinerary data if available
-                    if trip.group_id:
-                        itinerary_data["group_id"] = trip.group_id
-                    
-                    logger.info(f"Creating itinerary for trip: {trip.id}")
-                    itinerary_response = requests.post(
-                        f"{ITINERARY_SERVICE_URL}/api/itinerary",
-                        json=itinerary_data
-                    )
-                    
-                    if itinerary_response.status_code in (200, 201):
-                        logger.info(f"Successfully created itinerary for trip: {trip.id}")
-                        itinerary_data = itinerary_response.json()
-                        
-                        # Update trip with itinerary ID
-                        trip.itinerary_id = trip.id  # Using trip.id as itinerary_id
-                        db.session.commit()
-                    else:
-                        logger.error(f"Failed to create itinerary. Status: {itinerary_response.status_code}, Response: {itinerary_response.text}")
-                        # Continue even if itinerary creation failed, don't roll back the trip
-                        logger.warning(f"Continuing with trip creation despite itinerary failure")
-
-                except requests.exceptions.RequestException as e:
-                    # Handle connection errors to external services
-                    logger.error(f"Error connecting to itinerary service: {str(e)}")
-                    # Continue with trip creation even if itinerary creation failed
-                    logger.warning(f"Continuing with trip creation despite connection error to itinerary service")
-                
-                # Request recommendations for the new trip
-                try:
-                    logger.info(f"Requesting recommendations for trip: {trip.id}")
-                    success = publish_recommendation_request(
-                        trip.id, 
-                        trip.city, 
-                        trip.start_date, 
-                        trip.end_date
-                    )
-                    if success:
-                        logger.info(f"Successfully queued recommendation request for trip: {trip.id}")
-                    else:
-                        logger.error(f"Failed to queue recommendation request for trip: {trip.id}")
-                except Exception as e:
-                    logger.error(f"Error requesting recommendations: {str(e)}")
-                    # Continue with trip creation even if recommendation request failed
-                    logger.warning(f"Continuing with trip creation despite recommendation request failure")
-
             return jsonify(trip.to_dict()), 201
 
         except Exception as e:
@@ -109,18 +81,35 @@ def register_routes(app):
         trip = Trip.query.get_or_404(trip_id)
         return jsonify(trip.to_dict()), 200
 
+    @app.route('/api/trips/<int:trip_id>/dashboard', methods=['GET'])
+    def get_trip_dashboard(trip_id):
+        """Get the trip with its itinerary, recommendations, availability, readiness and settlement in one call."""
+        try:
+            dashboard, cached = get_dashboard(trip_id, request.args.get('base', 'SGD'))
+            if dashboard is None:
+                return jsonify({"error": "Trip not found"}), 404
+            return jsonify(dashboard), 200, {'X-Cache': 'HIT' if cached else 'MISS'}
+        except Exception as e:
+            logger.error(f"Error building dashboard for trip {trip_id}: {str(e)}")
+            return jsonify({"error": "Internal server error", "details": str(e)}), 500
+
     @app.route('/api/users/<int:user_id>/trips', methods=['GET'])
     def get_user_trips(user_id):
-        trips = Trip.query.filter_by(user_id=user_id).all()
-        return jsonify([trip.to_dict() for trip in trips]), 200
+        """Get a page of a user's trips, see list_trips for the query parameters."""
+        try:
+            trips, next_cursor = list_trips(Trip.user_id, user_id, request.args)
+        except TripListingError as e:
+            return jsonify({"error": str(e)}), 400
+        return trip_page_response(trips, next_cursor)
 
     @app.route('/api/groups/<int:group_id>/trips', methods=['GET'])
     def get_group_trips(group_id):
-        """Get all trips associated with a specific group."""
-        trips = Trip.query.filter_by(group_id=group_id).all()
-        if not trips:
-            return jsonify({"message": "No trips found for this group"}), 404
-        return jsonify([trip.to_dict() for trip in trips]), 200
+        """Get a page of the trips associated with a specific group."""
+        try:
+            trips, next_cursor = list_trips(Trip.group_id, group_id, request.args)
+        except TripListingError as e:
+            return jsonify({"error": str(e)}), 400
+        return trip_page_response(trips, next_cursor)
 
     @app.route('/api/trips/<int:trip_id>/itinerary', methods=['PUT'])
     def update_trip_itinerary(trip_id):
@@ -136,6 +125,7 @@ def register_routes(app):
         response = requests.put(itinerary_service_url, json=data)
         
         if response.status_code == 200:
+            invalidate_dashboard(trip_id)
             return jsonify({"message": "Itinerary updated successfully"}), 200
         return jsonify({"error": "Failed to update itinerary"}), response.status_code
 
@@ -151,13 +141,22 @@ def register_routes(app):
             recommendation = Recommendation.query.filter_by(trip_id=trip_id).first()
             
             if not recommendation:
+                # A request is already in flight, don't re-request on every poll
+                if not recommendation_request_due(trip.id, PRIORITY_INTERACTIVE):
+                    logger.info(f"No recommendations found for trip_id={trip_id}, request already pending")
+                    return jsonify({
+                        "status": "processing",
+                        "message": "Recommendations are being generated. Please try again in a few moments."
+                    }), 202  # Accepted
+                
                 # If recommendations don't exist, initiate a request to generate them
                 logger.info(f"No recommendations found for trip_id={trip_id}, initiating request")
                 success = publish_recommendation_request(
                     trip.id, 
                     trip.city, 
                     trip.start_date, 
-                    trip.end_date
+                    trip.end_date,
+                    priority=PRIORITY_INTERACTIVE
                 )
                 if success:
                     logger.info(f"Successfully queued recommendation request for trip: {trip.id}")
@@ -190,7 +189,8 @@ def register_routes(app):
                 trip.id, 
                 trip.city, 
                 trip.start_date, 
-                trip.end_date
+                trip.end_date,
+                priority=PRIORITY_INTERACTIVE
             )
             
             if not success:
@@ -210,34 +210,49 @@ def register_routes(app):
 
     @app.route('/api/trips/<int:trip_id>', methods=['DELETE'])
     def delete_trip(trip_id):
+        """Delete a trip; its itinerary and expenses are deleted by a background job."""
         try:
-            trip = Trip.query.get_or_404(trip_id)
-            
-            # Skip external service calls in testing environment
-            if not current_app.config['TESTING']:
-                try:
-                    # Delete itinerary
-                    itinerary_service_url = f"{ITINERARY_SERVICE_URL}/api/itinerary/{trip_id}"
-                    requests.delete(itinerary_service_url)
-                except requests.exceptions.RequestException as e:
-                    logger.error(f"Error connecting to itinerary service: {str(e)}")
-                    # Continue with trip deletion even if itinerary deletion fails
-            
-            # Delete recommendations for this trip
-            try:
-                recommendation = Recommendation.query.filter_by(trip_id=trip_id).first()
-                if recommendation:
-                    db.session.delete(recommendation)
-            except Exception as e:
-                logger.error(f"Error deleting recommendations: {str(e)}")
-                # Continue with trip deletion even if recommendation deletion fails
-            
-            # Delete trip from database
-            db.session.delete(trip)
+            job = create_deletion_job(trip_ids=[trip_id])
+            if job is None:
+                return jsonify({"error": "Trip not found"}), 404
             db.session.commit()
-            
-            return jsonify({"message": "Trip deleted successfully"}), 200
+            wake_outbox_relay()
+            return deletion_job_response(job)
         except Exception as e:
             logger.error(f"Unexpected error: {str(e)}")
             db.session.rollback()
-            return jsonify({"error": str(e)}), 500 
\ No newline at end of file
+            return jsonify({"error": str(e)}), 500
+
+    @app.route('/api/trips/deletions', methods=['POST'])
+    def delete_trips():
+        """
+        Delete a batch of trips, {"trip_ids": [...]}, or all the trips of a
+        group and its calendar, {"group_id": ...}. Returns 202 with a job
+        whose status is at the Location URL.
+        """
+        try:
+            data = request.get_json(silent=True) or {}
+            if ('trip_ids' in data) == ('group_id' in data):
+                return jsonify({"error": "Provide either trip_ids or group_id"}), 400
+
+            job = create_deletion_job(trip_ids=data.get('trip_ids'), group_id=data.get('group_id'))
+            if job is None:
+                return jsonify({"error": "None of the trips were found"}), 404
+            db.session.commit()
+            wake_outbox_relay()
+            return deletion_job_response(job)
+        except DeletionJobError as e:
+            db.session.rollback()
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error creating deletion job: {str(e)}")
+            db.session.rollback()
+            return jsonify({"error": str(e)}), 500
+
+    @app.route('/api/trips/deletions/<job_id>', methods=['GET'])
+    def get_trip_deletion(job_id):
+        """Get the progress of a deletion job."""
+        job = get_deletion_job(job_id)
+        if job is None:
+            return jsonify({"error": "Deletion job not found"}), 404
+        return jsonify(job.to_dict()), 200
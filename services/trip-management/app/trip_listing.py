@@ -0,0 +1,123 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import load_only
+
+from app.models import Trip
+
+# Page size of trip listings, unless the client asks for another one
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Format: {field of Trip.to_dict: column it is read from}
+TRIP_FIELDS = {
+    'id': Trip.id,
+    'user_id': Trip.user_id,
+    'group_id': Trip.group_id,
+    'city': Trip.city,
+    'start_date': Trip.start_date,
+    'end_date': Trip.end_date,
+    'itinerary_id': Trip.itinerary_id,
+    'created_at': Trip.created_at,
+    'updated_at': Trip.updated_at,
+}
+
+class TripListingError(ValueError):
+    """Raised when the query parameters of a trip listing are invalid"""
+
+def encode_cursor(trip):
+    """Opaque cursor pointing just after a trip in (start_date, id) order"""
+    data = json.dumps([trip.start_date.isoformat(), trip.id])
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        start_date, trip_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(start_date), int(trip_id)
+    except (ValueError, TypeError):
+        raise TripListingError("Invalid cursor")
+
+def _parse_date(args, name):
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+    except ValueError:
+        raise TripListingError(f"Invalid {name} date: {value}")
+
+def parse_fields(value):
+    """Parse the fields parameter into a list of Trip fields, or None for all of them"""
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in TRIP_FIELDS]
+    if unknown:
+        raise TripListingError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def list_trips(column, value, args):
+    """
+    Return one page of the trips whose `column` equals `value`.
+
+    Trips are ordered by (start_date, id), so with an index on
+    (column, start_date, id) every page is a single index range scan.
+
+    Query parameters:
+        limit: Page size, up to MAX_PAGE_SIZE
+        cursor: X-Next-Cursor of the previous page
+        order: asc (default) or desc by start date
+        from / to: Only trips overlapping this date range
+        city: Only trips to this city, case-insensitive
+        fields: Comma-separated fields to return, e.g. id,city,start_date
+
+    Returns:
+        Tuple: (list of trip dicts, cursor of the next page or None)
+
+    Raises:
+        TripListingError: If a parameter is invalid
+    """
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise TripListingError("limit must be an integer")
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise TripListingError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    order = args.get('order', 'asc')
+    if order not in ('asc', 'desc'):
+        raise TripListingError("order must be asc or desc")
+
+    fields = parse_fields(args.get('fields'))
+    date_from, date_to = _parse_date(args, 'from'), _parse_date(args, 'to')
+
+    query = Trip.query.filter(column == value)
+    if date_from:
+        query = query.filter(Trip.end_date >= date_from)
+    if date_to:
+        query = query.filter(Trip.start_date <= date_to)
+    if args.get('city'):
+        query = query.filter(func.lower(Trip.city) == args['city'].strip().lower())
+
+    if args.get('cursor'):
+        position = tuple_(*decode_cursor(args['cursor']))
+        key = tuple_(Trip.start_date, Trip.id)
+        query = query.filter(key > position if order == 'asc' else key < position)
+
+    if order == 'asc':
+        query = query.order_by(Trip.start_date.asc(), Trip.id.asc())
+    else:
+        query = query.order_by(Trip.start_date.desc(), Trip.id.desc())
+
+    if fields:
+        # The cursor always needs the sort key
+        columns = {TRIP_FIELDS[field] for field in fields} | {Trip.id, Trip.start_date}
+        query = query.options(load_only(*columns))
+
+    # Fetch one extra row to know whether there is a next page
+    trips = query.limit(limit + 1).all()
+    next_cursor = encode_cursor(trips[limit - 1]) if len(trips) > limit else None
+    return [trip.to_dict(fields) for trip in trips[:limit]], next_cursor
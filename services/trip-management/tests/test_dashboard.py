@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import threading
+import time
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+
+from app import dashboard, routes
+from app.models import db, Trip
+from app.message_broker import handle_recommendation_response
+from app.routes import register_routes
+
+def create_test_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    register_routes(app)
+    return app
+
+class FakeDelivery:
+    def __init__(self, message):
+        self.body = json.dumps(message).encode()
+
+class DashboardTest(unittest.TestCase):
+    def setUp(self):
+        self.app = create_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+        db.create_all()
+        self.client = self.app.test_client()
+
+        db.session.add(Trip(user_id=1, group_id=7, city='Tokyo',
+                            start_date=datetime(2025, 4, 1), end_date=datetime(2025, 4, 3)))
+        db.session.commit()
+
+        dashboard._cache.clear()
+        self.addCleanup(dashboard._cache.clear)
+        for name, value in [('DASHBOARD_SECTION_TIMEOUT', 0.5), ('DASHBOARD_CACHE_TTL', 60)]:
+            patcher = patch.object(dashboard, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.object(routes, 'wake_outbox_relay', lambda: None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Remote sections answer with their name and count their calls
+        self.calls = []
+        self.set_sections({name: self.section(name) for name in dashboard.REMOTE_SECTIONS})
+
+    def set_sections(self, sections):
+        patcher = patch.dict(dashboard.REMOTE_SECTIONS, sections)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def section(self, name, before=None):
+        def fetch(trip, base_currency):
+            self.calls.append(name)
+            if before:
+                before()
+            return {'section': name, 'trip_id': trip.id, 'base': base_currency}
+        return fetch
+
+    def get(self, base='SGD'):
+        response = self.client.get(f'/api/trips/1/dashboard?base={base}')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_sections_are_composed(self):
+        response = self.get('EUR')
+        body = response.get_json()
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertTrue(body['complete'])
+        self.assertEqual(body['sections']['trip']['data']['city'], 'Tokyo')
+        self.assertEqual(body['sections']['recommendations'], {'status': 'pending', 'data': None})
+        self.assertEqual(body['sections']['settlement'],
+                         {'status': 'ok', 'data': {'section': 'settlement', 'trip_id': 1, 'base': 'EUR'}})
+
+    def test_sections_are_fetched_concurrently(self):
+        # Every section waits for all the others to have started
+        barrier = threading.Barrier(len(dashboard.REMOTE_SECTIONS), timeout=0.4)
+        self.set_sections({name: self.section(name, barrier.wait) for name in dashboard.REMOTE_SECTIONS})
+
+        body = self.get().get_json()
+        self.assertTrue(body['complete'])
+        self.assertEqual({section['status'] for section in body['sections'].values()}, {'ok', 'pending'})
+
+    def test_slow_section_times_out_within_the_shared_deadline(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        slow = self.section('availability', lambda: release.wait(5))
+        # Each section is slow but well within the deadline on its own
+        self.set_sections({
+            name: (slow if name == 'availability' else self.section(name, lambda: time.sleep(0.2)))
+            for name in dashboard.REMOTE_SECTIONS
+        })
+
+        started = time.monotonic()
+        response = self.get()
+        elapsed = time.monotonic() - started
+
+        body = response.get_json()
+        self.assertLess(elapsed, 1.5)
+        self.assertFalse(body['complete'])
+        self.assertEqual(body['sections']['availability'], {'status': 'timeout'})
+        for name in ('itinerary', 'readiness', 'settlement'):
+            self.assertEqual(body['sections'][name]['status'], 'ok')
+        self.assertEqual(body['sections']['trip']['status'], 'ok')
+
+        # Partial dashboards aren't cached
+        release.set()
+        self.assertEqual(self.get().headers['X-Cache'], 'MISS')
+
+    def test_failed_section_is_reported(self):
+        def failing(trip, base_currency):
+            raise RuntimeError('finance is down')
+        self.set_sections({'readiness': failing})
+
+        body = self.get().get_json()
+        self.assertFalse(body['complete'])
+        self.assertEqual(body['sections']['readiness'], {'status': 'error', 'error': 'finance is down'})
+
+    def test_dashboard_is_cached_until_it_expires(self):
+        first = self.get()
+        second = self.get()
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(second.get_json(), first.get_json())
+        self.assertEqual(len(self.calls), len(dashboard.REMOTE_SECTIONS))
+
+        # Each base currency is cached separately
+        self.assertEqual(self.get('EUR').headers['X-Cache'], 'MISS')
+
+        with patch.object(dashboard, 'DASHBOARD_CACHE_TTL', 0.05):
+            self.get('JPY')
+            self.assertEqual(self.get('JPY').headers['X-Cache'], 'HIT')
+            time.sleep(0.1)
+            self.assertEqual(self.get('JPY').headers['X-Cache'], 'MISS')
+
+    def test_cache_is_bounded(self):
+        with patch.object(dashboard, 'DASHBOARD_CACHE_SIZE', 2):
+            for base in ('SGD', 'EUR', 'JPY'):
+                self.get(base)
+            self.assertEqual(list(dashboard._cache), [(1, 'EUR'), (1, 'JPY')])
+
+    def test_new_recommendations_invalidate_the_dashboard(self):
+        self.get()
+        self.get('EUR')
+        handle_recommendation_response(FakeDelivery({
+            'trip_id': 1,
+            'destination': 'Tokyo',
+            'recommendations': {'tips': ['Carry cash']}
+        }))
+
+        response = self.get()
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertEqual(response.get_json()['sections']['recommendations']['status'], 'ok')
+        self.assertEqual(self.get('EUR').headers['X-Cache'], 'MISS')
+
+    def test_deleting_the_trip_invalidates_the_dashboard(self):
+        self.get()
+        self.assertEqual(self.client.delete('/api/trips/1').status_code, 202)
+        self.assertEqual(self.client.get('/api/trips/1/dashboard').status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
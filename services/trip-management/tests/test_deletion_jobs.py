@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+
+from app import deletion_jobs, routes
+from app.models import db, Trip, Recommendation, OutboxEvent, DeletionJob
+from app.deletion_jobs import handle_deletion_result, record_deletion_result
+from app.outbox import EVENT_DELETION_REQUEST
+from app.routes import register_routes
+
+def create_test_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    register_routes(app)
+    return app
+
+class FakeDelivery:
+    def __init__(self, message):
+        self.body = json.dumps(message).encode()
+
+    def json(self):
+        return json.loads(self.body)
+
+class DeletionJobTest(unittest.TestCase):
+    def setUp(self):
+        self.app = create_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+        db.create_all()
+        self.client = self.app.test_client()
+
+        patcher = patch.object(routes, 'wake_outbox_relay', lambda: None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        for group_id in (None, 5, 5):
+            trip = Trip(user_id=1, group_id=group_id, city='Tokyo',
+                        start_date=datetime(2025, 4, 1), end_date=datetime(2025, 4, 3))
+            db.session.add(trip)
+            db.session.flush()
+            db.session.add(Recommendation(trip_id=trip.id, payload={'tips': []}))
+        db.session.commit()
+
+    def reply(self, job_id, service, status='completed', **fields):
+        handle_deletion_result(FakeDelivery({'job_id': job_id, 'service': service, 'status': status, **fields}))
+
+    def job(self, job_id):
+        return self.client.get(f"/api/trips/deletions/{job_id}").get_json()
+
+    def test_delete_trip_is_accepted_with_a_job(self):
+        response = self.client.delete('/api/trips/1')
+        self.assertEqual(response.status_code, 202)
+        job = response.get_json()
+        self.assertTrue(response.headers['Location'].endswith(f"/api/trips/deletions/{job['id']}"))
+        self.assertEqual((job['status'], job['trip_ids']), ('running', [1]))
+        self.assertEqual([task['service'] for task in job['tasks']], ['itinerary', 'finance'])
+
+        # Deleted here right away, the rest announced through the outbox
+        self.assertIsNone(db.session.get(Trip, 1))
+        self.assertEqual(Recommendation.query.filter_by(trip_id=1).count(), 0)
+        [event] = OutboxEvent.query.filter_by(event_type=EVENT_DELETION_REQUEST).all()
+        self.assertEqual(event.payload, {'job_id': job['id'], 'trip_ids': [1], 'group_id': None})
+
+        self.assertEqual(self.client.delete('/api/trips/1').status_code, 404)
+
+    def test_group_deletion_includes_the_calendar(self):
+        response = self.client.post('/api/trips/deletions', json={'group_id': 5})
+        self.assertEqual(response.status_code, 202)
+        job = response.get_json()
+        self.assertEqual(job['trip_ids'], [2, 3])
+        self.assertEqual([task['service'] for task in job['tasks']], ['itinerary', 'finance', 'calendar'])
+
+        for body in ({}, {'trip_ids': [1], 'group_id': 5}, {'trip_ids': []}, {'trip_ids': ['x']}):
+            self.assertEqual(self.client.post('/api/trips/deletions', json=body).status_code, 400, body)
+
+    def test_replies_complete_the_job(self):
+        job_id = self.client.delete('/api/trips/1').get_json()['id']
+        self.reply(job_id, 'itinerary', deleted=4)
+        job = self.job(job_id)
+        self.assertEqual((job['status'], job['progress']), ('running', {'finished': 1, 'total': 2}))
+
+        self.reply(job_id, 'finance', 'failed', error='database is down')
+        job = self.job(job_id)
+        self.assertEqual(job['status'], 'partial')
+        self.assertEqual(job['tasks'][1]['error'], 'database is down')
+        self.assertIsNotNone(job['completed_at'])
+
+        # Replies for unknown jobs or services are ignored
+        self.assertFalse(record_deletion_result({'job_id': 'nope', 'service': 'itinerary', 'status': 'completed'}))
+        self.assertFalse(record_deletion_result({'job_id': job_id, 'service': 'calendar', 'status': 'completed'}))
+
+    def test_unanswered_tasks_time_out(self):
+        job_id = self.client.delete('/api/trips/1').get_json()['id']
+        self.reply(job_id, 'itinerary', deleted=4)
+
+        # Not before the timeout
+        self.assertEqual(self.job(job_id)['status'], 'running')
+        job = db.session.get(DeletionJob, job_id)
+        job.created_at = datetime.utcnow() - timedelta(seconds=deletion_jobs.DELETION_TASK_TIMEOUT + 1)
+        db.session.commit()
+
+        job = self.job(job_id)
+        self.assertEqual(job['status'], 'partial')
+        self.assertEqual([task['status'] for task in job['tasks']], ['completed', 'failed'])
+        self.assertIn('No reply within', job['tasks'][1]['error'])
+
+    def test_late_reply_recovers_the_job(self):
+        job_id = self.client.delete('/api/trips/1').get_json()['id']
+        job = db.session.get(DeletionJob, job_id)
+        job.created_at = datetime.utcnow() - timedelta(seconds=deletion_jobs.DELETION_TASK_TIMEOUT + 1)
+        db.session.commit()
+        self.assertEqual(self.job(job_id)['status'], 'partial')
+
+        self.reply(job_id, 'itinerary', deleted=4)
+        self.reply(job_id, 'finance', deleted=2)
+        job = self.job(job_id)
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual([task['deleted'] for task in job['tasks']], [4, 2])
+
+        # A repeated failure doesn't undo a completed task
+        self.reply(job_id, 'finance', 'failed', error='late duplicate')
+        job = self.job(job_id)
+        self.assertEqual((job['status'], job['tasks'][1]['status']), ('completed', 'completed'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import sys
+import base64
+import json
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+
+from app.models import db, Trip
+from app.routes import register_routes
+from app.trip_listing import encode_cursor, decode_cursor, TripListingError
+
+def create_test_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['TESTING'] = True
+    db.init_app(app)
+    register_routes(app)
+    return app
+
+class TripListingTest(unittest.TestCase):
+    def setUp(self):
+        self.app = create_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+        db.create_all()
+        self.client = self.app.test_client()
+
+        # Seven trips of user 1, two of them on the same day so ids break the tie
+        start = datetime(2025, 1, 1)
+        days = [0, 10, 10, 20, 30, 40, 50]
+        cities = ['Tokyo', 'Paris', 'Tokyo', 'Rome', 'tokyo', 'Oslo', 'Lima']
+        for day, city in zip(days, cities):
+            db.session.add(Trip(user_id=1, group_id=7, city=city,
+                                start_date=start + timedelta(days=day), end_date=start + timedelta(days=day + 3)))
+        db.session.add(Trip(user_id=2, city='Tokyo', start_date=start, end_date=start))
+        db.session.commit()
+
+    def pages(self, url):
+        """Follow X-Next-Cursor through every page, returning the pages' trip ids"""
+        pages = []
+        cursor = None
+        while True:
+            response = self.client.get(url + (f"&cursor={cursor}" if cursor else ''))
+            self.assertEqual(response.status_code, 200)
+            pages.append([trip['id'] for trip in response.get_json()])
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor:
+                return pages
+
+    def test_cursor_round_trip(self):
+        trip = db.session.get(Trip, 3)
+        self.assertEqual(decode_cursor(encode_cursor(trip)), (trip.start_date, 3))
+        # URL-safe and unpadded
+        self.assertNotIn('=', encode_cursor(trip))
+
+    def test_pages_cover_every_trip_once(self):
+        self.assertEqual(self.pages('/api/users/1/trips?limit=3'), [[1, 2, 3], [4, 5, 6], [7]])
+        self.assertEqual(self.pages('/api/users/1/trips?limit=3&order=desc'), [[7, 6, 5], [4, 3, 2], [1]])
+        # A page ending exactly on the last trip has no next page
+        self.assertEqual(self.pages('/api/users/1/trips?limit=7'), [[1, 2, 3, 4, 5, 6, 7]])
+
+    def test_next_link_keeps_the_filters(self):
+        response = self.client.get('/api/users/1/trips?limit=1&city=TOKYO')
+        self.assertEqual(response.get_json()[0]['id'], 1)
+        self.assertIn('city=TOKYO', response.headers['Link'])
+        self.assertIn(f"cursor={response.headers['X-Next-Cursor']}", response.headers['Link'])
+        self.assertEqual(self.pages('/api/users/1/trips?limit=2&city=TOKYO'), [[1, 3], [5]])
+
+    def test_filters_and_fields(self):
+        response = self.client.get('/api/users/1/trips?from=2025-01-12&to=2025-01-21&fields=id,city')
+        self.assertEqual(response.get_json(), [{'id': 2, 'city': 'Paris'}, {'id': 3, 'city': 'Tokyo'}, {'id': 4, 'city': 'Rome'}])
+
+    def test_group_trips(self):
+        self.assertEqual(self.pages('/api/groups/7/trips?limit=4'), [[1, 2, 3, 4], [5, 6, 7]])
+        # An empty first page is a page like any other
+        response = self.client.get('/api/groups/8/trips')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), [])
+        self.assertNotIn('X-Next-Cursor', response.headers)
+        self.assertEqual(self.client.get('/api/groups/7/trips?city=Cairo').get_json(), [])
+
+    def test_invalid_parameters(self):
+        for query in ('limit=0', 'limit=1000', 'limit=many', 'order=sideways', 'fields=id,password', 'from=yesterday'):
+            response = self.client.get(f"/api/users/1/trips?{query}")
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_invalid_cursors(self):
+        def encode(value):
+            return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip('=')
+
+        cursors = ['!!!', 'bm90IGpzb24', encode({'a': 1}), encode(['2025-01-01']), encode([None, 1]),
+                   encode(['yesterday', 1]), encode(['2025-01-01', 'x']), encode(5)]
+        for cursor in cursors:
+            with self.assertRaises(TripListingError, msg=cursor):
+                decode_cursor(cursor)
+            response = self.client.get(f"/api/users/1/trips?cursor={cursor}")
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertEqual(response.get_json(), {'error': 'Invalid cursor'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,25 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.passwords import hash_password, verify_password, needs_rehash
 
 db = SQLAlchemy()
 
+# Full name as searched; the trigram index is built on this exact expression
+NAME_SQL = "lower(coalesce(first_name, '') || ' ' || coalesce(last_name, ''))"
+
 class User(db.Model):
     __tablename__ = 'users'
     
+    # Searches match lowercased emails and names by substring through pg_trgm,
+    # and emails exactly or by prefix through the pattern index. Postgres only.
+    __table_args__ = (
+        db.Index('ix_users_email_pattern', db.text('lower(email) text_pattern_ops')).ddl_if(dialect='postgresql'),
+        db.Index('ix_users_email_trgm', db.text('lower(email) gin_trgm_ops'),
+                 postgresql_using='gin').ddl_if(dialect='postgresql'),
+        db.Index('ix_users_name_trgm', db.text(f'({NAME_SQL}) gin_trgm_ops'),
+                 postgresql_using='gin').ddl_if(dialect='postgresql'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(100), unique=True, nullable=False)
     password_hash = db.Column(db.String(200), nullable=False)
@@ -18,13 +31,20 @@ class User(db.Model):
     
     def __init__(self, email, password, first_name=None, last_name=None, profile_picture=None):
         self.email = email
-        self.password_hash = generate_password_hash(password)
+        self.set_password(password)
         self.first_name = first_name
         self.last_name = last_name
         self.profile_picture = profile_picture
     
+    # Hashing runs in the password pool and raises PasswordHashingBusy when it's saturated
+    def set_password(self, password):
+        self.password_hash = hash_password(password)
+    
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        return needs_rehash(self.password_hash)
     
     def to_dict(self):
         return {
@@ -44,4 +64,8 @@ class User(db.Model):
             'first_name': self.first_name,
             'last_name': self.last_name,
             'profile_picture': self.profile_picture
-        } 
\ No newline at end of file
+        }
+
+# Search keys, matching the expressions of the indexes above
+EMAIL_KEY = db.func.lower(User.email)
+NAME_KEY = db.literal_column(NAME_SQL)
@@ -0,0 +1,239 @@
+import os
+import hashlib
+import logging
+import math
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Processes hashing passwords, so logins never hold up the request threads.
+# Every gunicorn worker has its own, so the CPUs are split between them
+PASSWORD_HASH_WORKERS = int(os.getenv(
+    'PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // int(os.getenv('WEB_CONCURRENCY', 1)))
+))
+
+# Hashes queued or running beyond this are rejected at once with a 503
+# rather than piling up behind each other
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', 4 * PASSWORD_HASH_WORKERS))
+
+# Seconds a request waits for its hash before giving up with a 503
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 5))
+
+# The scrypt cost is calibrated at startup so that one hash takes about
+# PASSWORD_HASH_TARGET_MS on this machine, within the bounds below. Under
+# gunicorn it's calibrated once in the master, see calibrate_for_workers.
+# Setting PASSWORD_HASH_METHOD (e.g. scrypt:32768:8:1) skips the calibration.
+PASSWORD_HASH_TARGET_MS = float(os.getenv('PASSWORD_HASH_TARGET_MS', 250))
+PASSWORD_HASH_MIN_N = int(os.getenv('PASSWORD_HASH_MIN_N', 2 ** 15))
+PASSWORD_HASH_MAX_N = int(os.getenv('PASSWORD_HASH_MAX_N', 2 ** 16))
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD')
+
+# scrypt block size and parallelism, Werkzeug's defaults
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+_executor = None
+_executor_lock = threading.Lock()
+_method = PASSWORD_HASH_METHOD
+
+# Hashes queued or running, and the counters reported by pool_stats, all
+# updated by the request threads under _stats_lock
+_pending = 0
+_stats = {'hashed': 0, 'verified': 0, 'rejected': 0, 'timed_out': 0}
+_stats_lock = threading.Lock()
+
+class PasswordHashingBusy(Exception):
+    """Raised when the hashing pool is saturated or a hash took too long"""
+
+def _time_scrypt(n, rounds=3):
+    """Return the fastest of a few scrypt runs at cost n, in milliseconds"""
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        hashlib.scrypt(b'calibration', salt=b'calibration-salt', n=n, r=SCRYPT_R, p=SCRYPT_P,
+                       maxmem=132 * n * SCRYPT_R * SCRYPT_P)
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+def calibrate_method(target_ms=PASSWORD_HASH_TARGET_MS):
+    """
+    Pick the scrypt cost whose hashes take closest to target_ms.
+
+    scrypt time grows linearly with n, which must be a power of two, so one
+    timing at the minimum cost is enough to extrapolate.
+    """
+    elapsed = _time_scrypt(PASSWORD_HASH_MIN_N)
+    doublings = round(math.log2(target_ms / elapsed)) if elapsed > 0 else 0
+    n = max(PASSWORD_HASH_MIN_N, min(PASSWORD_HASH_MAX_N, PASSWORD_HASH_MIN_N * 2 ** max(doublings, 0)))
+    logger.info(f"Calibrated password hashing: n={n}, {elapsed * n / PASSWORD_HASH_MIN_N:.0f}ms per hash")
+    return f"scrypt:{n}:{SCRYPT_R}:{SCRYPT_P}"
+
+def calibrate_for_workers():
+    """
+    Calibrate the hash cost once, before the gunicorn workers are forked.
+
+    The method is exported as PASSWORD_HASH_METHOD, so every worker hashes
+    with the same parameters, whether the app is preloaded or not and
+    including workers restarted later. Separately calibrated workers could
+    each pick a different n.
+    """
+    global _method
+    if _method is None:
+        _method = calibrate_method()
+    os.environ['PASSWORD_HASH_METHOD'] = _method
+    return _method
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Forked rather than spawned, so workers don't re-run app.py.
+            # They only hash, and share nothing with the request threads.
+            _executor = ProcessPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS,
+                mp_context=multiprocessing.get_context('fork')
+            )
+        return _executor
+
+def _reset_executor(executor):
+    """Replace a pool whose worker died, so the next request gets a fresh one"""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+def _reserve_slot():
+    """Take one of the PASSWORD_HASH_MAX_PENDING slots, or return False if none is free"""
+    global _pending
+    with _stats_lock:
+        if _pending >= PASSWORD_HASH_MAX_PENDING:
+            _stats['rejected'] += 1
+            return False
+        _pending += 1
+        return True
+
+def _release_slot(*_):
+    global _pending
+    with _stats_lock:
+        _pending -= 1
+
+def _run(fn, *args):
+    """Run fn in the pool, rejecting it straight away if the pool is saturated"""
+    if not _reserve_slot():
+        raise PasswordHashingBusy("Too many password hashes in progress")
+
+    executor = _get_executor()
+    try:
+        future = executor.submit(fn, *args)
+    except BrokenProcessPool:
+        _release_slot()
+        _reset_executor(executor)
+        raise PasswordHashingBusy("Password hashing pool restarted")
+    # The slot is held until the hash is done, even if the request gave up on it
+    future.add_done_callback(_release_slot)
+
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except TimeoutError:
+        _count('timed_out')
+        raise PasswordHashingBusy(f"Password hashing took over {PASSWORD_HASH_TIMEOUT} seconds")
+    except BrokenProcessPool:
+        _reset_executor(executor)
+        raise PasswordHashingBusy("Password hashing pool restarted")
+
+def start_password_pool():
+    """
+    Start the hashing processes and calibrate the hash cost.
+
+    Call before any other threads are started, so the workers are forked
+    from a single-threaded process.
+    """
+    global _method
+    executor = _get_executor()
+    if _method is None:
+        _method = executor.submit(calibrate_method).result()
+    else:
+        # Fork the workers now rather than on the first login
+        executor.submit(int).result()
+    return _method
+
+def current_method():
+    """The method and parameters new hashes are generated with"""
+    global _method
+    if _method is None:
+        _method = _run(calibrate_method)
+    return _method
+
+def hash_password(password):
+    """
+    Hash a password in the pool.
+
+    Raises:
+        PasswordHashingBusy: If the pool is saturated or the hash timed out
+    """
+    password_hash = _run(generate_password_hash, password, current_method())
+    _count('hashed')
+    return password_hash
+
+def verify_password(password_hash, password):
+    """
+    Check a password against its hash in the pool.
+
+    Raises:
+        PasswordHashingBusy: If the pool is saturated or the check timed out
+    """
+    valid = _run(check_password_hash, password_hash, password)
+    _count('verified')
+    return valid
+
+def _scrypt_cost(method):
+    """Return the (n, r, p) of a "scrypt:n:r:p" method, or None for other methods"""
+    name, *params = method.split(':')
+    if name != 'scrypt' or len(params) != 3:
+        return None
+    try:
+        return tuple(int(param) for param in params)
+    except ValueError:
+        return None
+
+def needs_rehash(password_hash):
+    """
+    Whether a hash is weaker than the current method's.
+
+    Stronger scrypt hashes are kept, so servers calibrated to different
+    costs don't rehash each other's hashes back and forth on every login.
+    A hash made with another algorithm is always replaced.
+    """
+    method = password_hash.split('$', 1)[0]
+    current = current_method()
+    if method == current:
+        return False
+
+    cost, current_cost = _scrypt_cost(method), _scrypt_cost(current)
+    if cost is None or current_cost is None:
+        return True
+    return any(have < wanted for have, wanted in zip(cost, current_cost))
+
+def pool_stats():
+    """Return the hashing method, pool size and counters"""
+    with _stats_lock:
+        return {
+            'method': _method,
+            'workers': PASSWORD_HASH_WORKERS,
+            'max_pending': PASSWORD_HASH_MAX_PENDING,
+            'pending': _pending,
+            **_stats
+        }
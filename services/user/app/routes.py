@@ -1,6 +1,19 @@
 from flask import request, jsonify, session
+from urllib.parse import urlencode
 from app.models import db, User
-from werkzeug.security import generate_password_hash
+from app.passwords import PasswordHashingBusy, pool_stats
+from app.tokens import SessionTokenError, verify_token, bearer_token, key_set, token_response
+from app.user_search import search_users as find_users, resolve_emails, resolve_ids, UserSearchError
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def hashing_busy_response(error):
+    """503 asking the client to retry once the password pool has caught up"""
+    logger.warning(f"Rejected password request: {error}")
+    return jsonify({'error': 'Service busy, please try again'}), 503, {'Retry-After': '1'}
 
 def register_routes(app):
     # Register a new user
@@ -19,13 +32,16 @@ def register_routes(app):
             return jsonify({'error': 'Email already registered'}), 400
         
         # Create new user
-        new_user = User(
-            email=data['email'],
-            password=data['password'],
-            first_name=data.get('first_name'),
-            last_name=data.get('last_name'),
-            profile_picture=data.get('profile_picture')
-        )
+        try:
+            new_user = User(
+                email=data['email'],
+                password=data['password'],
+                first_name=data.get('first_name'),
+                last_name=data.get('last_name'),
+                profile_picture=data.get('profile_picture')
+            )
+        except PasswordHashingBusy as e:
+            return hashing_busy_response(e)
         
         db.session.add(new_user)
         db.session.commit()
@@ -33,7 +49,8 @@ def register_routes(app):
         return jsonify({
             'message': 'User registered successfully',
             'user': new_user.to_dict(),
-            'user_id': new_user.id
+            'user_id': new_user.id,
+            **token_response(new_user)
         }), 201
     
     # User login
@@ -49,13 +66,27 @@ def register_routes(app):
         user = User.query.filter_by(email=data['email']).first()
         
         # Check if user exists and password is correct
-        if not user or not user.check_password(data['password']):
-            return jsonify({'error': 'Invalid email or password'}), 401
+        try:
+            if not user or not user.check_password(data['password']):
+                return jsonify({'error': 'Invalid email or password'}), 401
+        except PasswordHashingBusy as e:
+            return hashing_busy_response(e)
+        
+        # Upgrade hashes made with older parameters while we have the password.
+        # The login still succeeds if the pool is too busy, it's retried next time.
+        try:
+            if user.password_needs_rehash():
+                user.set_password(data['password'])
+                db.session.commit()
+                logger.info(f"Rehashed password of user {user.id}")
+        except PasswordHashingBusy:
+            pass
         
         return jsonify({
             'message': 'Login successful',
             'user': user.to_dict(),
-            'user_id': user.id
+            'user_id': user.id,
+            **token_response(user)
         }), 200
     
     # Get user profile
@@ -81,13 +112,19 @@ def register_routes(app):
         
         # Update password if provided
         if 'password' in data:
-            user.password_hash = generate_password_hash(data['password'])
+            try:
+                user.set_password(data['password'])
+            except PasswordHashingBusy as e:
+                db.session.rollback()
+                return hashing_busy_response(e)
         
         db.session.commit()
         
+        # The token carries the profile, so a new one is returned with the changes
         return jsonify({
             'message': 'Profile updated successfully',
-            'user': user.to_dict()
+            'user': user.to_dict(),
+            **token_response(user)
         }), 200
     
     # Get user by ID (public profile)
@@ -96,12 +133,58 @@ def register_routes(app):
         user = User.query.get_or_404(user_id)
         return jsonify(user.to_public_dict()), 200
     
-    # Search users by email
+    # Search users by email or name, a page at a time; see user_search for the parameters
     @app.route('/api/users/search', methods=['GET'])
     def search_users():
-        query = request.args.get('q', '')
-        if not query:
-            return jsonify({'error': 'Query parameter is required'}), 400
+        try:
+            users, next_cursor = find_users(request.args)
+        except UserSearchError as e:
+            return jsonify({'error': str(e)}), 400
         
-        users = User.query.filter(User.email.ilike(f'%{query}%')).all()
-        return jsonify([user.to_public_dict() for user in users]), 200 
\ No newline at end of file
+        # The cursor of the next page goes in X-Next-Cursor and Link
+        headers = {}
+        if next_cursor:
+            args = request.args.to_dict()
+            args['cursor'] = next_cursor
+            headers['X-Next-Cursor'] = next_cursor
+            headers['Link'] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+        return jsonify(users), 200, headers
+    
+    # Resolve a batch of exact emails, or of IDs, to users in one query
+    @app.route('/api/users/resolve', methods=['POST'])
+    def resolve_users():
+        data = request.get_json(silent=True) or {}
+        try:
+            if 'ids' in data:
+                users, missing = resolve_ids(data['ids'])
+            else:
+                users, missing = resolve_emails(data.get('emails'))
+        except UserSearchError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'users': users, 'missing': missing}), 200
+    
+    # Exchange a valid session token for a new one with a fresh expiry and profile
+    @app.route('/api/users/token/refresh', methods=['POST'])
+    def refresh_token():
+        token = bearer_token(request.headers)
+        if not token:
+            return jsonify({'error': 'Bearer token is required'}), 401
+        try:
+            claims = verify_token(token)
+        except SessionTokenError as e:
+            return jsonify({'error': 'Invalid session token', 'details': str(e)}), 401
+        
+        user = User.query.get(int(claims['sub']))
+        if not user:
+            return jsonify({'error': 'User no longer exists'}), 401
+        return jsonify(token_response(user)), 200
+    
+    # Public keys other services verify session tokens with
+    @app.route('/api/users/.well-known/jwks.json', methods=['GET'])
+    def get_signing_keys():
+        return jsonify(key_set()), 200, {'Cache-Control': 'public, max-age=300'}
+    
+    # Password hashing pool status
+    @app.route('/api/users/password-hashing', methods=['GET'])
+    def get_password_hashing_stats():
+        return jsonify(pool_stats()), 200
@@ -0,0 +1,171 @@
+"""
+Production serving with gunicorn.
+
+Every Flask service is served by gunicorn, configured by the
+gunicorn.conf.py next to its app.py from the settings below. The master
+process loads the app once, running its migrations, and forks
+WEB_CONCURRENCY worker processes serving requests on WEB_THREADS threads
+each. Workers are replaced after about WEB_MAX_REQUESTS requests, and all
+of them gracefully on SIGHUP.
+
+Work that must run once per service instance rather than once per worker,
+like the RabbitMQ consumers, is registered with run_once(). It's started
+by whichever worker holds an exclusive lock on a file in
+BACKGROUND_LOCK_DIR, and stopped when that worker exits; another worker
+then takes the lock over within BACKGROUND_LOCK_RETRY seconds. The worker
+holding the lock is never replaced for having served too many requests.
+Requests served by the other workers signal that work through a Wakeup.
+
+The same module is used by every Flask service (calendar,
+expense-management, finance, group-management, itinerary, trip-management
+and user), so keep the copies identical.
+"""
+import fcntl
+import logging
+import os
+import select
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Worker processes, one per CPU available by default, and the threads
+# serving requests in each
+_cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', _cpus))
+WEB_THREADS = int(os.getenv('WEB_THREADS', 8))
+
+# Load the app in the master before forking, so migrations run once and
+# workers share its memory; new code then needs a restart, not a SIGHUP
+WEB_PRELOAD = os.getenv('WEB_PRELOAD', 'true').lower() == 'true'
+
+# Requests a worker serves before it's replaced, plus up to the jitter so
+# workers aren't all replaced at once
+WEB_MAX_REQUESTS = int(os.getenv('WEB_MAX_REQUESTS', 10000))
+WEB_MAX_REQUESTS_JITTER = int(os.getenv('WEB_MAX_REQUESTS_JITTER', 1000))
+
+# Seconds a worker may go silent before it's killed and replaced, and
+# seconds stopping workers get to finish their requests and messages
+WEB_TIMEOUT = int(os.getenv('WEB_TIMEOUT', 30))
+WEB_GRACEFUL_TIMEOUT = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 40))
+
+# Seconds an idle keep-alive connection is kept open
+WEB_KEEPALIVE = int(os.getenv('WEB_KEEPALIVE', 5))
+
+# Directory of the lock files electing the worker that runs the background
+# work; one per service instance, e.g. the container's /tmp
+BACKGROUND_LOCK_DIR = os.getenv('BACKGROUND_LOCK_DIR', tempfile.gettempdir())
+
+# Seconds between two attempts of the other workers to take the lock over
+BACKGROUND_LOCK_RETRY = float(os.getenv('BACKGROUND_LOCK_RETRY', 5))
+
+_worker_hooks = []
+# Format: {name: (start, stop)}
+_background = {}
+# Stop functions of the background work started in this process, and the
+# lock files it holds, kept open for as long as the process lives
+_running = []
+_held_locks = []
+
+def at_worker_start(hook):
+    """Call hook in every worker right after it's forked, e.g. to drop inherited database connections"""
+    _worker_hooks.append(hook)
+    return hook
+
+def run_once(name, start, stop=None):
+    """
+    Run background work in one worker of the service instance.
+
+    Args:
+        name: Name of the lock file, unique per service
+        start: Starts the work, without blocking
+        stop: Stops it when the worker running it exits
+    """
+    _background[name] = (start, stop)
+
+def _hold_lock(worker, name, start, stop):
+    """Wait for the lock of name, then start its work in this worker"""
+    lock_file = open(os.path.join(BACKGROUND_LOCK_DIR, f"{name}.lock"), 'a')
+    while worker.alive:
+        try:
+            # Held until the process exits, however it exits
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            time.sleep(BACKGROUND_LOCK_RETRY)
+            continue
+
+        _held_locks.append(lock_file)
+        worker.max_requests = sys.maxsize
+        logger.info(f"Worker {os.getpid()} is running the {name} background work")
+        try:
+            start()
+        except Exception as e:
+            logger.error(f"Error starting the {name} background work: {e}")
+            logger.error(traceback.format_exc())
+        if stop:
+            _running.append(stop)
+        return
+
+class Wakeup:
+    """
+    A wake-up signal like threading.Event's set() and wait(), that any
+    process of the service instance can set, through a named pipe in
+    BACKGROUND_LOCK_DIR.
+    """
+
+    def __init__(self, name):
+        self.path = os.path.join(BACKGROUND_LOCK_DIR, f"{name}.wakeup")
+        self._fd = None
+        self._lock = threading.Lock()
+
+    def _pipe(self):
+        # Opened on first use, read and write so it never blocks on the other end
+        with self._lock:
+            if self._fd is None:
+                try:
+                    os.mkfifo(self.path)
+                except FileExistsError:
+                    pass
+                self._fd = os.open(self.path, os.O_RDWR | os.O_NONBLOCK)
+            return self._fd
+
+    def set(self):
+        try:
+            os.write(self._pipe(), b'.')
+        except BlockingIOError:
+            # The pipe is full of wake-ups nobody has waited for yet
+            pass
+
+    def wait(self, timeout):
+        """Wait until set, or for timeout seconds, and clear it"""
+        fd = self._pipe()
+        select.select([fd], [], [], timeout)
+        try:
+            while os.read(fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+# gunicorn server hooks, see gunicorn.conf.py
+
+def post_fork(server, worker):
+    for hook in _worker_hooks:
+        hook()
+
+def post_worker_init(worker):
+    for name, (start, stop) in _background.items():
+        thread = threading.Thread(target=_hold_lock, args=(worker, name, start, stop), name=f"{name}-lock")
+        thread.daemon = True
+        thread.start()
+
+def worker_exit(server, worker):
+    for stop in _running:
+        try:
+            stop()
+        except Exception as e:
+            logger.error(f"Error stopping background work: {e}")
@@ -0,0 +1,109 @@
+import os
+import base64
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+
+import jwt
+from jwt.algorithms import OKPAlgorithm
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Ed25519 private key in PEM, given directly or as a file, and required
+# unless APP_ENV is development. Every worker process must sign with the same
+# key, so the key can't be generated at startup.
+SESSION_SIGNING_KEY = os.getenv('SESSION_SIGNING_KEY')
+SESSION_SIGNING_KEY_FILE = os.getenv('SESSION_SIGNING_KEY_FILE')
+
+# In development a missing key is replaced by a temporary one, and tokens
+# don't survive restarts nor verify across worker processes
+APP_ENV = os.getenv('APP_ENV', 'production')
+
+# Lifetime of session tokens in seconds; clients refresh them before they expire
+SESSION_TOKEN_TTL = int(os.getenv('SESSION_TOKEN_TTL', 900))
+SESSION_TOKEN_ISSUER = os.getenv('SESSION_TOKEN_ISSUER', 'user-service')
+
+ALGORITHM = 'EdDSA'
+
+class SessionTokenError(Exception):
+    """Raised when a session token is missing, malformed, expired or forged"""
+
+def _load_private_key():
+    pem = SESSION_SIGNING_KEY
+    if not pem and SESSION_SIGNING_KEY_FILE:
+        with open(SESSION_SIGNING_KEY_FILE) as key_file:
+            pem = key_file.read()
+    if pem:
+        return serialization.load_pem_private_key(pem.encode(), password=None)
+
+    if APP_ENV != 'development':
+        raise RuntimeError(
+            "SESSION_SIGNING_KEY or SESSION_SIGNING_KEY_FILE must be set, "
+            "e.g. to a key from `openssl genpkey -algorithm ed25519`"
+        )
+    logger.warning("SESSION_SIGNING_KEY not set, signing session tokens with a temporary key")
+    return Ed25519PrivateKey.generate()
+
+_private_key = _load_private_key()
+_public_key = _private_key.public_key()
+
+# Key ID derived from the public key, so verifiers notice a rotated key
+_key_id = base64.urlsafe_b64encode(hashlib.sha256(
+    _public_key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+).digest()[:12]).decode().rstrip('=')
+
+def issue_token(user):
+    """
+    Sign a session token carrying the user's public profile.
+
+    Returns:
+        Tuple: (token, seconds until it expires)
+    """
+    now = datetime.now(timezone.utc)
+    profile = user.to_public_dict()
+    claims = {
+        'sub': str(profile.pop('id')),
+        **profile,
+        'iss': SESSION_TOKEN_ISSUER,
+        'iat': now,
+        'exp': now + timedelta(seconds=SESSION_TOKEN_TTL)
+    }
+    token = jwt.encode(claims, _private_key, algorithm=ALGORITHM, headers={'kid': _key_id})
+    return token, SESSION_TOKEN_TTL
+
+def verify_token(token):
+    """
+    Check a token issued by this service and return its claims.
+
+    Raises:
+        SessionTokenError: If the token is invalid or expired
+    """
+    try:
+        return jwt.decode(
+            token, _public_key, algorithms=[ALGORITHM], issuer=SESSION_TOKEN_ISSUER,
+            options={'require': ['sub', 'iat', 'exp']}
+        )
+    except jwt.PyJWTError as e:
+        raise SessionTokenError(str(e))
+
+def bearer_token(headers):
+    """Return the token of an `Authorization: Bearer` header, or None"""
+    scheme, _, token = headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None
+    return token.strip()
+
+def key_set():
+    """The public keys verifying session tokens, as a JWK set"""
+    jwk = OKPAlgorithm.to_jwk(_public_key, as_dict=True)
+    jwk.update({'kid': _key_id, 'alg': ALGORITHM, 'use': 'sig'})
+    return {'keys': [jwk]}
+
+def token_response(user):
+    """The token fields returned by login, registration and refresh"""
+    token, expires_in = issue_token(user)
+    return {'token': token, 'token_type': 'Bearer', 'expires_in': expires_in}
@@ -0,0 +1,145 @@
+import base64
+import json
+
+from sqlalchemy import case, or_, tuple_
+
+from app.models import db, User, EMAIL_KEY, NAME_KEY
+
+# Page size of searches, unless the client asks for another one
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Shorter queries can't use the trigram indexes, so they only match the
+# start of emails, through the lower(email) pattern index
+MIN_SUBSTRING_LENGTH = 3
+
+# Most emails or IDs resolved in one request
+MAX_RESOLVE_BATCH = 200
+
+class UserSearchError(ValueError):
+    """Raised when the parameters of a search or resolve request are invalid"""
+
+def encode_cursor(rank, email, user_id):
+    """Opaque cursor pointing just after a result in (rank, email, id) order"""
+    data = json.dumps([rank, email, user_id])
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        rank, email, user_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return int(rank), str(email), int(user_id)
+    except (ValueError, TypeError):
+        raise UserSearchError("Invalid cursor")
+
+def _like_pattern(query, prefix_only):
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"{escaped}%" if prefix_only else f"%{escaped}%"
+
+def search_users(args):
+    """
+    Return one page of the users whose email or name contains `q`.
+
+    Matching is case-insensitive and served by the pg_trgm indexes on the
+    lowercased email and full name. Results are ranked exact email match
+    first, then emails and then names starting with the query, then other
+    matches, and ordered by email within a rank.
+
+    Query parameters:
+        q: Text to search for
+        limit: Page size, up to MAX_PAGE_SIZE
+        cursor: X-Next-Cursor of the previous page
+
+    Returns:
+        Tuple: (list of public user dicts, cursor of the next page or None)
+
+    Raises:
+        UserSearchError: If a parameter is invalid
+    """
+    query = args.get('q', '').strip().lower()
+    if not query:
+        raise UserSearchError("Query parameter is required")
+
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise UserSearchError("limit must be an integer")
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise UserSearchError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    prefix = _like_pattern(query, prefix_only=True)
+    if len(query) < MIN_SUBSTRING_LENGTH:
+        match = EMAIL_KEY.like(prefix, escape='\\')
+    else:
+        substring = _like_pattern(query, prefix_only=False)
+        match = or_(EMAIL_KEY.like(substring, escape='\\'), NAME_KEY.like(substring, escape='\\'))
+
+    rank = case(
+        (EMAIL_KEY == query, 0),
+        (EMAIL_KEY.like(prefix, escape='\\'), 1),
+        (NAME_KEY.like(prefix, escape='\\'), 2),
+        else_=3
+    )
+
+    search = db.session.query(User, rank, EMAIL_KEY).filter(match)
+    if args.get('cursor'):
+        search = search.filter(tuple_(rank, EMAIL_KEY, User.id) > tuple_(*decode_cursor(args['cursor'])))
+
+    # Fetch one extra row to know whether there is a next page
+    rows = search.order_by(rank, EMAIL_KEY, User.id).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        user, user_rank, email = rows[limit - 1]
+        next_cursor = encode_cursor(user_rank, email, user.id)
+    return [user.to_public_dict() for user, _, _ in rows[:limit]], next_cursor
+
+def resolve_emails(emails):
+    """
+    Look up users by exact email, case-insensitively, in one query.
+
+    Returns:
+        Tuple: (public user dicts in the order of the emails, emails with no user)
+
+    Raises:
+        UserSearchError: If emails isn't a list of at most MAX_RESOLVE_BATCH strings
+    """
+    if not isinstance(emails, list) or not all(isinstance(email, str) for email in emails):
+        raise UserSearchError("emails must be a list of strings")
+    if len(emails) > MAX_RESOLVE_BATCH:
+        raise UserSearchError(f"At most {MAX_RESOLVE_BATCH} emails can be resolved at once")
+
+    keys = list(dict.fromkeys(email.strip().lower() for email in emails if email.strip()))
+    users = {}
+    if keys:
+        users = {user.email.lower(): user for user in User.query.filter(EMAIL_KEY.in_(keys))}
+
+    found = [users[key].to_public_dict() for key in keys if key in users]
+    missing = [key for key in keys if key not in users]
+    return found, missing
+
+def resolve_ids(user_ids):
+    """
+    Look up users by ID in one query.
+
+    Returns:
+        Tuple: (public user dicts in the order of the IDs, IDs with no user)
+
+    Raises:
+        UserSearchError: If user_ids isn't a list of at most MAX_RESOLVE_BATCH integers
+    """
+    if not isinstance(user_ids, list):
+        raise UserSearchError("ids must be a list of integers")
+    if len(user_ids) > MAX_RESOLVE_BATCH:
+        raise UserSearchError(f"At most {MAX_RESOLVE_BATCH} users can be resolved at once")
+    try:
+        keys = list(dict.fromkeys(int(user_id) for user_id in user_ids))
+    except (TypeError, ValueError):
+        raise UserSearchError("ids must be a list of integers")
+
+    users = {}
+    if keys:
+        users = {user.id: user for user in User.query.filter(User.id.in_(keys))}
+
+    found = [users[key].to_public_dict() for key in keys if key in users]
+    missing = [key for key in keys if key not in users]
+    return found, missing
@@ -0,0 +1,110 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Sign session tokens with a temporary key
+os.environ.setdefault('APP_ENV', 'development')
+
+import unittest
+from unittest.mock import patch
+
+from flask import Flask
+
+from app import passwords
+from app.models import db, User
+from app.passwords import PasswordHashingBusy, hash_password, verify_password, needs_rehash, pool_stats
+from app.routes import register_routes
+
+# Cheap hashes, the cost itself isn't what's tested
+FAST_METHOD = 'scrypt:1024:8:1'
+FASTER_METHOD = 'scrypt:512:8:1'
+
+def create_test_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    register_routes(app)
+    return app
+
+class PasswordPoolTest(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(passwords, '_method', FAST_METHOD)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_hash_and_verify(self):
+        password_hash = hash_password('secret')
+        self.assertTrue(password_hash.startswith(FAST_METHOD + '$'))
+        self.assertTrue(verify_password(password_hash, 'secret'))
+        self.assertFalse(verify_password(password_hash, 'guess'))
+        self.assertEqual(pool_stats()['pending'], 0)
+
+    def test_needs_rehash(self):
+        password_hash = hash_password('secret')
+        self.assertFalse(needs_rehash(password_hash))
+        # Only weaker hashes are upgraded
+        with patch.object(passwords, '_method', FASTER_METHOD):
+            self.assertFalse(needs_rehash(password_hash))
+        with patch.object(passwords, '_method', 'scrypt:2048:8:1'):
+            self.assertTrue(needs_rehash(password_hash))
+        with patch.object(passwords, '_method', 'scrypt:1024:8:2'):
+            self.assertTrue(needs_rehash(password_hash))
+        # Hashes of other algorithms are always replaced
+        self.assertTrue(needs_rehash('pbkdf2:sha256:600000$salt$hash'))
+
+    def test_calibrated_once_for_all_workers(self):
+        self.addCleanup(os.environ.pop, 'PASSWORD_HASH_METHOD', None)
+        with patch.object(passwords, '_method', None), \
+                patch.object(passwords, 'calibrate_method', return_value=FASTER_METHOD) as calibrate:
+            self.assertEqual(passwords.calibrate_for_workers(), FASTER_METHOD)
+            self.assertEqual(passwords.calibrate_for_workers(), FASTER_METHOD)
+            self.assertEqual(passwords.current_method(), FASTER_METHOD)
+        calibrate.assert_called_once()
+        # Workers forked without the preloaded app read it back from the environment
+        self.assertEqual(os.environ['PASSWORD_HASH_METHOD'], FASTER_METHOD)
+
+    def test_saturated_pool_rejects_at_once(self):
+        rejected = pool_stats()['rejected']
+        with patch.object(passwords, 'PASSWORD_HASH_MAX_PENDING', 0):
+            with self.assertRaises(PasswordHashingBusy):
+                hash_password('secret')
+        self.assertEqual(pool_stats()['rejected'], rejected + 1)
+        self.assertEqual(pool_stats()['pending'], 0)
+
+class PasswordRoutesTest(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(passwords, '_method', FAST_METHOD)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.app = create_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+        db.create_all()
+        self.client = self.app.test_client()
+
+    def login(self):
+        response = self.client.post('/api/users/login', json={'email': 'ana@example.com', 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        return User.query.filter_by(email='ana@example.com').one().password_hash
+
+    def test_login_upgrades_weaker_hashes(self):
+        with patch.object(passwords, '_method', FASTER_METHOD):
+            self.client.post('/api/users/register', json={'email': 'ana@example.com', 'password': 'secret'})
+        self.assertTrue(self.login().startswith(FAST_METHOD + '$'))
+
+        # A server calibrated to a lower cost keeps the stronger hash
+        with patch.object(passwords, '_method', FASTER_METHOD):
+            self.assertTrue(self.login().startswith(FAST_METHOD + '$'))
+
+    def test_busy_pool_answers_503(self):
+        with patch.object(passwords, 'PASSWORD_HASH_MAX_PENDING', 0):
+            response = self.client.post('/api/users/register', json={'email': 'ana@example.com', 'password': 'secret'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(User.query.count(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
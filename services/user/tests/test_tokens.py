@@ -0,0 +1,55 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Sign session tokens with a temporary key
+os.environ.setdefault('APP_ENV', 'development')
+
+import unittest
+from unittest.mock import patch
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+from app import tokens
+from app.tokens import SessionTokenError, issue_token, verify_token, key_set, bearer_token
+
+class FakeUser:
+    def to_public_dict(self):
+        return {'id': 7, 'email': 'ana@example.com', 'first_name': 'Ana', 'last_name': None, 'profile_picture': None}
+
+class TokenTest(unittest.TestCase):
+    def test_issued_tokens_verify_against_the_key_set(self):
+        token, expires_in = issue_token(FakeUser())
+        self.assertEqual(expires_in, tokens.SESSION_TOKEN_TTL)
+        self.assertEqual(verify_token(token)['sub'], '7')
+
+        # As other services verify them
+        [jwk] = key_set()['keys']
+        self.assertEqual(jwt.get_unverified_header(token)['kid'], jwk['kid'])
+        claims = jwt.decode(token, jwt.PyJWK(jwk).key, algorithms=['EdDSA'], issuer='user-service')
+        self.assertEqual((claims['email'], claims['first_name']), ('ana@example.com', 'Ana'))
+
+        with self.assertRaises(SessionTokenError):
+            verify_token(token[:-4] + 'AAAA')
+
+    def test_bearer_token(self):
+        self.assertEqual(bearer_token({'Authorization': 'Bearer abc '}), 'abc')
+        self.assertIsNone(bearer_token({'Authorization': 'Basic abc'}))
+        self.assertIsNone(bearer_token({}))
+
+    def test_signing_key_required_outside_development(self):
+        pem = Ed25519PrivateKey.generate().private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ).decode()
+        with patch.multiple(tokens, SESSION_SIGNING_KEY=None, SESSION_SIGNING_KEY_FILE=None, APP_ENV='production'):
+            with self.assertRaises(RuntimeError):
+                tokens._load_private_key()
+        with patch.multiple(tokens, SESSION_SIGNING_KEY=pem, APP_ENV='production'):
+            key = tokens._load_private_key()
+        self.assertEqual(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                           serialization.NoEncryption()).decode(), pem)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Sign session tokens with a temporary key
+os.environ.setdefault('APP_ENV', 'development')
+
+import unittest
+from unittest.mock import patch
+
+from flask import Flask
+
+from app import models
+from app.models import db, User
+from app.routes import register_routes
+from app.user_search import encode_cursor, decode_cursor, UserSearchError
+
+def create_test_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    register_routes(app)
+    return app
+
+class UserSearchTest(unittest.TestCase):
+    def setUp(self):
+        # Passwords aren't searched, so they aren't hashed in the pool
+        patcher = patch.object(models, 'hash_password', lambda password: 'unhashed')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.app = create_test_app()
+        self.context = self.app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+        db.create_all()
+        self.client = self.app.test_client()
+
+        for email, first_name, last_name in [
+            ('zoe.annabel@example.com', 'Zoe', 'Annabel'),    # name contains the query
+            ('anna@example.com', 'Anna', 'Smith'),            # email starts with the query
+            ('bob@example.com', 'Anna', 'Jones'),             # name starts with the query
+            ('Anna.Lee@example.com', 'Lee', None),            # email starts with the query
+            ('anna.b@example.com', None, None),               # email starts with the query
+            ('joanna@example.com', 'Jo', 'Doe'),              # email contains the query
+            ('carl@example.com', 'Carl', 'Berg'),             # no match
+            ('a.bob@example.com', None, None),
+        ]:
+            db.session.add(User(email=email, password='secret', first_name=first_name, last_name=last_name))
+        db.session.commit()
+
+    def search(self, query):
+        response = self.client.get(f"/api/users/search?{query}")
+        self.assertEqual(response.status_code, 200)
+        return [user['email'] for user in response.get_json()], response
+
+    def test_ranking(self):
+        emails, _ = self.search('q=ANNA')
+        self.assertEqual(emails, [
+            # Emails starting with the query, by email
+            'anna.b@example.com', 'Anna.Lee@example.com', 'anna@example.com',
+            # Names starting with it
+            'bob@example.com',
+            # Anything else containing it
+            'joanna@example.com', 'zoe.annabel@example.com',
+        ])
+        # An exact email comes first
+        self.assertEqual(self.search('q=Bob@Example.com')[0], ['bob@example.com', 'a.bob@example.com'])
+
+    def test_short_queries_only_match_email_prefixes(self):
+        emails, _ = self.search('q=an')
+        self.assertEqual(emails, ['anna.b@example.com', 'Anna.Lee@example.com', 'anna@example.com'])
+        # Wildcards are matched literally
+        self.assertEqual(self.search('q=%25')[0], [])
+
+    def test_cursor_pages_through_every_rank(self):
+        pages = []
+        url = '/api/users/search?q=anna&limit=4'
+        while url:
+            response = self.client.get(url)
+            pages.append([user['email'] for user in response.get_json()])
+            cursor = response.headers.get('X-Next-Cursor')
+            url = f"/api/users/search?q=anna&limit=4&cursor={cursor}" if cursor else None
+            if cursor:
+                self.assertIn(f"cursor={cursor}", response.headers['Link'])
+        self.assertEqual(pages, [
+            ['anna.b@example.com', 'Anna.Lee@example.com', 'anna@example.com', 'bob@example.com'],
+            ['joanna@example.com', 'zoe.annabel@example.com'],
+        ])
+
+    def test_cursor_round_trip(self):
+        cursor = encode_cursor(2, 'bob@example.com', 3)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), (2, 'bob@example.com', 3))
+        for invalid in ('!!!', encode_cursor(2, 'bob@example.com', 3)[:-6], 'WzFd'):
+            with self.assertRaises(UserSearchError):
+                decode_cursor(invalid)
+
+    def test_invalid_parameters(self):
+        for query in ('q=', 'q=anna&limit=0', 'q=anna&limit=101', 'q=anna&limit=some', 'q=anna&cursor=!!!'):
+            self.assertEqual(self.client.get(f"/api/users/search?{query}").status_code, 400, query)
+
+    def test_resolve(self):
+        response = self.client.post('/api/users/resolve', json={'emails': ['ANNA@example.com', 'nobody@example.com', 'anna@example.com']})
+        body = response.get_json()
+        self.assertEqual([user['email'] for user in body['users']], ['anna@example.com'])
+        self.assertEqual(body['missing'], ['nobody@example.com'])
+
+        body = self.client.post('/api/users/resolve', json={'ids': [3, 99, '1']}).get_json()
+        self.assertEqual(([user['id'] for user in body['users']], body['missing']), ([3, 1], [99]))
+        self.assertEqual(self.client.post('/api/users/resolve', json={'ids': ['x']}).status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()